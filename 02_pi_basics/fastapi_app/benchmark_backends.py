@@ -0,0 +1,284 @@
+"""
+資料庫後端效能測試
+以相同的讀數比較 MongoDB（DatabaseManager）與 SQLite（SQLiteDatabaseManager）的：
+- 寫入速度（逐筆 insert_sensor_data 與批次 insert_sensor_data_many）
+- 查詢延遲（最新一頁、第二頁、1 小時範圍、裝置統計）
+- 記憶體（RSS）：SQLite 在 API 程序內，量測程序 RSS 的增加；
+  MongoDB 為 mongod 的常駐記憶體（serverStatus 的 mem.resident）加上程序 RSS 的增加
+- 資料與索引大小
+
+兩者都經過 API 使用的方法，MongoDB 寫入時會同時累加統計彙總（見 common/rollups.py）
+MongoDB 使用獨立的資料庫 iot_benchmark、SQLite 使用獨立的檔案，結束後都會刪除
+
+使用方式:
+    python benchmark_backends.py                          # 1M 筆讀數
+    python benchmark_backends.py --readings 100000        # 快速測試
+    python benchmark_backends.py --backends sqlite        # 沒有 MongoDB 時只測 SQLite
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import resource
+import sqlite3
+import statistics
+import time
+from datetime import datetime, timedelta
+
+# 使用獨立的測試資料庫（必須在建立 DatabaseManager 之前設定）
+os.environ.setdefault('MONGO_DATABASE', 'iot_benchmark')
+
+from pymongo.errors import PyMongoError
+
+from database import DatabaseManager, STORAGE_DOCUMENT
+from sqlite_database import SQLiteDatabaseManager
+
+# ============================================================================
+# 測試設定
+# ============================================================================
+
+BACKENDS = ('mongodb', 'sqlite')
+SQLITE_BENCHMARK_PATH = 'iot_benchmark.db'
+
+DEVICES = 10                # 裝置數
+SENSOR_TYPES = ('temperature', 'humidity')
+INTERVAL_SECONDS = 5        # 每台裝置每種感測器的發送間隔
+LOAD_CHUNK = 5000           # 批次寫入每次的筆數
+SINGLE_INSERTS = 2000       # 逐筆寫入的測試筆數
+QUERY_ROUNDS = 50           # 每種查詢的次數
+PAGE_SIZE = 100
+
+def generate_readings(total, start):
+    """依時間順序產生讀數（與 benchmark_storage.py 相同的格式），固定亂數種子讓兩個後端資料相同"""
+    rng = random.Random(42)
+    per_tick = DEVICES * len(SENSOR_TYPES)
+    for i in range(total):
+        tick, slot = divmod(i, per_tick)
+        device, sensor = divmod(slot, len(SENSOR_TYPES))
+        yield {
+            'device_id': f"pico_{device:03d}",
+            'device_type': 'pico_w',
+            'timestamp': start + timedelta(seconds=tick * INTERVAL_SECONDS),
+            'sensor_type': SENSOR_TYPES[sensor],
+            'value': round(rng.uniform(20, 30), 2),
+            'unit': 'celsius' if sensor == 0 else 'percent',
+            'location': f"room_{device % 3}"
+        }
+
+def chunks(iterable, size):
+    """把產生器切成固定大小的列表"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def rss_mb() -> float:
+    """目前程序的常駐記憶體（MB）；沒有 /proc 時使用最高值"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# ============================================================================
+# 後端
+# ============================================================================
+
+def open_backend(name, path):
+    """建立資料庫管理器（清除上一次的測試資料）"""
+    if name == 'sqlite':
+        for suffix in ('', '-wal', '-shm'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path + suffix)
+        return SQLiteDatabaseManager(path)
+
+    db = DatabaseManager(storage_mode=STORAGE_DOCUMENT)
+    db.sensor_data.drop()
+    db.rollups.collection.drop()
+    db.close()
+    return DatabaseManager(storage_mode=STORAGE_DOCUMENT)
+
+def storage_stats(name, db):
+    """(資料 MB, 索引 MB, 伺服器常駐記憶體 MB)"""
+    if name == 'sqlite':
+        conn = db.store.connection()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size, _ = db.store.file_size()
+        try:
+            # dbstat 需要編譯時啟用（多數 Python 發行版有）
+            index = conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+                                 "(SELECT name FROM sqlite_master WHERE type = 'index')").fetchone()[0] or 0
+        except sqlite3.Error:
+            index = 0
+        return (size - index) / 1024 / 1024, index / 1024 / 1024, 0.0
+
+    data = index = 0
+    for collection in (db.sensor_data, db.rollups.collection):
+        stats = db.db.command('collStats', collection.name)
+        data += stats.get('storageSize', 0)
+        index += stats.get('totalIndexSize', 0)
+    resident = db.client.admin.command('serverStatus').get('mem', {}).get('resident', 0)
+    return data / 1024 / 1024, index / 1024 / 1024, resident
+
+def drop_backend(name, db):
+    """刪除測試資料並關閉"""
+    if name == 'mongodb':
+        db.sensor_data.drop()
+        db.rollups.collection.drop()
+    db.close()
+    if name == 'sqlite':
+        for suffix in ('', '-wal', '-shm'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(db.path + suffix)
+
+# ============================================================================
+# 量測
+# ============================================================================
+
+def measure(func, rounds=QUERY_ROUNDS):
+    """
+    執行多次並量測延遲
+
+    返回:
+        (中位數毫秒, p95 毫秒)
+    """
+    latencies = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - t0) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+def measure_queries(db, start, span_ticks):
+    """最新一頁、第二頁、1 小時範圍與裝置統計的查詢延遲"""
+    rng = random.Random(7)
+    window_ticks = 3600 // INTERVAL_SECONDS
+
+    def device():
+        return f"pico_{rng.randrange(DEVICES):03d}"
+
+    def first_page():
+        db.query_sensor_data_page({'device_id': device()}, limit=PAGE_SIZE, serialize=False)
+
+    def second_page():
+        filter_dict = {'device_id': device()}
+        _, cursor = db.query_sensor_data_page(filter_dict, limit=PAGE_SIZE, serialize=False)
+        db.query_sensor_data_page(filter_dict, limit=PAGE_SIZE, cursor=cursor, serialize=False)
+
+    def range_hour():
+        begin = start + timedelta(
+            seconds=rng.randrange(max(span_ticks - window_ticks, 1)) * INTERVAL_SECONDS)
+        db.query_sensor_data({'device_id': device(),
+                              'timestamp': {'$gte': begin, '$lt': begin + timedelta(hours=1)}},
+                             limit=0, serialize=False)
+
+    def device_statistics():
+        db.get_device_statistics(device())
+
+    return {
+        'query_page': measure(first_page),
+        'query_cursor': measure(second_page),
+        'query_1h': measure(range_hour),
+        'query_stats': measure(device_statistics),
+    }
+
+def run_backend(name, total, path):
+    """測試一個後端"""
+    print(f"\n--- 後端: {name} ---")
+    rss_before = rss_mb()
+    db = open_backend(name, path)
+
+    per_tick = DEVICES * len(SENSOR_TYPES)
+    span_ticks = total // per_tick
+    start = datetime(2025, 1, 1)
+    result = {}
+
+    # 逐筆寫入（API 的寫入方式），接在批次資料之後
+    single_start = start + timedelta(seconds=(span_ticks + 1) * INTERVAL_SECONDS)
+    single = list(generate_readings(SINGLE_INSERTS, single_start))
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for reading in single:
+            db.insert_sensor_data(reading)
+    result['single_rate'] = SINGLE_INSERTS / (time.perf_counter() - t0)
+    print(f"逐筆寫入: {result['single_rate']:,.0f} 筆/秒")
+
+    # 批次寫入
+    loaded = 0
+    t0 = time.perf_counter()
+    for chunk in chunks(generate_readings(total, start), LOAD_CHUNK):
+        loaded += db.insert_sensor_data_many(chunk)
+        print(f"\r批次寫入: {loaded:,}/{total:,} 筆", end="", flush=True)
+    elapsed = time.perf_counter() - t0
+    result['bulk_rate'] = loaded / elapsed
+    print(f"\r批次寫入: {loaded:,} 筆，{elapsed:.1f} 秒（{result['bulk_rate']:,.0f} 筆/秒）")
+
+    result.update(measure_queries(db, start, span_ticks))
+    for key, label in (('query_page', '最新一頁'), ('query_cursor', '第二頁'),
+                       ('query_1h', '1 小時範圍'), ('query_stats', '裝置統計')):
+        median, p95 = result[key]
+        print(f"{label}: 中位數 {median:.2f} ms，p95 {p95:.2f} ms")
+
+    result['data_mb'], result['index_mb'], server_rss = storage_stats(name, db)
+    result['rss_mb'] = rss_mb() - rss_before + server_rss
+    print(f"資料 {result['data_mb']:.1f} MB，索引 {result['index_mb']:.1f} MB，"
+          f"記憶體 {result['rss_mb']:.0f} MB")
+
+    drop_backend(name, db)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='資料庫後端效能測試')
+    parser.add_argument('--readings', type=int, default=1_000_000, help='讀數筆數')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS),
+                        help='要測試的後端')
+    parser.add_argument('--sqlite-path', default=SQLITE_BENCHMARK_PATH, help='SQLite 測試檔案')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"資料庫後端效能測試（{' / '.join(args.backends)}）")
+    print("=" * 60)
+    print(f"讀數: {args.readings:,} 筆（{DEVICES} 台裝置 × {len(SENSOR_TYPES)} 種感測器，"
+          f"每 {INTERVAL_SECONDS} 秒一筆）")
+
+    results = {}
+    for name in args.backends:
+        try:
+            results[name] = run_backend(name, args.readings, args.sqlite_path)
+        except PyMongoError as e:
+            print(f"⚠ 無法測試 {name}: {e}")
+    labels = list(results)
+    if not labels:
+        return
+
+    print()
+    print("=" * 60)
+    print("測試結果")
+    print("=" * 60)
+    rows = [
+        ('逐筆寫入 (筆/秒)', 'single_rate', '{:,.0f}'),
+        ('批次寫入 (筆/秒)', 'bulk_rate', '{:,.0f}'),
+        ('資料大小 (MB)', 'data_mb', '{:,.1f}'),
+        ('索引大小 (MB)', 'index_mb', '{:,.1f}'),
+        ('記憶體 RSS (MB)', 'rss_mb', '{:,.0f}'),
+    ]
+    print(f"{'項目':<18}" + "".join(f"{label:>16}" for label in labels))
+    for name, key, fmt in rows:
+        print(f"{name:<18}" + "".join(f"{fmt.format(results[label][key]):>16}" for label in labels))
+    for name, key in (('最新一頁', 'query_page'), ('第二頁', 'query_cursor'),
+                      ('1 小時範圍', 'query_1h'), ('裝置統計', 'query_stats')):
+        values = [f"{results[label][key][0]:.2f} / {results[label][key][1]:.2f}" for label in labels]
+        print(f"{name + ' p50/p95 (ms)':<18}" + "".join(f"{v:>16}" for v in values))
+
+if __name__ == "__main__":
+    main()
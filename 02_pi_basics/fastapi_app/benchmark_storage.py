@@ -0,0 +1,208 @@
+"""
+儲存模式效能測試
+比較三種儲存方式的：
+- document: 每筆一個文件（一般集合）
+- timeseries: 每筆一個文件（MongoDB 時間序列集合，需要 MongoDB 5.0 以上）
+- bucket: 每小時一個桶文件
+
+項目：
+- 寫入速度（逐筆 insert_sensor_data 與批次 insert_sensor_data_many）
+- 集合與索引大小
+- 時間範圍查詢延遲（1 小時、1 天）
+
+測試使用獨立的資料庫 iot_benchmark，結束後會刪除測試集合
+
+使用方式:
+    python benchmark_storage.py                       # 10M 筆讀數（需要數分鐘）
+    python benchmark_storage.py --readings 1000000    # 快速測試
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+# 使用獨立的測試資料庫（必須在建立 DatabaseManager 之前設定）
+os.environ.setdefault('MONGO_DATABASE', 'iot_benchmark')
+
+from database import DatabaseManager, STORAGE_DOCUMENT, STORAGE_BUCKET
+from timeseries import ensure_timeseries_collection
+from indexes import ensure_indexes
+
+# ============================================================================
+# 測試設定
+# ============================================================================
+
+# 測試的儲存方式: (名稱, DatabaseManager 儲存模式, 是否使用時間序列集合)
+MODES = (
+    ('document', STORAGE_DOCUMENT, False),
+    ('timeseries', STORAGE_DOCUMENT, True),
+    ('bucket', STORAGE_BUCKET, False),
+)
+
+DEVICES = 10                # 裝置數
+SENSOR_TYPES = ('temperature', 'humidity')
+INTERVAL_SECONDS = 5        # 每台裝置每種感測器的發送間隔
+LOAD_CHUNK = 50000          # 批次寫入每次的筆數
+SINGLE_INSERTS = 5000       # 逐筆寫入的測試筆數
+QUERY_ROUNDS = 50           # 每種查詢的次數
+
+def generate_readings(total, start):
+    """
+    依時間順序產生讀數（每次產生一個時間點所有裝置與感測器的讀數）
+
+    參數:
+        total: 總筆數
+        start: 第一筆的時間
+    """
+    per_tick = DEVICES * len(SENSOR_TYPES)
+    for i in range(total):
+        tick, slot = divmod(i, per_tick)
+        device, sensor = divmod(slot, len(SENSOR_TYPES))
+        yield {
+            'device_id': f"pico_{device:03d}",
+            'device_type': 'pico_w',
+            'timestamp': start + timedelta(seconds=tick * INTERVAL_SECONDS),
+            'sensor_type': SENSOR_TYPES[sensor],
+            'value': round(random.uniform(20, 30), 2),
+            'unit': 'celsius' if sensor == 0 else 'percent',
+            'location': f"room_{device % 3}"
+        }
+
+def chunks(iterable, size):
+    """把產生器切成固定大小的列表"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def collection_stats(db, name):
+    """取得集合的文件數（時間序列集合為內部的桶數）、資料大小與索引大小"""
+    stats = db.db.command('collStats', name)
+    return {
+        'documents': stats.get('timeseries', {}).get('bucketCount', stats.get('count', 0)),
+        'storage_mb': stats.get('storageSize', 0) / 1024 / 1024,
+        'index_mb': stats.get('totalIndexSize', 0) / 1024 / 1024
+    }
+
+def measure_queries(db, start, span_ticks, window):
+    """
+    量測時間範圍查詢延遲
+
+    返回:
+        (中位數毫秒, p95 毫秒, 平均筆數)
+    """
+    latencies = []
+    counts = []
+    window_ticks = int(window.total_seconds() // INTERVAL_SECONDS)
+    for _ in range(QUERY_ROUNDS):
+        device_id = f"pico_{random.randrange(DEVICES):03d}"
+        begin = start + timedelta(
+            seconds=random.randrange(max(span_ticks - window_ticks, 1)) * INTERVAL_SECONDS)
+        filter_dict = {
+            'device_id': device_id,
+            'timestamp': {'$gte': begin, '$lt': begin + window}
+        }
+        t0 = time.perf_counter()
+        data = db.query_sensor_data(filter_dict, limit=0)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        counts.append(len(data))
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return statistics.median(latencies), p95, statistics.mean(counts)
+
+def run_mode(label, mode, timeseries, total):
+    """測試一種儲存方式"""
+    print(f"\n--- 儲存方式: {label} ---")
+    db = DatabaseManager(storage_mode=mode)
+    collection = db.sensor_buckets if mode == STORAGE_BUCKET else db.sensor_data
+    collection.drop()
+    if mode == STORAGE_BUCKET:
+        db._ensure_bucket_indexes()
+    else:
+        if timeseries:
+            ensure_timeseries_collection(db.db, 'sensor_data')
+        ensure_indexes(db.sensor_data)
+
+    per_tick = DEVICES * len(SENSOR_TYPES)
+    span_ticks = total // per_tick
+    start = datetime(2025, 1, 1)
+    result = {}
+
+    # 逐筆寫入（API 的寫入方式），接在批次資料之後
+    single_start = start + timedelta(seconds=(span_ticks + 1) * INTERVAL_SECONDS)
+    single = list(generate_readings(SINGLE_INSERTS, single_start))
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for reading in single:
+            db.insert_sensor_data(reading)
+    result['single_rate'] = SINGLE_INSERTS / (time.perf_counter() - t0)
+    print(f"逐筆寫入: {result['single_rate']:,.0f} 筆/秒")
+
+    # 批次寫入
+    loaded = 0
+    t0 = time.perf_counter()
+    for chunk in chunks(generate_readings(total, start), LOAD_CHUNK):
+        loaded += db.insert_sensor_data_many(chunk)
+        print(f"\r批次寫入: {loaded:,}/{total:,} 筆", end="", flush=True)
+    elapsed = time.perf_counter() - t0
+    result['bulk_rate'] = loaded / elapsed
+    print(f"\r批次寫入: {loaded:,} 筆，{elapsed:.1f} 秒（{result['bulk_rate']:,.0f} 筆/秒）")
+
+    result.update(collection_stats(db, collection.name))
+    print(f"文件數: {result['documents']:,}，資料 {result['storage_mb']:.1f} MB，"
+          f"索引 {result['index_mb']:.1f} MB")
+
+    for name, window in (('1h', timedelta(hours=1)), ('1d', timedelta(days=1))):
+        median, p95, rows = measure_queries(db, start, span_ticks, window)
+        result[f'query_{name}'] = (median, p95)
+        print(f"範圍查詢 {name}: 中位數 {median:.1f} ms，p95 {p95:.1f} ms（平均 {rows:,.0f} 筆）")
+
+    collection.drop()
+    db.close()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='儲存模式效能測試')
+    parser.add_argument('--readings', type=int, default=10_000_000, help='讀數筆數')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("儲存模式效能測試（document / timeseries / bucket）")
+    print("=" * 60)
+    print(f"讀數: {args.readings:,} 筆（{DEVICES} 台裝置 × {len(SENSOR_TYPES)} 種感測器，"
+          f"每 {INTERVAL_SECONDS} 秒一筆）")
+
+    results = {label: run_mode(label, mode, timeseries, args.readings)
+               for label, mode, timeseries in MODES}
+    labels = [label for label, _, _ in MODES]
+
+    print()
+    print("=" * 60)
+    print("測試結果")
+    print("=" * 60)
+    rows = [
+        ('文件數', 'documents', '{:,.0f}'),
+        ('資料大小 (MB)', 'storage_mb', '{:,.1f}'),
+        ('索引大小 (MB)', 'index_mb', '{:,.1f}'),
+        ('逐筆寫入 (筆/秒)', 'single_rate', '{:,.0f}'),
+        ('批次寫入 (筆/秒)', 'bulk_rate', '{:,.0f}'),
+    ]
+    print(f"{'項目':<18}" + "".join(f"{label:>16}" for label in labels))
+    for name, key, fmt in rows:
+        print(f"{name:<18}" + "".join(f"{fmt.format(results[label][key]):>16}" for label in labels))
+    for window in ('1h', '1d'):
+        values = [f"{results[label][f'query_{window}'][0]:.1f} / {results[label][f'query_{window}'][1]:.1f}"
+                  for label in labels]
+        print(f"{'查詢 ' + window + ' p50/p95 (ms)':<18}" + "".join(f"{v:>16}" for v in values))
+
+if __name__ == "__main__":
+    main()
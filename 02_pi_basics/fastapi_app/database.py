@@ -7,13 +7,82 @@
 - 感測器資料的 CRUD 操作
 - 裝置資訊管理
 - 查詢和篩選
+- 鍵集分頁（以 next_cursor 翻頁，每一頁的成本都與第一頁相同）
+- 欄位選擇（projection）與原始文件輸出（由 API 直接編碼為 JSON，見 common/serialization.py）
+- 分桶儲存模式（每個裝置、感測器每小時一個文件，減少文件數與索引大小）
+- 寫入時累加每分鐘/小時/天的統計彙總，裝置統計直接讀取彙總（見 common/rollups.py）
+- 寫入時更新每個裝置、感測器的最新讀數，最新資料直接讀取（見 common/latest.py）
+- 資料保留政策（過期讀數與彙總由 API 的背景排程器刪除，見 common/retention.py）
+- sensor_data 使用 MongoDB 時間序列集合（MongoDB 5.0 以上）
 """
 
-from pymongo import MongoClient, DESCENDING
-from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo import DESCENDING, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, ConnectionFailure, OperationFailure
 from datetime import datetime
-from typing import List, Dict, Optional
+from itertools import dropwhile, islice
+from numbers import Number
+from typing import Iterator, List, Dict, Optional, Tuple
 import os
+import sys
+
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from timeseries import ensure_timeseries_collection
+from indexes import ensure_indexes
+from timestamps import to_datetime, normalize_fields
+from mongo_pool import get_client, release_client
+from pagination import paginate, check_limit, encode_cursor, decode_cursor
+from serialization import projection
+from rollups import RollupWriter, summarize, written_documents
+from latest import LatestWriter, latest_reading
+from retention import policy_for, start_scheduler
+
+# ============================================================================
+# 儲存模式設定
+# ============================================================================
+
+STORAGE_DOCUMENT = 'document'   # 每筆讀數一個文件（預設）
+STORAGE_BUCKET = 'bucket'       # 每個裝置、感測器每小時一個桶文件
+STORAGE_MODES = (STORAGE_DOCUMENT, STORAGE_BUCKET)
+
+BUCKET_MAX_READINGS = 1000      # 每個桶最多筆數，超過就開新桶（避免文件無限成長）
+
+# 桶的分組欄位；讀數的其他欄位（device_type、unit、location...）存在桶的 meta，
+# meta 不同的讀數會放進不同的桶
+BUCKET_KEY_FIELDS = ('device_id', 'sensor_type')
+
+# 分桶模式查詢時可逐筆比對的條件
+_COMPARE = {
+    '$gt': lambda a, b: a > b,
+    '$gte': lambda a, b: a >= b,
+    '$lt': lambda a, b: a < b,
+    '$lte': lambda a, b: a <= b,
+    '$ne': lambda a, b: a != b,
+    '$in': lambda a, b: a in b,
+}
+
+def _bucket_start(timestamp: datetime) -> datetime:
+    """取得時間戳記所屬桶的起始時間（整點）"""
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def _matches(value, condition) -> bool:
+    """逐筆比對單一欄位條件（等於或 $gt/$gte/$lt/$lte/$ne/$in）"""
+    if not isinstance(condition, dict):
+        return value == condition
+    try:
+        return all(_COMPARE[op](value, operand) for op, operand in condition.items())
+    except TypeError:
+        return False
+
+def _reading_key(doc: dict) -> tuple:
+    """
+    分桶模式讀數的排序鍵（時間, 桶 _id, 桶內位置）
+
+    讀數的 _id 為「桶 _id:位置」，時間相同的讀數也有固定順序，鍵集分頁才不會重複或遺漏
+    """
+    bucket_id, _, index = doc['_id'].rpartition(':')
+    return doc['timestamp'], bucket_id, int(index)
 
 class DatabaseManager:
     """
@@ -22,13 +91,16 @@ class DatabaseManager:
     負責所有資料庫操作，包括連接、查詢、插入、更新和刪除
     """
     
-    def __init__(self, connection_string: str = None):
+    def __init__(self, connection_string: str = None, storage_mode: str = None):
         """
         初始化資料庫管理器
         
         參數:
             connection_string: MongoDB 連接字串
                              如果未提供，使用環境變數或預設值
+            storage_mode: 感測器資料儲存模式
+                          'document'（每筆一個文件）或 'bucket'（每小時一個桶文件），
+                          如果未提供，使用環境變數 SENSOR_STORAGE_MODE 或 'document'
         """
         # 取得連接字串
         if connection_string is None:
@@ -40,9 +112,14 @@ class DatabaseManager:
         # 資料庫名稱
         self.db_name = os.getenv('MONGO_DATABASE', 'iot_data')
         
+        # 儲存模式
+        self.storage_mode = storage_mode or os.getenv('SENSOR_STORAGE_MODE', STORAGE_DOCUMENT)
+        if self.storage_mode not in STORAGE_MODES:
+            raise ValueError(f"未知的儲存模式: {self.storage_mode}（可用: {', '.join(STORAGE_MODES)}）")
+        
         try:
-            # 建立 MongoDB 客戶端
-            self.client = MongoClient(connection_string)
+            # 取得共用的 MongoDB 客戶端（同一程序內共用連線池）
+            self.client = get_client(connection_string)
             
             # 選擇資料庫
             self.db = self.client[self.db_name]
@@ -50,9 +127,25 @@ class DatabaseManager:
             # 取得集合（Collection）
             self.sensor_data = self.db['sensor_data']
             self.devices = self.db['devices']
+            self.sensor_buckets = self.db['sensor_buckets']
             
             print(f"✓ 成功連接到 MongoDB 資料庫: {self.db_name}")
             
+            # sensor_data 建立為時間序列集合（已存在的一般集合不變更）
+            if not self.bucketed:
+                ensure_timeseries_collection(self.db, 'sensor_data')
+                ensure_indexes(self.sensor_data)
+            ensure_indexes(self.devices)
+            
+            if self.bucketed:
+                self._ensure_bucket_indexes()
+                print("✓ 感測器資料使用分桶儲存（每個裝置、感測器每小時一個文件）")
+            
+            # 統計彙總（兩種儲存模式共用 sensor_data_rollups）
+            self.rollups = RollupWriter.for_collection(self.sensor_data)
+            # 最新讀數（兩種儲存模式共用 sensor_data_latest）
+            self.latest = LatestWriter.for_collection(self.sensor_data)
+            
         except ConnectionFailure as e:
             print(f"✗ MongoDB 連接失敗: {e}")
             raise
@@ -75,9 +168,34 @@ class DatabaseManager:
     def close(self):
         """關閉資料庫連接"""
         if self.client:
-            self.client.close()
+            release_client(self.client)
             print("資料庫連接已關閉")
     
+    def retention_policies(self) -> Dict[str, dict]:
+        """
+        資料保留政策（見 common/retention.py）
+        
+        返回:
+            集合名稱 → 保留政策：目前儲存模式的讀數集合與統計彙總
+        """
+        readings = self.sensor_buckets if self.bucketed else self.sensor_data
+        rollups = self.rollups.collection
+        return {readings.name: policy_for(readings.name), rollups.name: policy_for(rollups.name)}
+    
+    def start_retention(self):
+        """
+        套用保留政策並啟動背景排程器（見 common/retention.py）
+        
+        返回:
+            RetentionScheduler，或 None（都由 MongoDB 處理，不需要背景執行緒）
+        """
+        return start_scheduler(self.db, self.retention_policies())
+    
+    @property
+    def bucketed(self) -> bool:
+        """是否使用分桶儲存"""
+        return self.storage_mode == STORAGE_BUCKET
+    
     # ========================================================================
     # 感測器資料操作
     # ========================================================================
@@ -93,27 +211,72 @@ class DatabaseManager:
             str: 插入資料的 ID
         """
         try:
-            # 確保有時間戳記
-            if 'timestamp' not in data:
-                data['timestamp'] = datetime.now()
+            # 確保有時間戳記，並統一轉成 BSON 日期
+            normalize_fields(data, ('timestamp',), fill_missing=True)
             
-            # 插入資料
-            result = self.sensor_data.insert_one(data)
+            if self.bucketed:
+                reading_id = self._insert_bucket_reading(data)
+            else:
+                # 插入資料
+                reading_id = str(self.sensor_data.insert_one(data).inserted_id)
+                print(f"✓ 插入感測器資料: {reading_id}")
             
-            print(f"✓ 插入感測器資料: {result.inserted_id}")
-            return str(result.inserted_id)
+            self.rollups.apply([data])
+            self.latest.apply([data])
+            return reading_id
             
         except Exception as e:
             print(f"✗ 插入感測器資料失敗: {e}")
             raise
     
+    def insert_sensor_data_many(self, readings: List[dict]) -> int:
+        """
+        批次插入感測器資料
+        
+        參數:
+            readings: 感測器資料字典列表
+        
+        返回:
+            int: 插入的資料筆數
+        """
+        if not readings:
+            return 0
+        
+        try:
+            for data in readings:
+                normalize_fields(data, ('timestamp',), fill_missing=True)
+            
+            if self.bucketed:
+                count = self._insert_bucket_readings(readings)
+            else:
+                count = len(self.sensor_data.insert_many(readings, ordered=False).inserted_ids)
+            
+            self.rollups.apply(readings)
+            self.latest.apply(readings)
+            return count
+            
+        except BulkWriteError as e:
+            # 部分寫入成功時，已寫入的讀數仍要累加到彙總、更新最新讀數
+            # （分桶模式在 _insert_bucket_readings 中處理）
+            if not self.bucketed:
+                written = written_documents(readings, e)
+                self.rollups.apply(written)
+                self.latest.apply(written)
+            print(f"✗ 批次插入感測器資料失敗: {e}")
+            raise
+        except Exception as e:
+            print(f"✗ 批次插入感測器資料失敗: {e}")
+            raise
+    
     def query_sensor_data(
         self,
         filter_dict: dict = None,
         limit: int = 100,
         skip: int = 0,
         sort_by: str = 'timestamp',
-        sort_order: int = DESCENDING
+        sort_order: int = DESCENDING,
+        fields: Optional[List[str]] = None,
+        serialize: bool = True
     ) -> List[dict]:
         """
         查詢感測器資料
@@ -124,6 +287,8 @@ class DatabaseManager:
             skip: 跳過的資料筆數（用於分頁）
             sort_by: 排序欄位
             sort_order: 排序順序（DESCENDING 或 ASCENDING）
+            fields: 只取回這些欄位（None 表示全部，_id 一定包含）
+            serialize: 轉換 _id 與時間為字串；False 時回傳原始文件（交給 serialization.dumps 編碼）
         
         返回:
             List[dict]: 感測器資料列表
@@ -132,23 +297,20 @@ class DatabaseManager:
             if filter_dict is None:
                 filter_dict = {}
             
+            if self.bucketed:
+                readings = self._query_bucket_readings(filter_dict, limit, skip, sort_by, sort_order)
+                return self._finish_readings(readings, fields, serialize)
+            
             # 查詢資料
-            cursor = self.sensor_data.find(filter_dict) \
+            cursor = self.sensor_data.find(filter_dict, projection(fields)) \
                                      .sort(sort_by, sort_order) \
                                      .skip(skip) \
                                      .limit(limit)
             
+            if not serialize:
+                return list(cursor)
             # 轉換為列表並處理 ObjectId
-            data = []
-            for doc in cursor:
-                # 將 ObjectId 轉換為字串
-                doc['_id'] = str(doc['_id'])
-                # 將 datetime 轉換為 ISO 格式字串
-                if 'timestamp' in doc and isinstance(doc['timestamp'], datetime):
-                    doc['timestamp'] = doc['timestamp'].isoformat()
-                data.append(doc)
-            
-            return data
+            return [self._serialize_document(doc) for doc in cursor]
             
         except Exception as e:
             print(f"✗ 查詢感測器資料失敗: {e}")
@@ -174,6 +336,54 @@ class DatabaseManager:
         filter_dict = {'device_id': device_id}
         return self.query_sensor_data(filter_dict, limit=limit, skip=skip)
     
+    def query_sensor_data_page(
+        self,
+        filter_dict: dict = None,
+        limit: int = 100,
+        cursor: str = None,
+        skip: int = 0,
+        sort_order: int = DESCENDING,
+        fields: Optional[List[str]] = None,
+        serialize: bool = True
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        以鍵集分頁查詢感測器資料（依時間排序，時間相同時依 _id）
+        
+        以上一頁最後一筆的（timestamp, _id）為起點，不需要 skip，
+        深層頁面的成本與第一頁相同，翻頁期間寫入的新資料也不會造成重複或遺漏
+        
+        參數:
+            filter_dict: 查詢過濾條件
+            limit: 每頁筆數
+            cursor: 上一頁回傳的 next_cursor（第一頁為 None）
+            skip: 跳過的資料筆數（相容舊版分頁）
+            sort_order: 排序順序（DESCENDING 或 ASCENDING）
+            fields: 只取回這些欄位（None 表示全部；_id 與 timestamp 一定包含，游標需要）
+            serialize: 轉換 _id 與時間為字串；False 時回傳原始文件
+        
+        返回:
+            (感測器資料列表, next_cursor)；沒有下一頁時 next_cursor 為 None
+        
+        例外:
+            ValueError: 游標格式錯誤，或每頁筆數小於 1
+        """
+        if filter_dict is None:
+            filter_dict = {}
+        
+        if self.bucketed:
+            readings, next_cursor = self._query_bucket_page(filter_dict, limit, cursor,
+                                                            skip, sort_order)
+            if fields is not None:
+                fields = [*fields, 'timestamp']
+            return self._finish_readings(readings, fields, serialize), next_cursor
+        
+        docs, next_cursor = paginate(self.sensor_data, filter_dict, 'timestamp', sort_order,
+                                     limit=limit, cursor=cursor, skip=skip,
+                                     projection=projection(fields, required=('timestamp',)))
+        if not serialize:
+            return docs, next_cursor
+        return [self._serialize_document(doc) for doc in docs], next_cursor
+    
     def get_latest_data(self, device_id: str = None) -> dict:
         """
         取得最新的感測器資料
@@ -189,18 +399,15 @@ class DatabaseManager:
             if device_id:
                 filter_dict['device_id'] = device_id
             
-            # 查詢最新一筆資料
-            doc = self.sensor_data.find_one(
-                filter_dict,
-                sort=[('timestamp', DESCENDING)]
-            )
+            # 讀取最新讀數集合（每個裝置、感測器一個文件），不需要排序原始讀數
+            doc = latest_reading(self.latest.collection, 'timestamp', filter_dict)
+            if doc is None:
+                return None
             
-            if doc:
+            # 分桶模式的讀數沒有自己的 _id
+            if '_id' in doc:
                 doc['_id'] = str(doc['_id'])
-                if 'timestamp' in doc and isinstance(doc['timestamp'], datetime):
-                    doc['timestamp'] = doc['timestamp'].isoformat()
-            
-            return doc
+            return self._serialize_reading(doc)
             
         except Exception as e:
             print(f"✗ 取得最新資料失敗: {e}")
@@ -217,6 +424,16 @@ class DatabaseManager:
             int: 刪除的資料筆數
         """
         try:
+            self.latest.remove({'device_id': device_id})
+            # 裝置統計讀取彙總，也要一併刪除
+            self.rollups.collection.delete_many({'device_id': device_id})
+            
+            if self.bucketed:
+                deleted = self._count_bucket_readings({'device_id': device_id})
+                self.sensor_buckets.delete_many({'device_id': device_id})
+                print(f"✓ 刪除 {deleted} 筆資料（裝置: {device_id}）")
+                return deleted
+            
             result = self.sensor_data.delete_many({'device_id': device_id})
             print(f"✓ 刪除 {result.deleted_count} 筆資料（裝置: {device_id}）")
             return result.deleted_count
@@ -239,6 +456,9 @@ class DatabaseManager:
             if filter_dict is None:
                 filter_dict = {}
             
+            if self.bucketed:
+                return self._count_bucket_readings(filter_dict)
+            
             count = self.sensor_data.count_documents(filter_dict)
             return count
             
@@ -313,15 +533,22 @@ class DatabaseManager:
             print(f"✗ 查詢裝置失敗: {e}")
             raise
     
-    def get_all_devices(self) -> List[dict]:
+    def get_all_devices(self, fields: Optional[List[str]] = None,
+                        serialize: bool = True) -> List[dict]:
         """
         查詢所有裝置
         
+        參數:
+            fields: 只取回這些欄位（None 表示全部）
+            serialize: 轉換 _id 與時間為字串；False 時回傳原始文件
+        
         返回:
             List[dict]: 裝置列表
         """
         try:
-            cursor = self.devices.find()
+            cursor = self.devices.find({}, projection(fields))
+            if not serialize:
+                return list(cursor)
             
             devices = []
             for doc in cursor:
@@ -401,6 +628,9 @@ class DatabaseManager:
         """
         取得裝置的統計資料
         
+        讀取每日彙總（寫入時累加），不需要掃描裝置的所有讀數；
+        只統計數值讀數，count 為數值讀數的筆數
+        
         參數:
             device_id: 裝置 ID
         
@@ -408,33 +638,297 @@ class DatabaseManager:
             dict: 統計資料（平均值、最大值、最小值等）
         """
         try:
-            pipeline = [
-                {'$match': {'device_id': device_id}},
-                {'$group': {
-                    '_id': '$device_id',
-                    'count': {'$sum': 1},
-                    'avg_value': {'$avg': '$value'},
-                    'min_value': {'$min': '$value'},
-                    'max_value': {'$max': '$value'},
-                    'latest_timestamp': {'$max': '$timestamp'}
-                }}
-            ]
-            
-            result = list(self.sensor_data.aggregate(pipeline))
-            
-            if result:
-                stats = result[0]
-                # 轉換 datetime 為 ISO 格式
-                if 'latest_timestamp' in stats and isinstance(stats['latest_timestamp'], datetime):
-                    stats['latest_timestamp'] = stats['latest_timestamp'].isoformat()
-                return stats
-            else:
+            stats = summarize(self.rollups.collection, self.sensor_data,
+                              {'device_id': device_id}, 'timestamp')
+            if not stats:
                 return {}
             
+            latest_timestamp = stats['last']
+            if isinstance(latest_timestamp, datetime):
+                latest_timestamp = latest_timestamp.isoformat()
+            return {
+                '_id': device_id,
+                'count': stats['count'],
+                'avg_value': stats['avg'],
+                'min_value': stats['min'],
+                'max_value': stats['max'],
+                'latest_timestamp': latest_timestamp
+            }
+            
         except Exception as e:
             print(f"✗ 取得統計資料失敗: {e}")
             raise
 
+    # ========================================================================
+    # 分桶儲存
+    # ========================================================================
+    #
+    # 每個裝置、感測器每小時一個桶文件（同一小時內 meta 欄位不同時分開存放）：
+    #
+    #   {
+    #     device_id, sensor_type, start,        # 分組欄位（start 為整點）
+    #     meta: {device_type, unit, location},  # 讀數的其他欄位
+    #     timestamps: [...], values: [...],     # 讀數（依寫入順序）
+    #     count, sum, min, max, first, last     # 預先計算的統計
+    #   }
+    #
+    # 每 5 秒一筆的裝置一天只產生 24 個文件，而不是約 17,000 個；
+    # 查詢時在程式中展開為原本的單筆格式，_id 為「桶 ID:索引」
+    
+    def _ensure_bucket_indexes(self):
+        """建立分桶集合的索引（登記在 common/indexes.py）"""
+        ensure_indexes(self.sensor_buckets)
+    
+    def _bucket_key(self, data: dict) -> Tuple[dict, datetime]:
+        """
+        計算讀數所屬的桶
+        
+        返回:
+            (桶的分組條件, 讀數時間)
+        """
+        timestamp = to_datetime(data['timestamp'])
+        meta = {
+            key: data[key] for key in sorted(data)
+            if key not in BUCKET_KEY_FIELDS and key not in ('_id', 'timestamp', 'value')
+        }
+        key = {field: data.get(field) for field in BUCKET_KEY_FIELDS}
+        key['start'] = _bucket_start(timestamp)
+        key['meta'] = meta
+        return key, timestamp
+    
+    @staticmethod
+    def _bucket_update(timestamps: List[datetime], values: List) -> dict:
+        """產生把讀數加入桶的更新操作（$push 讀數並更新統計）"""
+        numeric = [v for v in values if isinstance(v, Number) and not isinstance(v, bool)]
+        update = {
+            '$push': {'timestamps': {'$each': timestamps}, 'values': {'$each': values}},
+            '$inc': {'count': len(values), 'sum': sum(numeric)},
+            '$min': {'first': min(timestamps)},
+            '$max': {'last': max(timestamps)}
+        }
+        if numeric:
+            update['$min']['min'] = min(numeric)
+            update['$max']['max'] = max(numeric)
+        return update
+    
+    def _insert_bucket_reading(self, data: dict) -> str:
+        """把一筆讀數加入所屬的桶（桶不存在或已滿時建立新桶）"""
+        key, timestamp = self._bucket_key(data)
+        bucket = self.sensor_buckets.find_one_and_update(
+            {**key, 'count': {'$lt': BUCKET_MAX_READINGS}},
+            self._bucket_update([timestamp], [data.get('value')]),
+            projection={'count': 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        reading_id = f"{bucket['_id']}:{bucket['count'] - 1}"
+        print(f"✓ 插入感測器資料: {reading_id}")
+        return reading_id
+    
+    def _insert_bucket_readings(self, readings: List[dict]) -> int:
+        """
+        批次把讀數加入所屬的桶（同一個桶的讀數合併成一個更新操作）
+        
+        部分更新操作失敗時，已寫入的讀數先累加到彙總、更新最新讀數，再拋出 BulkWriteError
+        """
+        groups = {}
+        for data in readings:
+            key, timestamp = self._bucket_key(data)
+            group = groups.setdefault(repr(key), (key, [], [], []))
+            group[1].append(timestamp)
+            group[2].append(data.get('value'))
+            group[3].append(data)
+        
+        operations = []
+        # 每個更新操作包含的讀數（與 operations 的索引對應）
+        operation_readings = []
+        for key, timestamps, values, documents in groups.values():
+            for i in range(0, len(values), BUCKET_MAX_READINGS):
+                chunk_timestamps = timestamps[i:i + BUCKET_MAX_READINGS]
+                chunk_values = values[i:i + BUCKET_MAX_READINGS]
+                operations.append(UpdateOne(
+                    {**key, 'count': {'$lte': BUCKET_MAX_READINGS - len(chunk_values)}},
+                    self._bucket_update(chunk_timestamps, chunk_values),
+                    upsert=True
+                ))
+                operation_readings.append(documents[i:i + BUCKET_MAX_READINGS])
+        
+        try:
+            self.sensor_buckets.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            written = [doc for chunk in written_documents(operation_readings, e) for doc in chunk]
+            self.rollups.apply(written)
+            self.latest.apply(written)
+            raise
+        return len(readings)
+    
+    @staticmethod
+    def _range_filter(low_field: str, high_field: str, condition) -> dict:
+        """把單筆讀數的範圍條件轉換為桶的 first/last 或 min/max 條件"""
+        if not isinstance(condition, dict):
+            return {low_field: {'$lte': condition}, high_field: {'$gte': condition}}
+        
+        result = {}
+        for op, operand in condition.items():
+            if op in ('$gt', '$gte'):
+                result.setdefault(high_field, {})[op] = operand
+            elif op in ('$lt', '$lte'):
+                result.setdefault(low_field, {})[op] = operand
+            elif op not in _COMPARE:
+                raise ValueError(f"分桶模式不支援的查詢條件: {op}")
+        return result
+    
+    def _bucket_filter(self, filter_dict: dict) -> Tuple[dict, dict]:
+        """
+        把單筆讀數的查詢條件轉換為桶的查詢條件
+        
+        返回:
+            (桶的查詢條件, 展開後需要逐筆比對的條件)
+        """
+        bucket_filter = {}
+        checks = {}
+        for field, condition in filter_dict.items():
+            if field in BUCKET_KEY_FIELDS:
+                bucket_filter[field] = condition
+            elif field == 'timestamp':
+                checks[field] = condition
+                bucket_filter.update(self._range_filter('first', 'last', condition))
+            elif field == 'value':
+                checks[field] = condition
+                bucket_filter.update(self._range_filter('min', 'max', condition))
+            elif field.startswith('$'):
+                raise ValueError(f"分桶模式不支援的查詢條件: {field}")
+            else:
+                bucket_filter[f'meta.{field}'] = condition
+        return bucket_filter, checks
+    
+    @staticmethod
+    def _unwind_buckets(buckets, checks: dict, sort_order: int = None) -> List[dict]:
+        """把桶展開為單筆讀數，只保留符合逐筆條件的讀數"""
+        time_check = checks.get('timestamp')
+        value_check = checks.get('value')
+        readings = []
+        for bucket in buckets:
+            base = {field: bucket.get(field) for field in BUCKET_KEY_FIELDS}
+            base.update(bucket.get('meta', {}))
+            bucket_id = bucket['_id']
+            for i, (timestamp, value) in enumerate(zip(bucket['timestamps'], bucket['values'])):
+                if time_check is not None and not _matches(timestamp, time_check):
+                    continue
+                if value_check is not None and not _matches(value, value_check):
+                    continue
+                readings.append({'_id': f"{bucket_id}:{i}", **base,
+                                 'timestamp': timestamp, 'value': value})
+        if sort_order is not None:
+            readings.sort(key=_reading_key, reverse=sort_order == DESCENDING)
+        return readings
+    
+    def _iter_bucket_readings(self, bucket_filter: dict, checks: dict,
+                              sort_order: int) -> Iterator[dict]:
+        """
+        依時間順序逐筆產生讀數
+        
+        桶依起始時間排序後，同一小時的桶（不同感測器或 meta）一起展開排序，
+        取得前幾筆資料時只需要讀取最新（或最舊）的幾個桶
+        """
+        cursor = self.sensor_buckets.find(bucket_filter).sort('start', sort_order)
+        group = []
+        for bucket in cursor:
+            if group and bucket['start'] != group[0]['start']:
+                yield from self._unwind_buckets(group, checks, sort_order)
+                group = []
+            group.append(bucket)
+        if group:
+            yield from self._unwind_buckets(group, checks, sort_order)
+    
+    def _query_bucket_readings(self, filter_dict: dict, limit: int, skip: int,
+                               sort_by: str, sort_order: int) -> List[dict]:
+        """分桶模式的查詢（回傳與單筆文件相同格式的讀數）"""
+        bucket_filter, checks = self._bucket_filter(filter_dict)
+        stop = skip + limit if limit else None
+        
+        if sort_by == 'timestamp':
+            return list(islice(self._iter_bucket_readings(bucket_filter, checks, sort_order),
+                               skip, stop))
+        
+        # 依其他欄位排序時需要展開所有符合的桶（缺少欄位的讀數與 MongoDB 一樣排在最小）
+        readings = self._unwind_buckets(self.sensor_buckets.find(bucket_filter), checks)
+        readings.sort(key=lambda doc: (doc.get(sort_by) is not None, doc.get(sort_by)),
+                      reverse=sort_order == DESCENDING)
+        return readings[skip:stop]
+    
+    def _query_bucket_page(self, filter_dict: dict, limit: int, cursor: Optional[str],
+                           skip: int, sort_order: int) -> Tuple[List[dict], Optional[str]]:
+        """
+        分桶模式的鍵集分頁
+        
+        只讀取游標時間之前（降冪）或之後（升冪）的桶，
+        再略過同一個桶中已經回傳過的讀數
+        """
+        check_limit(limit)
+        bucket_filter, checks = self._bucket_filter(filter_dict)
+        after = None
+        if cursor:
+            timestamp, reading_id = decode_cursor(cursor, 'timestamp', sort_order)
+            if not isinstance(timestamp, datetime) or not isinstance(reading_id, str):
+                raise ValueError("游標格式錯誤")
+            after = _reading_key({'_id': reading_id, 'timestamp': timestamp})
+            edge = {'first': {'$lte': timestamp}} if sort_order == DESCENDING \
+                else {'last': {'$gte': timestamp}}
+            bucket_filter = {'$and': [bucket_filter, edge]} if bucket_filter else edge
+        
+        readings = self._iter_bucket_readings(bucket_filter, checks, sort_order)
+        if after is not None:
+            if sort_order == DESCENDING:
+                readings = dropwhile(lambda doc: _reading_key(doc) >= after, readings)
+            else:
+                readings = dropwhile(lambda doc: _reading_key(doc) <= after, readings)
+        page = list(islice(readings, skip, skip + limit + 1))
+        
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(page[-1], 'timestamp', sort_order)
+        return page, next_cursor
+    
+    def _count_bucket_readings(self, filter_dict: dict) -> int:
+        """分桶模式的資料筆數（沒有逐筆條件時直接加總各桶的 count）"""
+        bucket_filter, checks = self._bucket_filter(filter_dict)
+        if not checks:
+            result = list(self.sensor_buckets.aggregate([
+                {'$match': bucket_filter},
+                {'$group': {'_id': None, 'count': {'$sum': '$count'}}}
+            ]))
+            return result[0]['count'] if result else 0
+        
+        return sum(len(self._unwind_buckets([bucket], checks))
+                   for bucket in self.sensor_buckets.find(bucket_filter))
+    
+    def _finish_readings(self, readings: List[dict], fields: Optional[List[str]],
+                         serialize: bool) -> List[dict]:
+        """分桶模式展開的讀數依 fields 取欄位並轉換格式"""
+        if fields is not None:
+            keep = {'_id', *fields}
+            readings = [{k: v for k, v in doc.items() if k in keep} for doc in readings]
+        if serialize:
+            return [self._serialize_reading(doc) for doc in readings]
+        return readings
+    
+    @staticmethod
+    def _serialize_document(doc: dict) -> dict:
+        """文件轉換為 API 回應格式（ObjectId 轉為字串、datetime 轉為 ISO 格式字串）"""
+        doc['_id'] = str(doc['_id'])
+        if 'timestamp' in doc and isinstance(doc['timestamp'], datetime):
+            doc['timestamp'] = doc['timestamp'].isoformat()
+        return doc
+    
+    @staticmethod
+    def _serialize_reading(doc: dict) -> dict:
+        """展開後的讀數轉換為 API 回應格式"""
+        if isinstance(doc.get('timestamp'), datetime):
+            doc['timestamp'] = doc['timestamp'].isoformat()
+        return doc
+
 # ============================================================================
 # 使用範例
 # ============================================================================
@@ -6,18 +6,32 @@ FastAPI 主應用程式
 - 健康檢查
 - 感測器資料的 CRUD 操作
 - 裝置管理
+- 資料庫後端：MongoDB（預設）或 SQLite（DATABASE_BACKEND=sqlite，見 sqlite_database.py）
+- 資料庫呼叫都交給執行緒池執行，慢查詢不會阻塞事件迴圈（見 common/async_db.py）
 """
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Query, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from datetime import datetime
 from typing import List, Optional
+import os
 import uvicorn
 
 # 匯入自訂模組
 from models import SensorData, SensorDataResponse, Device, DeviceResponse, HealthResponse
-from database import DatabaseManager
+
+# 資料庫後端：mongodb 或 sqlite（不需要 MongoDB，資料存在 SQLITE_PATH 檔案）
+DATABASE_BACKEND = os.getenv('DATABASE_BACKEND', 'mongodb')
+if DATABASE_BACKEND == 'sqlite':
+    from sqlite_database import SQLiteDatabaseManager as DatabaseManager
+elif DATABASE_BACKEND == 'mongodb':
+    from database import DatabaseManager
+else:
+    raise ValueError(f"未知的資料庫後端: {DATABASE_BACKEND}（可用: mongodb, sqlite）")
+
+from serialization import dumps, parse_fields, JSON_MEDIA_TYPE
+from async_db import run_db, shutdown_executors
 
 # 建立 FastAPI 應用程式實例
 app = FastAPI(
@@ -39,6 +53,9 @@ app.add_middleware(
 # 初始化資料庫管理器
 db = DatabaseManager()
 
+# 資料保留排程器（啟動時建立）
+retention = None
+
 # ============================================================================
 # 健康檢查端點
 # ============================================================================
@@ -63,7 +80,7 @@ async def health_check():
     """
     try:
         # 測試資料庫連接
-        db_status = db.check_connection()
+        db_status = await run_db(db.check_connection)
         
         return {
             "status": "healthy" if db_status else "unhealthy",
@@ -103,7 +120,7 @@ async def create_sensor_data(data: SensorData):
             data_dict["timestamp"] = datetime.now()
         
         # 插入資料到資料庫
-        result_id = db.insert_sensor_data(data_dict)
+        result_id = await run_db(db.insert_sensor_data, data_dict)
         
         return {
             "status": "success",
@@ -122,22 +139,26 @@ async def create_sensor_data(data: SensorData):
 
 @app.get("/api/data", response_model=SensorDataResponse)
 async def get_all_sensor_data(
-    limit: int = 100,
+    limit: int = Query(100, ge=1, description="每頁筆數"),
     skip: int = 0,
+    cursor: Optional[str] = None,
     device_id: Optional[str] = None,
-    sensor_type: Optional[str] = None
+    sensor_type: Optional[str] = None,
+    fields: Optional[str] = None
 ):
     """
     查詢感測器資料
     
     參數:
         limit: 返回資料筆數上限（預設 100）
-        skip: 跳過的資料筆數（用於分頁）
+        skip: 跳過的資料筆數（舊版分頁，深層頁面較慢）
+        cursor: 上一頁回傳的 next_cursor（建議的分頁方式）
         device_id: 篩選特定裝置（選用）
         sensor_type: 篩選特定感測器類型（選用）
+        fields: 只回傳這些欄位，逗號分隔（選用，例如 value,timestamp）
     
     返回:
-        感測器資料列表
+        感測器資料列表與 next_cursor（沒有下一頁時為 null）
     """
     try:
         # 建立查詢過濾條件
@@ -147,16 +168,25 @@ async def get_all_sensor_data(
         if sensor_type:
             filter_dict["sensor_type"] = sensor_type
         
-        # 查詢資料
-        data = db.query_sensor_data(filter_dict, limit=limit, skip=skip)
+        # 查詢資料（原始文件直接編碼為 JSON，不逐筆轉換也不經過 response_model 驗證）
+        data, next_cursor = await run_db(db.query_sensor_data_page, filter_dict, limit=limit,
+                                         cursor=cursor, skip=skip,
+                                         fields=parse_fields(fields),
+                                         serialize=False)
         
-        return {
+        return Response(content=dumps({
             "status": "success",
             "message": f"Retrieved {len(data)} records",
             "data": data,
-            "count": len(data)
-        }
+            "count": len(data),
+            "next_cursor": next_cursor
+        }), media_type=JSON_MEDIA_TYPE)
     
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid query: {str(e)}"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -166,8 +196,10 @@ async def get_all_sensor_data(
 @app.get("/api/data/{device_id}", response_model=SensorDataResponse)
 async def get_device_data(
     device_id: str,
-    limit: int = 100,
-    skip: int = 0
+    limit: int = Query(100, ge=1, description="每頁筆數"),
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
 ):
     """
     查詢特定裝置的感測器資料
@@ -175,29 +207,40 @@ async def get_device_data(
     參數:
         device_id: 裝置 ID
         limit: 返回資料筆數上限
-        skip: 跳過的資料筆數
+        skip: 跳過的資料筆數（舊版分頁）
+        cursor: 上一頁回傳的 next_cursor
+        fields: 只回傳這些欄位，逗號分隔（選用）
     
     返回:
-        該裝置的感測器資料列表
+        該裝置的感測器資料列表與 next_cursor
     """
     try:
-        data = db.get_device_data(device_id, limit=limit, skip=skip)
+        data, next_cursor = await run_db(db.query_sensor_data_page, {'device_id': device_id},
+                                         limit=limit, cursor=cursor, skip=skip,
+                                         fields=parse_fields(fields),
+                                         serialize=False)
         
-        if not data:
+        if not data and not cursor:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"No data found for device: {device_id}"
             )
         
-        return {
+        return Response(content=dumps({
             "status": "success",
             "message": f"Retrieved {len(data)} records for device {device_id}",
             "data": data,
-            "count": len(data)
-        }
+            "count": len(data),
+            "next_cursor": next_cursor
+        }), media_type=JSON_MEDIA_TYPE)
     
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid query: {str(e)}"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -216,7 +259,7 @@ async def delete_device_data(device_id: str):
         刪除結果
     """
     try:
-        deleted_count = db.delete_device_data(device_id)
+        deleted_count = await run_db(db.delete_device_data, device_id)
         
         if deleted_count == 0:
             raise HTTPException(
@@ -243,23 +286,31 @@ async def delete_device_data(device_id: str):
 # ============================================================================
 
 @app.get("/api/devices", response_model=DeviceResponse)
-async def get_all_devices():
+async def get_all_devices(fields: Optional[str] = None):
     """
     查詢所有裝置
     
+    參數:
+        fields: 只回傳這些欄位，逗號分隔（選用）
+    
     返回:
         裝置列表
     """
     try:
-        devices = db.get_all_devices()
+        devices = await run_db(db.get_all_devices, fields=parse_fields(fields), serialize=False)
         
-        return {
+        return Response(content=dumps({
             "status": "success",
             "message": f"Retrieved {len(devices)} devices",
             "data": devices,
             "count": len(devices)
-        }
+        }), media_type=JSON_MEDIA_TYPE)
     
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid query: {str(e)}"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -278,7 +329,7 @@ async def get_device(device_id: str):
         裝置資訊
     """
     try:
-        device = db.get_device(device_id)
+        device = await run_db(db.get_device, device_id)
         
         if not device:
             raise HTTPException(
@@ -311,9 +362,13 @@ async def startup_event():
     print("IoT Data API 啟動中...")
     print("=" * 50)
     
+    global retention
+    
     # 測試資料庫連接
-    if db.check_connection():
+    if await run_db(db.check_connection):
         print("✓ 資料庫連接成功")
+        # 過期的讀數與彙總在背景分批刪除（時間序列集合由 MongoDB 整批移除）
+        retention = await run_db(db.start_retention)
     else:
         print("✗ 資料庫連接失敗")
     
@@ -323,6 +378,10 @@ async def startup_event():
 async def shutdown_event():
     """應用程式關閉時執行"""
     print("IoT Data API 正在關閉...")
+    if retention is not None:
+        retention.stop()
+    # 等待執行中的查詢結束後再關閉資料庫連接
+    shutdown_executors()
     db.close()
     print("資料庫連接已關閉")
 
@@ -80,6 +80,7 @@ class SensorDataResponse(BaseModel):
     message: str = Field(..., description="訊息", example="Data retrieved successfully")
     data: Optional[List[dict]] = Field(default=None, description="資料列表")
     count: Optional[int] = Field(default=None, description="資料筆數")
+    next_cursor: Optional[str] = Field(default=None, description="下一頁的游標（沒有下一頁時為 null）")
     
     class Config:
         schema_extra = {
@@ -95,7 +96,8 @@ class SensorDataResponse(BaseModel):
                         "timestamp": "2025-01-11T10:30:00"
                     }
                 ],
-                "count": 1
+                "count": 1,
+                "next_cursor": None
             }
         }
 
@@ -226,6 +228,7 @@ class QueryParams(BaseModel):
     """
     limit: int = Field(default=100, ge=1, le=1000, description="返回資料筆數上限")
     skip: int = Field(default=0, ge=0, description="跳過的資料筆數")
+    cursor: Optional[str] = Field(default=None, description="上一頁回傳的 next_cursor")
     device_id: Optional[str] = Field(default=None, description="裝置 ID 篩選")
     sensor_type: Optional[str] = Field(default=None, description="感測器類型篩選")
     start_time: Optional[datetime] = Field(default=None, description="開始時間")
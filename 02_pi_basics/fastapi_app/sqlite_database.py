@@ -0,0 +1,469 @@
+"""
+SQLite 資料庫管理模組
+與 database.py 的 DatabaseManager 相同的介面，資料存在單一 SQLite 檔案（WAL 模式），
+適合不執行 MongoDB 的 Pi（mongod 常駐需要數百 MB 記憶體）
+
+使用方式（main.py 依環境變數選擇）：
+    DATABASE_BACKEND=sqlite SQLITE_PATH=iot_data.db uvicorn main:app
+
+與 MongoDB 版本的差異：
+- _id 為整數（API 回應中為字串或數字，與 ObjectId 字串一樣不需要解析）
+- 裝置統計直接以 SQL 彙總（COUNT/SUM/MIN/MAX），由 (device_id, timestamp, value)
+  覆蓋索引計算，不需要另外維護統計彙總
+- 查詢條件支援欄位相等與 $gt/$gte/$lt/$lte/$ne/$in，其他運算子拋出 ValueError
+- 過期讀數由背景執行緒分批刪除（與 common/retention.py 相同的保留期限與報告）
+
+連線、交易與讀數資料表見 common/sqlite_store.py
+"""
+
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+import json
+import os
+import sqlite3
+import sys
+
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from pymongo import DESCENDING
+from sqlite_store import SQLiteStore, ReadingTable, SQLiteRetention, SQLITE_PATH
+from serialization import dumps
+from retention import policy_for
+
+class SQLiteDatabaseManager:
+    """
+    SQLite 資料庫管理器類別
+
+    提供與 DatabaseManager 相同的方法，API 端點不需要修改
+    """
+
+    def __init__(self, path: str = None):
+        """
+        初始化資料庫管理器
+
+        參數:
+            path: SQLite 檔案路徑
+                  如果未提供，使用環境變數 SQLITE_PATH 或 iot_data.db
+        """
+        self.path = path or os.getenv('SQLITE_PATH', SQLITE_PATH)
+        self.storage_mode = 'sqlite'
+
+        try:
+            self.store = SQLiteStore(self.path)
+            self.sensor_data = ReadingTable(self.store, 'sensor_data')
+            self.store.connection().execute("""
+                CREATE TABLE IF NOT EXISTS devices (
+                    id INTEGER PRIMARY KEY,
+                    device_id TEXT NOT NULL UNIQUE,
+                    data TEXT NOT NULL
+                )
+            """)
+            print(f"✓ 使用 SQLite 資料庫: {self.path}（WAL 模式）")
+        except sqlite3.Error as e:
+            print(f"✗ SQLite 資料庫開啟失敗: {e}")
+            raise
+
+    def check_connection(self) -> bool:
+        """
+        檢查資料庫連接狀態
+
+        返回:
+            bool: True 表示連接正常，False 表示連接失敗
+        """
+        try:
+            self.store.connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            print(f"資料庫連接檢查失敗: {e}")
+            return False
+
+    def close(self):
+        """關閉資料庫連接"""
+        self.store.close()
+        print("資料庫連接已關閉")
+
+    def retention_policies(self) -> Dict[str, dict]:
+        """
+        資料保留政策（見 common/retention.py）
+
+        返回:
+            資料表名稱 → 保留政策
+        """
+        return {self.sensor_data.name: policy_for('sensor_data')}
+
+    def start_retention(self) -> SQLiteRetention:
+        """
+        啟動資料保留排程器（過期讀數在背景分批刪除）
+
+        返回:
+            SQLiteRetention: 關閉時呼叫 stop()
+        """
+        retention = SQLiteRetention(self.store, self.retention_policies())
+        retention.start()
+        return retention
+
+    # ========================================================================
+    # 感測器資料操作
+    # ========================================================================
+
+    def insert_sensor_data(self, data: dict) -> str:
+        """
+        插入感測器資料
+
+        參數:
+            data: 感測器資料字典
+
+        返回:
+            str: 插入資料的 ID
+        """
+        try:
+            reading_id = str(self.sensor_data.insert_one(data))
+            print(f"✓ 插入感測器資料: {reading_id}")
+            return reading_id
+        except Exception as e:
+            print(f"✗ 插入感測器資料失敗: {e}")
+            raise
+
+    def insert_sensor_data_many(self, readings: List[dict]) -> int:
+        """
+        批次插入感測器資料（同一個交易，全部成功或全部不寫入）
+
+        參數:
+            readings: 感測器資料字典列表
+
+        返回:
+            int: 插入的資料筆數
+        """
+        try:
+            return self.sensor_data.insert_many(readings)
+        except Exception as e:
+            print(f"✗ 批次插入感測器資料失敗: {e}")
+            raise
+
+    def query_sensor_data(
+        self,
+        filter_dict: dict = None,
+        limit: int = 100,
+        skip: int = 0,
+        sort_by: str = 'timestamp',
+        sort_order: int = DESCENDING,
+        fields: Optional[List[str]] = None,
+        serialize: bool = True
+    ) -> List[dict]:
+        """
+        查詢感測器資料
+
+        參數:
+            filter_dict: 查詢過濾條件（MongoDB 寫法）
+            limit: 返回資料筆數上限（0 表示不限制）
+            skip: 跳過的資料筆數（用於分頁）
+            sort_by: 排序欄位
+            sort_order: 排序順序（DESCENDING 或 ASCENDING）
+            fields: 只取回這些欄位（None 表示全部，_id 一定包含）
+            serialize: 轉換 _id 與時間為字串；False 時回傳原始文件
+
+        返回:
+            List[dict]: 感測器資料列表
+        """
+        try:
+            docs = self.sensor_data.find(filter_dict, sort_by, sort_order, limit, skip, fields)
+            if not serialize:
+                return docs
+            return [self._serialize_document(doc) for doc in docs]
+        except Exception as e:
+            print(f"✗ 查詢感測器資料失敗: {e}")
+            raise
+
+    def get_device_data(
+        self,
+        device_id: str,
+        limit: int = 100,
+        skip: int = 0
+    ) -> List[dict]:
+        """
+        查詢特定裝置的感測器資料
+
+        參數:
+            device_id: 裝置 ID
+            limit: 返回資料筆數上限
+            skip: 跳過的資料筆數
+
+        返回:
+            List[dict]: 該裝置的感測器資料列表
+        """
+        return self.query_sensor_data({'device_id': device_id}, limit=limit, skip=skip)
+
+    def query_sensor_data_page(
+        self,
+        filter_dict: dict = None,
+        limit: int = 100,
+        cursor: str = None,
+        skip: int = 0,
+        sort_order: int = DESCENDING,
+        fields: Optional[List[str]] = None,
+        serialize: bool = True
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        以鍵集分頁查詢感測器資料（依時間排序，時間相同時依 _id）
+
+        參數:
+            filter_dict: 查詢過濾條件
+            limit: 每頁筆數
+            cursor: 上一頁回傳的 next_cursor（第一頁為 None）
+            skip: 跳過的資料筆數（相容舊版分頁）
+            sort_order: 排序順序（DESCENDING 或 ASCENDING）
+            fields: 只取回這些欄位（None 表示全部）
+            serialize: 轉換 _id 與時間為字串；False 時回傳原始文件
+
+        返回:
+            (感測器資料列表, next_cursor)；沒有下一頁時 next_cursor 為 None
+
+        例外:
+            ValueError: 游標格式錯誤
+        """
+        docs, next_cursor = self.sensor_data.find_page(filter_dict, limit, cursor, skip,
+                                                       sort_order, fields)
+        if not serialize:
+            return docs, next_cursor
+        return [self._serialize_document(doc) for doc in docs], next_cursor
+
+    def get_latest_data(self, device_id: str = None) -> dict:
+        """
+        取得最新的感測器資料
+
+        參數:
+            device_id: 裝置 ID（選用）
+
+        返回:
+            dict: 最新的感測器資料
+        """
+        try:
+            doc = self.sensor_data.find_one({'device_id': device_id} if device_id else None)
+            return self._serialize_document(doc) if doc else None
+        except Exception as e:
+            print(f"✗ 取得最新資料失敗: {e}")
+            raise
+
+    def delete_device_data(self, device_id: str) -> int:
+        """
+        刪除特定裝置的所有資料
+
+        參數:
+            device_id: 裝置 ID
+
+        返回:
+            int: 刪除的資料筆數
+        """
+        try:
+            deleted = self.sensor_data.delete({'device_id': device_id})
+            print(f"✓ 刪除 {deleted} 筆資料（裝置: {device_id}）")
+            return deleted
+        except Exception as e:
+            print(f"✗ 刪除資料失敗: {e}")
+            raise
+
+    def get_data_count(self, filter_dict: dict = None) -> int:
+        """
+        取得資料筆數
+
+        參數:
+            filter_dict: 查詢過濾條件
+
+        返回:
+            int: 資料筆數
+        """
+        try:
+            return self.sensor_data.count(filter_dict)
+        except Exception as e:
+            print(f"✗ 取得資料筆數失敗: {e}")
+            raise
+
+    # ========================================================================
+    # 裝置管理操作
+    # ========================================================================
+    #
+    # 裝置資訊整筆存成 JSON（時間為 ISO 格式字串），device_id 為唯一鍵
+
+    def register_device(self, device_info: dict) -> str:
+        """
+        註冊新裝置（已存在時更新）
+
+        參數:
+            device_info: 裝置資訊字典
+
+        返回:
+            str: 裝置資料的 ID
+        """
+        try:
+            device_id = device_info['device_id']
+            with self.store.transaction() as conn:
+                row = conn.execute("SELECT id, data FROM devices WHERE device_id = ?",
+                                   (device_id,)).fetchone()
+                if row:
+                    # 更新現有裝置
+                    data = {**json.loads(row[1]), **device_info, 'last_seen': datetime.now()}
+                    conn.execute("UPDATE devices SET data = ? WHERE id = ?",
+                                 (dumps(data).decode('utf-8'), row[0]))
+                    print(f"✓ 更新裝置資訊: {device_id}")
+                    return str(row[0])
+
+                # 插入新裝置
+                device_info['created_at'] = datetime.now()
+                device_info['last_seen'] = datetime.now()
+                cursor = conn.execute("INSERT INTO devices (device_id, data) VALUES (?, ?)",
+                                      (device_id, dumps(device_info).decode('utf-8')))
+                print(f"✓ 註冊新裝置: {device_id}")
+                return str(cursor.lastrowid)
+
+        except Exception as e:
+            print(f"✗ 註冊裝置失敗: {e}")
+            raise
+
+    def get_device(self, device_id: str) -> dict:
+        """
+        查詢特定裝置資訊
+
+        參數:
+            device_id: 裝置 ID
+
+        返回:
+            dict: 裝置資訊
+        """
+        try:
+            row = self.store.connection().execute(
+                "SELECT id, data FROM devices WHERE device_id = ?", (device_id,)).fetchone()
+            return self._device_document(row, None, serialize=True) if row else None
+        except Exception as e:
+            print(f"✗ 查詢裝置失敗: {e}")
+            raise
+
+    def get_all_devices(self, fields: Optional[List[str]] = None,
+                        serialize: bool = True) -> List[dict]:
+        """
+        查詢所有裝置
+
+        參數:
+            fields: 只取回這些欄位（None 表示全部）
+            serialize: 轉換 _id 為字串；False 時回傳原始文件
+
+        返回:
+            List[dict]: 裝置列表
+        """
+        try:
+            rows = self.store.connection().execute("SELECT id, data FROM devices ORDER BY id")
+            return [self._device_document(row, fields, serialize) for row in rows]
+        except Exception as e:
+            print(f"✗ 查詢所有裝置失敗: {e}")
+            raise
+
+    def update_device_status(self, device_id: str, status: str) -> bool:
+        """
+        更新裝置狀態
+
+        參數:
+            device_id: 裝置 ID
+            status: 新狀態
+
+        返回:
+            bool: 更新是否成功
+        """
+        try:
+            with self.store.transaction() as conn:
+                updated = conn.execute(
+                    "UPDATE devices SET data = json_set(data, '$.status', ?, '$.last_seen', ?) "
+                    "WHERE device_id = ?",
+                    (status, datetime.now().isoformat(), device_id)).rowcount
+
+            if updated > 0:
+                print(f"✓ 更新裝置狀態: {device_id} -> {status}")
+                return True
+            else:
+                print(f"✗ 裝置不存在或狀態未變更: {device_id}")
+                return False
+
+        except Exception as e:
+            print(f"✗ 更新裝置狀態失敗: {e}")
+            raise
+
+    def delete_device(self, device_id: str) -> bool:
+        """
+        刪除裝置
+
+        參數:
+            device_id: 裝置 ID
+
+        返回:
+            bool: 刪除是否成功
+        """
+        try:
+            with self.store.transaction() as conn:
+                deleted = conn.execute("DELETE FROM devices WHERE device_id = ?",
+                                       (device_id,)).rowcount
+
+            if deleted > 0:
+                print(f"✓ 刪除裝置: {device_id}")
+                return True
+            else:
+                print(f"✗ 裝置不存在: {device_id}")
+                return False
+
+        except Exception as e:
+            print(f"✗ 刪除裝置失敗: {e}")
+            raise
+
+    # ========================================================================
+    # 統計和分析
+    # ========================================================================
+
+    def get_device_statistics(self, device_id: str) -> dict:
+        """
+        取得裝置的統計資料
+
+        以 SQL 彙總數值讀數（由覆蓋索引計算，不讀資料表）；
+        欄位與 MongoDB 版本相同，count 為數值讀數的筆數
+
+        參數:
+            device_id: 裝置 ID
+
+        返回:
+            dict: 統計資料（平均值、最大值、最小值等）
+        """
+        try:
+            stats = self.sensor_data.statistics({'device_id': device_id})
+            if not stats:
+                return {}
+
+            return {
+                '_id': device_id,
+                'count': stats['count'],
+                'avg_value': stats['avg'],
+                'min_value': stats['min'],
+                'max_value': stats['max'],
+                'latest_timestamp': stats['last'].isoformat()
+            }
+
+        except Exception as e:
+            print(f"✗ 取得統計資料失敗: {e}")
+            raise
+
+    # ========================================================================
+    # 格式轉換
+    # ========================================================================
+
+    @staticmethod
+    def _device_document(row: Tuple, fields: Optional[List[str]], serialize: bool) -> dict:
+        """裝置資料列轉換為文件"""
+        doc = {'_id': str(row[0]) if serialize else row[0], **json.loads(row[1])}
+        if fields is not None:
+            keep = {'_id', *fields}
+            doc = {key: value for key, value in doc.items() if key in keep}
+        return doc
+
+    @staticmethod
+    def _serialize_document(doc: dict) -> dict:
+        """讀數轉換為 API 回應格式（_id 轉為字串、datetime 轉為 ISO 格式字串）"""
+        doc['_id'] = str(doc['_id'])
+        if isinstance(doc.get('timestamp'), datetime):
+            doc['timestamp'] = doc['timestamp'].isoformat()
+        return doc
@@ -16,19 +16,35 @@ db.createUser({
   ]
 });
 
-// 建立 sensor_data 集合
-db.createCollection('sensor_data');
+// 建立 sensor_data 集合（時間序列集合：依裝置與時間分桶、欄式壓縮，需要 MongoDB 5.0 以上）
+db.createCollection('sensor_data', {
+  timeseries: {
+    timeField: 'timestamp',
+    metaField: 'device_id',
+    granularity: 'seconds'
+  }
+});
 
 // 建立 devices 集合
 db.createCollection('devices');
 
-// 為 sensor_data 建立索引（提升查詢效能）
-db.sensor_data.createIndex({ "device_id": 1 });
-db.sensor_data.createIndex({ "timestamp": -1 });
-db.sensor_data.createIndex({ "device_id": 1, "timestamp": -1 });
+// 為 sensor_data 建立索引（與 common/indexes.py 的登記相同，API 啟動時也會建立）
+// device_id 單欄查詢使用 device_id + timestamp 索引，不需要另外建立
+// 以 _id 結尾，供鍵集分頁（next_cursor）使用
+db.sensor_data.createIndex({ "device_id": 1, "timestamp": -1, "_id": -1 });
+db.sensor_data.createIndex({ "device_id": 1, "sensor_type": 1, "timestamp": -1, "_id": -1 });
+db.sensor_data.createIndex({ "timestamp": -1, "_id": -1 });
+
+// 統計彙總（common/rollups.py，每個裝置、感測器每分鐘/小時/天一個文件）
+db.sensor_data_rollups.createIndex(
+  { "device_id": 1, "sensor_type": 1, "resolution": 1, "start": 1 },
+  { unique: true }
+);
+db.sensor_data_rollups.createIndex({ "resolution": 1, "start": 1 });
 
 // 為 devices 建立索引
 db.devices.createIndex({ "device_id": 1 }, { unique: true });
+db.devices.createIndex({ "status": 1 });
 
 // 插入範例裝置資料
 db.devices.insertMany([
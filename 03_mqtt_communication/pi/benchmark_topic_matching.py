@@ -0,0 +1,104 @@
+"""
+主題比對效能測試
+比較「逐一比對所有訂閱」與「TopicTrie 索引」的每則訊息比對成本
+
+不需要 MQTT Broker，直接在本機執行：
+    python benchmark_topic_matching.py
+    python benchmark_topic_matching.py --devices 500 --messages 50000
+"""
+
+import argparse
+import random
+import time
+from mqtt_client import PiMQTTClient, TopicTrie
+
+LOCATIONS = ['classroom_a', 'classroom_b', 'lab', 'office', 'hallway']
+SENSOR_TYPES = ['temperature', 'humidity', 'light']
+
+def build_patterns(devices: int) -> list:
+    """
+    建立模擬的訂閱模式
+
+    - 每個裝置的命令主題：devices/<id>/command
+    - 每個裝置的感測器主題：sensors/<id>/+
+    - 每個位置的彙總主題：sensors/+/<location>/#
+    - 全域監看：alerts/#
+    """
+    patterns = []
+    for i in range(devices):
+        device_id = f"pico_{i:03d}"
+        patterns.append(f"devices/{device_id}/command")
+        patterns.append(f"sensors/{device_id}/+")
+    for location in LOCATIONS:
+        patterns.append(f"sensors/+/{location}/#")
+    patterns.append("alerts/#")
+    return patterns
+
+def build_topics(devices: int, count: int) -> list:
+    """建立模擬的訊息主題"""
+    rng = random.Random(42)
+    topics = []
+    for _ in range(count):
+        device_id = f"pico_{rng.randrange(devices):03d}"
+        kind = rng.random()
+        if kind < 0.6:
+            topics.append(f"sensors/{device_id}/{rng.choice(SENSOR_TYPES)}")
+        elif kind < 0.8:
+            topics.append(f"sensors/{device_id}/{rng.choice(LOCATIONS)}/{rng.choice(SENSOR_TYPES)}")
+        elif kind < 0.95:
+            topics.append(f"devices/{device_id}/command")
+        else:
+            topics.append(f"alerts/{device_id}/offline")
+    return topics
+
+def main():
+    parser = argparse.ArgumentParser(description='主題比對效能測試')
+    parser.add_argument('--devices', type=int, default=300, help='模擬裝置數量')
+    parser.add_argument('--messages', type=int, default=20000, help='測試訊息數量')
+    args = parser.parse_args()
+
+    patterns = build_patterns(args.devices)
+    topics = build_topics(args.devices, args.messages)
+
+    # 只用來呼叫比對函式，不會連線
+    client = PiMQTTClient(client_id="benchmark", broker="localhost")
+
+    trie = TopicTrie()
+    for pattern in patterns:
+        trie.insert(pattern, pattern)
+
+    print("=" * 60)
+    print("主題比對效能測試")
+    print("=" * 60)
+    print(f"訂閱數量: {len(patterns)}")
+    print(f"訊息數量: {len(topics)}")
+
+    # 逐一比對（原本的做法，找出所有匹配）
+    start = time.perf_counter()
+    linear_results = []
+    for topic in topics:
+        linear_results.append([p for p in patterns if client._topic_matches(topic, p)])
+    linear_time = time.perf_counter() - start
+
+    # Trie 索引
+    start = time.perf_counter()
+    trie_results = []
+    for topic in topics:
+        trie_results.append(trie.match(topic))
+    trie_time = time.perf_counter() - start
+
+    # 兩種做法的結果必須一致
+    mismatches = sum(1 for a, b in zip(linear_results, trie_results) if a != b)
+
+    linear_us = linear_time / len(topics) * 1e6
+    trie_us = trie_time / len(topics) * 1e6
+
+    print("-" * 60)
+    print(f"逐一比對: {linear_us:10.2f} µs/則  ({len(topics) / linear_time:,.0f} 則/秒)")
+    print(f"Trie 索引: {trie_us:10.2f} µs/則  ({len(topics) / trie_time:,.0f} 則/秒)")
+    print(f"加速倍數: {linear_us / trie_us:.1f}x")
+    print(f"結果不一致: {mismatches} 則")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
@@ -11,12 +11,17 @@
 
 import sys
 import os
+import threading
 from datetime import datetime
 from typing import Dict, Optional
-import json
 
 # 加入 FastAPI 應用程式路徑
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../02_pi_basics/fastapi_app'))
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from sensor_decoder import SensorDecoder, SensorReading, PayloadError
+from timestamps import to_datetime
 
 try:
     from database import DatabaseManager
@@ -40,6 +45,12 @@ class DataHandler:
         """
         self.db = db_manager
         
+        # 訊息解碼器（此處要求 unit 欄位）
+        self.decoder = SensorDecoder(required=('device_id', 'sensor_type', 'value', 'unit'))
+        
+        # 多個工作執行緒同時處理訊息時，保護統計和最近資料
+        self.lock = threading.Lock()
+        
         # 統計資訊
         self.processed_count = 0
         self.saved_count = 0
@@ -49,59 +60,49 @@ class DataHandler:
         self.recent_data = []
         self.max_recent = 10
     
-    def validate_sensor_data(self, data: Dict) -> bool:
+    def parse_message(self, data) -> SensorReading:
         """
-        驗證感測器資料格式
+        解析並驗證訊息
         
         參數:
-            data: 感測器資料字典
+            data: 原始 payload（bytes/str）或已解析的字典
         
         返回:
-            bool: 資料是否有效
-        """
-        required_fields = ['device_id', 'sensor_type', 'value', 'unit']
+            SensorReading: 感測器讀數記錄
         
-        # 檢查必填欄位
-        for field in required_fields:
-            if field not in data:
-                print(f"✗ 缺少必填欄位: {field}")
-                return False
-        
-        # 檢查數值型別
-        if not isinstance(data['value'], (int, float)):
-            print(f"✗ 數值型別錯誤: {type(data['value'])}")
-            return False
-        
-        return True
+        例外:
+            PayloadError: 訊息無法解析或驗證失敗
+        """
+        if isinstance(data, dict):
+            return self.decoder.from_dict(data)
+        return self.decoder.decode(data)
     
-    def format_data(self, data: Dict) -> Dict:
+    def format_data(self, reading: SensorReading) -> SensorReading:
         """
-        格式化資料
+        格式化資料（直接修改記錄，不複製）
         
         參數:
-            data: 原始資料
+            reading: 感測器讀數記錄
         
         返回:
-            dict: 格式化後的資料
+            SensorReading: 格式化後的記錄
         """
-        formatted = data.copy()
-        
         # 確保有時間戳記
-        if 'timestamp' not in formatted:
-            formatted['timestamp'] = datetime.now()
-        elif isinstance(formatted['timestamp'], (int, float)):
-            # 如果是 Unix 時間戳記，轉換為 datetime
-            formatted['timestamp'] = datetime.fromtimestamp(formatted['timestamp'])
+        if reading.timestamp is None:
+            reading.timestamp = datetime.now()
+        else:
+            # Unix 時間戳記、ISO 字串統一轉換為 datetime
+            reading.timestamp = to_datetime(reading.timestamp)
         
         # 確保有裝置類型
-        if 'device_type' not in formatted:
-            formatted['device_type'] = 'unknown'
+        if 'device_type' not in reading.fields:
+            reading.fields['device_type'] = 'unknown'
         
         # 四捨五入數值
-        if isinstance(formatted['value'], float):
-            formatted['value'] = round(formatted['value'], 2)
+        if isinstance(reading.value, float):
+            reading.value = round(reading.value, 2)
         
-        return formatted
+        return reading
     
     def save_to_database(self, data: Dict) -> bool:
         """
@@ -121,16 +122,17 @@ class DataHandler:
             # 儲存到資料庫
             result_id = self.db.insert_sensor_data(data)
             
-            if result_id:
-                self.saved_count += 1
-                return True
-            else:
-                self.error_count += 1
-                return False
+            with self.lock:
+                if result_id:
+                    self.saved_count += 1
+                else:
+                    self.error_count += 1
+            return bool(result_id)
         
         except Exception as e:
             print(f"✗ 儲存資料失敗: {e}")
-            self.error_count += 1
+            with self.lock:
+                self.error_count += 1
             return False
     
     def handle_message(self, topic: str, data: Dict) -> bool:
@@ -139,61 +141,59 @@ class DataHandler:
         
         參數:
             topic: MQTT 主題
-            data: 訊息資料
+            data: 訊息資料（原始 bytes/str 或已解析的字典）
         
         返回:
             bool: 處理是否成功
         """
         try:
-            self.processed_count += 1
+            with self.lock:
+                self.processed_count += 1
             
-            # 如果資料是字串，嘗試解析為 JSON
-            if isinstance(data, str):
-                try:
-                    data = json.loads(data)
-                except json.JSONDecodeError:
-                    print(f"✗ 無法解析 JSON: {data}")
+            # 解析並驗證資料
+            try:
+                reading = self.parse_message(data)
+            except PayloadError as e:
+                print(f"✗ {e}")
+                with self.lock:
                     self.error_count += 1
-                    return False
-            
-            # 驗證資料
-            if not self.validate_sensor_data(data):
-                self.error_count += 1
                 return False
             
             # 格式化資料
-            formatted_data = self.format_data(data)
+            formatted_data = self.format_data(reading)
             
             # 儲存最近的資料
-            self.recent_data.append({
-                'topic': topic,
-                'data': formatted_data,
-                'time': datetime.now()
-            })
-            if len(self.recent_data) > self.max_recent:
-                self.recent_data.pop(0)
+            with self.lock:
+                self.recent_data.append({
+                    'topic': topic,
+                    'data': formatted_data,
+                    'time': datetime.now()
+                })
+                if len(self.recent_data) > self.max_recent:
+                    self.recent_data.pop(0)
             
             # 列印資料
             self.print_data(topic, formatted_data)
             
             # 儲存到資料庫
             if self.db:
-                self.save_to_database(formatted_data)
+                self.save_to_database(formatted_data.to_document())
             
             return True
         
         except Exception as e:
             print(f"✗ 處理訊息時發生錯誤: {e}")
-            self.error_count += 1
+            with self.lock:
+                self.error_count += 1
             return False
     
-    def print_data(self, topic: str, data: Dict):
+    def print_data(self, topic: str, data: SensorReading):
         """
         列印資料（格式化輸出）
         
         參數:
             topic: MQTT 主題
-            data: 資料字典
+            data: 感測器讀數記錄
         """
         print("\n" + "-" * 50)
         print(f"📨 收到訊息 [{self.processed_count}]")
@@ -201,7 +201,7 @@ class DataHandler:
         print(f"裝置: {data.get('device_id')}")
         print(f"類型: {data.get('sensor_type')}")
         print(f"數值: {data.get('value')} {data.get('unit')}")
-        if 'location' in data:
+        if data.get('location') is not None:
             print(f"位置: {data.get('location')}")
         print(f"時間: {data.get('timestamp')}")
         print("-" * 50)
@@ -7,14 +7,275 @@ Pi MQTT 客戶端模組
 - 訂閱主題
 - 訊息處理回調
 - 自動重連
+- 多執行緒分派（同一裝置的訊息保持順序）
 """
 
 import paho.mqtt.client as mqtt
 import json
+import queue
+import threading
 import time
+import zlib
 from datetime import datetime
 from typing import Callable, Dict, List
 
+# 分派佇列滿時的處理策略
+POLICY_BLOCK = 'block'  # 等待佇列有空位（會延遲 paho 網路執行緒）
+POLICY_DROP = 'drop'    # 直接丟棄新訊息
+
+class TopicTrie:
+    """
+    主題訂閱索引（Trie）
+    
+    依照主題的每一層建立樹狀索引，比對訊息主題時只需走過主題的層數，
+    不必逐一比對每個訂閱。支援 MQTT 萬用字元：
+    - + : 單層萬用字元
+    - # : 多層萬用字元（也匹配上一層本身，例如 sensors/# 匹配 sensors）
+    """
+    
+    class _Node:
+        __slots__ = ('children', 'entry')
+        
+        def __init__(self):
+            self.children = {}
+            self.entry = None  # (訂閱順序, 回調函式)
+    
+    def __init__(self):
+        """初始化空的索引"""
+        self.root = self._Node()
+        self.sequence = 0
+        self.size = 0
+    
+    def insert(self, pattern: str, callback: Callable):
+        """
+        加入（或取代）一個訂閱
+        
+        參數:
+            pattern: MQTT 主題模式
+            callback: 回調函式
+        """
+        node = self.root
+        for level in pattern.split('/'):
+            child = node.children.get(level)
+            if child is None:
+                child = self._Node()
+                node.children[level] = child
+            node = child
+        
+        if node.entry is None:
+            self.size += 1
+        self.sequence += 1
+        node.entry = (self.sequence, callback)
+    
+    def remove(self, pattern: str) -> bool:
+        """
+        移除一個訂閱，並清除不再使用的節點
+        
+        返回:
+            bool: 是否有移除
+        """
+        path = [self.root]
+        levels = pattern.split('/')
+        for level in levels:
+            child = path[-1].children.get(level)
+            if child is None:
+                return False
+            path.append(child)
+        
+        if path[-1].entry is None:
+            return False
+        path[-1].entry = None
+        self.size -= 1
+        
+        # 由下往上刪除空節點
+        for depth in range(len(levels), 0, -1):
+            node = path[depth]
+            if node.entry is not None or node.children:
+                break
+            del path[depth - 1].children[levels[depth - 1]]
+        return True
+    
+    def match(self, topic: str) -> List[Callable]:
+        """
+        找出所有匹配主題的回調函式（依訂閱順序排列）
+        
+        參數:
+            topic: 訊息主題
+        
+        返回:
+            list: 回調函式列表
+        """
+        levels = topic.split('/')
+        entries = []
+        # 以 $ 開頭的系統主題不匹配第一層萬用字元
+        self._collect(self.root, levels, 0, entries, not topic.startswith('$'))
+        
+        if len(entries) > 1:
+            entries.sort(key=lambda entry: entry[0])
+        return [callback for _, callback in entries]
+    
+    def _collect(self, node, levels, index, entries, allow_wildcard):
+        """遞迴走訪索引，收集匹配的訂閱"""
+        children = node.children
+        
+        if allow_wildcard:
+            multi = children.get('#')
+            if multi is not None and multi.entry is not None:
+                entries.append(multi.entry)
+        
+        if index == len(levels):
+            if node.entry is not None:
+                entries.append(node.entry)
+            return
+        
+        child = children.get(levels[index])
+        if child is not None:
+            self._collect(child, levels, index + 1, entries, True)
+        
+        if allow_wildcard:
+            single = children.get('+')
+            if single is not None:
+                self._collect(single, levels, index + 1, entries, True)
+    
+    def __len__(self):
+        return self.size
+
+class MessageDispatcher:
+    """
+    訊息分派器
+    
+    將訊息交給固定數量的工作執行緒處理。每則訊息依照 device_id
+    （沒有時用主題）分配到固定的分片，同一裝置的訊息一定由同一個
+    執行緒依序處理，不同裝置則可以平行處理。
+    """
+    
+    def __init__(self, workers: int = 4, queue_size: int = 100,
+                 policy: str = POLICY_BLOCK, put_timeout: float = 1.0):
+        """
+        初始化分派器
+        
+        參數:
+            workers: 工作執行緒數量（分片數）
+            queue_size: 每個分片的佇列上限
+            policy: 佇列滿時的策略（'block' 或 'drop'）
+            put_timeout: block 策略下最多等待秒數，逾時仍丟棄
+        """
+        if policy not in (POLICY_BLOCK, POLICY_DROP):
+            raise ValueError(f"未知的分派策略: {policy}")
+        
+        self.workers = workers
+        self.policy = policy
+        self.put_timeout = put_timeout
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads: List[threading.Thread] = []
+        self.running = False
+        
+        # 統計資訊
+        self.lock = threading.Lock()
+        self.dispatched_count = 0
+        self.dropped_count = 0
+        self.blocked_count = 0
+    
+    def start(self, handler: Callable):
+        """
+        啟動工作執行緒
+        
+        參數:
+            handler: 實際處理訊息的函式 handler(topic, data, callbacks)
+        """
+        self.running = True
+        for index, shard_queue in enumerate(self.queues):
+            thread = threading.Thread(
+                target=self._worker,
+                args=(shard_queue, handler),
+                name=f"mqtt_dispatch_{index}",
+                daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+    
+    def stop(self, timeout: float = 5.0):
+        """停止工作執行緒（先處理完佇列中的訊息）"""
+        if not self.running:
+            return
+        
+        self.running = False
+        for shard_queue in self.queues:
+            shard_queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+    
+    def shard_for(self, topic: str, data) -> int:
+        """
+        計算訊息所屬的分片
+        
+        使用 crc32 而非 hash()，讓同一個 key 每次執行都落在同一個分片
+        """
+        key = None
+        if isinstance(data, dict):
+            key = data.get('device_id')
+        if key is None:
+            key = topic
+        return zlib.crc32(str(key).encode('utf-8')) % self.workers
+    
+    def dispatch(self, topic: str, data, callbacks: List[Callable]) -> bool:
+        """
+        將訊息放入對應分片的佇列
+        
+        返回:
+            bool: 是否成功放入佇列
+        """
+        shard_queue = self.queues[self.shard_for(topic, data)]
+        item = (topic, data, callbacks)
+        
+        try:
+            shard_queue.put_nowait(item)
+        except queue.Full:
+            if self.policy == POLICY_DROP:
+                with self.lock:
+                    self.dropped_count += 1
+                return False
+            
+            with self.lock:
+                self.blocked_count += 1
+            try:
+                shard_queue.put(item, timeout=self.put_timeout)
+            except queue.Full:
+                with self.lock:
+                    self.dropped_count += 1
+                return False
+        
+        with self.lock:
+            self.dispatched_count += 1
+        return True
+    
+    def _worker(self, shard_queue: queue.Queue, handler: Callable):
+        """工作執行緒主迴圈"""
+        while True:
+            item = shard_queue.get()
+            if item is None:
+                break
+            topic, data, callbacks = item
+            handler(topic, data, callbacks)
+    
+    def get_statistics(self) -> Dict:
+        """
+        取得分派統計資訊
+        
+        返回:
+            dict: 統計資訊
+        """
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'policy': self.policy,
+                'dispatched': self.dispatched_count,
+                'dropped': self.dropped_count,
+                'blocked': self.blocked_count,
+                'queue_depths': [q.qsize() for q in self.queues]
+            }
+
 class PiMQTTClient:
     """
     Pi MQTT 客戶端類別
@@ -22,7 +283,9 @@ class PiMQTTClient:
     封裝 MQTT 訂閱和訊息處理功能
     """
     
-    def __init__(self, client_id: str, broker: str, port: int = 1883, keepalive: int = 60):
+    def __init__(self, client_id: str, broker: str, port: int = 1883, keepalive: int = 60,
+                 dispatch_workers: int = 0, dispatch_queue_size: int = 100,
+                 dispatch_policy: str = POLICY_BLOCK, decode_payload: bool = True):
         """
         初始化 MQTT 客戶端
         
@@ -31,11 +294,18 @@ class PiMQTTClient:
             broker: MQTT Broker 位址
             port: MQTT 連接埠（預設 1883）
             keepalive: 保持連接時間（秒）
+            dispatch_workers: 處理回調的工作執行緒數量
+                              0 表示直接在 paho 網路執行緒上執行回調
+            dispatch_queue_size: 每個工作執行緒的佇列上限
+            dispatch_policy: 佇列滿時的策略（'block' 或 'drop'）
+            decode_payload: 是否先把訊息解析成 JSON 再交給回調
+                            False 時回調直接收到原始 bytes（由回調自行解析）
         """
         self.client_id = client_id
         self.broker = broker
         self.port = port
         self.keepalive = keepalive
+        self.decode_payload = decode_payload
         
         # 建立 MQTT 客戶端
         self.client = mqtt.Client(client_id=client_id)
@@ -51,9 +321,25 @@ class PiMQTTClient:
         # 訂閱的主題和回調
         self.subscriptions: Dict[str, Callable] = {}
         
+        # 訂閱索引，用於快速找出匹配的回調
+        self.subscription_index = TopicTrie()
+        
         # 統計資訊
         self.message_count = 0
         self.error_count = 0
+        
+        # 每個回調函式的執行時間統計
+        self.stats_lock = threading.Lock()
+        self.callback_stats: Dict[str, Dict] = {}
+        
+        # 訊息分派器（選用）
+        self.dispatcher = None
+        if dispatch_workers > 0:
+            self.dispatcher = MessageDispatcher(
+                workers=dispatch_workers,
+                queue_size=dispatch_queue_size,
+                policy=dispatch_policy
+            )
     
     def _on_connect(self, client, userdata, flags, rc):
         """
@@ -94,26 +380,71 @@ class PiMQTTClient:
         try:
             self.message_count += 1
             
-            # 解碼訊息
             topic = msg.topic
-            payload = msg.payload.decode('utf-8')
             
-            # 嘗試解析 JSON
-            try:
-                data = json.loads(payload)
-            except json.JSONDecodeError:
-                data = payload
+            if self.decode_payload:
+                # 解碼訊息並嘗試解析 JSON
+                payload = msg.payload.decode('utf-8')
+                try:
+                    data = json.loads(payload)
+                except json.JSONDecodeError:
+                    data = payload
+            else:
+                # 原始 bytes 直接交給回調
+                data = msg.payload
             
-            # 呼叫對應的回調函式
-            for pattern, callback in self.subscriptions.items():
-                if self._topic_matches(topic, pattern):
-                    callback(topic, data)
-                    break
+            # 找出所有匹配的回調函式
+            callbacks = self.subscription_index.match(topic)
+            
+            if not callbacks:
+                return
+            
+            # 交給工作執行緒，或直接在網路執行緒上執行
+            if self.dispatcher:
+                self.dispatcher.dispatch(topic, data, callbacks)
+            else:
+                self._run_callbacks(topic, data, callbacks)
         
         except Exception as e:
             print(f"✗ 處理訊息時發生錯誤: {e}")
             self.error_count += 1
     
+    def _run_callbacks(self, topic: str, data, callbacks: List[Callable]):
+        """
+        執行回調函式並記錄執行時間
+        
+        參數:
+            topic: MQTT 主題
+            data: 訊息資料
+            callbacks: 要執行的回調函式列表
+        """
+        for callback in callbacks:
+            name = getattr(callback, '__qualname__', repr(callback))
+            start = time.perf_counter()
+            failed = False
+            
+            try:
+                callback(topic, data)
+            except Exception as e:
+                print(f"✗ 回調函式 {name} 發生錯誤: {e}")
+                failed = True
+            
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            
+            with self.stats_lock:
+                if failed:
+                    self.error_count += 1
+                stats = self.callback_stats.get(name)
+                if stats is None:
+                    stats = {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+                    self.callback_stats[name] = stats
+                stats['calls'] += 1
+                stats['total_ms'] += elapsed_ms
+                if elapsed_ms > stats['max_ms']:
+                    stats['max_ms'] = elapsed_ms
+                if failed:
+                    stats['errors'] += 1
+    
     def _topic_matches(self, topic: str, pattern: str) -> bool:
         """
         檢查主題是否匹配模式
@@ -125,9 +456,17 @@ class PiMQTTClient:
         topic_parts = topic.split('/')
         pattern_parts = pattern.split('/')
         
-        # 如果模式以 # 結尾
+        # 以 $ 開頭的系統主題不匹配第一層萬用字元
+        if topic.startswith('$') and pattern_parts[0] in ('+', '#'):
+            return False
+        
+        # 如果模式以 # 結尾，比對 # 之前的每一層（# 也匹配上一層本身）
         if pattern_parts[-1] == '#':
-            return topic.startswith('/'.join(pattern_parts[:-1]))
+            prefix = pattern_parts[:-1]
+            if len(topic_parts) < len(prefix):
+                return False
+            topic_parts = topic_parts[:len(prefix)]
+            pattern_parts = prefix
         
         # 檢查每一層
         if len(topic_parts) != len(pattern_parts):
@@ -148,6 +487,11 @@ class PiMQTTClient:
         """
         try:
             print(f"正在連接到 MQTT Broker: {self.broker}:{self.port}")
+            
+            # 先啟動工作執行緒，才不會漏掉連線後立即收到的訊息
+            if self.dispatcher and not self.dispatcher.running:
+                self.dispatcher.start(self._run_callbacks)
+            
             self.client.connect(self.broker, self.port, self.keepalive)
             
             # 啟動網路迴圈（背景執行緒）
@@ -171,6 +515,11 @@ class PiMQTTClient:
             self.client.loop_stop()
             self.client.disconnect()
             self.connected = False
+            
+            # 處理完佇列中剩餘的訊息
+            if self.dispatcher:
+                self.dispatcher.stop()
+            
             print("MQTT 連接已中斷")
         except Exception as e:
             print(f"中斷連接時發生錯誤: {e}")
@@ -187,6 +536,7 @@ class PiMQTTClient:
         try:
             # 儲存訂閱資訊
             self.subscriptions[topic] = callback
+            self.subscription_index.insert(topic, callback)
             
             # 如果已連接，立即訂閱
             if self.connected:
@@ -209,6 +559,7 @@ class PiMQTTClient:
         try:
             if topic in self.subscriptions:
                 del self.subscriptions[topic]
+                self.subscription_index.remove(topic)
             
             if self.connected:
                 self.client.unsubscribe(topic)
@@ -255,11 +606,24 @@ class PiMQTTClient:
         返回:
             dict: 統計資訊
         """
+        with self.stats_lock:
+            callbacks = {
+                name: {
+                    'calls': stats['calls'],
+                    'errors': stats['errors'],
+                    'avg_ms': stats['total_ms'] / stats['calls'] if stats['calls'] else 0,
+                    'max_ms': stats['max_ms']
+                }
+                for name, stats in self.callback_stats.items()
+            }
+        
         return {
             'connected': self.connected,
             'message_count': self.message_count,
             'error_count': self.error_count,
-            'subscriptions': list(self.subscriptions.keys())
+            'subscriptions': list(self.subscriptions.keys()),
+            'callbacks': callbacks,
+            'dispatch': self.dispatcher.get_statistics() if self.dispatcher else None
         }
     
     def print_statistics(self):
@@ -273,6 +637,20 @@ class PiMQTTClient:
         print(f"  訂閱主題: {len(stats['subscriptions'])} 個")
         for topic in stats['subscriptions']:
             print(f"    - {topic}")
+        
+        if stats['callbacks']:
+            print("  回調執行時間:")
+            for name, cb_stats in stats['callbacks'].items():
+                print(f"    - {name}: {cb_stats['calls']} 次，"
+                      f"平均 {cb_stats['avg_ms']:.2f} ms，最長 {cb_stats['max_ms']:.2f} ms，"
+                      f"錯誤 {cb_stats['errors']} 次")
+        
+        dispatch = stats['dispatch']
+        if dispatch:
+            print(f"  分派模式: {dispatch['workers']} 個工作執行緒（{dispatch['policy']}）")
+            print(f"    已分派: {dispatch['dispatched']} 則，丟棄: {dispatch['dropped']} 則，"
+                  f"等待: {dispatch['blocked']} 次")
+            print(f"    佇列深度: {dispatch['queue_depths']}")
         print("=" * 50)
 
 # ============================================================================
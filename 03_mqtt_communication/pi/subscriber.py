@@ -13,7 +13,7 @@ import sys
 import os
 import time
 import signal
-from mqtt_client import PiMQTTClient
+from mqtt_client import PiMQTTClient, POLICY_BLOCK, POLICY_DROP
 from data_handler import DataHandler
 
 # 加入 FastAPI 應用程式路徑
@@ -38,7 +38,9 @@ class MQTTSubscriber:
         client_id: str = "pi_subscriber",
         broker: str = "localhost",
         port: int = 1883,
-        use_database: bool = True
+        use_database: bool = True,
+        workers: int = 0,
+        drop_when_full: bool = False
     ):
         """
         初始化訂閱者
@@ -48,6 +50,8 @@ class MQTTSubscriber:
             broker: MQTT Broker 位址
             port: MQTT 連接埠
             use_database: 是否使用資料庫
+            workers: 處理訊息的工作執行緒數量（0 表示不使用）
+            drop_when_full: 工作佇列滿時丟棄訊息，而非等待
         """
         self.client_id = client_id
         self.broker = broker
@@ -69,7 +73,11 @@ class MQTTSubscriber:
         self.mqtt_client = PiMQTTClient(
             client_id=client_id,
             broker=broker,
-            port=port
+            port=port,
+            dispatch_workers=workers,
+            dispatch_policy=POLICY_DROP if drop_when_full else POLICY_BLOCK,
+            # DataHandler 直接解析原始 bytes
+            decode_payload=False
         )
         
         # 運行狀態
@@ -179,6 +187,13 @@ class MQTTSubscriber:
         print(f"  連接狀態: {'已連接' if mqtt_stats['connected'] else '未連接'}")
         print(f"  接收訊息: {mqtt_stats['message_count']} 則")
         print(f"  發生錯誤: {mqtt_stats['error_count']} 次")
+        for name, cb_stats in mqtt_stats['callbacks'].items():
+            print(f"  回調 {name}: 平均 {cb_stats['avg_ms']:.2f} ms，"
+                  f"最長 {cb_stats['max_ms']:.2f} ms")
+        if mqtt_stats['dispatch']:
+            dispatch = mqtt_stats['dispatch']
+            print(f"  工作執行緒: {dispatch['workers']} 個，"
+                  f"丟棄 {dispatch['dropped']} 則，佇列深度 {dispatch['queue_depths']}")
         
         # 資料處理統計
         data_stats = self.data_handler.get_statistics()
@@ -204,6 +219,10 @@ def main():
     parser.add_argument('--port', type=int, default=1883, help='MQTT 連接埠')
     parser.add_argument('--client-id', default='pi_subscriber', help='客戶端 ID')
     parser.add_argument('--no-db', action='store_true', help='不使用資料庫')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='處理訊息的工作執行緒數量（預設 0，直接在 MQTT 執行緒處理）')
+    parser.add_argument('--drop-when-full', action='store_true',
+                        help='工作佇列滿時丟棄訊息（預設為等待）')
     
     args = parser.parse_args()
     
@@ -212,7 +231,9 @@ def main():
         client_id=args.client_id,
         broker=args.broker,
         port=args.port,
-        use_database=not args.no_db
+        use_database=not args.no_db,
+        workers=args.workers,
+        drop_when_full=args.drop_when_full
     )
     
     # 執行
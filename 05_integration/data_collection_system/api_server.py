@@ -3,21 +3,41 @@
 """
 資料查詢 API 服務
 提供 RESTful API 端點查詢儲存在 MongoDB 的感測器資料
+（資料庫呼叫交給執行緒池執行，不阻塞事件迴圈，見 common/async_db.py）
+統計與裝置列表的回應會快取，裝置有新資料時失效（見 common/response_cache.py）
 """
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
 from datetime import datetime, timedelta
 from typing import Optional, List
 from pydantic import BaseModel
+import os
+import sys
 import uvicorn
 
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from mongo_pool import get_client, release_client
+from pagination import paginate
+from serialization import dumps, parse_fields, projection, JSON_MEDIA_TYPE
+from rollups import rollup_collection_name, summarize
+from latest import latest_collection_name, latest_by_device
+from async_db import run_db, run_heavy, shutdown_executors
+from response_cache import ResponseCache, IngestWatcher
+
 # ============ 配置參數 ============
 MONGO_URI = "mongodb://localhost:27017/"
 MONGO_DB = "iot_data"
 MONGO_COLLECTION = "sensor_readings"
 
+# 回應快取的存活時間（秒）；裝置有新資料時統計會提早失效
+CACHE_TTLS = {
+    "stats": 60,        # /api/stats/{device_id}
+    "devices": 5,       # /api/devices（所有裝置，只依存活時間過期）
+}
+
 # ============ 資料模型 ============
 class SensorReading(BaseModel):
     """感測器讀數資料模型"""
@@ -36,6 +56,7 @@ class QueryResponse(BaseModel):
     count: int
     data: List[dict]
     message: Optional[str] = None
+    next_cursor: Optional[str] = None   # 下一頁的游標（沒有下一頁時為 None）
 
 class StatsResponse(BaseModel):
     """統計資訊回應模型"""
@@ -65,15 +86,39 @@ app.add_middleware(
 )
 
 # ============ 資料庫連接 ============
+# 共用連線池，第一次查詢時才連線（uvicorn 多 worker 時每個 worker 各自建立）
 try:
-    mongo_client = MongoClient(MONGO_URI)
+    mongo_client = get_client(MONGO_URI)
     db = mongo_client[MONGO_DB]
     collection = db[MONGO_COLLECTION]
-    print(f"✓ 成功連接到 MongoDB: {MONGO_DB}.{MONGO_COLLECTION}")
+    # 統計彙總（由 mqtt_to_db 寫入時累加）
+    rollups = db[rollup_collection_name(MONGO_COLLECTION)]
+    # 每個裝置、感測器的最新讀數（由 mqtt_to_db 寫入時更新）
+    latest_readings = db[latest_collection_name(MONGO_COLLECTION)]
+    print(f"✓ MongoDB 設定完成: {MONGO_DB}.{MONGO_COLLECTION}")
 except Exception as e:
     print(f"✗ MongoDB 連接失敗: {e}")
     mongo_client = None
 
+def query_response(data: List[dict], message: str, next_cursor: Optional[str] = None) -> Response:
+    """
+    查詢結果直接編碼為 JSON（格式與 QueryResponse 相同）
+    
+    原始文件的 ObjectId、datetime 在編碼時才轉成字串，不逐筆修改文件，
+    也不經過 response_model 的逐項驗證
+    """
+    return Response(content=dumps({
+        "status": "success",
+        "count": len(data),
+        "data": data,
+        "message": message,
+        "next_cursor": next_cursor
+    }), media_type=JSON_MEDIA_TYPE)
+
+# 回應快取（每個 uvicorn worker 各自一份）
+cache = ResponseCache()
+watcher = None
+
 # ============ API 端點 ============
 
 @app.get("/")
@@ -88,7 +133,8 @@ async def root():
             "device_data": "/api/data/{device_id}",
             "time_range": "/api/data/range",
             "statistics": "/api/stats/{device_id}",
-            "devices": "/api/devices"
+            "devices": "/api/devices",
+            "cache": "/api/cache"
         }
     }
 
@@ -100,7 +146,7 @@ async def health_check():
     
     try:
         # 測試資料庫連接
-        mongo_client.admin.command('ping')
+        await run_db(mongo_client.admin.command, 'ping')
         return {
             "status": "healthy",
             "database": "connected",
@@ -112,62 +158,47 @@ async def health_check():
 @app.get("/api/data", response_model=QueryResponse)
 async def get_all_data(
     limit: int = Query(default=100, ge=1, le=1000, description="最多回傳筆數"),
-    skip: int = Query(default=0, ge=0, description="跳過筆數（分頁用）")
+    skip: int = Query(default=0, ge=0, description="跳過筆數（舊版分頁，深層頁面較慢）"),
+    cursor: Optional[str] = Query(default=None, description="上一頁回傳的 next_cursor"),
+    fields: Optional[str] = Query(default=None, description="只回傳這些欄位，逗號分隔（例如 value,stored_at）")
 ):
     """取得所有感測器資料（分頁）"""
     try:
-        # 查詢資料，按儲存時間降序排列
-        cursor = collection.find().sort("stored_at", -1).skip(skip).limit(limit)
-        data = []
-        
-        for doc in cursor:
-            # 轉換 ObjectId 為字串
-            doc['_id'] = str(doc['_id'])
-            # 轉換 datetime 為 ISO 格式字串
-            if 'stored_at' in doc and isinstance(doc['stored_at'], datetime):
-                doc['stored_at'] = doc['stored_at'].isoformat()
-            data.append(doc)
-        
-        return QueryResponse(
-            status="success",
-            count=len(data),
-            data=data,
-            message=f"成功取得 {len(data)} 筆資料"
-        )
+        # 查詢資料，按儲存時間降序排列（鍵集分頁，時間相同時依 _id）
+        data, next_cursor = await run_db(paginate, collection, {}, "stored_at", -1,
+                                         limit=limit, cursor=cursor, skip=skip,
+                                         projection=projection(parse_fields(fields), ("stored_at",)))
+        return query_response(data, f"成功取得 {len(data)} 筆資料", next_cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"參數錯誤: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
 
 @app.get("/api/data/{device_id}", response_model=QueryResponse)
 async def get_device_data(
     device_id: str,
-    limit: int = Query(default=100, ge=1, le=1000, description="最多回傳筆數")
+    limit: int = Query(default=100, ge=1, le=1000, description="最多回傳筆數"),
+    cursor: Optional[str] = Query(default=None, description="上一頁回傳的 next_cursor"),
+    fields: Optional[str] = Query(default=None, description="只回傳這些欄位，逗號分隔（例如 value,stored_at）")
 ):
     """取得特定裝置的感測器資料"""
     try:
         # 查詢特定裝置的資料
-        cursor = collection.find({"device_id": device_id}).sort("stored_at", -1).limit(limit)
-        data = []
-        
-        for doc in cursor:
-            doc['_id'] = str(doc['_id'])
-            if 'stored_at' in doc and isinstance(doc['stored_at'], datetime):
-                doc['stored_at'] = doc['stored_at'].isoformat()
-            data.append(doc)
+        data, next_cursor = await run_db(paginate, collection, {"device_id": device_id}, "stored_at", -1,
+                                         limit=limit, cursor=cursor,
+                                         projection=projection(parse_fields(fields), ("stored_at",)))
         
-        if not data:
+        if not data and not cursor:
             raise HTTPException(
                 status_code=404,
                 detail=f"找不到裝置 {device_id} 的資料"
             )
         
-        return QueryResponse(
-            status="success",
-            count=len(data),
-            data=data,
-            message=f"成功取得裝置 {device_id} 的 {len(data)} 筆資料"
-        )
+        return query_response(data, f"成功取得裝置 {device_id} 的 {len(data)} 筆資料", next_cursor)
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"參數錯誤: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
 
@@ -177,7 +208,9 @@ async def get_data_by_time_range(
     start_time: Optional[str] = Query(default=None, description="開始時間 (ISO 格式)"),
     end_time: Optional[str] = Query(default=None, description="結束時間 (ISO 格式)"),
     hours: Optional[int] = Query(default=None, ge=1, le=168, description="最近 N 小時"),
-    limit: int = Query(default=1000, ge=1, le=10000, description="最多回傳筆數")
+    limit: int = Query(default=1000, ge=1, le=10000, description="最多回傳筆數"),
+    cursor: Optional[str] = Query(default=None, description="上一頁回傳的 next_cursor"),
+    fields: Optional[str] = Query(default=None, description="只回傳這些欄位，逗號分隔（例如 value,stored_at）")
 ):
     """依時間範圍查詢資料"""
     try:
@@ -205,64 +238,38 @@ async def get_data_by_time_range(
         if time_filter:
             query["stored_at"] = time_filter
         
-        # 執行查詢
-        cursor = collection.find(query).sort("stored_at", -1).limit(limit)
-        data = []
-        
-        for doc in cursor:
-            doc['_id'] = str(doc['_id'])
-            if 'stored_at' in doc and isinstance(doc['stored_at'], datetime):
-                doc['stored_at'] = doc['stored_at'].isoformat()
-            data.append(doc)
-        
-        return QueryResponse(
-            status="success",
-            count=len(data),
-            data=data,
-            message=f"成功取得 {len(data)} 筆資料"
-        )
+        # 執行查詢（一次最多 10000 筆，使用耗時查詢的執行緒池）
+        data, next_cursor = await run_heavy(paginate, collection, query, "stored_at", -1,
+                                            limit=limit, cursor=cursor,
+                                            projection=projection(parse_fields(fields), ("stored_at",)))
+        return query_response(data, f"成功取得 {len(data)} 筆資料", next_cursor)
     except ValueError as e:
-        raise HTTPException(status_code=400, detail=f"時間格式錯誤: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"參數錯誤: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
 
 @app.get("/api/stats/{device_id}", response_model=StatsResponse)
+@cache.cached("stats", ttl=CACHE_TTLS["stats"], device_param="device_id")
 async def get_device_statistics(device_id: str):
-    """取得特定裝置的統計資訊"""
+    """取得特定裝置的統計資訊（讀取每日彙總，不掃描所有讀數；只統計數值讀數）"""
     try:
-        # 使用 MongoDB aggregation 計算統計
-        pipeline = [
-            {"$match": {"device_id": device_id}},
-            {"$group": {
-                "_id": "$device_id",
-                "total_records": {"$sum": 1},
-                "avg_value": {"$avg": "$value"},
-                "max_value": {"$max": "$value"},
-                "min_value": {"$min": "$value"},
-                "first_reading": {"$min": "$stored_at"},
-                "last_reading": {"$max": "$stored_at"}
-            }}
-        ]
+        stats = await run_heavy(summarize, rollups, collection, {"device_id": device_id}, "stored_at")
         
-        result = list(collection.aggregate(pipeline))
-        
-        if not result:
+        if not stats:
             raise HTTPException(
                 status_code=404,
                 detail=f"找不到裝置 {device_id} 的資料"
             )
         
-        stats = result[0]
-        
         return StatsResponse(
             status="success",
             device_id=device_id,
-            total_records=stats['total_records'],
-            avg_value=round(stats['avg_value'], 2) if stats['avg_value'] else None,
-            max_value=stats['max_value'],
-            min_value=stats['min_value'],
-            first_reading=stats['first_reading'],
-            last_reading=stats['last_reading']
+            total_records=stats['count'],
+            avg_value=round(stats['avg'], 2) if stats['avg'] else None,
+            max_value=stats['max'],
+            min_value=stats['min'],
+            first_reading=stats['first'],
+            last_reading=stats['last']
         )
     except HTTPException:
         raise
@@ -270,29 +277,24 @@ async def get_device_statistics(device_id: str):
         raise HTTPException(status_code=500, detail=f"統計計算失敗: {str(e)}")
 
 @app.get("/api/devices")
+@cache.cached("devices", ttl=CACHE_TTLS["devices"])
 async def get_all_devices():
     """取得所有裝置列表"""
     try:
-        # 取得所有不重複的裝置 ID
-        device_ids = collection.distinct("device_id")
+        # 每個裝置的最新資料（一次讀取最新讀數集合，與讀數筆數無關）
+        newest = await run_db(latest_by_device, latest_readings, "stored_at")
         
-        # 取得每個裝置的最新資料
         devices = []
-        for device_id in device_ids:
-            latest = collection.find_one(
-                {"device_id": device_id},
-                sort=[("stored_at", -1)]
-            )
-            
-            if latest:
-                devices.append({
-                    "device_id": device_id,
-                    "device_type": latest.get("device_type"),
-                    "sensor_type": latest.get("sensor_type"),
-                    "last_value": latest.get("value"),
-                    "unit": latest.get("unit"),
-                    "last_seen": latest.get("stored_at").isoformat() if isinstance(latest.get("stored_at"), datetime) else None
-                })
+        for device_id in sorted(newest, key=str):
+            latest = newest[device_id]
+            devices.append({
+                "device_id": device_id,
+                "device_type": latest.get("device_type"),
+                "sensor_type": latest.get("sensor_type"),
+                "last_value": latest.get("value"),
+                "unit": latest.get("unit"),
+                "last_seen": latest.get("stored_at").isoformat() if isinstance(latest.get("stored_at"), datetime) else None
+            })
         
         return {
             "status": "success",
@@ -302,6 +304,26 @@ async def get_all_devices():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
 
+@app.get("/api/cache")
+async def get_cache_statistics():
+    """回應快取的命中率統計（調整 CACHE_TTLS 與快取上限用）"""
+    return cache.get_statistics()
+
+@app.on_event("startup")
+async def startup_event():
+    """啟動新資料檢查（裝置有新資料時刪除該裝置的快取）"""
+    global watcher
+    if mongo_client is not None:
+        watcher = IngestWatcher(cache, latest_readings, "stored_at").start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """關閉資料庫連接"""
+    if watcher is not None:
+        await watcher.stop()
+    shutdown_executors()
+    release_client(mongo_client)
+
 # ============ 啟動服務 ============
 if __name__ == "__main__":
     print("=" * 60)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+水平擴充效能測試
+啟動多個 mqtt_to_db worker（共享訂閱），發布測試訊息並量測寫入 MongoDB 的吞吐量，
+同時重送部分訊息，確認冪等寫入沒有產生重複資料
+
+需要支援 MQTT v5 共享訂閱的 Broker（Mosquitto 1.6 以上）與 MongoDB
+
+使用方式:
+    python3 benchmark_scale_out.py --workers 1
+    python3 benchmark_scale_out.py --workers 4 --messages 20000 --duplicates 0.05
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import signal
+import time
+
+import paho.mqtt.client as mqtt
+from pymongo import MongoClient
+
+import mqtt_to_db
+
+# ============ 測試設定 ============
+BENCH_TOPIC = "bench/scale_out"
+BENCH_COLLECTION = "scale_out_benchmark"
+BENCH_GROUP = "bench_collectors"
+DEVICES = 20
+STARTUP_WAIT = 3.0          # 等待 worker 連線與訂閱（秒）
+TIMEOUT = 120.0             # 等待全部寫入的上限（秒）
+
+def worker(worker_id):
+    """worker 程序：以共享訂閱執行資料收集"""
+    mqtt_to_db.run(share_group=BENCH_GROUP, worker_id=str(worker_id),
+                   topic=f"{BENCH_TOPIC}/#", collection_name=BENCH_COLLECTION)
+
+def make_messages(count):
+    """產生測試訊息（每筆都有唯一的 device_id + timestamp + seq）"""
+    messages = []
+    base = time.time()
+    for i in range(count):
+        device_id = f"bench_{i % DEVICES:02d}"
+        messages.append((f"{BENCH_TOPIC}/{device_id}", json.dumps({
+            "device_id": device_id,
+            "sensor_type": "temperature",
+            "value": round(random.uniform(20, 30), 2),
+            "unit": "°C",
+            "timestamp": base + i // DEVICES,
+            "seq": i
+        })))
+    return messages
+
+def publish(messages, duplicates):
+    """
+    以 QoS 1 發布訊息，並重送其中一部分（模擬 QoS 1 重送）
+
+    返回:
+        int: 重送筆數
+    """
+    client = mqtt.Client(client_id="scale_out_publisher")
+    client.max_inflight_messages_set(1000)
+    client.connect(mqtt_to_db.MQTT_BROKER, mqtt_to_db.MQTT_PORT)
+    client.loop_start()
+
+    resent = random.sample(messages, int(len(messages) * duplicates))
+    infos = [client.publish(topic, payload, qos=1) for topic, payload in messages + resent]
+    for info in infos:
+        info.wait_for_publish()
+
+    client.loop_stop()
+    client.disconnect()
+    return len(resent)
+
+def wait_for_documents(collection, expected, timeout):
+    """等待集合中的文件數達到預期（或逾時）"""
+    deadline = time.monotonic() + timeout
+    count = 0
+    while time.monotonic() < deadline:
+        count = collection.count_documents({})
+        if count >= expected:
+            break
+        time.sleep(0.2)
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description='水平擴充效能測試')
+    parser.add_argument('--workers', type=int, default=2, help='worker 數量')
+    parser.add_argument('--messages', type=int, default=10000, help='測試訊息數')
+    parser.add_argument('--duplicates', type=float, default=0.05, help='重送比例（0~1）')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("水平擴充效能測試（共享訂閱 + 冪等寫入）")
+    print("=" * 60)
+    print(f"worker: {args.workers}，訊息: {args.messages} 筆，重送比例: {args.duplicates:.0%}\n")
+
+    mongo = MongoClient(mqtt_to_db.MONGO_URI)
+    collection = mongo[mqtt_to_db.MONGO_DB][BENCH_COLLECTION]
+    collection.drop()
+
+    # 啟動 worker
+    processes = [multiprocessing.Process(target=worker, args=(i,)) for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    time.sleep(STARTUP_WAIT)
+
+    messages = make_messages(args.messages)
+    start = time.perf_counter()
+    resent = publish(messages, args.duplicates)
+    published = time.perf_counter() - start
+
+    count = wait_for_documents(collection, args.messages, TIMEOUT)
+    elapsed = time.perf_counter() - start
+
+    # 停止 worker（等同 Ctrl+C，讓 worker 寫完佇列並列印統計）
+    for process in processes:
+        os.kill(process.pid, signal.SIGINT)
+    for process in processes:
+        process.join(30)
+
+    count = collection.count_documents({})
+    distinct = len(collection.distinct("ingest_key"))
+
+    print()
+    print("=" * 60)
+    print("測試結果")
+    print("=" * 60)
+    print(f"發布: {args.messages + resent} 則（其中重送 {resent} 則），耗時 {published:.2f} 秒")
+    print(f"寫入: {count} 筆，唯一鍵 {distinct} 個，耗時 {elapsed:.2f} 秒")
+    print(f"吞吐量: {count / elapsed:,.0f} 筆/秒（{args.workers} 個 worker）")
+    if count == args.messages and distinct == count:
+        print("✓ 沒有遺失也沒有重複的資料")
+    else:
+        print(f"✗ 預期 {args.messages} 筆，實際 {count} 筆（唯一鍵 {distinct} 個）")
+
+    collection.drop()
+    mongo.close()
+
+if __name__ == "__main__":
+    main()
@@ -5,32 +5,102 @@
 整合 MQTT 訂閱和 FastAPI，自動將感測器資料儲存到資料庫
 """
 
-import paho.mqtt.client as mqtt
-from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, PyMongoError
 from datetime import datetime
-import json
+import argparse
+import logging
+import os
+import queue
 import sys
+import threading
+import time
+
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from sensor_decoder import (SensorDecoder, REQUIRED_FIELDS, SENSOR_RANGES,
+                            PayloadParseError, PayloadValidationError)
+from spool import WriteAheadSpool, SpoolReplayer
+from ingest_log import setup_logging, IngestMonitor
+from pipeline import Pipeline, DecodeStage, EnrichStage, FunctionStage, Sink
+import scale_out
+from scale_out import (shared_topic, worker_client_id, create_mqtt_client, connect_mqtt_client,
+                       add_ingest_key, ensure_ingest_key_index, upsert_new)
+from timeseries import ensure_timeseries_collection, timeseries_options
+from indexes import ensure_indexes
+from rollups import RollupWriter, written_documents, rollup_collection_name
+from latest import LatestWriter
+from retention import start_scheduler, policy_for
+from mongo_pool import get_client, release_client
 
 # ============ 配置參數 ============
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 SUBSCRIBE_TOPIC = "sensors/#"
+MQTT_CLIENT_ID = "data_collector"
+
+# 水平擴充（多個 worker 以共享訂閱分攤訊息，預設讀取環境變數，也可用命令列參數指定）
+SHARE_GROUP = scale_out.SHARE_GROUP     # 共享訂閱群組，None 表示單一程序
+WORKER_ID = scale_out.WORKER_ID         # worker 編號
+SHARED_QOS = 1                          # 共享訂閱使用 QoS 1，worker 斷線時 Broker 會重送
 
 MONGO_URI = "mongodb://localhost:27017/"
 MONGO_DB = "iot_data"
 MONGO_COLLECTION = "sensor_readings"
+MONGO_TIMEOUT_MS = 5000     # 連線逾時（毫秒），逾時的資料改寫入本機暫存
+MONGO_TIMESERIES = True     # 集合不存在時建立為時間序列集合（MongoDB 5.0 以上）
+
+# 批次寫入設定
+BATCH_SIZE = 100            # 累積多少筆就寫入一次
+FLUSH_INTERVAL = 1.0        # 最長等待時間（秒），逾時即使未滿也寫入
+QUEUE_MAX_SIZE = 10000      # 記憶體佇列上限
+QUEUE_PUT_TIMEOUT = 5.0     # 佇列滿時最多等待秒數（背壓），逾時則丟棄
+
+# 本機暫存設定（MongoDB 變慢或無法連線時先寫入磁碟，恢復後補寫）
+SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool")
+SPOOL_FSYNC = "interval"    # always / interval / never
+SPOOL_SYNC_INTERVAL = 1.0   # interval 策略的同步間隔（秒）
+REPLAY_BATCH_SIZE = 500     # 每次補寫最多筆數
+
+# 日誌設定（不再每則訊息都輸出，改為抽樣明細 + 定期彙總）
+LOG_SAMPLE_EVERY = 100      # 每幾則訊息輸出一則明細
+ROLLUP_INTERVAL = 10.0      # 彙總輸出間隔（秒）
+
+# 熱路徑使用的記錄器（在 main() 中設定為非阻塞輸出）
+logger = logging.getLogger("mqtt_to_db")
 
 # ============ MongoDB 連接 ============
 class DatabaseManager:
     """MongoDB 資料庫管理類別"""
     
-    def __init__(self, uri, db_name, collection_name):
-        """初始化資料庫連接"""
+    def __init__(self, uri, db_name, collection_name, spool=None, idempotent=False):
+        """
+        初始化資料庫連接
+        
+        參數:
+            spool: WriteAheadSpool 實例，寫入失敗時改存到本機暫存（可省略）
+            idempotent: 以 ingest_key 做冪等 upsert（多個 worker 或 QoS 1 重送時不產生重複資料）
+        """
+        self.spool = spool
+        self.idempotent = idempotent
+        self.duplicate_count = 0
         try:
-            self.client = MongoClient(uri)
+            self.client = get_client(uri, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS)
             self.db = self.client[db_name]
             self.collection = self.db[collection_name]
             print(f"✓ 成功連接到 MongoDB: {db_name}.{collection_name}")
+            if idempotent:
+                # 冪等寫入需要唯一索引與 upsert，時間序列集合都不支援，維持一般集合
+                ensure_ingest_key_index(self.collection)
+            elif MONGO_TIMESERIES:
+                ensure_timeseries_collection(self.db, collection_name,
+                                             timeseries_options(MONGO_COLLECTION))
+            # 查詢 API 使用的索引（登記在 common/indexes.py）
+            ensure_indexes(self.collection, MONGO_COLLECTION)
+            # 每分鐘/小時/天的統計彙總（統計 API 讀取彙總，不再掃描原始讀數）
+            self.rollups = RollupWriter.for_collection(self.collection, MONGO_COLLECTION)
+            # 每個裝置、感測器的最新讀數（/api/devices 讀取，不再逐一查詢裝置）
+            self.latest = LatestWriter.for_collection(self.collection, MONGO_COLLECTION)
         except Exception as e:
             print(f"✗ MongoDB 連接失敗: {e}")
             sys.exit(1)
@@ -43,10 +113,100 @@ class DatabaseManager:
             
             # 插入資料
             result = self.collection.insert_one(data)
-            return str(result.inserted_id)
         except Exception as e:
             print(f"✗ 資料插入失敗: {e}")
+            if self.spool is not None:
+                self.spool.append(data)
+                print("  已寫入本機暫存，資料庫恢復後補寫")
             return None
+        self._apply_derived([data])
+        return str(result.inserted_id)
+    
+    def insert_many(self, documents):
+        """
+        批次插入資料（ordered=False，單筆失敗不影響其他筆）
+        
+        資料庫無法連線或逾時時，整批改寫入本機暫存（不算失敗）
+        
+        回傳:
+            (成功筆數, 失敗筆數)
+        """
+        if not documents:
+            return 0, 0
+        
+        try:
+            if self.idempotent:
+                return self._upsert_many(documents)
+            result = self.collection.insert_many(documents, ordered=False)
+            self._apply_derived(documents)
+            return len(result.inserted_ids), 0
+        except BulkWriteError as e:
+            inserted = e.details.get('nInserted', 0)
+            print(f"✗ 批次插入部分失敗: {len(e.details.get('writeErrors', []))} 筆")
+            self._apply_derived(written_documents(documents, e))
+            return inserted, len(documents) - inserted
+        except PyMongoError as e:
+            if self.spool is None:
+                print(f"✗ 批次插入失敗: {e}")
+                return 0, len(documents)
+            self.spool.append_many(documents)
+            print(f"⚠ 資料庫無法寫入，{len(documents)} 筆已寫入本機暫存: {e}")
+            return 0, 0
+    
+    def _upsert_many(self, documents):
+        """以 ingest_key 冪等寫入，已存在的資料計入 duplicate_count（只彙總、更新新寫入的資料）"""
+        inserted, duplicates, errors = upsert_new(self.collection, documents)
+        self.duplicate_count += duplicates
+        if errors:
+            print(f"✗ 批次寫入部分失敗: {len(errors)} 筆")
+        self._apply_derived(inserted)
+        return len(inserted), len(errors)
+    
+    def _apply_derived(self, documents):
+        """
+        把已寫入的資料累加到統計彙總、更新最新讀數
+        
+        讀數已經寫入，失敗時不重試整批（重試會重複寫入讀數），
+        只輸出錯誤；需要時以 python rollups.py / latest.py --rebuild 重建
+        """
+        try:
+            self.rollups.apply(documents)
+        except PyMongoError as e:
+            print(f"✗ 統計彙總更新失敗: {e}")
+        try:
+            self.latest.apply(documents)
+        except PyMongoError as e:
+            print(f"✗ 最新讀數更新失敗: {e}")
+    
+    def replay_many(self, documents):
+        """
+        補寫本機暫存的資料（給 SpoolReplayer 使用）
+        
+        暫存的文件已帶有 _id，重複補寫只會產生重複鍵錯誤，視為已寫入
+        （時間序列集合不強制 _id 唯一，寫入逾時但實際已寫入的批次補寫後會重複，
+        不能接受時請使用 --share-group 的冪等寫入模式）
+        
+        回傳:
+            bool: 這批是否處理完成（False 表示資料庫仍無法使用，稍後重試）
+        """
+        try:
+            if self.idempotent:
+                self._upsert_many(documents)
+            else:
+                self.collection.insert_many(documents, ordered=False)
+                self._apply_derived(documents)
+        except BulkWriteError as e:
+            # 重複鍵（11000）代表先前已寫入；其他錯誤重試也不會成功，一併略過
+            errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != 11000]
+            if errors:
+                print(f"✗ 補寫時略過 {len(errors)} 筆無法寫入的資料")
+            self._apply_derived(written_documents(documents, e))
+        except PyMongoError as e:
+            print(f"✗ 補寫失敗，稍後重試: {e}")
+            return False
+        
+        print(f"✓ 已補寫本機暫存資料 {len(documents)} 筆")
+        return True
     
     def get_stats(self):
         """取得資料庫統計資訊"""
@@ -59,99 +219,288 @@ class DatabaseManager:
     
     def close(self):
         """關閉資料庫連接"""
-        self.client.close()
+        release_client(self.client)
 
-# ============ 資料驗證 ============
-def validate_sensor_data(data):
-    """驗證感測器資料格式"""
-    required_fields = ['device_id', 'sensor_type', 'value']
+# ============ 批次寫入 ============
+class BatchWriter(Sink):
+    """
+    批次寫入器（資料收集流程的輸出）
+    
+    on_message 只把資料放進有上限的佇列，由背景寫入執行緒
+    在批次滿了或超過等待時間時，用 insert_many 一次寫入。
+    佇列滿時 submit() 會阻塞（背壓），避免記憶體無限成長；
+    有設定本機暫存時則直接寫入暫存，不阻塞也不丟棄。
+    """
+    
+    name = "queue"
+    
+    def __init__(self, db_manager, stats, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, max_queue_size=QUEUE_MAX_SIZE,
+                 put_timeout=QUEUE_PUT_TIMEOUT, spool=None, monitor=None):
+        """
+        初始化批次寫入器
+        
+        參數:
+            db_manager: DatabaseManager 實例
+            stats: 共用的統計資訊字典（會加入佇列與寫入延遲計數）
+            batch_size: 每批最多筆數
+            flush_interval: 批次最長等待時間（秒）
+            max_queue_size: 佇列上限
+            put_timeout: 佇列滿時最多等待秒數
+            spool: WriteAheadSpool 實例，佇列滿時改寫入本機暫存（可省略）
+            monitor: IngestMonitor 實例，記錄批次寫入延遲（可省略）
+        """
+        self.db_manager = db_manager
+        self.stats = stats
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.spool = spool
+        self.monitor = monitor
+        
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        
+        # 佇列與寫入延遲統計，和原本的計數放在同一個字典
+        stats.update({
+            'queue_depth': 0,
+            'queue_max_depth': 0,
+            'backpressure_waits': 0,
+            'dropped_count': 0,
+            'spilled_count': 0,
+            'flush_count': 0,
+            'flush_latency_ms_last': 0.0,
+            'flush_latency_ms_max': 0.0,
+            'flush_latency_ms_total': 0.0
+        })
     
-    # 檢查必要欄位
-    for field in required_fields:
-        if field not in data:
-            return False, f"缺少必要欄位: {field}"
+    def start(self):
+        """啟動背景寫入執行緒"""
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="batch_writer", daemon=True)
+        self.thread.start()
     
-    # 檢查數值類型
-    if not isinstance(data['value'], (int, float)):
-        return False, "value 必須是數字"
+    def stop(self, timeout=10):
+        """停止寫入執行緒，並把佇列中剩餘的資料寫完"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout)
     
-    # 檢查溫度範圍（如果是溫度感測器）
-    if data['sensor_type'] == 'temperature':
-        if data['value'] < -50 or data['value'] > 100:
-            return False, f"溫度值超出合理範圍: {data['value']}"
+    def submit(self, data):
+        """
+        把資料放進佇列
+        
+        佇列滿時寫入本機暫存；沒有暫存時最多等待 put_timeout 秒，仍放不進去就丟棄
+        
+        回傳:
+            bool: 是否成功放入佇列或暫存
+        """
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            if self.spool is not None:
+                self.spool.append(data)
+                with self.lock:
+                    self.stats['spilled_count'] += 1
+                return True
+            with self.lock:
+                self.stats['backpressure_waits'] += 1
+            try:
+                self.queue.put(data, timeout=self.put_timeout)
+            except queue.Full:
+                with self.lock:
+                    self.stats['dropped_count'] += 1
+                return False
+        
+        depth = self.queue.qsize()
+        with self.lock:
+            self.stats['queue_depth'] = depth
+            if depth > self.stats['queue_max_depth']:
+                self.stats['queue_max_depth'] = depth
+        return True
+    
+    def write(self, items):
+        """放入佇列（Sink 介面），放不進去時拋出例外讓流程記錄為錯誤"""
+        for data in items:
+            if not self.submit(data):
+                raise RuntimeError(f"寫入佇列已滿，資料已丟棄: {data.get('device_id')}")
     
-    return True, "驗證通過"
+    def _run(self):
+        """寫入執行緒主迴圈"""
+        batch = []
+        deadline = None
+        
+        while self.running or not self.queue.empty() or batch:
+            # 計算這次最多等待多久
+            if batch:
+                wait = max(0.0, deadline - time.monotonic())
+            else:
+                wait = self.flush_interval
+            
+            try:
+                item = self.queue.get(timeout=wait)
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+            except queue.Empty:
+                pass
+            
+            # 批次已滿、已逾時，或正在關閉時寫入
+            if batch and (len(batch) >= self.batch_size
+                          or time.monotonic() >= deadline
+                          or not self.running):
+                self._flush(batch)
+                batch = []
+    
+    def _flush(self, batch):
+        """將一批資料寫入資料庫並更新統計"""
+        start = time.perf_counter()
+        inserted, failed = self.db_manager.insert_many(batch)
+        latency_ms = (time.perf_counter() - start) * 1000
+        
+        with self.lock:
+            stats = self.stats
+            stats['saved_count'] += inserted
+            stats['save_errors'] += failed
+            stats['flush_count'] += 1
+            stats['flush_latency_ms_last'] = latency_ms
+            stats['flush_latency_ms_total'] += latency_ms
+            if latency_ms > stats['flush_latency_ms_max']:
+                stats['flush_latency_ms_max'] = latency_ms
+            stats['queue_depth'] = self.queue.qsize()
+        
+        if self.monitor is not None:
+            self.monitor.record_latency(latency_ms)
+        
+        # 每批的明細只在 DEBUG 等級輸出，平常由定期彙總呈現
+        logger.debug("✓ 批次寫入 %d 筆（%.1f ms，佇列剩餘 %d 筆，總計 %d 筆）",
+                     inserted, latency_ms, stats['queue_depth'], stats['saved_count'])
+
+# ============ 資料收集流程 ============
+def build_pipeline(writer, stats, monitor, idempotent=False):
+    """
+    建立資料收集流程：解碼驗證 →（唯一鍵）→ 補充欄位 → 放入批次寫入佇列
+    
+    必要欄位、數值型別和各感測器的合理範圍定義在 common/sensor_decoder.py
+    """
+    def on_error(stage, item, error, rejected):
+        if isinstance(error, PayloadParseError):
+            stats['parse_errors'] += 1
+            monitor.record_error('parse', f"✗ {error}")
+        elif isinstance(error, PayloadValidationError):
+            stats['validation_errors'] += 1
+            monitor.record_error('validation', f"✗ 資料驗證失敗: {error}"
+                                               f"（原始資料: {item.payload[:200]}）")
+        elif stage == writer.name:
+            # 丟棄筆數已由 BatchWriter 計入 dropped_count
+            monitor.record_error('dropped', f"✗ {error}")
+        else:
+            stats['other_errors'] += 1
+            monitor.record_error('other', f"✗ 處理訊息時發生錯誤（{stage}）: {error}")
+    
+    # 直接從原始 bytes 解析並驗證（超出合理範圍的讀數拒絕），加入主題資訊；
+    # 冪等寫入的唯一鍵以裝置時間區分每一筆讀數，要求裝置提供 timestamp
+    required = REQUIRED_FIELDS + ('timestamp',) if idempotent else REQUIRED_FIELDS
+    stages = [DecodeStage(SensorDecoder(required=required, ranges=SENSOR_RANGES),
+                          topic_field='mqtt_topic')]
+    if idempotent:
+        # 唯一鍵只依裝置送來的內容計算，必須在加入儲存時間之前
+        stages.append(FunctionStage("ingest_key", add_ingest_key))
+    stages.append(EnrichStage(stored_at=datetime.now))
+    
+    return Pipeline(
+        "mqtt_to_db",
+        stages=stages,
+        # 放入批次寫入佇列（由背景執行緒寫入資料庫）
+        sinks=[writer],
+        on_error=on_error
+    )
 
 # ============ MQTT 回調函式 ============
-def on_connect(client, userdata, flags, rc):
-    """當連接到 MQTT Broker 時的回調函式"""
+def on_connect(client, userdata, flags, rc, properties=None):
+    """當連接到 MQTT Broker 時的回調函式（相容 MQTT v3.1.1 與 v5）"""
     if rc == 0:
+        topic = userdata['topic']
         print(f"✓ 成功連接到 MQTT Broker")
-        print(f"✓ 訂閱主題: {SUBSCRIBE_TOPIC}\n")
-        client.subscribe(SUBSCRIBE_TOPIC)
+        print(f"✓ 訂閱主題: {topic}\n")
+        client.subscribe(topic, qos=userdata['qos'])
     else:
         print(f"✗ 連接失敗，錯誤碼: {rc}")
 
 def on_message(client, userdata, msg):
     """當收到 MQTT 訊息時的回調函式"""
-    db_manager = userdata['db_manager']
-    stats = userdata['stats']
+    data = userdata['pipeline'].run(msg)
     
-    try:
-        # 解析 JSON 資料
-        payload = msg.payload.decode('utf-8')
-        data = json.loads(payload)
-        
-        # 加入主題資訊
-        data['mqtt_topic'] = msg.topic
-        
-        # 驗證資料
-        is_valid, message = validate_sensor_data(data)
-        if not is_valid:
-            print(f"✗ 資料驗證失敗: {message}")
-            print(f"  原始資料: {data}")
-            stats['validation_errors'] += 1
-            return
-        
-        # 儲存到資料庫
-        doc_id = db_manager.insert_data(data)
-        
-        if doc_id:
-            stats['saved_count'] += 1
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            print(f"[{current_time}] ✓ 資料已儲存")
-            print(f"  裝置: {data.get('device_id')}")
-            print(f"  感測器: {data.get('sensor_type')}")
-            print(f"  數值: {data.get('value')} {data.get('unit', '')}")
-            print(f"  文件 ID: {doc_id}")
-            print(f"  總計: {stats['saved_count']} 筆")
-            print("-" * 60)
-        else:
-            stats['save_errors'] += 1
-            
-    except json.JSONDecodeError as e:
-        print(f"✗ JSON 解析錯誤: {e}")
-        stats['parse_errors'] += 1
-    except Exception as e:
-        print(f"✗ 處理訊息時發生錯誤: {e}")
-        stats['other_errors'] += 1
+    # 只抽樣輸出明細，其餘由定期彙總呈現
+    if data is not None and userdata['monitor'].record_message():
+        logger.info(f"✓ 資料已排入寫入佇列: {data.get('device_id')} "
+                    f"{data.get('sensor_type')}={data.get('value')} {data.get('unit', '')}"
+                    f"（佇列深度 {userdata['stats']['queue_depth']} 筆）")
 
-def on_disconnect(client, userdata, rc):
+def on_disconnect(client, userdata, rc, properties=None):
     """當與 MQTT Broker 斷開連接時的回調函式"""
     if rc != 0:
         print(f"\n✗ 意外斷線，錯誤碼: {rc}")
 
+def print_statistics(stats, spool_stats=None, duplicates=None):
+    """列印統計資訊"""
+    avg_latency = (stats['flush_latency_ms_total'] / stats['flush_count']
+                   if stats['flush_count'] else 0)
+    
+    print("\n統計資訊：")
+    print(f"  成功儲存: {stats['saved_count']} 筆")
+    if duplicates is not None:
+        print(f"  重複略過: {duplicates} 筆（QoS 1 重送或其他 worker 已寫入）")
+    print(f"  驗證錯誤: {stats['validation_errors']} 筆")
+    print(f"  儲存錯誤: {stats['save_errors']} 筆")
+    print(f"  解析錯誤: {stats['parse_errors']} 筆")
+    print(f"  其他錯誤: {stats['other_errors']} 筆")
+    print(f"  丟棄筆數: {stats['dropped_count']} 筆（佇列已滿）")
+    print(f"  背壓等待: {stats['backpressure_waits']} 次")
+    print(f"  佇列深度: {stats['queue_depth']} 筆（最高 {stats['queue_max_depth']} 筆）")
+    print(f"  批次寫入: {stats['flush_count']} 次，"
+          f"平均 {avg_latency:.1f} ms，最長 {stats['flush_latency_ms_max']:.1f} ms")
+    
+    if spool_stats:
+        print(f"  佇列滿改寫暫存: {stats['spilled_count']} 筆")
+        print(f"  本機暫存: 累計 {spool_stats['spooled_total']} 筆，"
+              f"已補寫 {spool_stats['replayed_total']} 筆")
+        print(f"  待補寫: {spool_stats['pending_records']} 筆"
+              f"（{spool_stats['pending_bytes'] / 1024:.1f} KB，"
+              f"最舊 {spool_stats['lag_seconds']} 秒前）")
+
 # ============ 主程式 ============
-def main():
-    """主程式流程"""
+def run(share_group=SHARE_GROUP, worker_id=WORKER_ID, topic=SUBSCRIBE_TOPIC,
+        collection_name=MONGO_COLLECTION):
+    """
+    執行資料收集（單一程序，或共享訂閱群組中的一個 worker）
+    
+    參數:
+        share_group: 共享訂閱群組名稱，None 表示一般訂閱
+        worker_id: worker 編號（決定 client_id 與本機暫存目錄）
+        topic: 訂閱主題
+        collection_name: 儲存的集合名稱
+    """
     print("=" * 60)
     print("資料收集系統 - MQTT 到 MongoDB")
+    if share_group:
+        print(f"共享訂閱群組: {share_group}，worker {worker_id}")
     print("=" * 60)
     print()
     
+    # 共享訂閱模式：每個 worker 用自己的暫存目錄，寫入改為冪等 upsert
+    idempotent = bool(share_group)
+    spool_dir = os.path.join(SPOOL_DIR, f"worker_{worker_id}") if share_group else SPOOL_DIR
+    
+    # 開啟本機暫存（上次未補寫的資料會繼續補寫）
+    spool = WriteAheadSpool(spool_dir, fsync_policy=SPOOL_FSYNC,
+                            sync_interval=SPOOL_SYNC_INTERVAL)
+    
     # 初始化資料庫
-    db_manager = DatabaseManager(MONGO_URI, MONGO_DB, MONGO_COLLECTION)
+    db_manager = DatabaseManager(MONGO_URI, MONGO_DB, collection_name,
+                                 spool=spool, idempotent=idempotent)
     
     # 顯示目前資料庫統計
     stats_info = db_manager.get_stats()
@@ -167,9 +516,35 @@ def main():
         'other_errors': 0
     }
     
+    # 非阻塞日誌與定期彙總
+    setup_logging("mqtt_to_db", fmt="[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    monitor = IngestMonitor(
+        logger,
+        interval=ROLLUP_INTERVAL,
+        sample_every=LOG_SAMPLE_EVERY,
+        extra=lambda: (f"佇列 {stats['queue_depth']} 筆，"
+                       f"待補寫 {spool.pending_records} 筆")
+    )
+    
+    # 啟動批次寫入器與暫存補寫執行緒
+    writer = BatchWriter(db_manager, stats, spool=spool, monitor=monitor)
+    writer.start()
+    pipeline = build_pipeline(writer, stats, monitor, idempotent=idempotent)
+    replayer = SpoolReplayer(spool, db_manager.replay_many, batch_size=REPLAY_BATCH_SIZE)
+    replayer.start()
+    print(f"批次寫入: 每 {BATCH_SIZE} 筆或 {FLUSH_INTERVAL} 秒寫入一次"
+          f"（佇列上限 {QUEUE_MAX_SIZE} 筆）")
+    pending = spool.get_statistics()['pending_records']
+    print(f"本機暫存: {spool_dir}（待補寫 {pending} 筆，fsync={SPOOL_FSYNC}）")
+    print(f"日誌: 每 {LOG_SAMPLE_EVERY} 則輸出一則明細，每 {ROLLUP_INTERVAL:.0f} 秒輸出彙總\n")
+    
     # 建立 MQTT 客戶端
-    client = mqtt.Client(client_id="data_collector")
-    client.user_data_set({'db_manager': db_manager, 'stats': stats})
+    client = create_mqtt_client(worker_client_id(MQTT_CLIENT_ID, share_group, worker_id),
+                                share_group)
+    client.user_data_set({'db_manager': db_manager, 'writer': writer, 'pipeline': pipeline,
+                          'stats': stats, 'monitor': monitor,
+                          'topic': shared_topic(topic, share_group),
+                          'qos': SHARED_QOS if share_group else 0})
     
     # 設定回調函式
     client.on_connect = on_connect
@@ -179,32 +554,61 @@ def main():
     # 連接到 MQTT Broker
     print(f"正在連接到 MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}...")
     try:
-        client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
+        connect_mqtt_client(client, MQTT_BROKER, MQTT_PORT, keepalive=60, group=share_group)
     except Exception as e:
         print(f"✗ 連接失敗: {e}")
+        writer.stop()
+        replayer.stop()
+        spool.close()
         db_manager.close()
         return
     
     # 開始監聽
     print("\n等待接收資料...")
     print("按 Ctrl+C 停止\n")
+    monitor.start()
+    
+    # 資料保留：原始讀數與統計彙總的過期資料在背景分批刪除（共享訂閱群組只由 worker 0 執行）
+    retention = None
+    if not share_group or str(worker_id) == "0":
+        retention = start_scheduler(db_manager.db, {
+            collection_name: policy_for(MONGO_COLLECTION),
+            db_manager.rollups.collection.name: policy_for(rollup_collection_name(MONGO_COLLECTION))
+        }, logger)
     
     try:
         # 開始循環處理訊息
         client.loop_forever()
     except KeyboardInterrupt:
         print("\n\n程式已停止")
-        print("\n統計資訊：")
-        print(f"  成功儲存: {stats['saved_count']} 筆")
-        print(f"  驗證錯誤: {stats['validation_errors']} 筆")
-        print(f"  儲存錯誤: {stats['save_errors']} 筆")
-        print(f"  解析錯誤: {stats['parse_errors']} 筆")
-        print(f"  其他錯誤: {stats['other_errors']} 筆")
     finally:
         client.disconnect()
+        
+        # 先把佇列中剩餘的資料寫完再關閉資料庫
+        writer.stop()
+        replayer.stop()
+        if retention is not None:
+            retention.stop()
+        monitor.stop()
+        print_statistics(stats, replayer.get_statistics(),
+                         db_manager.duplicate_count if idempotent else None)
+        print()
+        print("\n".join(pipeline.format_statistics()))
+        spool.close()
         db_manager.close()
         print("\n連接已關閉")
 
+def main():
+    """主程式流程"""
+    parser = argparse.ArgumentParser(description='資料收集系統 - MQTT 到 MongoDB')
+    parser.add_argument('--share-group', default=SHARE_GROUP,
+                        help='共享訂閱群組名稱（多個 worker 分攤訊息）')
+    parser.add_argument('--worker-id', default=WORKER_ID, help='worker 編號')
+    parser.add_argument('--topic', default=SUBSCRIBE_TOPIC, help='訂閱主題')
+    args = parser.parse_args()
+    
+    run(args.share_group, args.worker_id, args.topic)
+
 # ============ 執行主程式 ============
 if __name__ == "__main__":
     main()
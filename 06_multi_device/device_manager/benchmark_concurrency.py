@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API 併發效能測試
+以 uvicorn 啟動 dashboard_api，持續送出耗時的 /api/statistics 請求，
+同時定時呼叫 /health，量測健康檢查在負載下的延遲（p50 / p95 / p99）
+
+分別測試兩種模式（見 common/async_db.py）：
+- offload: 資料庫呼叫交給執行緒池（目前的做法）
+- blocking: DB_OFFLOAD=0，在事件迴圈中直接呼叫 PyMongo（以前的做法）
+
+blocking 模式下每個 /health 都要等正在執行的統計查詢結束，p99 約等於一次統計查詢的時間；
+offload 模式下 /health 不受影響
+
+測試資料寫入獨立的資料庫 iot_benchmark（讀數與統計彙總），結束後刪除
+
+使用方式:
+    python3 benchmark_concurrency.py
+    python3 benchmark_concurrency.py --clients 16 --duration 20
+    python3 benchmark_concurrency.py --heavy-path "/api/devices"     # 每台裝置 count_documents
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from pymongo import MongoClient
+
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from indexes import ensure_indexes
+from rollups import RollupWriter
+
+# ============ 測試設定 ============
+MONGO_URI = "mongodb://localhost:27017/"
+BENCH_DB = "iot_benchmark"
+MODES = ("offload", "blocking")
+PORT = 8011
+DEVICES = 20
+READING_INTERVAL = 60       # 每台裝置的讀數間隔（秒）
+LOAD_CHUNK = 5000
+STARTUP_TIMEOUT = 15.0      # 等待 API 啟動（秒）
+HEALTH_INTERVAL = 0.05      # /health 呼叫間隔（秒）
+HEAVY_PATH = "/api/statistics?hours=720"
+
+def seed(db, readings):
+    """寫入測試讀數與統計彙總（與 multi_device_subscriber 相同的欄位）"""
+    collection = db["sensor_readings"]
+    collection.drop()
+    db["sensor_readings_rollups"].drop()
+    ensure_indexes(collection)
+    rollups = RollupWriter.for_collection(collection)
+
+    rng = random.Random(42)
+    start = datetime.now() - timedelta(seconds=readings // DEVICES * READING_INTERVAL)
+    chunk = []
+    for i in range(readings):
+        tick, device = divmod(i, DEVICES)
+        chunk.append({
+            "device_id": f"pico_{device:03d}",
+            "sensor_type": "temperature",
+            "value": round(rng.uniform(18, 30), 2),
+            "unit": "°C",
+            "stored_at": start + timedelta(seconds=tick * READING_INTERVAL),
+        })
+        if len(chunk) == LOAD_CHUNK or i == readings - 1:
+            collection.insert_many(chunk, ordered=False)
+            rollups.apply(chunk)
+            chunk = []
+    db["devices"].drop()
+    db["devices"].insert_many([{"device_id": f"pico_{d:03d}", "device_name": f"Pico {d}",
+                                "status": "online"} for d in range(DEVICES)])
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def describe(latencies):
+    """(p50, p95, p99, 最大值) 毫秒"""
+    return (statistics.median(latencies) if latencies else 0.0,
+            percentile(latencies, 0.95), percentile(latencies, 0.99),
+            max(latencies, default=0.0))
+
+# ============ API 程序 ============
+
+def start_server(mode, port):
+    """以 uvicorn 啟動 dashboard_api（單一 worker）"""
+    # 停用回應快取，每個統計請求都實際查詢資料庫
+    env = dict(os.environ, MONGO_URI=MONGO_URI, MONGO_DB=BENCH_DB, RESPONSE_CACHE="0",
+               DB_OFFLOAD="0" if mode == "blocking" else "1")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "dashboard_api:app",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env
+    )
+
+async def wait_ready(client):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("API 未在時間內啟動")
+
+# ============ 量測 ============
+
+async def sample_health(client, stop, latencies):
+    """定時呼叫 /health 並記錄延遲"""
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        response = await client.get("/health")
+        if response.status_code == 200:
+            latencies.append((time.perf_counter() - t0) * 1000)
+        await asyncio.sleep(HEALTH_INTERVAL)
+
+async def heavy_client(client, path, stop, latencies):
+    """連續送出耗時請求"""
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await client.get(path)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+async def run_phase(client, path, clients, duration):
+    """量測一段時間內 /health 的延遲（clients 為 0 時沒有負載）"""
+    stop = asyncio.Event()
+    health, heavy = [], []
+    tasks = [asyncio.create_task(sample_health(client, stop, health))]
+    tasks += [asyncio.create_task(heavy_client(client, path, stop, heavy)) for _ in range(clients)]
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return health, heavy
+
+async def run_mode(mode, args):
+    print(f"\n--- 模式: {mode} ---")
+    server = start_server(mode, args.port)
+    try:
+        limits = httpx.Limits(max_connections=args.clients + 4)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}",
+                                     timeout=120.0, limits=limits) as client:
+            await wait_ready(client)
+            idle, _ = await run_phase(client, args.heavy_path, 0, args.duration / 2)
+            loaded, heavy = await run_phase(client, args.heavy_path, args.clients, args.duration)
+    finally:
+        server.terminate()
+        server.wait()
+
+    result = {
+        "idle": describe(idle),
+        "loaded": describe(loaded),
+        "heavy": describe(heavy),
+        "heavy_rate": len(heavy) / args.duration,
+    }
+    for key, label in (("idle", "/health（無負載）"), ("loaded", "/health（負載中）"),
+                       ("heavy", args.heavy_path)):
+        p50, p95, p99, worst = result[key]
+        print(f"{label}: p50 {p50:.1f} ms，p95 {p95:.1f} ms，p99 {p99:.1f} ms，最大 {worst:.1f} ms")
+    print(f"耗時請求: {result['heavy_rate']:.1f} 次/秒")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='API 併發效能測試')
+    parser.add_argument('--readings', type=int, default=500_000, help='測試讀數筆數')
+    parser.add_argument('--clients', type=int, default=8, help='同時送出耗時請求的客戶端數')
+    parser.add_argument('--duration', type=float, default=10.0, help='負載測試秒數')
+    parser.add_argument('--heavy-path', default=HEAVY_PATH, help='耗時請求的路徑')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES), help='測試模式')
+    parser.add_argument('--port', type=int, default=PORT, help='API 埠號')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("API 併發效能測試（dashboard_api）")
+    print("=" * 60)
+
+    mongo = MongoClient(MONGO_URI)
+    db = mongo[BENCH_DB]
+    print(f"寫入測試資料: {args.readings:,} 筆讀數（{DEVICES} 台裝置）...")
+    seed(db, args.readings)
+
+    results = {}
+    try:
+        for mode in args.modes:
+            results[mode] = asyncio.run(run_mode(mode, args))
+    finally:
+        mongo.drop_database(BENCH_DB)
+        mongo.close()
+
+    print()
+    print("=" * 60)
+    print(f"測試結果（{args.clients} 個客戶端持續請求 {args.heavy_path}）")
+    print("=" * 60)
+    print(f"{'項目':<24}" + "".join(f"{mode:>14}" for mode in results))
+    rows = [
+        ("/health p50 (ms)", lambda r: r["loaded"][0]),
+        ("/health p99 (ms)", lambda r: r["loaded"][2]),
+        ("/health 最大 (ms)", lambda r: r["loaded"][3]),
+        ("/health p99 無負載 (ms)", lambda r: r["idle"][2]),
+        ("耗時請求 p50 (ms)", lambda r: r["heavy"][0]),
+        ("耗時請求 (次/秒)", lambda r: r["heavy_rate"]),
+    ]
+    for label, value in rows:
+        print(f"{label:<24}" + "".join(f"{value(r):>14.1f}" for r in results.values()))
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,35 @@
 """
 多感測器儀表板 API
 提供彙總查詢、多裝置資料比較和統計分析功能
+
+資料庫呼叫交給執行緒池執行（見 common/async_db.py）：統計、比較、時間序列等耗時查詢
+使用較小的執行緒池，執行期間 /health 與其他端點仍可立即回應
+
+儀表板輪詢的端點回應會快取（見 common/response_cache.py）：
+指定裝置的結果在該裝置有新資料時失效，所有裝置的彙總依存活時間過期；
+時間序列已結束的區間計算一次後保存，每次只重新查詢頭尾（見 common/bucket_cache.py）
 """
 
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
 from datetime import datetime, timedelta
 from typing import List, Optional
 from pydantic import BaseModel
+import asyncio
+import os
+import sys
 import uvicorn
 
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from mongo_pool import get_client, release_client
+from rollups import rollup_collection_name, summarize, series
+from latest import latest_collection_name, latest_readings, latest_reading
+from async_db import run_db, run_heavy, shutdown_executors
+from response_cache import ResponseCache, IngestWatcher
+from bucket_cache import BucketCache
+
 # ============ 資料模型 ============
 class DeviceInfo(BaseModel):
     device_id: str
@@ -53,12 +72,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# MongoDB 連接
-mongo_client = MongoClient("mongodb://localhost:27017/")
-db = mongo_client["iot_data"]
+# MongoDB 連接（共用連線池，第一次查詢時才連線，多 worker 時每個 worker 各自建立）
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DB = os.environ.get("MONGO_DB", "iot_data")
+mongo_client = get_client(MONGO_URI)
+db = mongo_client[MONGO_DB]
 devices_collection = db["devices"]
 readings_collection = db["sensor_readings"]
 alerts_collection = db["device_alerts"]
+# 每分鐘/小時/天的統計彙總（由 multi_device_subscriber 寫入時累加），
+# 比較、統計與時間序列端點讀取彙總，只有不滿一分鐘的頭尾才查詢原始讀數
+rollups_collection = db[rollup_collection_name("sensor_readings")]
+# 每個裝置、感測器的最新讀數（由 multi_device_subscriber 寫入時更新），
+# 儀表板刷新只讀這個小集合與彙總，不再掃描原始讀數
+latest_collection = db[latest_collection_name("sensor_readings")]
+
+DASHBOARD_LATEST_LIMIT = 10     # 儀表板顯示的最新讀數筆數
+
+# 回應快取的存活時間（秒）
+CACHE_TTLS = {
+    "dashboard": 5,     # /api/dashboard
+    "devices": 10,      # /api/devices
+    "comparison": 30,   # /api/comparison
+    "statistics": 30,   # /api/statistics
+}
+
+# 回應快取（每個 uvicorn worker 各自一份）
+cache = ResponseCache()
+watcher = None
+# 時間序列已結束的區間（stored_at 為寫入時間，舊區間不會再有新讀數，一直保存）
+timeseries_buckets = BucketCache()
+
+def timeseries_points(device_id: str, start: datetime, interval_seconds: int):
+    """裝置的時間序列：已結束的區間讀取快取，其餘由彙總計算（在執行緒池執行）"""
+    def fetch(range_start, range_end):
+        points = series(rollups_collection, readings_collection, {"device_id": device_id},
+                        "stored_at", range_start, interval_seconds, range_end)
+        return {point['start']: point for point in points}
+    return timeseries_buckets.get(("timeseries", device_id), start, interval_seconds, fetch)
 
 # ============ API 端點 ============
 
@@ -73,44 +124,43 @@ async def root():
             "devices": "/api/devices",
             "comparison": "/api/comparison",
             "statistics": "/api/statistics",
-            "alerts": "/api/alerts"
+            "alerts": "/api/alerts",
+            "cache": "/api/cache"
         }
     }
 
 @app.get("/api/dashboard", response_model=DashboardSummary)
+@cache.cached("dashboard", ttl=CACHE_TTLS["dashboard"])
 async def get_dashboard_summary():
     """
     取得儀表板摘要資訊
     包含裝置總數、線上/離線狀態、24小時讀數統計
     """
     try:
-        # 計算裝置數量
-        total_devices = devices_collection.count_documents({})
-        online_devices = devices_collection.count_documents({"status": "online"})
-        offline_devices = total_devices - online_devices
-        
-        # 計算 24 小時內的讀數
+        # 裝置數量、24 小時內的讀數（由統計彙總加總，只有不滿一分鐘的開頭查詢原始讀數）
+        # 與最新讀數同時查詢
         cutoff_time = datetime.now() - timedelta(hours=24)
-        total_readings_24h = readings_collection.count_documents({
-            "stored_at": {"$gte": cutoff_time}
-        })
-        
-        # 取得每個裝置的最新讀數
-        pipeline = [
-            {"$sort": {"stored_at": -1}},
-            {"$group": {
-                "_id": "$device_id",
-                "latest_reading": {"$first": "$$ROOT"}
-            }},
-            {"$limit": 10}
-        ]
+        total_devices, online_devices, stats, readings = await asyncio.gather(
+            run_db(devices_collection.count_documents, {}),
+            run_db(devices_collection.count_documents, {"status": "online"}),
+            run_heavy(summarize, rollups_collection, readings_collection, {}, "stored_at",
+                      start=cutoff_time),
+            run_db(latest_readings, latest_collection, "stored_at")
+        )
+        offline_devices = total_devices - online_devices
+        total_readings_24h = stats["count"] if stats else 0
         
-        latest_readings_data = list(readings_collection.aggregate(pipeline))
-        latest_readings = []
+        # 每個裝置的最新讀數（最新讀數集合依時間排序，每個裝置取最新的一筆）
+        newest = {}
+        for reading in readings:
+            newest.setdefault(reading['device_id'], reading)
+            if len(newest) == DASHBOARD_LATEST_LIMIT:
+                break
+        latest_readings_data = list(newest.values())
+        latest_readings_list = []
         
-        for item in latest_readings_data:
-            reading = item['latest_reading']
-            latest_readings.append(SensorReading(
+        for reading in latest_readings_data:
+            latest_readings_list.append(SensorReading(
                 device_id=reading['device_id'],
                 value=reading['value'],
                 unit=reading['unit'],
@@ -122,20 +172,21 @@ async def get_dashboard_summary():
             online_devices=online_devices,
             offline_devices=offline_devices,
             total_readings_24h=total_readings_24h,
-            latest_readings=latest_readings
+            latest_readings=latest_readings_list
         )
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"取得儀表板資料失敗: {str(e)}")
 
 @app.get("/api/devices")
+@cache.cached("devices", ttl=CACHE_TTLS["devices"])
 async def get_all_devices():
     """取得所有裝置列表及其狀態"""
     try:
         devices = []
-        for device in devices_collection.find():
+        for device in await run_db(lambda: list(devices_collection.find())):
             # 計算該裝置的總讀數
-            total_readings = readings_collection.count_documents({
+            total_readings = await run_heavy(readings_collection.count_documents, {
                 "device_id": device['device_id']
             })
             
@@ -157,15 +208,13 @@ async def get_all_devices():
 async def get_device_detail(device_id: str):
     """取得特定裝置的詳細資訊"""
     try:
-        device = devices_collection.find_one({"device_id": device_id})
+        device = await run_db(devices_collection.find_one, {"device_id": device_id})
         if not device:
             raise HTTPException(status_code=404, detail="找不到裝置")
         
-        # 取得最新讀數
-        latest_reading = readings_collection.find_one(
-            {"device_id": device_id},
-            sort=[("stored_at", -1)]
-        )
+        # 取得最新讀數（最新讀數集合中該裝置各感測器最新的一筆）
+        newest_reading = await run_db(latest_reading, latest_collection, "stored_at",
+                                      {"device_id": device_id})
         
         # 計算統計資訊
         cutoff_time = datetime.now() - timedelta(hours=24)
@@ -183,10 +232,10 @@ async def get_device_detail(device_id: str):
             }}
         ]
         
-        stats = list(readings_collection.aggregate(pipeline))
+        stats = await run_heavy(lambda: list(readings_collection.aggregate(pipeline)))
         
         device['_id'] = str(device['_id'])
-        device['latest_reading'] = latest_reading
+        device['latest_reading'] = newest_reading
         device['statistics_24h'] = stats[0] if stats else None
         
         return device
@@ -197,6 +246,7 @@ async def get_device_detail(device_id: str):
         raise HTTPException(status_code=500, detail=f"取得裝置資訊失敗: {str(e)}")
 
 @app.get("/api/comparison")
+@cache.cached("comparison", ttl=CACHE_TTLS["comparison"], device_param="device_ids")
 async def compare_devices(
     device_ids: str = Query(..., description="裝置 ID 列表，用逗號分隔"),
     hours: int = Query(24, description="統計時間範圍（小時）")
@@ -215,29 +265,16 @@ async def compare_devices(
         comparisons = []
         
         for device_id in device_list:
-            pipeline = [
-                {"$match": {
-                    "device_id": device_id,
-                    "stored_at": {"$gte": cutoff_time}
-                }},
-                {"$group": {
-                    "_id": "$device_id",
-                    "avg_value": {"$avg": "$value"},
-                    "min_value": {"$min": "$value"},
-                    "max_value": {"$max": "$value"},
-                    "count": {"$sum": 1}
-                }}
-            ]
-            
-            result = list(readings_collection.aggregate(pipeline))
+            stats = await run_heavy(summarize, rollups_collection, readings_collection,
+                                    {"device_id": device_id}, "stored_at", cutoff_time)
             
-            if result:
+            if stats:
                 comparisons.append(DeviceComparison(
                     device_id=device_id,
-                    average_value=round(result[0]['avg_value'], 2),
-                    min_value=result[0]['min_value'],
-                    max_value=result[0]['max_value'],
-                    reading_count=result[0]['count']
+                    average_value=round(stats['avg'], 2),
+                    min_value=stats['min'],
+                    max_value=stats['max'],
+                    reading_count=stats['count']
                 ))
             else:
                 comparisons.append(DeviceComparison(
@@ -257,6 +294,7 @@ async def compare_devices(
         raise HTTPException(status_code=500, detail=f"比較裝置資料失敗: {str(e)}")
 
 @app.get("/api/statistics")
+@cache.cached("statistics", ttl=CACHE_TTLS["statistics"], device_param="device_id")
 async def get_statistics(
     device_id: Optional[str] = Query(None, description="裝置 ID（可選）"),
     hours: int = Query(24, description="統計時間範圍（小時）")
@@ -268,34 +306,18 @@ async def get_statistics(
     try:
         cutoff_time = datetime.now() - timedelta(hours=hours)
         
-        match_query = {"stored_at": {"$gte": cutoff_time}}
-        if device_id:
-            match_query["device_id"] = device_id
-        
-        # 計算統計資訊
-        pipeline = [
-            {"$match": match_query},
-            {"$group": {
-                "_id": "$device_id" if not device_id else None,
-                "avg_value": {"$avg": "$value"},
-                "min_value": {"$min": "$value"},
-                "max_value": {"$max": "$value"},
-                "count": {"$sum": 1}
-            }}
-        ]
-        
-        results = list(readings_collection.aggregate(pipeline))
-        
         if device_id:
             # 單一裝置統計
-            if results:
+            stats = await run_heavy(summarize, rollups_collection, readings_collection,
+                                    {"device_id": device_id}, "stored_at", cutoff_time)
+            if stats:
                 return {
                     "device_id": device_id,
                     "time_range_hours": hours,
-                    "average_value": round(results[0]['avg_value'], 2),
-                    "min_value": results[0]['min_value'],
-                    "max_value": results[0]['max_value'],
-                    "reading_count": results[0]['count']
+                    "average_value": round(stats['avg'], 2),
+                    "min_value": stats['min'],
+                    "max_value": stats['max'],
+                    "reading_count": stats['count']
                 }
             else:
                 return {
@@ -305,17 +327,19 @@ async def get_statistics(
                 }
         else:
             # 所有裝置彙總統計
+            results = await run_heavy(summarize, rollups_collection, readings_collection, {},
+                                      "stored_at", cutoff_time, group_by="device_id")
             return {
                 "time_range_hours": hours,
                 "devices": [
                     {
-                        "device_id": r['_id'],
-                        "average_value": round(r['avg_value'], 2),
-                        "min_value": r['min_value'],
-                        "max_value": r['max_value'],
-                        "reading_count": r['count']
+                        "device_id": group,
+                        "average_value": round(stats['avg'], 2),
+                        "min_value": stats['min'],
+                        "max_value": stats['max'],
+                        "reading_count": stats['count']
                     }
-                    for r in results
+                    for group, stats in results.items()
                 ]
             }
     
@@ -326,7 +350,7 @@ async def get_statistics(
 async def get_timeseries_data(
     device_id: str = Query(..., description="裝置 ID"),
     hours: int = Query(24, description="時間範圍（小時）"),
-    interval_minutes: int = Query(60, description="資料點間隔（分鐘）")
+    interval_minutes: int = Query(60, ge=1, description="資料點間隔（分鐘）")
 ):
     """
     取得時間序列資料（用於繪製圖表）
@@ -339,30 +363,9 @@ async def get_timeseries_data(
     try:
         cutoff_time = datetime.now() - timedelta(hours=hours)
         
-        # 使用聚合管道取得平均值
-        pipeline = [
-            {"$match": {
-                "device_id": device_id,
-                "stored_at": {"$gte": cutoff_time}
-            }},
-            {"$sort": {"stored_at": 1}},
-            {"$group": {
-                "_id": {
-                    "$subtract": [
-                        {"$toLong": "$stored_at"},
-                        {"$mod": [
-                            {"$toLong": "$stored_at"},
-                            interval_minutes * 60 * 1000
-                        ]}
-                    ]
-                },
-                "avg_value": {"$avg": "$value"},
-                "timestamp": {"$first": "$stored_at"}
-            }},
-            {"$sort": {"timestamp": 1}}
-        ]
-        
-        results = list(readings_collection.aggregate(pipeline))
+        # 依間隔合併彙總文件取得平均值（間隔為整小時時使用每小時彙總，否則使用每分鐘彙總），
+        # 已結束的區間讀取快取
+        points = await run_heavy(timeseries_points, device_id, cutoff_time, interval_minutes * 60)
         
         return {
             "device_id": device_id,
@@ -370,10 +373,10 @@ async def get_timeseries_data(
             "interval_minutes": interval_minutes,
             "data_points": [
                 {
-                    "timestamp": r['timestamp'],
-                    "value": round(r['avg_value'], 2)
+                    "timestamp": point['first'],
+                    "value": round(point['avg'], 2)
                 }
-                for r in results
+                for _, point in points
             ]
         }
     
@@ -388,7 +391,7 @@ async def get_alerts(
     """取得警報記錄"""
     try:
         query = {"device_id": device_id} if device_id else {}
-        alerts = alerts_collection.find(query).sort("created_at", -1).limit(limit)
+        alerts = await run_db(lambda: list(alerts_collection.find(query).sort("created_at", -1).limit(limit)))
         
         result = []
         for alert in alerts:
@@ -405,7 +408,7 @@ async def health_check():
     """健康檢查端點"""
     try:
         # 測試資料庫連接
-        mongo_client.admin.command('ping')
+        await run_db(mongo_client.admin.command, 'ping')
         return {
             "status": "healthy",
             "database": "connected",
@@ -414,6 +417,25 @@ async def health_check():
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"服務不健康: {str(e)}")
 
+@app.get("/api/cache")
+async def get_cache_statistics():
+    """回應快取與時間序列區間快取的命中率統計（調整 CACHE_TTLS 與快取上限用）"""
+    return {**cache.get_statistics(), "timeseries_buckets": timeseries_buckets.get_statistics()}
+
+@app.on_event("startup")
+async def startup_event():
+    """啟動新資料檢查（裝置有新資料時刪除該裝置的快取）"""
+    global watcher
+    watcher = IngestWatcher(cache, latest_collection, "stored_at").start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """關閉資料庫連接"""
+    if watcher is not None:
+        await watcher.stop()
+    shutdown_executors()
+    release_client(mongo_client)
+
 # ============ 啟動伺服器 ============
 if __name__ == "__main__":
     print("多感測器儀表板 API")
@@ -5,24 +5,38 @@
 管理多個 Pico 裝置的註冊、查詢、移除和狀態追蹤
 """
 
-from pymongo import MongoClient
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict
 import json
+import os
+import sys
+
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from timeseries import ensure_timeseries_collection
+from indexes import ensure_indexes
+from mongo_pool import get_client, release_client
+from latest import latest_collection_name, latest_reading, latest_by_device
 
 class DeviceManager:
     """裝置管理類別"""
     
     def __init__(self, mongo_uri="mongodb://localhost:27017/", db_name="iot_data"):
         """初始化裝置管理器"""
-        self.client = MongoClient(mongo_uri)
+        self.client = get_client(mongo_uri)
         self.db = self.client[db_name]
         self.devices_collection = self.db['devices']
         self.readings_collection = self.db['sensor_readings']
+        # 每個裝置、感測器的最新讀數（由 multi_device_subscriber 寫入時更新）
+        self.latest_collection = self.db[latest_collection_name('sensor_readings')]
         
-        # 建立索引以提升查詢效能
-        self.devices_collection.create_index("device_id", unique=True)
-        self.readings_collection.create_index([("device_id", 1), ("stored_at", -1)])
+        # 讀數集合必須在建立索引前建立，否則會自動建立成一般集合
+        ensure_timeseries_collection(self.db, 'sensor_readings')
+        
+        # 建立索引以提升查詢效能（登記在 common/indexes.py）
+        ensure_indexes(self.devices_collection)
+        ensure_indexes(self.readings_collection)
     
     def register_device(self, device_id: str, device_info: Dict) -> bool:
         """
@@ -106,19 +120,16 @@ class DeviceManager:
         if not device:
             return {"error": "Device not found"}
         
-        # 取得最新讀數
-        latest_reading = self.readings_collection.find_one(
-            {"device_id": device_id},
-            sort=[("stored_at", -1)]
-        )
+        # 取得最新讀數（讀取最新讀數集合，不排序原始讀數）
+        newest = latest_reading(self.latest_collection, "stored_at", {"device_id": device_id})
         
         # 計算資料統計
         total_readings = self.readings_collection.count_documents({"device_id": device_id})
         
         # 判斷線上狀態（5分鐘內有資料視為線上）
         is_online = False
-        if latest_reading and latest_reading.get('stored_at'):
-            time_diff = datetime.now() - latest_reading['stored_at']
+        if newest and newest.get('stored_at'):
+            time_diff = datetime.now() - newest['stored_at']
             is_online = time_diff < timedelta(minutes=5)
         
         return {
@@ -127,27 +138,21 @@ class DeviceManager:
             "status": "online" if is_online else "offline",
             "last_seen": device.get('last_seen'),
             "total_readings": total_readings,
-            "latest_value": latest_reading.get('value') if latest_reading else None,
-            "latest_timestamp": latest_reading.get('stored_at') if latest_reading else None
+            "latest_value": newest.get('value') if newest else None,
+            "latest_timestamp": newest.get('stored_at') if newest else None
         }
     
     def get_online_devices(self) -> List[str]:
         """取得所有線上裝置"""
         cutoff_time = datetime.now() - timedelta(minutes=5)
         
-        # 從讀數中找出最近活躍的裝置
-        pipeline = [
-            {"$match": {"stored_at": {"$gte": cutoff_time}}},
-            {"$group": {"_id": "$device_id"}},
-            {"$project": {"device_id": "$_id", "_id": 0}}
-        ]
-        
-        result = self.readings_collection.aggregate(pipeline)
-        return [doc['device_id'] for doc in result]
+        # 從最新讀數中找出最近活躍的裝置
+        return list(latest_by_device(self.latest_collection, "stored_at",
+                                     {"stored_at": {"$gte": cutoff_time}}))
     
     def close(self):
         """關閉資料庫連接"""
-        self.client.close()
+        release_client(self.client)
 
 # ============ CLI 介面 ============
 def main():
@@ -5,12 +5,21 @@
 實作心跳檢測、離線警報和狀態追蹤功能
 """
 
-from pymongo import MongoClient
 from datetime import datetime, timedelta
 from typing import List, Dict
+import os
+import sys
 import time
 import threading
 
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from indexes import ensure_indexes
+from mongo_pool import get_client, release_client
+from rollups import rollup_collection_name, summarize
+from retention import apply_retention
+
 class DeviceMonitor:
     """裝置監控類別"""
     
@@ -25,10 +34,11 @@ class DeviceMonitor:
             offline_threshold_minutes: 離線判定時間（分鐘）
             check_interval_seconds: 檢查間隔（秒）
         """
-        self.client = MongoClient(mongo_uri)
+        self.client = get_client(mongo_uri)
         self.db = self.client[db_name]
         self.devices_collection = self.db['devices']
         self.readings_collection = self.db['sensor_readings']
+        self.rollups_collection = self.db[rollup_collection_name('sensor_readings')]
         self.alerts_collection = self.db['device_alerts']
         
         self.offline_threshold = timedelta(minutes=offline_threshold_minutes)
@@ -36,8 +46,9 @@ class DeviceMonitor:
         self.running = False
         self.monitor_thread = None
         
-        # 建立索引
-        self.alerts_collection.create_index([("device_id", 1), ("created_at", -1)])
+        # 建立索引（登記在 common/indexes.py）與保留期限（TTL 索引，見 common/retention.py）
+        ensure_indexes(self.alerts_collection)
+        apply_retention(self.alerts_collection)
     
     def check_device_heartbeat(self, device_id: str) -> Dict:
         """
@@ -215,6 +226,9 @@ class DeviceMonitor:
         """
         取得裝置統計資訊
         
+        讀取每分鐘/小時/天的彙總（multi_device_subscriber 寫入時累加），
+        只有不滿一分鐘的開頭才查詢原始讀數
+        
         Args:
             device_id: 裝置 ID
             hours: 統計時間範圍（小時）
@@ -224,36 +238,18 @@ class DeviceMonitor:
         """
         cutoff_time = datetime.now() - timedelta(hours=hours)
         
-        # 計算讀數數量
-        total_readings = self.readings_collection.count_documents({
-            "device_id": device_id,
-            "stored_at": {"$gte": cutoff_time}
-        })
-        
-        # 計算平均值（假設是溫度感測器）
-        pipeline = [
-            {"$match": {
-                "device_id": device_id,
-                "stored_at": {"$gte": cutoff_time}
-            }},
-            {"$group": {
-                "_id": None,
-                "avg_value": {"$avg": "$value"},
-                "min_value": {"$min": "$value"},
-                "max_value": {"$max": "$value"}
-            }}
-        ]
-        
-        stats = list(self.readings_collection.aggregate(pipeline))
+        # 讀數數量、平均值、最小與最大值（假設是溫度感測器）
+        stats = summarize(self.rollups_collection, self.readings_collection,
+                          {"device_id": device_id}, "stored_at", cutoff_time)
         
         if stats:
             return {
                 "device_id": device_id,
                 "time_range_hours": hours,
-                "total_readings": total_readings,
-                "average_value": round(stats[0]['avg_value'], 2) if stats[0]['avg_value'] else None,
-                "min_value": stats[0]['min_value'],
-                "max_value": stats[0]['max_value']
+                "total_readings": stats['count'],
+                "average_value": round(stats['avg'], 2) if stats['avg'] else None,
+                "min_value": stats['min'],
+                "max_value": stats['max']
             }
         else:
             return {
@@ -268,7 +264,7 @@ class DeviceMonitor:
     def close(self):
         """關閉連接"""
         self.stop_monitoring()
-        self.client.close()
+        release_client(self.client)
 
 # ============ CLI 介面 ============
 def main():
@@ -3,22 +3,175 @@
 """多裝置 MQTT 訂閱器 - 支援多個主題和裝置識別"""
 
 import paho.mqtt.client as mqtt
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from datetime import datetime, timedelta
 import json
+import os
+import sys
+import threading
+
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from ingest_log import setup_logging, IngestMonitor
+from pipeline import Pipeline, EnrichStage, FunctionStage, MongoSink
+from timeseries import ensure_timeseries_collection
+from rollups import RollupWriter
+from latest import LatestWriter
+from retention import start_scheduler, policy_for
+from mongo_pool import get_client, release_client
 
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 MONGO_URI = "mongodb://localhost:27017/"
 MONGO_DB = "iot_data"
 
+# 日誌設定：每幾筆輸出一筆明細、彙總間隔（秒）
+LOG_SAMPLE_EVERY = 50
+ROLLUP_INTERVAL = 10.0
+
+# 裝置上線狀態：每幾秒把 last_seen 批次寫回 devices 集合，超過多久沒資料視為離線
+PRESENCE_FLUSH_INTERVAL = 5.0
+OFFLINE_TIMEOUT = timedelta(minutes=5)
+
+logger = setup_logging("multi_device_subscriber", fmt="%(message)s")
+
+class DevicePresence:
+    """
+    裝置上線狀態表
+    
+    每筆讀數只更新記憶體中的 last_seen，由背景執行緒每 flush_interval 秒
+    用一次 bulk_write 寫回 devices 集合；status 只在真的改變時才寫入
+    （第一次看到裝置、離線後又收到資料、超過 offline_timeout 沒有資料）
+    """
+    
+    def __init__(self, collection, flush_interval=PRESENCE_FLUSH_INTERVAL,
+                 offline_timeout=OFFLINE_TIMEOUT):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.offline_timeout = offline_timeout
+        
+        self.lock = threading.Lock()
+        self.last_seen = {}         # device_id -> 最後收到資料的時間
+        self.dirty = set()          # 有新的 last_seen 尚未寫回的裝置
+        self.status = {}            # device_id -> 資料庫中目前的 status
+        
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.flush_count = 0
+        self.write_count = 0
+        
+        # 載入資料庫中已知的狀態，避免重新啟動後重複寫入相同的 status
+        try:
+            for device in collection.find({}, {"device_id": 1, "status": 1, "_id": 0}):
+                if device.get("device_id") is not None:
+                    self.status[device["device_id"]] = device.get("status")
+        except PyMongoError as e:
+            print(f"✗ 載入裝置狀態失敗: {e}")
+    
+    def seen(self, device_id, when):
+        """記錄裝置在 when 時送來資料（只更新記憶體）"""
+        with self.lock:
+            self.last_seen[device_id] = when
+            self.dirty.add(device_id)
+    
+    def start(self):
+        """啟動背景寫回執行緒"""
+        self.thread = threading.Thread(target=self._run, name="device_presence", daemon=True)
+        self.thread.start()
+    
+    def stop(self, timeout=10):
+        """停止背景執行緒，並把尚未寫回的狀態寫完"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+        self.flush()
+    
+    def _run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+    
+    def flush(self):
+        """
+        把累積的 last_seen 與狀態變化用一次 bulk_write 寫回
+        
+        Returns:
+            int: 寫入的操作數
+        """
+        now = datetime.now()
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            changes = {}
+            for device_id in dirty:
+                if self.status.get(device_id) != "online":
+                    changes[device_id] = "online"
+            for device_id, last_seen in self.last_seen.items():
+                if (device_id not in dirty and self.status.get(device_id) == "online"
+                        and now - last_seen > self.offline_timeout):
+                    changes[device_id] = "offline"
+            last_seen = {device_id: self.last_seen[device_id] for device_id in dirty}
+        
+        operations = []
+        for device_id in dirty | changes.keys():
+            fields = {}
+            if device_id in last_seen:
+                fields["last_seen"] = last_seen[device_id]
+            if device_id in changes:
+                fields["status"] = changes[device_id]
+            operations.append(UpdateOne({"device_id": device_id}, {"$set": fields}, upsert=True))
+        
+        if not operations:
+            return 0
+        
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            # 寫入失敗：放回待寫清單，下次一起重試
+            with self.lock:
+                self.dirty |= dirty
+            logger.error(f"✗ 裝置狀態寫入失敗: {e}")
+            return 0
+        
+        with self.lock:
+            self.status.update(changes)
+            self.flush_count += 1
+            self.write_count += len(operations)
+        for device_id, status in changes.items():
+            logger.info(f"裝置 {device_id} 狀態變更: {status}")
+        return len(operations)
+
 class MultiDeviceSubscriber:
     def __init__(self):
-        self.mongo_client = MongoClient(MONGO_URI)
+        self.mongo_client = get_client(MONGO_URI)
         self.db = self.mongo_client[MONGO_DB]
+        # 讀數存在時間序列集合（集合不存在時建立）
+        ensure_timeseries_collection(self.db, 'sensor_readings')
         self.collection = self.db['sensor_readings']
+        self.rollups = RollupWriter.for_collection(self.collection)
+        self.latest = LatestWriter.for_collection(self.collection)
+        self.retention = None
         self.devices_collection = self.db['devices']
+        self.presence = DevicePresence(self.devices_collection)
         self.stats = {}
+        self.monitor = IngestMonitor(
+            logger,
+            interval=ROLLUP_INTERVAL,
+            sample_every=LOG_SAMPLE_EVERY,
+            extra=lambda: f"裝置 {len(self.stats)} 台"
+        )
+        
+        # 資料收集流程：解析 → 加入儲存時間 → 更新上線狀態 → 寫入資料庫（並累加統計彙總、更新最新讀數）
+        self.pipeline = Pipeline(
+            "multi_device_subscriber",
+            stages=[
+                FunctionStage("decode", self.decode),
+                EnrichStage(stored_at=datetime.now),
+                FunctionStage("presence", self.track_presence),
+            ],
+            sinks=[MongoSink(self.collection, rollups=self.rollups, latest=self.latest)],
+            monitor=self.monitor
+        )
     
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
@@ -27,31 +180,33 @@ class MultiDeviceSubscriber:
             client.subscribe("sensors/#")
             print("✓ 訂閱主題: sensors/#\n")
     
+    def decode(self, msg):
+        """解析 JSON 訊息並加入主題"""
+        data = json.loads(msg.payload)
+        data['mqtt_topic'] = msg.topic
+        return data
+    
+    def track_presence(self, data):
+        """更新裝置最後上線時間（只更新記憶體，定期批次寫回）"""
+        device_id = data.get('device_id')
+        if device_id is not None:
+            self.presence.seen(device_id, data['stored_at'])
+        return data
+    
     def on_message(self, client, userdata, msg):
-        try:
-            data = json.loads(msg.payload.decode('utf-8'))
-            device_id = data.get('device_id')
-            
-            # 更新裝置最後上線時間
-            self.devices_collection.update_one(
-                {"device_id": device_id},
-                {"$set": {"last_seen": datetime.now(), "status": "online"}},
-                upsert=True
-            )
-            
-            # 儲存資料
-            data['mqtt_topic'] = msg.topic
-            data['stored_at'] = datetime.now()
-            self.collection.insert_one(data)
-            
-            # 更新統計
-            if device_id not in self.stats:
-                self.stats[device_id] = 0
-            self.stats[device_id] += 1
-            
-            print(f"[{device_id}] {data.get('value')} {data.get('unit')} (總計: {self.stats[device_id]})")
-        except Exception as e:
-            print(f"✗ 錯誤: {e}")
+        data = self.pipeline.run(msg)
+        if data is None:
+            return
+        
+        # 更新統計
+        device_id = data.get('device_id')
+        if device_id not in self.stats:
+            self.stats[device_id] = 0
+        self.stats[device_id] += 1
+        
+        # 只抽樣輸出明細，其餘由定期彙總呈現
+        if self.monitor.record_message():
+            logger.info(f"[{device_id}] {data.get('value')} {data.get('unit')} (總計: {self.stats[device_id]})")
     
     def run(self):
         client = mqtt.Client(client_id="multi_device_subscriber")
@@ -61,6 +216,12 @@ class MultiDeviceSubscriber:
         print("多裝置 MQTT 訂閱器")
         print("=" * 60)
         client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
+        self.monitor.start()
+        self.presence.start()
+        # 資料保留：過期的讀數與統計彙總在背景刪除
+        self.retention = start_scheduler(self.db, {
+            name: policy_for(name) for name in ('sensor_readings', self.rollups.collection.name)
+        }, logger)
         
         try:
             client.loop_forever()
@@ -68,9 +229,15 @@ class MultiDeviceSubscriber:
             print("\n\n統計資訊:")
             for device_id, count in self.stats.items():
                 print(f"  {device_id}: {count} 筆")
+            print()
+            print("\n".join(self.pipeline.format_statistics()))
         finally:
+            self.presence.stop()
+            if self.retention is not None:
+                self.retention.stop()
+            self.monitor.stop()
             client.disconnect()
-            self.mongo_client.close()
+            release_client(self.mongo_client)
 
 if __name__ == "__main__":
     subscriber = MultiDeviceSubscriber()
@@ -1,16 +1,28 @@
 """
 環境監測 API 服務
 提供歷史資料查詢、統計分析和趨勢分析功能
+（資料庫呼叫交給執行緒池執行，不阻塞事件迴圈，見 common/async_db.py）
 """
 
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime, timedelta
 from typing import Optional
+import os
+import sys
 import pymongo
 from config import *
 import logging
 
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from timestamps import to_datetime
+from mongo_pool import get_client, release_client
+from rollups import rollup_collection_name, summarize
+from latest import latest_collection_name, latest_reading
+from async_db import run_db, run_heavy, shutdown_executors
+
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -35,15 +47,21 @@ app.add_middleware(
 db_client = None
 db = None
 collection = None
+rollups = None
+latest = None
 
 @app.on_event("startup")
 async def startup_db_client():
     """啟動時連接資料庫"""
-    global db_client, db, collection
+    global db_client, db, collection, rollups, latest
     try:
-        db_client = pymongo.MongoClient(MONGO_URI)
+        db_client = get_client(MONGO_URI)
         db = db_client[MONGO_DB]
         collection = db[MONGO_COLLECTION]
+        # 統計彙總（monitor_service 寫入時累加）
+        rollups = db[rollup_collection_name(MONGO_COLLECTION)]
+        # 每個裝置、感測器的最新讀數（monitor_service 寫入時更新）
+        latest = db[latest_collection_name(MONGO_COLLECTION)]
         logger.info(f"已連接到 MongoDB: {MONGO_DB}.{MONGO_COLLECTION}")
     except Exception as e:
         logger.error(f"MongoDB 連接失敗: {e}")
@@ -53,8 +71,9 @@ async def startup_db_client():
 async def shutdown_db_client():
     """關閉時斷開資料庫連接"""
     global db_client
+    shutdown_executors()
     if db_client:
-        db_client.close()
+        release_client(db_client)
         logger.info("已斷開 MongoDB 連接")
 
 @app.get("/")
@@ -76,7 +95,7 @@ async def health_check():
     """健康檢查"""
     try:
         # 測試資料庫連接
-        db_client.server_info()
+        await run_db(db_client.server_info)
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Database error: {str(e)}")
@@ -93,14 +112,11 @@ async def get_latest_data(
     """
     try:
         query = {"device_id": device_id} if device_id else {}
-        data = collection.find_one(
-            query,
-            {"_id": 0},
-            sort=[("timestamp", pymongo.DESCENDING)]
-        )
+        data = await run_db(latest_reading, latest, "timestamp", query)
         
         if not data:
             raise HTTPException(status_code=404, detail="找不到資料")
+        data.pop("_id", None)
         
         return {"status": "success", "data": data}
     except HTTPException:
@@ -132,25 +148,30 @@ async def get_history_data(
         
         # 時間範圍查詢
         if start and end:
-            query["timestamp"] = {
-                "$gte": start,
-                "$lte": end
-            }
+            try:
+                query["timestamp"] = {
+                    "$gte": to_datetime(start),
+                    "$lte": to_datetime(end)
+                }
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
         elif hours:
             cutoff_time = datetime.now() - timedelta(hours=hours)
-            query["timestamp"] = {"$gte": cutoff_time.isoformat()}
+            query["timestamp"] = {"$gte": cutoff_time}
         
         # 查詢資料
-        data = list(collection.find(
+        data = await run_heavy(lambda: list(collection.find(
             query,
             {"_id": 0}
-        ).sort("timestamp", pymongo.DESCENDING).limit(limit))
+        ).sort("timestamp", pymongo.DESCENDING).limit(limit)))
         
         return {
             "status": "success",
             "count": len(data),
             "data": data
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"查詢失敗: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -163,6 +184,9 @@ async def get_statistics(
     """
     取得統計資訊
     
+    讀取每分鐘/小時/天的彙總（筆數、總和、平方和），
+    只有不滿一分鐘的開頭才查詢原始資料
+    
     Args:
         device_id: 裝置 ID
         hours: 統計最近幾小時
@@ -170,32 +194,20 @@ async def get_statistics(
     try:
         cutoff_time = datetime.now() - timedelta(hours=hours)
         
-        query = {
-            "device_id": device_id,
-            "sensor_type": "temperature",
-            "timestamp": {"$gte": cutoff_time.isoformat()}
-        }
+        summary = await run_heavy(summarize, rollups, collection,
+                                  {"device_id": device_id, "sensor_type": "temperature"},
+                                  "timestamp", cutoff_time)
         
-        # 使用聚合管道計算統計
-        pipeline = [
-            {"$match": query},
-            {"$group": {
-                "_id": None,
-                "count": {"$sum": 1},
-                "average": {"$avg": "$value"},
-                "min": {"$min": "$value"},
-                "max": {"$max": "$value"},
-                "std_dev": {"$stdDevPop": "$value"}
-            }}
-        ]
-        
-        result = list(collection.aggregate(pipeline))
-        
-        if not result:
+        if not summary:
             raise HTTPException(status_code=404, detail="找不到資料")
         
-        stats = result[0]
-        stats.pop("_id")
+        stats = {
+            "count": summary["count"],
+            "average": summary["avg"],
+            "min": summary["min"],
+            "max": summary["max"],
+            "std_dev": summary["std_dev"]
+        }
         
         # 四捨五入到小數點後 2 位
         for key in ["average", "min", "max", "std_dev"]:
@@ -232,14 +244,14 @@ async def get_trend_analysis(
         query = {
             "device_id": device_id,
             "sensor_type": "temperature",
-            "timestamp": {"$gte": cutoff_time.isoformat()}
+            "timestamp": {"$gte": cutoff_time}
         }
         
         # 取得資料並按時間排序
-        data = list(collection.find(
+        data = await run_heavy(lambda: list(collection.find(
             query,
             {"_id": 0, "value": 1, "timestamp": 1}
-        ).sort("timestamp", pymongo.ASCENDING))
+        ).sort("timestamp", pymongo.ASCENDING)))
         
         if len(data) < 2:
             raise HTTPException(status_code=404, detail="資料不足以分析趨勢")
@@ -23,6 +23,10 @@ TEMP_MAX = 35  # 最高溫度（°C）
 TEMP_CHANGE_THRESHOLD = 5  # 溫度變化閾值（°C/小時）
 SENSOR_TIMEOUT = 900  # 感測器無回應超時（秒，15分鐘）
 
+# 日誌設定
+LOG_SAMPLE_EVERY = 100  # 每幾筆資料輸出一筆明細
+LOG_ROLLUP_INTERVAL = 60  # 彙總輸出間隔（秒）
+
 # API 設定
 API_HOST = "0.0.0.0"
 API_PORT = 8000
@@ -3,19 +3,28 @@
 訂閱 MQTT 訊息並儲存到 MongoDB，包含異常檢測功能
 """
 
-import json
-import logging
-from datetime import datetime, timedelta
+import os
+import sys
+import time
 import paho.mqtt.client as mqtt
-import pymongo
 from config import *
 
-# 設定日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from sensor_decoder import SensorDecoder, PayloadError
+from ingest_log import setup_logging, IngestMonitor
+from pipeline import (Pipeline, DecodeStage, EnrichStage, FunctionStage, FunctionSink,
+                      SinkWriteFailed, TimestampStage)
+from timestamps import now
+from indexes import ensure_indexes
+from rollups import RollupWriter
+from latest import LatestWriter
+from retention import start_scheduler, policy_for
+from mongo_pool import get_client
+
+# 設定日誌（經由佇列在背景輸出，不阻塞 MQTT 執行緒）
+logger = setup_logging(__name__)
 
 class EnvironmentalMonitor:
     """環境監測服務類別"""
@@ -24,54 +33,71 @@ class EnvironmentalMonitor:
         """初始化監測服務"""
         self.db = None
         self.collection = None
+        self.rollups = None
+        self.latest = None
         self.last_temperature = None
         self.last_timestamp = None
+        # 每筆資料只計數，明細抽樣輸出，並定期輸出一行彙總
+        self.monitor = IngestMonitor(
+            logger,
+            interval=LOG_ROLLUP_INTERVAL,
+            sample_every=LOG_SAMPLE_EVERY
+        )
         self.connect_database()
+        
+        # 資料收集流程：解碼驗證 → 時間轉為 BSON 日期 → 正常範圍檢查 → 異常檢測 → 加入建立時間 → 儲存
+        self.pipeline = Pipeline(
+            "environmental_monitor",
+            stages=[
+                # 必要欄位和數值型別由共用解碼器檢查；超出範圍只記錄警告，不拒絕資料
+                DecodeStage(SensorDecoder(
+                    required=("device_id", "sensor_type", "value", "timestamp")
+                )),
+                TimestampStage("timestamp"),
+                FunctionStage("range_check", self.check_normal_range),
+                FunctionStage("anomaly", self.report_anomalies),
+                EnrichStage(created_at=now),
+            ],
+            sinks=[FunctionSink("mongodb", self.save_data)],
+            on_error=self.on_pipeline_error
+        )
     
     def connect_database(self):
         """連接到 MongoDB"""
         try:
-            client = pymongo.MongoClient(MONGO_URI)
+            client = get_client(MONGO_URI)
             self.db = client[MONGO_DB]
             self.collection = self.db[MONGO_COLLECTION]
             
-            # 建立索引以提升查詢效能
-            self.collection.create_index([("device_id", 1), ("timestamp", -1)])
-            self.collection.create_index([("timestamp", -1)])
+            # 建立索引以提升查詢效能（登記在 common/indexes.py）
+            ensure_indexes(self.collection, "environmental_data")
+            # 每分鐘/小時/天的統計彙總（/api/stats 讀取彙總）
+            self.rollups = RollupWriter.for_collection(self.collection, "environmental_data")
+            # 每個裝置、感測器的最新讀數（/api/latest 讀取）
+            self.latest = LatestWriter.for_collection(self.collection, "environmental_data")
             
             logger.info(f"已連接到 MongoDB: {MONGO_DB}.{MONGO_COLLECTION}")
         except Exception as e:
             logger.error(f"MongoDB 連接失敗: {e}")
             raise
     
-    def validate_data(self, data):
+    def check_normal_range(self, data):
         """
-        驗證接收到的資料
+        檢查溫度是否在正常範圍內
+        
+        超出時不拒絕資料，只記錄警告
         
         Args:
             data: 資料字典
             
         Returns:
-            tuple: (是否有效, 錯誤訊息)
+            dict: 原本的資料字典
         """
-        required_fields = ["device_id", "sensor_type", "value", "timestamp"]
-        
-        # 檢查必要欄位
-        for field in required_fields:
-            if field not in data:
-                return False, f"缺少必要欄位: {field}"
-        
-        # 檢查溫度範圍
         if data["sensor_type"] == "temperature":
             value = data["value"]
-            if not isinstance(value, (int, float)):
-                return False, "溫度值必須是數字"
-            
             if value < TEMP_MIN or value > TEMP_MAX:
-                logger.warning(f"溫度超出正常範圍: {value}°C")
-                # 不拒絕資料，但記錄警告
-        
-        return True, None
+                self.monitor.record_warning("out_of_range", f"溫度超出正常範圍: {value}°C")
+        return data
     
     def detect_anomalies(self, data):
         """
@@ -89,7 +115,7 @@ class EnvironmentalMonitor:
             return anomalies
         
         current_temp = data["value"]
-        current_time = datetime.fromisoformat(data["timestamp"])
+        current_time = data["timestamp"]  # TimestampStage 已轉為 datetime
         
         # 檢查溫度範圍
         if current_temp < TEMP_MIN:
@@ -116,6 +142,20 @@ class EnvironmentalMonitor:
         
         return anomalies
     
+    def report_anomalies(self, data):
+        """
+        檢測異常並記錄警告（不拒絕資料）
+        
+        Args:
+            data: 資料字典
+            
+        Returns:
+            dict: 原本的資料字典
+        """
+        for anomaly in self.detect_anomalies(data):
+            self.monitor.record_warning("anomaly", f"⚠️  異常檢測: {anomaly}")
+        return data
+    
     def save_data(self, data):
         """
         儲存資料到 MongoDB
@@ -127,19 +167,30 @@ class EnvironmentalMonitor:
             bool: 儲存是否成功
         """
         try:
-            # 加入建立時間
-            data["created_at"] = datetime.now().isoformat()
-            
             # 儲存到資料庫
+            start = time.perf_counter()
             result = self.collection.insert_one(data)
-            logger.info(
-                f"✓ 已儲存資料: {data['device_id']} - "
-                f"{data['sensor_type']}: {data['value']}"
-            )
-            return True
+            self.monitor.record_latency((time.perf_counter() - start) * 1000)
+            
+            if self.monitor.record_message():
+                logger.info(
+                    f"✓ 已儲存資料: {data['device_id']} - "
+                    f"{data['sensor_type']}: {data['value']}"
+                )
         except Exception as e:
-            logger.error(f"✗ 儲存失敗: {e}")
+            self.monitor.record_error("save", f"✗ 儲存失敗: {e}")
             return False
+        
+        # 資料已寫入，彙總失敗只記錄錯誤（需要時以 rollups.py / latest.py --rebuild 重建）
+        try:
+            self.rollups.apply([data])
+        except Exception as e:
+            self.monitor.record_error("rollup", f"✗ 統計彙總更新失敗: {e}")
+        try:
+            self.latest.apply([data])
+        except Exception as e:
+            self.monitor.record_error("latest", f"✗ 最新讀數更新失敗: {e}")
+        return True
     
     def on_connect(self, client, userdata, flags, rc):
         """MQTT 連接回調"""
@@ -152,44 +203,17 @@ class EnvironmentalMonitor:
     
     def on_message(self, client, userdata, msg):
         """MQTT 訊息回調"""
-        try:
-            # 解析 JSON 訊息
-            payload = msg.payload.decode('utf-8')
-            data = json.loads(payload)
-            
-            logger.info(f"收到訊息: {msg.topic}")
-            
-            # 驗證資料
-            is_valid, error_msg = self.validate_data(data)
-            if not is_valid:
-                logger.error(f"資料驗證失敗: {error_msg}")
-                return
-            
-            # 檢測異常
-            anomalies = self.detect_anomalies(data)
-            if anomalies:
-                for anomaly in anomalies:
-                    logger.warning(f"⚠️  異常檢測: {anomaly}")
-            
-            # 儲存資料
-            self.save_data(data)
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON 解析失敗: {e}")
-        except Exception as e:
-            logger.error(f"處理訊息時發生錯誤: {e}")
+        self.pipeline.run(msg)
     
-    def cleanup_old_data(self):
-        """清理過期資料"""
-        try:
-            cutoff_date = datetime.now() - timedelta(days=DATA_RETENTION_DAYS)
-            result = self.collection.delete_many({
-                "timestamp": {"$lt": cutoff_date.isoformat()}
-            })
-            if result.deleted_count > 0:
-                logger.info(f"已清理 {result.deleted_count} 筆過期資料")
-        except Exception as e:
-            logger.error(f"清理資料失敗: {e}")
+    def on_pipeline_error(self, stage, item, error, rejected):
+        """流程中某一筆資料失敗"""
+        if isinstance(error, SinkWriteFailed):
+            # 儲存函式已記錄錯誤
+            return
+        if isinstance(error, PayloadError):
+            self.monitor.record_error("validation", f"資料驗證失敗: {error}")
+        else:
+            self.monitor.record_error("other", f"處理訊息時發生錯誤（{stage}）: {error}")
     
     def run(self):
         """啟動監測服務"""
@@ -206,12 +230,20 @@ class EnvironmentalMonitor:
         client.on_connect = self.on_connect
         client.on_message = self.on_message
         
+        # 資料保留：原始資料保留 DATA_RETENTION_DAYS 天，統計彙總依解析度保留，
+        # 過期資料在背景分批、限速刪除（取代一次刪除全部過期資料的 delete_many）
+        retention = start_scheduler(self.db, {
+            MONGO_COLLECTION: policy_for("environmental_data", DATA_RETENTION_DAYS),
+            self.rollups.collection.name: policy_for("environmental_data_rollups")
+        }, logger)
+        
         try:
             # 連接到 MQTT Broker
             client.connect(MQTT_BROKER, MQTT_PORT, 60)
             
             # 開始監聽
             logger.info("開始監聽 MQTT 訊息...")
+            self.monitor.start()
             client.loop_forever()
             
         except KeyboardInterrupt:
@@ -220,6 +252,11 @@ class EnvironmentalMonitor:
             logger.error(f"服務錯誤: {e}")
         finally:
             client.disconnect()
+            if retention is not None:
+                retention.stop()
+            self.monitor.stop()
+            for line in self.pipeline.format_statistics():
+                logger.info(line)
             logger.info("服務已停止")
 
 def main():
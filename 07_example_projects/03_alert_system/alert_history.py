@@ -37,7 +37,7 @@ def list_alerts(collection, device_id=None, hours=None, severity=None):
     
     if hours:
         cutoff_time = datetime.now() - timedelta(hours=hours)
-        query["timestamp"] = {"$gte": cutoff_time.isoformat()}
+        query["timestamp"] = {"$gte": cutoff_time}
     
     alerts = list(collection.find(query, {"_id": 0}).sort("timestamp", -1))
     
@@ -66,7 +66,7 @@ def list_alerts(collection, device_id=None, hours=None, severity=None):
 def show_statistics(collection, hours=24):
     """顯示警報統計"""
     cutoff_time = datetime.now() - timedelta(hours=hours)
-    query = {"timestamp": {"$gte": cutoff_time.isoformat()}}
+    query = {"timestamp": {"$gte": cutoff_time}}
     
     alerts = list(collection.find(query, {"_id": 0}))
     
@@ -111,7 +111,7 @@ def export_alerts(collection, output_file, device_id=None, hours=None):
     
     if hours:
         cutoff_time = datetime.now() - timedelta(hours=hours)
-        query["timestamp"] = {"$gte": cutoff_time.isoformat()}
+        query["timestamp"] = {"$gte": cutoff_time}
     
     alerts = list(collection.find(query, {"_id": 0}).sort("timestamp", -1))
     
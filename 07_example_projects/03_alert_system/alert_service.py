@@ -5,11 +5,20 @@
 
 import json
 import logging
+import os
+import sys
 from datetime import datetime, timedelta
 import paho.mqtt.client as mqtt
-import pymongo
 import argparse
 
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from timestamps import now, to_datetime
+from indexes import ensure_indexes
+from retention import apply_retention
+from mongo_pool import get_client
+
 # 設定日誌
 logging.basicConfig(
     level=logging.INFO,
@@ -49,13 +58,13 @@ class AlertSystem:
         """連接到 MongoDB"""
         try:
             db_config = self.config['database']
-            client = pymongo.MongoClient(db_config['uri'])
+            client = get_client(db_config['uri'])
             self.db = client[db_config['db']]
             self.collection = self.db[db_config['collection']]
             
-            # 建立索引
-            self.collection.create_index([("timestamp", -1)])
-            self.collection.create_index([("device_id", 1), ("timestamp", -1)])
+            # 建立索引（登記在 common/indexes.py）與保留期限（TTL 索引，見 common/retention.py）
+            ensure_indexes(self.collection, "alerts")
+            apply_retention(self.collection, "alerts")
             
             logger.info(f"已連接到 MongoDB: {db_config['db']}.{db_config['collection']}")
         except Exception as e:
@@ -162,7 +171,12 @@ class AlertSystem:
         if self.check_cooldown(rule['name'], device_id, cooldown):
             return
         
-        # 建立警報記錄
+        # 建立警報記錄（時間存成 BSON 日期）
+        try:
+            data_timestamp = to_datetime(data.get('timestamp'))
+        except ValueError:
+            data_timestamp = None
+        
         alert = {
             'alert_id': f"alert_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self.alert_count}",
             'device_id': device_id,
@@ -171,8 +185,8 @@ class AlertSystem:
             'sensor_type': data.get('sensor_type'),
             'value': data.get('value'),
             'change_rate': change_rate,
-            'timestamp': datetime.now().isoformat(),
-            'data_timestamp': data.get('timestamp')
+            'timestamp': now(),
+            'data_timestamp': data_timestamp
         }
         
         # 格式化訊息
@@ -249,9 +263,9 @@ class AlertSystem:
         
         # 計算變化率
         try:
-            timestamp = datetime.fromisoformat(data.get('timestamp'))
-        except:
-            timestamp = datetime.now()
+            timestamp = to_datetime(data.get('timestamp'))
+        except ValueError:
+            timestamp = now()
         
         change_rate = self.calculate_change_rate(device_id, value, timestamp)
         
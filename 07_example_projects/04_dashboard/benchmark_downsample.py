@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+圖表降採樣效能測試
+以模擬的讀數（每 5 秒一筆、6 小時，加上幾個尖峰）比較 /api/chart 回傳全部讀數與降採樣後的：
+- 點數與 JSON 大小（與 API 相同的編碼方式）
+- 降採樣與編碼時間
+- 形狀：尖峰是否保留、最大/最小值是否保留、以選出的點線性內插與原始讀數的平均誤差
+
+不需要資料庫
+
+使用方式:
+    python3 benchmark_downsample.py
+    python3 benchmark_downsample.py --hours 24 --max-points 1000
+"""
+
+import argparse
+import bisect
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../common'))
+
+from downsample import downsample, METHODS, np
+
+# ============ 測試設定 ============
+INTERVAL_SECONDS = 5
+SPIKES = 5              # 尖峰數
+ROUNDS = 20
+
+def generate(hours, seed=42):
+    """隨機漫步的溫度讀數，加上幾個單點尖峰"""
+    rng = random.Random(seed)
+    total = hours * 3600 // INTERVAL_SECONDS
+    start = datetime.now() - timedelta(hours=hours)
+    spikes = set(rng.sample(range(1, total - 1), SPIKES))
+    value = 25.0
+    readings = []
+    for i in range(total):
+        value += rng.uniform(-0.05, 0.05)
+        spike = rng.choice((-8, 8)) if i in spikes else 0
+        readings.append({"device_id": "pico_001", "sensor_type": "temperature",
+                         "timestamp": start + timedelta(seconds=i * INTERVAL_SECONDS),
+                         "value": round(value + spike, 2), "unit": "°C"})
+    return readings, spikes
+
+def encode(readings):
+    """與 /api/chart 相同的回應，回傳 JSON bytes"""
+    body = {"status": "success",
+            "labels": [d["timestamp"] for d in readings],
+            "values": [d["value"] for d in readings]}
+    return json.dumps(jsonable_encoder(body)).encode()
+
+def interpolation_error(readings, selected):
+    """以選出的點線性內插，與原始讀數的平均絕對誤差"""
+    times = [d["timestamp"] for d in selected]
+    total = 0.0
+    for d in readings:
+        i = min(max(bisect.bisect_left(times, d["timestamp"]), 1), len(times) - 1)
+        left, right = selected[i - 1], selected[i]
+        span = (right["timestamp"] - left["timestamp"]).total_seconds()
+        ratio = (d["timestamp"] - left["timestamp"]).total_seconds() / span if span else 0.0
+        total += abs(left["value"] + (right["value"] - left["value"]) * ratio - d["value"])
+    return total / len(readings)
+
+def measure(readings, spikes, max_points, method):
+    t0 = time.perf_counter()
+    for _ in range(ROUNDS):
+        selected = downsample(readings, max_points, method) if method else readings
+    downsample_ms = (time.perf_counter() - t0) / ROUNDS * 1000
+
+    t0 = time.perf_counter()
+    for _ in range(ROUNDS):
+        payload = encode(selected)
+    encode_ms = (time.perf_counter() - t0) / ROUNDS * 1000
+
+    values = [d["value"] for d in readings]
+    kept = {id(d) for d in selected}
+    return {
+        "points": len(selected),
+        "bytes": len(payload),
+        "downsample_ms": downsample_ms,
+        "encode_ms": encode_ms,
+        "spikes": sum(1 for i in spikes if id(readings[i]) in kept),
+        "extremes": (max(d["value"] for d in selected) == max(values)
+                     and min(d["value"] for d in selected) == min(values)),
+        "error": interpolation_error(readings, selected),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='圖表降採樣效能測試')
+    parser.add_argument('--hours', type=int, default=6, help='時間範圍（小時）')
+    parser.add_argument('--max-points', type=int, default=800, help='降採樣點數（圖表寬度）')
+    args = parser.parse_args()
+
+    readings, spikes = generate(args.hours)
+    print("=" * 60)
+    print(f"圖表降採樣效能測試（{len(readings):,} 點 → {args.max_points} 點，"
+          f"NumPy: {'有' if np is not None else '無'}）")
+    print("=" * 60)
+
+    results = {"raw": measure(readings, spikes, None, None)}
+    for method in METHODS:
+        results[method] = measure(readings, spikes, args.max_points, method)
+
+    rows = [
+        ("點數", lambda r: f"{r['points']:,}"),
+        ("JSON 大小 (KB)", lambda r: f"{r['bytes'] / 1024:.1f}"),
+        ("降採樣 (ms)", lambda r: f"{r['downsample_ms']:.2f}"),
+        ("編碼 (ms)", lambda r: f"{r['encode_ms']:.2f}"),
+        (f"保留尖峰 (/{SPIKES})", lambda r: str(r['spikes'])),
+        ("保留最大/最小值", lambda r: "✓" if r['extremes'] else "✗"),
+        ("內插平均誤差", lambda r: f"{r['error']:.4f}"),
+    ]
+    print(f"{'項目':<16}" + "".join(f"{name:>12}" for name in results))
+    for label, value in rows:
+        print(f"{label:<16}" + "".join(f"{value(r):>12}" for r in results.values()))
+
+if __name__ == "__main__":
+    main()
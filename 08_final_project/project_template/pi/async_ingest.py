@@ -0,0 +1,210 @@
+"""
+非同步資料收集模組
+在 FastAPI 的事件迴圈上接收 MQTT 訊息並寫入 MongoDB
+
+與 mqtt_subscriber.py 的差異：
+- 不另外開背景執行緒，MQTT 接收、驗證、寫入都是協程
+- 使用 aiomqtt（MQTT）和 motor（MongoDB）非同步套件
+- 有上限的佇列和固定數量的寫入協程，限制同時進行的寫入
+- 關閉時先把佇列中的資料寫完
+"""
+
+import asyncio
+import json
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+try:
+    import aiomqtt
+    from motor.motor_asyncio import AsyncIOMotorClient
+    ASYNC_AVAILABLE = True
+except ImportError:
+    ASYNC_AVAILABLE = False
+
+def validate_payload(payload) -> Optional[str]:
+    """
+    驗證訊息內容
+
+    Args:
+        payload: 解析後的 JSON 內容
+
+    Returns:
+        Optional[str]: 錯誤訊息，驗證通過時回傳 None
+    """
+    if not isinstance(payload, dict):
+        return "訊息內容必須是 JSON 物件"
+    if "device_id" not in payload:
+        return "缺少必要欄位: device_id"
+    return None
+
+class AsyncIngestService:
+    """非同步資料收集服務類別"""
+
+    def __init__(self, broker: str, port: int, topics: List[str],
+                 mongodb_uri: str, database_name: str, collection_name: str = "sensor_data",
+                 concurrency: int = 4, queue_size: int = 1000, batch_size: int = 50,
+                 reconnect_interval: float = 5.0):
+        """
+        初始化非同步資料收集服務
+
+        Args:
+            broker: MQTT Broker 位址
+            port: MQTT Broker 埠號
+            topics: 要訂閱的主題列表
+            mongodb_uri: MongoDB 連接字串
+            database_name: 資料庫名稱
+            collection_name: 集合名稱
+            concurrency: 寫入協程數量（同時進行的寫入上限）
+            queue_size: 待寫入佇列上限，滿了會暫停接收（背壓）
+            batch_size: 每次寫入最多筆數
+            reconnect_interval: MQTT 斷線後重新連接的間隔（秒）
+        """
+        if not ASYNC_AVAILABLE:
+            raise RuntimeError("需要安裝 aiomqtt 和 motor 才能使用非同步模式")
+
+        self.broker = broker
+        self.port = port
+        self.topics = topics
+        self.mongodb_uri = mongodb_uri
+        self.database_name = database_name
+        self.collection_name = collection_name
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.reconnect_interval = reconnect_interval
+
+        self.queue: Optional[asyncio.Queue] = None
+        self.queue_size = queue_size
+        self.mongo_client = None
+        self.collection = None
+        self.consumer_task: Optional[asyncio.Task] = None
+        self.writer_tasks: List[asyncio.Task] = []
+        self.is_connected = False
+
+        # 統計資訊
+        self.stats = {
+            "received": 0,
+            "saved": 0,
+            "invalid": 0,
+            "parse_errors": 0,
+            "save_errors": 0
+        }
+
+    async def start(self):
+        """在目前的事件迴圈上啟動接收與寫入協程"""
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.mongo_client = AsyncIOMotorClient(self.mongodb_uri)
+        self.collection = self.mongo_client[self.database_name][self.collection_name]
+
+        self.writer_tasks = [
+            asyncio.create_task(self._writer(), name=f"ingest_writer_{i}")
+            for i in range(self.concurrency)
+        ]
+        self.consumer_task = asyncio.create_task(self._consume(), name="ingest_consumer")
+        print(f"非同步資料收集已啟動（{self.concurrency} 個寫入協程）")
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        停止服務：先停止接收，再等佇列中的資料寫完
+
+        Args:
+            timeout: 等待寫完的最長秒數
+        """
+        if self.consumer_task:
+            self.consumer_task.cancel()
+            await asyncio.gather(self.consumer_task, return_exceptions=True)
+            self.consumer_task = None
+
+        if self.queue:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                print(f"✗ 關閉逾時，{self.queue.qsize()} 筆資料未寫入")
+
+        for task in self.writer_tasks:
+            task.cancel()
+        await asyncio.gather(*self.writer_tasks, return_exceptions=True)
+        self.writer_tasks = []
+
+        if self.mongo_client:
+            self.mongo_client.close()
+        print("非同步資料收集已停止")
+
+    async def _consume(self):
+        """接收 MQTT 訊息，斷線時自動重新連接"""
+        while True:
+            try:
+                async with aiomqtt.Client(self.broker, self.port) as client:
+                    async with client.messages() as messages:
+                        for topic in self.topics:
+                            await client.subscribe(topic)
+                        self.is_connected = True
+                        print(f"✓ MQTT 已連接到 {self.broker}:{self.port}")
+
+                        async for message in messages:
+                            await self._handle(message.topic.value, message.payload)
+            except aiomqtt.MqttError as e:
+                self.is_connected = False
+                print(f"✗ MQTT 連線中斷: {e}，{self.reconnect_interval} 秒後重新連接")
+                await asyncio.sleep(self.reconnect_interval)
+            except asyncio.CancelledError:
+                self.is_connected = False
+                raise
+
+    async def _handle(self, topic: str, raw_payload: bytes):
+        """解析、驗證訊息並放入待寫入佇列"""
+        self.stats["received"] += 1
+
+        try:
+            payload = json.loads(raw_payload)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            print(f"✗ JSON 解析失敗: {e}")
+            self.stats["parse_errors"] += 1
+            return
+
+        error = validate_payload(payload)
+        if error:
+            print(f"✗ 資料驗證失敗: {error}")
+            self.stats["invalid"] += 1
+            return
+
+        payload["saved_at"] = datetime.now()
+
+        # 佇列滿時在此等待，暫停讀取下一則訊息
+        await self.queue.put(payload)
+
+    async def _writer(self):
+        """寫入協程：一次取出佇列中現有的資料（最多 batch_size 筆）批次寫入"""
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            try:
+                result = await self.collection.insert_many(batch, ordered=False)
+                self.stats["saved"] += len(result.inserted_ids)
+            except BulkWriteError as e:
+                inserted = e.details.get("nInserted", 0)
+                print(f"✗ 批次寫入部分失敗: {len(batch) - inserted} 筆")
+                self.stats["saved"] += inserted
+                self.stats["save_errors"] += len(batch) - inserted
+            except Exception as e:
+                print(f"✗ 寫入資料失敗: {e}")
+                self.stats["save_errors"] += len(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def get_statistics(self) -> Dict:
+        """
+        取得統計資訊
+
+        Returns:
+            Dict: 統計資訊
+        """
+        return {
+            **self.stats,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "connected": self.is_connected
+        }
@@ -0,0 +1,134 @@
+"""
+資料收集效能測試
+比較 thread 模式（paho 背景執行緒 + pymongo）與 async 模式（aiomqtt + motor）
+收完 N 則 MQTT 訊息並寫入 MongoDB 所需的時間與 CPU 時間
+
+需要本機的 MQTT Broker 和 MongoDB：
+    python benchmark_ingest.py --mode thread --messages 5000
+    python benchmark_ingest.py --mode async --messages 5000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import paho.mqtt.client as mqtt
+from pymongo import MongoClient
+import config
+from async_ingest import AsyncIngestService
+from database import DatabaseManager
+from mqtt_subscriber import MQTTSubscriber
+
+BENCH_TOPIC = "benchmark/sensors/ingest"
+BENCH_DATABASE = "ingest_benchmark"
+
+def publish_messages(count: int):
+    """以 QoS 1 發布測試訊息"""
+    publisher = mqtt.Client(client_id="ingest_benchmark_publisher")
+    publisher.connect(config.MQTT_BROKER, config.MQTT_PORT, 60)
+    publisher.loop_start()
+
+    for i in range(count):
+        payload = {
+            "device_id": f"pico_{i % 20:03d}",
+            "timestamp": time.time(),
+            "data": {"temperature": 20 + (i % 100) / 10}
+        }
+        publisher.publish(BENCH_TOPIC, json.dumps(payload), qos=1)
+
+    publisher.loop_stop()
+    publisher.disconnect()
+
+def wait_for_count(collection, count: int, timeout: float) -> bool:
+    """等待集合中的資料筆數達到 count"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if collection.count_documents({}) >= count:
+            return True
+        time.sleep(0.05)
+    return False
+
+def run_thread_mode(count: int, timeout: float):
+    """thread 模式：與 main.py 預設行為相同"""
+    db = DatabaseManager(config.MONGODB_URI, BENCH_DATABASE)
+    db.connect()
+
+    subscriber = MQTTSubscriber(
+        broker=config.MQTT_BROKER,
+        port=config.MQTT_PORT,
+        topics=[BENCH_TOPIC],
+        on_message_callback=lambda topic, payload: db.insert_sensor_data(payload)
+    )
+    subscriber.start()
+    time.sleep(1)
+
+    publish_messages(count)
+    done = wait_for_count(db.collection, count, timeout)
+
+    subscriber.stop()
+    db.disconnect()
+    return done
+
+async def run_async_mode(count: int, timeout: float, concurrency: int):
+    """async 模式：與 INGEST_MODE=async 行為相同"""
+    service = AsyncIngestService(
+        broker=config.MQTT_BROKER,
+        port=config.MQTT_PORT,
+        topics=[BENCH_TOPIC],
+        mongodb_uri=config.MONGODB_URI,
+        database_name=BENCH_DATABASE,
+        concurrency=concurrency
+    )
+    await service.start()
+    await asyncio.sleep(1)
+
+    # 發布者是同步程式，放到執行緒中以免卡住事件迴圈
+    await asyncio.to_thread(publish_messages, count)
+
+    deadline = time.monotonic() + timeout
+    while service.stats["saved"] < count and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    await service.stop()
+    return service.stats["saved"] >= count
+
+def main():
+    parser = argparse.ArgumentParser(description='資料收集效能測試')
+    parser.add_argument('--mode', choices=['thread', 'async'], default='thread', help='收集模式')
+    parser.add_argument('--messages', type=int, default=5000, help='測試訊息數量')
+    parser.add_argument('--concurrency', type=int, default=config.INGEST_CONCURRENCY,
+                        help='async 模式的寫入協程數量')
+    parser.add_argument('--timeout', type=float, default=120, help='最長等待秒數')
+    args = parser.parse_args()
+
+    # 清空測試資料庫
+    cleanup = MongoClient(config.MONGODB_URI)
+    cleanup.drop_database(BENCH_DATABASE)
+
+    print("=" * 60)
+    print(f"資料收集效能測試（{args.mode} 模式，{args.messages} 則訊息）")
+    print("=" * 60)
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    if args.mode == 'thread':
+        done = run_thread_mode(args.messages, args.timeout)
+    else:
+        done = asyncio.run(run_async_mode(args.messages, args.timeout, args.concurrency))
+
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    stored = cleanup[BENCH_DATABASE]["sensor_data"].count_documents({})
+
+    print("-" * 60)
+    print(f"完成: {'是' if done else '否（逾時）'}，已寫入 {stored} 筆")
+    print(f"經過時間: {wall:.2f} 秒（{stored / wall:,.0f} 則/秒）")
+    print(f"CPU 時間: {cpu:.2f} 秒（每千則 {cpu / max(stored, 1) * 1000 * 1000:.1f} ms）")
+    print("=" * 60)
+
+    cleanup.drop_database(BENCH_DATABASE)
+    cleanup.close()
+
+if __name__ == "__main__":
+    main()
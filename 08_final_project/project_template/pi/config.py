@@ -11,6 +11,12 @@ load_dotenv()
 # API 設定
 API_PORT = int(os.getenv("API_PORT", "8000"))
 
+# 資料庫後端
+# mongodb: MongoDB（預設）
+# sqlite:  SQLite 檔案（WAL 模式），不需要執行 MongoDB，適合記憶體較少的 Pi
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "mongodb")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "student_project.db")
+
 # MongoDB 設定
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "student_project")
@@ -21,5 +27,13 @@ MQTT_BROKER = os.getenv("MQTT_BROKER", "localhost")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 MQTT_TOPICS = os.getenv("MQTT_TOPICS", "student/sensors/#").split(",")
 
+# 資料收集模式
+# thread: paho 背景執行緒 + pymongo（預設）
+# async:  在 FastAPI 事件迴圈上用 aiomqtt + motor 非同步收集
+INGEST_MODE = os.getenv("INGEST_MODE", "thread")
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "1000"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "50"))
+
 # 日誌設定
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
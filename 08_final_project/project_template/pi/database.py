@@ -23,6 +23,11 @@ class DatabaseManager:
         self.db = None
         self.collection = None
     
+    @property
+    def is_connected(self) -> bool:
+        """是否已連接到 MongoDB"""
+        return self.client is not None
+    
     def connect(self):
         """連接到 MongoDB"""
         try:
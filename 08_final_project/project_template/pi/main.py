@@ -4,13 +4,22 @@
 """
 
 import asyncio
+import os
+import sys
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from mqtt_subscriber import MQTTSubscriber
+from async_ingest import AsyncIngestService, validate_payload
 from database import DatabaseManager
+from sqlite_database import SQLiteDatabaseManager
 from models import SensorData, DeviceInfo
 import config
 
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../common'))
+
+from pipeline import Pipeline, FunctionStage, FunctionSink, StdoutSink
+
 # 初始化 FastAPI
 app = FastAPI(title="學生專題 API")
 
@@ -23,16 +32,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 初始化資料庫
-db = DatabaseManager(config.MONGODB_URI, config.DATABASE_NAME)
+# 初始化資料庫（DATABASE_BACKEND=sqlite 時使用 SQLite 檔案，不需要 MongoDB）
+if config.DATABASE_BACKEND == "sqlite":
+    db = SQLiteDatabaseManager(config.SQLITE_PATH)
+else:
+    db = DatabaseManager(config.MONGODB_URI, config.DATABASE_NAME)
 
-# 初始化 MQTT 訂閱者
+# 初始化 MQTT 訂閱者（thread 模式）或非同步資料收集服務（async 模式）
 mqtt_subscriber = None
+ingest_service = None
+
+def check_payload(payload):
+    """驗證訊息內容（與 async 模式使用相同規則）"""
+    error = validate_payload(payload)
+    if error:
+        raise ValueError(error)
+    return payload
+
+# thread 模式的資料收集流程：驗證 → 儲存 → 顯示
+ingest_pipeline = Pipeline(
+    "project_ingest",
+    stages=[FunctionStage("validate", check_payload)],
+    sinks=[
+        FunctionSink("mongodb", db.insert_sensor_data),
+        StdoutSink(lambda data: f"✓ 資料已儲存: {data.get('device_id')}（ID: {data.get('_id')}）")
+    ]
+)
 
 @app.on_event("startup")
 async def startup_event():
     """應用程式啟動時執行"""
-    global mqtt_subscriber
+    global mqtt_subscriber, ingest_service
     
     print("=" * 50)
     print("啟動學生專題服務")
@@ -40,17 +70,34 @@ async def startup_event():
     
     # 連接資料庫
     db.connect()
-    print(f"✓ 資料庫已連接: {config.DATABASE_NAME}")
+    print(f"✓ 資料庫已連接: {config.DATABASE_BACKEND}")
     
-    # 啟動 MQTT 訂閱者
-    mqtt_subscriber = MQTTSubscriber(
-        broker=config.MQTT_BROKER,
-        port=config.MQTT_PORT,
-        topics=config.MQTT_TOPICS,
-        on_message_callback=handle_mqtt_message
-    )
-    mqtt_subscriber.start()
-    print(f"✓ MQTT 訂閱已啟動: {config.MQTT_TOPICS}")
+    if config.INGEST_MODE == "async" and config.DATABASE_BACKEND == "sqlite":
+        print("⚠ async 模式使用 motor 寫入 MongoDB，SQLite 後端改用 thread 模式")
+    
+    if config.INGEST_MODE == "async" and config.DATABASE_BACKEND != "sqlite":
+        # 在目前的事件迴圈上啟動非同步資料收集
+        ingest_service = AsyncIngestService(
+            broker=config.MQTT_BROKER,
+            port=config.MQTT_PORT,
+            topics=config.MQTT_TOPICS,
+            mongodb_uri=config.MONGODB_URI,
+            database_name=config.DATABASE_NAME,
+            concurrency=config.INGEST_CONCURRENCY,
+            queue_size=config.INGEST_QUEUE_SIZE,
+            batch_size=config.INGEST_BATCH_SIZE
+        )
+        await ingest_service.start()
+    else:
+        # 啟動 MQTT 訂閱者
+        mqtt_subscriber = MQTTSubscriber(
+            broker=config.MQTT_BROKER,
+            port=config.MQTT_PORT,
+            topics=config.MQTT_TOPICS,
+            on_message_callback=handle_mqtt_message
+        )
+        mqtt_subscriber.start()
+    print(f"✓ MQTT 訂閱已啟動（{'async' if ingest_service else 'thread'} 模式）: {config.MQTT_TOPICS}")
     
     print("=" * 50)
     print(f"API 服務運行於: http://0.0.0.0:{config.API_PORT}")
@@ -61,6 +108,9 @@ async def shutdown_event():
     """應用程式關閉時執行"""
     if mqtt_subscriber:
         mqtt_subscriber.stop()
+    if ingest_service:
+        # 先把佇列中的資料寫完
+        await ingest_service.stop()
     db.disconnect()
     print("服務已關閉")
 
@@ -72,16 +122,7 @@ def handle_mqtt_message(topic, payload):
         topic: MQTT 主題
         payload: 訊息內容（dict）
     """
-    try:
-        print(f"收到訊息 - 主題: {topic}")
-        print(f"內容: {payload}")
-        
-        # 儲存到資料庫
-        result = db.insert_sensor_data(payload)
-        print(f"✓ 資料已儲存，ID: {result}")
-        
-    except Exception as e:
-        print(f"處理訊息時發生錯誤: {e}")
+    ingest_pipeline.run(payload)
 
 # API 端點
 
@@ -101,11 +142,23 @@ async def root():
 @app.get("/health")
 async def health_check():
     """健康檢查端點"""
-    return {
+    mqtt_connected = (
+        (mqtt_subscriber and mqtt_subscriber.is_connected)
+        or (ingest_service and ingest_service.is_connected)
+    )
+    
+    result = {
         "status": "healthy",
-        "database": "connected" if db.client else "disconnected",
-        "mqtt": "connected" if mqtt_subscriber and mqtt_subscriber.is_connected else "disconnected"
+        "database": "connected" if db.is_connected else "disconnected",
+        "mqtt": "connected" if mqtt_connected else "disconnected",
+        "ingest_mode": "async" if ingest_service else "thread",
+        "database_backend": config.DATABASE_BACKEND
     }
+    if ingest_service:
+        result["ingest"] = ingest_service.get_statistics()
+    else:
+        result["pipeline"] = ingest_pipeline.get_statistics()
+    return result
 
 @app.get("/api/data")
 async def get_all_data(limit: int = 100):
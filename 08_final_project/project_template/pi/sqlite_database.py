@@ -0,0 +1,155 @@
+"""
+SQLite 資料庫管理模組
+與 database.py 相同的介面，資料存在單一 SQLite 檔案（WAL 模式），不需要執行 MongoDB
+
+在 .env 設定 DATABASE_BACKEND=sqlite 即可使用（檔案位置為 SQLITE_PATH）
+連線、交易與讀數資料表見 common/sqlite_store.py（位於本儲存庫根目錄）
+"""
+
+import os
+import sys
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+# 加入共用模組路徑
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../common'))
+
+from sqlite_store import SQLiteStore, ReadingTable
+
+class SQLiteDatabaseManager:
+    """SQLite 資料庫管理類別"""
+
+    def __init__(self, path: str):
+        """
+        初始化資料庫管理器
+
+        Args:
+            path: SQLite 檔案路徑
+        """
+        self.path = path
+        self.store = None
+        self.collection = None
+
+    @property
+    def is_connected(self) -> bool:
+        """資料庫是否已開啟"""
+        return self.store is not None
+
+    def connect(self):
+        """開啟 SQLite 資料庫（檔案不存在時建立資料表與索引）"""
+        try:
+            self.store = SQLiteStore(self.path)
+            self.collection = ReadingTable(self.store, "sensor_data")
+            print(f"✓ 已開啟 SQLite 資料庫: {self.path}（WAL 模式）")
+        except Exception as e:
+            print(f"✗ SQLite 資料庫開啟失敗: {e}")
+            raise
+
+    def disconnect(self):
+        """關閉資料庫"""
+        if self.store:
+            self.store.close()
+            self.store = None
+            print("SQLite 資料庫已關閉")
+
+    @staticmethod
+    def _serialize(doc: Dict) -> Dict:
+        """_id 轉為字串（與 MongoDB 版本的回應格式相同）"""
+        doc["_id"] = str(doc["_id"])
+        return doc
+
+    def insert_sensor_data(self, data: Dict[str, Any]) -> str:
+        """
+        插入感測器資料
+
+        Args:
+            data: 感測器資料字典（timestamp 會轉成 datetime，沒有時填入目前時間）
+
+        Returns:
+            str: 插入資料的 ID
+        """
+        try:
+            # 加入儲存時間
+            data["saved_at"] = datetime.now()
+
+            return str(self.collection.insert_one(data))
+        except Exception as e:
+            print(f"插入資料失敗: {e}")
+            raise
+
+    def get_all_data(self, limit: int = 100) -> List[Dict]:
+        """
+        取得所有資料
+
+        Args:
+            limit: 回傳資料筆數限制
+
+        Returns:
+            List[Dict]: 資料列表
+        """
+        try:
+            return [self._serialize(doc) for doc in self.collection.find(limit=limit)]
+        except Exception as e:
+            print(f"查詢資料失敗: {e}")
+            raise
+
+    def get_device_data(self, device_id: str, limit: int = 50) -> List[Dict]:
+        """
+        取得特定裝置的資料
+
+        Args:
+            device_id: 裝置 ID
+            limit: 回傳資料筆數限制
+
+        Returns:
+            List[Dict]: 資料列表
+        """
+        try:
+            docs = self.collection.find({"device_id": device_id}, limit=limit)
+            return [self._serialize(doc) for doc in docs]
+        except Exception as e:
+            print(f"查詢裝置資料失敗: {e}")
+            raise
+
+    def get_device_list(self) -> List[Dict]:
+        """
+        取得所有裝置列表（與 MongoDB 版本的 $group 相同：最後資料時間與筆數）
+
+        Returns:
+            List[Dict]: 裝置資訊列表
+        """
+        try:
+            return self.collection.device_summary()
+        except Exception as e:
+            print(f"查詢裝置列表失敗: {e}")
+            raise
+
+    def clear_all_data(self) -> int:
+        """
+        清除所有資料
+
+        Returns:
+            int: 刪除的資料筆數
+        """
+        try:
+            return self.collection.delete()
+        except Exception as e:
+            print(f"清除資料失敗: {e}")
+            raise
+
+    def get_latest_data(self, device_id: str) -> Optional[Dict]:
+        """
+        取得裝置的最新資料
+
+        Args:
+            device_id: 裝置 ID
+
+        Returns:
+            Optional[Dict]: 最新資料，如果沒有則回傳 None
+        """
+        try:
+            doc = self.collection.find_one({"device_id": device_id})
+            return self._serialize(doc) if doc else None
+        except Exception as e:
+            print(f"查詢最新資料失敗: {e}")
+            raise
@@ -0,0 +1,129 @@
+"""
+非同步 API 的資料庫存取模組
+FastAPI 的 async def 端點中，把阻塞的 PyMongo / SQLite 呼叫交給有上限的執行緒池執行
+
+以前端點都宣告為 async def，卻直接呼叫同步的 PyMongo：
+一個慢的聚合查詢執行期間整個事件迴圈停住，同時進來的請求（包括 /health）全部要等它結束
+
+做法：
+- run_db(): 一般查詢（find_one、分頁、最新讀數、ping），在一般執行緒池執行
+- run_heavy(): 聚合、統計、匯出等耗時查詢，在另一個較小的執行緒池執行；
+  耗時查詢再多也只會佔用自己的執行緒，一般查詢與健康檢查不需要排在它們後面
+- 兩個執行緒池的大小合計不超過 MongoClient 的連線池（見 mongo_pool.py），
+  超過上限的請求在事件迴圈中等待，不會建立更多執行緒或連線
+
+沒有改用非同步驅動程式（Motor）：統計彙總、最新讀數、分頁、SQLite 後端等共用模組都是同步的，
+Motor 本身也是以執行緒池包裝 PyMongo，直接把共用模組的呼叫交給執行緒池即可沿用全部的查詢程式
+
+使用方式：
+    from async_db import run_db, run_heavy, shutdown_executors
+
+    @app.get("/api/latest")
+    async def get_latest(device_id: str):
+        return await run_db(collection.find_one, {"device_id": device_id})
+
+    @app.get("/api/statistics")
+    async def get_statistics():
+        return await run_heavy(summarize, rollups, collection, {}, "stored_at")
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        shutdown_executors()
+
+環境變數：
+    DB_EXECUTOR_WORKERS     一般查詢的執行緒數（預設 8）
+    DB_HEAVY_WORKERS        耗時查詢的執行緒數（預設 2）
+    DB_OFFLOAD              設為 0 時直接在事件迴圈中執行（只用於效能比較）
+"""
+
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+# ============================================================================
+# 預設設定
+# ============================================================================
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+DB_EXECUTOR_WORKERS = _env_int("DB_EXECUTOR_WORKERS", 8)
+DB_HEAVY_WORKERS = _env_int("DB_HEAVY_WORKERS", 2)
+DB_OFFLOAD = os.environ.get("DB_OFFLOAD", "1") != "0"
+
+LANE_DEFAULT = "db"
+LANE_HEAVY = "db_heavy"
+
+_LANE_WORKERS = {
+    LANE_DEFAULT: DB_EXECUTOR_WORKERS,
+    LANE_HEAVY: DB_HEAVY_WORKERS,
+}
+
+# ============================================================================
+# 執行緒池
+# ============================================================================
+
+_lock = threading.Lock()
+_executors: Dict[str, ThreadPoolExecutor] = {}
+
+def _reset_after_fork():
+    """子程序不能使用父程序的執行緒，清空快取（第一次使用時重新建立）"""
+    global _lock
+    _lock = threading.Lock()
+    _executors.clear()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_executor(lane: str = LANE_DEFAULT) -> ThreadPoolExecutor:
+    """取得（第一次使用時建立）指定用途的執行緒池"""
+    executor = _executors.get(lane)
+    if executor is None:
+        with _lock:
+            executor = _executors.get(lane)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=_LANE_WORKERS[lane],
+                                              thread_name_prefix=lane)
+                _executors[lane] = executor
+    return executor
+
+def shutdown_executors(wait: bool = True):
+    """關閉所有執行緒池（API 關閉時呼叫；之後再使用會重新建立）"""
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+# ============================================================================
+# 執行
+# ============================================================================
+
+async def run_in_lane(lane: str, func: Callable, *args, **kwargs) -> Any:
+    """
+    在指定的執行緒池執行阻塞的函式，並等待結果（不阻塞事件迴圈）
+
+    參數:
+        lane: 執行緒池（LANE_DEFAULT 或 LANE_HEAVY）
+        func: 阻塞的函式（例如 collection.find_one）
+        *args, **kwargs: 傳給 func 的參數
+
+    返回:
+        func 的回傳值；func 拋出的例外會在 await 時拋出
+    """
+    if not DB_OFFLOAD:
+        return func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(lane), functools.partial(func, *args, **kwargs))
+
+async def run_db(func: Callable, *args, **kwargs) -> Any:
+    """在一般查詢的執行緒池執行（見 run_in_lane）"""
+    return await run_in_lane(LANE_DEFAULT, func, *args, **kwargs)
+
+async def run_heavy(func: Callable, *args, **kwargs) -> Any:
+    """在耗時查詢的執行緒池執行（聚合、統計、匯出；見 run_in_lane）"""
+    return await run_in_lane(LANE_HEAVY, func, *args, **kwargs)
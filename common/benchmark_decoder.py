@@ -0,0 +1,97 @@
+"""
+訊息解碼效能測試
+比較原本的解析流程與 SensorDecoder 每秒可處理的訊息數（單一執行緒 = 單一核心）
+
+原本的流程：
+    payload.decode('utf-8') → json.loads → 逐欄位驗證 → data.copy()
+
+SensorDecoder：
+    decode(payload bytes) → SensorReading → to_document()
+
+執行方式：
+    python benchmark_decoder.py
+    python benchmark_decoder.py --messages 500000
+"""
+
+import argparse
+import json
+import time
+from sensor_decoder import SensorDecoder, SENSOR_RANGES, PayloadError
+
+def make_payloads(count: int) -> list:
+    """建立模擬的 MQTT payload（bytes）"""
+    payloads = []
+    for i in range(count):
+        payloads.append(json.dumps({
+            "device_id": f"pico_{i % 50:03d}",
+            "device_type": "pico_w",
+            "sensor_type": "temperature" if i % 2 else "humidity",
+            "value": 20 + (i % 100) / 10,
+            "unit": "celsius" if i % 2 else "percent",
+            "location": "classroom_a",
+            "timestamp": 1704974422 + i
+        }).encode('utf-8'))
+    return payloads
+
+def legacy_path(payload: bytes):
+    """原本各服務的做法"""
+    data = json.loads(payload.decode('utf-8'))
+
+    for field in ('device_id', 'sensor_type', 'value'):
+        if field not in data:
+            return None
+    if not isinstance(data['value'], (int, float)):
+        return None
+    if data['sensor_type'] == 'temperature':
+        if data['value'] < -50 or data['value'] > 100:
+            return None
+
+    return data.copy()
+
+def measure(func, payloads: list) -> float:
+    """執行一輪並回傳經過秒數"""
+    start = time.perf_counter()
+    for payload in payloads:
+        func(payload)
+    return time.perf_counter() - start
+
+def report(name: str, elapsed: float, count: int) -> float:
+    """列印結果並回傳每秒訊息數"""
+    rate = count / elapsed
+    print(f"{name:<16} {elapsed:8.3f} 秒  {rate:12,.0f} 則/秒  {elapsed / count * 1e6:6.2f} µs/則")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description='訊息解碼效能測試')
+    parser.add_argument('--messages', type=int, default=200000, help='測試訊息數量')
+    parser.add_argument('--repeat', type=int, default=5, help='重複次數（取最快的一次）')
+    args = parser.parse_args()
+
+    payloads = make_payloads(args.messages)
+    decoder = SensorDecoder(ranges=SENSOR_RANGES)   # 與原本的流程相同，檢查範圍
+
+    def decoder_path(payload: bytes):
+        try:
+            return decoder.decode(payload).to_document()
+        except PayloadError:
+            return None
+
+    print("=" * 60)
+    print(f"訊息解碼效能測試（{args.messages} 則訊息，單一執行緒）")
+    print("=" * 60)
+
+    # 兩種做法交替執行，減少系統負載變化造成的誤差
+    legacy_times, decoder_times = [], []
+    for _ in range(args.repeat):
+        legacy_times.append(measure(legacy_path, payloads))
+        decoder_times.append(measure(decoder_path, payloads))
+
+    legacy = report("原本流程", min(legacy_times), len(payloads))
+    decoded = report("SensorDecoder", min(decoder_times), len(payloads))
+
+    print("-" * 60)
+    print(f"差異: {decoded / legacy:.2f}x")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
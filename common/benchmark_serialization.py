@@ -0,0 +1,140 @@
+"""
+查詢結果序列化效能測試
+比較 API 把 1,000 / 10,000 筆文件轉成 JSON 回應所需的 CPU 時間（單一執行緒）
+
+原本的流程：
+    逐筆 doc['_id'] = str(...)、isoformat() → response_model 驗證（pydantic）→
+    jsonable_encoder → json.dumps（FastAPI 的 JSONResponse）
+
+serialization.dumps：
+    原始文件直接編碼（ObjectId、datetime 在編碼時轉換）→ Response(bytes)
+
+serialization.dumps + projection：
+    同上，文件只包含 projection 選取的欄位（fields=device_id,value,stored_at）
+
+文件在記憶體中產生，不需要 MongoDB；只量測序列化，不包含查詢時間
+
+執行方式：
+    python benchmark_serialization.py
+    python benchmark_serialization.py --rows 1000 10000 50000 --repeat 10
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from serialization import dumps, orjson
+
+# ============================================================================
+# 測試資料
+# ============================================================================
+
+PROJECTED_FIELDS = ("_id", "device_id", "value", "stored_at")
+
+class QueryResponse(BaseModel):
+    """與 05 api_server 的 response_model 相同"""
+    status: str
+    count: int
+    data: List[dict]
+    message: Optional[str] = None
+    next_cursor: Optional[str] = None
+
+def make_documents(count: int) -> list:
+    """建立模擬的 sensor_readings 文件（與 mqtt_to_db 寫入的欄位相同）"""
+    start = datetime(2025, 1, 1)
+    return [{
+        "_id": ObjectId(),
+        "device_id": f"pico_{i % 50:03d}",
+        "device_type": "pico_w",
+        "sensor_type": "temperature" if i % 2 else "humidity",
+        "value": 20 + (i % 100) / 10,
+        "unit": "celsius" if i % 2 else "percent",
+        "location": "classroom_a",
+        "timestamp": 1735660800 + i,
+        "mqtt_topic": "sensors/pico_001/temperature",
+        "stored_at": start + timedelta(seconds=i)
+    } for i in range(count)]
+
+# ============================================================================
+# 序列化方式
+# ============================================================================
+
+def legacy_path(docs: list) -> bytes:
+    """原本的做法（逐筆修改 → response_model 驗證 → jsonable_encoder → json.dumps）"""
+    data = []
+    for doc in docs:
+        doc['_id'] = str(doc['_id'])
+        if 'stored_at' in doc and isinstance(doc['stored_at'], datetime):
+            doc['stored_at'] = doc['stored_at'].isoformat()
+        data.append(doc)
+    response = QueryResponse(status="success", count=len(data), data=data, message="ok")
+    content = jsonable_encoder(response.model_dump())
+    return json.dumps(content, ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+def dumps_path(docs: list) -> bytes:
+    """serialization.dumps（原始文件直接編碼）"""
+    return dumps({"status": "success", "count": len(docs), "data": docs,
+                  "message": "ok", "next_cursor": None})
+
+# ============================================================================
+# 量測
+# ============================================================================
+
+def measure(func, docs: list, repeat: int, fresh: bool) -> float:
+    """
+    取多次執行中最少的 CPU 時間（秒）
+
+    參數:
+        fresh: 每次都使用新的文件副本（原本的做法會修改文件）
+    """
+    best = None
+    for _ in range(repeat):
+        batch = [dict(doc) for doc in docs] if fresh else docs
+        start = time.process_time()
+        func(batch)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def report(name: str, elapsed: float, rows: int, baseline: float) -> None:
+    per_1000 = elapsed / rows * 1000 * 1e3
+    print(f"  {name:<26} {elapsed * 1e3:9.2f} ms  {per_1000:7.2f} ms/千筆  {baseline / elapsed:6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description='查詢結果序列化效能測試')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000], help='每次回應的筆數')
+    parser.add_argument('--repeat', type=int, default=5, help='重複次數（取最快的一次）')
+    args = parser.parse_args()
+
+    print("=" * 68)
+    print(f"查詢結果序列化效能測試（CPU 時間，JSON 編碼器: {'orjson' if orjson else 'json'}）")
+    print("=" * 68)
+
+    for rows in args.rows:
+        docs = make_documents(rows)
+        projected = [{field: doc[field] for field in PROJECTED_FIELDS} for doc in docs]
+
+        # 輸出內容相同（欄位順序與格式）
+        assert json.loads(legacy_path([dict(doc) for doc in docs]))["data"] == \
+            json.loads(dumps_path(docs))["data"]
+
+        legacy = measure(legacy_path, docs, args.repeat, fresh=True)
+        direct = measure(dumps_path, docs, args.repeat, fresh=False)
+        narrow = measure(dumps_path, projected, args.repeat, fresh=False)
+
+        print(f"\n{rows:,} 筆：")
+        report("原本流程", legacy, rows, legacy)
+        report("serialization.dumps", direct, rows, legacy)
+        report("dumps + projection (3 欄位)", narrow, rows, legacy)
+
+    print("=" * 68)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+已結束時間區間的快取模組
+圖表與歷史資料依固定區間（例如每小時）組成，只有目前的區間還會有新資料，
+已經結束的區間計算一次之後保存，之後的請求只重新查詢目前的區間
+
+以前圖表每次刷新都重新查詢整個時間範圍（24 小時的圖表每次 24 個區間），
+其中 23 個區間的結果與上次完全相同
+
+查詢範圍拆成三段：
+- 開頭不滿一個區間的部分（例如「最近 24 小時」的起點在整點之間）：每次查詢
+- 完整且已經結束的區間：從快取讀取，沒有的才查詢（相鄰的合併成一次查詢）並保存
+- 目前的區間（與結束時間所在、不完整的區間）：每次查詢
+三段中需要查詢的相鄰範圍合併成一次查詢，快取完整時每次請求只有頭尾兩個小查詢
+
+區間結束後再等 BUCKET_CACHE_SETTLE 秒才視為已結束（寫入中的讀數還沒有出現在查詢結果）；
+沒有資料的區間也會保存，不會每次重新查詢
+
+讀數時間由裝置提供、可能補寫舊資料時（離線暫存重送），以 max_age 限制保存時間，
+補寫的讀數最多延遲 max_age 反映；時間由伺服器寫入時（stored_at）不需要設定
+
+使用方式：
+    from bucket_cache import BucketCache, group_by_bucket
+
+    buckets = BucketCache()
+
+    def fetch(start, end):
+        # 回傳 {區間起點: 值}；end 為 None 表示到現在
+        return {p["start"]: p for p in series(rollups, raw, match, "stored_at", start, 3600, end)}
+
+    points = buckets.get(("timeseries", device_id), cutoff, 3600, fetch)   # [(區間起點, 值)]
+
+保存的值由多個請求共用，呼叫端不可以修改
+
+環境變數：
+    BUCKET_CACHE_MAX_ENTRIES    保存的區間數上限（預設 4096，超過時淘汰最久沒有使用的）
+    BUCKET_CACHE_SETTLE         區間結束後多久視為已結束（秒，預設 120）
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from rollups import ceil_time, floor_time
+
+# ============================================================================
+# 預設設定
+# ============================================================================
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+BUCKET_CACHE_MAX_ENTRIES = _env_int("BUCKET_CACHE_MAX_ENTRIES", 4096)
+BUCKET_CACHE_SETTLE = _env_int("BUCKET_CACHE_SETTLE", 120)
+
+# 查詢函式：(開始, 結束或 None) → {區間起點: 值}
+Fetch = Callable[[datetime, Optional[datetime]], Dict[datetime, Any]]
+
+# ============================================================================
+# 快取
+# ============================================================================
+
+class BucketCache:
+    """
+    已結束區間的快取（LRU；可以在多個執行緒中使用，查詢時不持有鎖）
+
+    每個 API 程序各自一份，同一個區間在兩個請求同時缺少時可能查詢兩次，結果相同
+    """
+
+    def __init__(self, max_entries: int = BUCKET_CACHE_MAX_ENTRIES,
+                 settle_seconds: int = BUCKET_CACHE_SETTLE,
+                 max_age: Optional[float] = None,
+                 clock: Callable[[], datetime] = datetime.now):
+        """
+        參數:
+            max_entries: 保存的區間數上限
+            settle_seconds: 區間結束後多久視為已結束（秒）
+            max_age: 保存的區間多久後重新查詢（秒）；None 表示一直保存
+            clock: 目前時間（與讀數相同的本機時間）
+        """
+        self.max_entries = max_entries
+        self.settle = timedelta(seconds=settle_seconds)
+        self.max_age = timedelta(seconds=max_age) if max_age is not None else None
+        self.clock = clock
+        self._entries: "OrderedDict[Tuple, Tuple[Any, datetime]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "queries": 0, "evictions": 0}
+
+    # ---------------------------------------------------------------- 保存
+
+    def _lookup(self, key: Tuple, now: datetime) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, stored_at = entry
+            if self.max_age is not None and stored_at + self.max_age <= now:
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def _store(self, items: Iterable[Tuple[Tuple, Any]], now: datetime):
+        with self._lock:
+            for key, value in items:
+                self._entries[key] = (value, now)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        """清空快取（例如刪除資料之後）"""
+        with self._lock:
+            self._entries.clear()
+
+    # ---------------------------------------------------------------- 查詢
+
+    def get(self, key: Hashable, start: datetime, bucket_seconds: int, fetch: Fetch,
+            end: Optional[datetime] = None) -> List[Tuple[datetime, Any]]:
+        """
+        取得時間範圍內每個區間的值（已結束的區間讀取快取）
+
+        區間以 1970-01-01 起算對齊（與 rollups.series 相同）
+
+        參數:
+            key: 查詢的識別（例如 ("timeseries", 裝置 ID)；不同的條件必須使用不同的 key）
+            start: 開始時間
+            bucket_seconds: 區間長度（秒）
+            fetch: 查詢函式 (開始, 結束或 None) → {區間起點: 值}；
+                回傳範圍內有資料的區間，區間起點不在範圍內時以範圍開始時間所在的區間為準
+            end: 結束時間（不包含；None 表示到現在）
+
+        返回:
+            依時間排序的 [(區間起點, 值)]（沒有資料的區間省略）
+        """
+        now = self.clock()
+        first = ceil_time(start, bucket_seconds)
+        # 已結束的完整區間：first <= 區間起點 < limit
+        limit = floor_time(now - self.settle, bucket_seconds)
+        if end is not None:
+            limit = min(limit, floor_time(end, bucket_seconds))
+
+        step = timedelta(seconds=bucket_seconds)
+        values: Dict[datetime, Any] = {}
+        missing: List[datetime] = []
+        hits = 0
+        # 需要查詢的範圍 [開始, 結束)，結束為 None 表示到現在
+        ranges: List[List[Optional[datetime]]] = []
+
+        def need(range_start: datetime, range_end: Optional[datetime]):
+            if ranges and ranges[-1][1] == range_start:
+                ranges[-1][1] = range_end
+            else:
+                ranges.append([range_start, range_end])
+
+        if first >= limit:
+            need(start, end)
+        else:
+            if start < first:
+                need(start, first)
+            slot = first
+            while slot < limit:
+                found, value = self._lookup((key, bucket_seconds, slot), now)
+                if found:
+                    values[slot] = value
+                    hits += 1
+                else:
+                    missing.append(slot)
+                    need(slot, slot + step)
+                slot += step
+            if end is None or limit < end:
+                need(limit, end)
+
+        with self._lock:
+            self.stats["hits"] += hits
+            self.stats["misses"] += len(missing)
+            self.stats["queries"] += len(ranges)
+        fetched: Dict[datetime, Any] = {}
+        for range_start, range_end in ranges:
+            fetched.update(fetch(range_start, range_end))
+        values.update(fetched)
+
+        if missing:
+            self._store((((key, bucket_seconds, slot), fetched.get(slot)) for slot in missing), now)
+        return [(slot, values[slot]) for slot in sorted(values) if values[slot] is not None]
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """命中率統計（以區間計算）"""
+        total = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / total, 4) if total else None,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+        }
+
+# ============================================================================
+# 原始讀數
+# ============================================================================
+
+def group_by_bucket(documents: Iterable[Dict], time_field: str,
+                    bucket_seconds: int) -> Dict[datetime, List[Dict]]:
+    """依時間排序的讀數分到各區間（查詢函式回傳原始讀數時使用）"""
+    buckets: Dict[datetime, List[Dict]] = {}
+    for doc in documents:
+        buckets.setdefault(floor_time(doc[time_field], bucket_seconds), []).append(doc)
+    return buckets
+
+def flatten(buckets: List[Tuple[datetime, List[Dict]]]) -> List[Dict]:
+    """各區間的讀數合併成依時間排序的列表"""
+    return [doc for _, documents in buckets for doc in documents]
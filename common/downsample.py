@@ -0,0 +1,213 @@
+"""
+圖表降採樣模組
+圖表端點回傳的點數超過畫面能顯示的像素時，在伺服器端挑出代表的點再回傳
+
+以前 /api/chart 回傳時間範圍內全部的讀數：每 5 秒一筆的裝置 6 小時約 4,300 點，
+圖表寬度只有幾百像素，多出來的點只增加傳輸量與瀏覽器繪圖時間；
+直接每 N 點取一點又會漏掉尖峰
+
+方法：
+- lttb（Largest-Triangle-Three-Buckets）：依序在每個區段選出與前一個選取點、
+  下一區段平均點構成最大三角形面積的點，保留曲線的形狀（預設）
+- minmax: 時間範圍依像素分成等寬的區段，每個區段保留最小與最大值，
+  尖峰、最大與最小值一定保留（適合需要顯示極值的圖表）
+兩種方法都保留第一點與最後一點，回傳的點數不超過 max_points
+
+有安裝 NumPy 時以陣列運算（時間轉換、區段平均點、每個區段的最小/最大值一次算完），
+否則使用 Python 迴圈（結果相同）；LTTB 每個點的選擇取決於前一個選取的點，選點本身依序計算
+
+使用方式：
+    from downsample import downsample
+
+    points = downsample(readings, max_points=600)                  # LTTB
+    points = downsample(readings, max_points=600, method="minmax")
+"""
+
+import math
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# ============================================================================
+# 預設設定
+# ============================================================================
+
+METHOD_LTTB = "lttb"
+METHOD_MINMAX = "minmax"
+METHODS = (METHOD_LTTB, METHOD_MINMAX)
+
+MIN_POINTS = 4      # 第一點、最後一點與至少一個區段的兩個點
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def _all_numbers(values: Sequence) -> bool:
+    """全部都是有限的 int / float（不含布林值）；逐一呼叫 _is_number 太慢，先比對型別"""
+    return set(map(type, values)) <= {int, float} and all(map(math.isfinite, values))
+
+def _elapsed_seconds(timestamps: Sequence):
+    """時間換算成距離第一點的秒數（以第一點為原點，累加時不損失精度）"""
+    first = timestamps[0]
+    if isinstance(first, datetime):
+        # 轉成 datetime64 陣列要逐一換算，比直接相減慢
+        seconds = [(t - first).total_seconds() for t in timestamps]
+    else:
+        seconds = [float(t) - float(first) for t in timestamps]
+    return np.asarray(seconds, dtype=float) if np is not None else seconds
+
+# ============================================================================
+# LTTB
+# ============================================================================
+
+def _lttb_edges(size: int, max_points: int) -> List[int]:
+    """中間的點（不含第一點與最後一點）分成 max_points - 2 個區段的邊界"""
+    buckets = max_points - 2
+    width = (size - 2) / buckets
+    return [1 + int(i * width) for i in range(buckets)] + [size - 1]
+
+def _bucket_averages(x, y, edges: List[int]):
+    """每個區段的平均點（區段為 edges 相鄰兩個邊界之間）"""
+    if np is not None:
+        starts = np.array(edges[:-1])
+        counts = np.diff(edges)
+        return ((np.add.reduceat(x[:edges[-1]], starts) / counts).tolist(),
+                (np.add.reduceat(y[:edges[-1]], starts) / counts).tolist())
+    avg_x, avg_y = [], []
+    for start, end in zip(edges, edges[1:]):
+        avg_x.append(sum(x[start:end]) / (end - start))
+        avg_y.append(sum(y[start:end]) / (end - start))
+    return avg_x, avg_y
+
+def _lttb(x, y, max_points: int) -> List[int]:
+    """
+    每個點的選擇取決於前一個選取的點，只能依序計算；
+    區段的平均點事先一次算完，迴圈中只比較區段內每個點的三角形面積
+    """
+    size = len(x)
+    edges = _lttb_edges(size, max_points)
+    avg_x, avg_y = _bucket_averages(x, y, edges)
+    if np is not None:
+        x, y = x.tolist(), y.tolist()
+    # 每個區段使用下一區段的平均點，最後一個區段使用最後一點
+    avg_x = avg_x[1:] + [x[-1]]
+    avg_y = avg_y[1:] + [y[-1]]
+
+    selected = [0]
+    px, py = x[0], y[0]
+    for i in range(len(edges) - 1):
+        ax, ay = avg_x[i], avg_y[i]
+        best, best_area = edges[i], -1.0
+        for j in range(edges[i], edges[i + 1]):
+            area = abs((px - ax) * (y[j] - py) - (px - x[j]) * (ay - py))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        px, py = x[best], y[best]
+    selected.append(size - 1)
+    return selected
+
+# ============================================================================
+# 最小/最大值
+# ============================================================================
+
+def _minmax_numpy(x, y, max_points: int) -> List[int]:
+    size = len(x)
+    bins = max((max_points - 2) // 2, 1)
+    edges = np.linspace(x[0], x[-1], bins + 1)
+    bin_ids = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, bins - 1)
+
+    # 依（區段, 數值）排序，每個區段的第一個是最小值；數值取負號排序則是最大值
+    by_min = np.lexsort((y, bin_ids))
+    by_max = np.lexsort((-y, bin_ids))
+    _, first_min = np.unique(bin_ids[by_min], return_index=True)
+    _, first_max = np.unique(bin_ids[by_max], return_index=True)
+    selected = np.concatenate(([0, size - 1], by_min[first_min], by_max[first_max]))
+    return np.unique(selected).tolist()
+
+def _minmax_python(x: List[float], y: List[float], max_points: int) -> List[int]:
+    size = len(x)
+    bins = max((max_points - 2) // 2, 1)
+    span = (x[-1] - x[0]) / bins
+    extremes: Dict[int, List[int]] = {}
+    for i in range(size):
+        bin_id = min(int((x[i] - x[0]) / span), bins - 1) if span > 0 else 0
+        current = extremes.get(bin_id)
+        if current is None:
+            extremes[bin_id] = [i, i]
+            continue
+        if y[i] < y[current[0]]:
+            current[0] = i
+        if y[i] > y[current[1]]:
+            current[1] = i
+    selected = {0, size - 1}
+    for low, high in extremes.values():
+        selected.update((low, high))
+    return sorted(selected)
+
+# ============================================================================
+# 降採樣
+# ============================================================================
+
+def downsample_indices(timestamps: Sequence, values: Sequence[float], max_points: int,
+                       method: str = METHOD_LTTB) -> List[int]:
+    """
+    選出代表的點
+
+    參數:
+        timestamps: 依時間排序的時間（datetime 或秒數）
+        values: 數值
+        max_points: 最多回傳的點數（至少 MIN_POINTS）
+        method: METHOD_LTTB 或 METHOD_MINMAX
+
+    返回:
+        List[int]: 選出的點的索引（由小到大）
+    """
+    if method not in METHODS:
+        raise ValueError(f"不支援的降採樣方法: {method}（可用: {', '.join(METHODS)}）")
+    size = len(values)
+    max_points = max(max_points, MIN_POINTS)
+    if size <= max_points:
+        return list(range(size))
+
+    x = _elapsed_seconds(timestamps)
+    if np is not None:
+        y = np.asarray(values, dtype=float)
+        pick = _lttb if method == METHOD_LTTB else _minmax_numpy
+    else:
+        y = [float(v) for v in values]
+        pick = _lttb if method == METHOD_LTTB else _minmax_python
+    return pick(x, y, max_points)
+
+def downsample(points: List[Dict], max_points: Optional[int], method: str = METHOD_LTTB,
+               time_field: str = "timestamp", value_field: str = "value") -> List[Dict]:
+    """
+    降採樣讀數列表
+
+    數值不是數字的讀數（布林值、字串、缺少數值）無法計算，降採樣時略過
+
+    參數:
+        points: 依時間排序的讀數
+        max_points: 最多回傳的點數；None 或 0 表示不降採樣
+        method: METHOD_LTTB 或 METHOD_MINMAX
+        time_field: 時間欄位
+        value_field: 數值欄位
+
+    返回:
+        List[Dict]: 選出的讀數（原本的物件，依時間排序）
+    """
+    if method not in METHODS:
+        raise ValueError(f"不支援的降採樣方法: {method}（可用: {', '.join(METHODS)}）")
+    if not max_points or len(points) <= max_points:
+        return points
+    times = [p.get(time_field) for p in points]
+    values = [p.get(value_field) for p in points]
+    if not _all_numbers(values) or None in times:
+        points = [p for p, t, v in zip(points, times, values) if t is not None and _is_number(v)]
+        times = [p[time_field] for p in points]
+        values = [p[value_field] for p in points]
+    indices = downsample_indices(times, values, max_points, method)
+    return [points[i] for i in indices]
@@ -0,0 +1,284 @@
+"""
+索引登記模組
+每個集合需要的索引集中登記在 INDEXES，各服務啟動時呼叫 ensure_indexes() 建立
+（create_index 對已存在、設定相同的索引不做任何事，重複執行沒有影響）
+
+API 服務實際送出的查詢形狀登記在 QUERY_SHAPES，
+index_report.py 會用 explain() 檢查每個查詢是否使用索引
+
+新增查詢或索引時：
+1. 在 QUERY_SHAPES 加入查詢（篩選欄位與排序）
+2. 在 INDEXES 加入對應的索引
+3. 執行 python index_report.py --apply 確認沒有全集合掃描
+
+設計原則：
+- 複合索引以「等值篩選欄位 → 排序/範圍欄位」排列（例如 device_id, timestamp）
+- 前綴相同的單欄索引是多餘的（device_id 可以使用 device_id + timestamp 索引）
+- 時間降冪索引同時支援升冪排序（反向掃描）
+- 分頁查詢以（時間, _id）排序，索引以 _id 結尾，游標條件與排序都能直接使用索引（見 pagination.py）
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from pagination import keyset_filter, keyset_sort
+
+# ============================================================================
+# 索引登記
+# ============================================================================
+
+# 集合名稱 → 索引列表；每個索引是 create_index 的參數：
+#   {"key": [(欄位, 方向), ...], 其他選項（unique、partialFilterExpression...）}
+# 不指定名稱，使用 MongoDB 預設名稱（例如 device_id_1_timestamp_-1），與舊版服務建立的索引相同
+INDEXES: Dict[str, List[Dict]] = {
+    # 02_pi_basics/fastapi_app（文件模式）
+    "sensor_data": [
+        {"key": [("device_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]},
+        {"key": [("device_id", ASCENDING), ("sensor_type", ASCENDING), ("timestamp", DESCENDING),
+                 ("_id", DESCENDING)]},
+        {"key": [("timestamp", DESCENDING), ("_id", DESCENDING)]},
+    ],
+    # 02_pi_basics/fastapi_app（分桶模式）
+    "sensor_buckets": [
+        {"key": [("device_id", ASCENDING), ("sensor_type", ASCENDING), ("start", DESCENDING)]},
+        {"key": [("start", DESCENDING)]},
+    ],
+    # 02_pi_basics/fastapi_app、06_multi_device
+    "devices": [
+        {"key": [("device_id", ASCENDING)], "unique": True},
+        {"key": [("status", ASCENDING)]},
+    ],
+    # 05_integration/data_collection_system、06_multi_device
+    "sensor_readings": [
+        {"key": [("device_id", ASCENDING), ("stored_at", DESCENDING), ("_id", DESCENDING)]},
+        {"key": [("stored_at", DESCENDING), ("_id", DESCENDING)]},
+    ],
+    # 06_multi_device/device_manager
+    "device_alerts": [
+        {"key": [("device_id", ASCENDING), ("created_at", DESCENDING)]},
+        {"key": [("created_at", DESCENDING)]},
+    ],
+    # 07_example_projects/01_environmental_monitor
+    "environmental_data": [
+        {"key": [("device_id", ASCENDING), ("timestamp", DESCENDING)]},
+        {"key": [("timestamp", DESCENDING)]},
+    ],
+    # 07_example_projects/02_data_logger、04_dashboard
+    "sensor_logs": [
+        {"key": [("device_id", ASCENDING), ("timestamp", DESCENDING)]},
+        {"key": [("timestamp", DESCENDING)]},
+    ],
+    # 07_example_projects/03_alert_system
+    "alerts": [
+        {"key": [("device_id", ASCENDING), ("timestamp", DESCENDING)]},
+        {"key": [("timestamp", DESCENDING)]},
+    ],
+    # 07_example_projects/05_smart_home
+    "control_history": [
+        {"key": [("device_id", ASCENDING), ("timestamp", DESCENDING)]},
+        {"key": [("timestamp", DESCENDING)]},
+    ],
+}
+
+# 彙總集合（rollups.py）：依分組與區間 upsert 的唯一索引（裝置統計也使用這個索引的前綴），
+# 加上不指定裝置時依解析度與時間查詢的索引
+_ROLLUP_INDEXES = [
+    {"key": [("device_id", ASCENDING), ("sensor_type", ASCENDING), ("resolution", ASCENDING),
+             ("start", ASCENDING)], "unique": True},
+    {"key": [("resolution", ASCENDING), ("start", ASCENDING)]},
+]
+for _source in ("sensor_data", "sensor_readings", "environmental_data", "sensor_logs"):
+    INDEXES[f"{_source}_rollups"] = _ROLLUP_INDEXES
+
+# 最新讀數集合（latest.py）：每個裝置、感測器一個文件的唯一索引（條件取代依此判斷衝突），
+# 加上依時間排序的索引（文件數只有裝置數 × 感測器種類）
+for _source, _time_field in (("sensor_data", "timestamp"), ("sensor_readings", "stored_at"),
+                             ("environmental_data", "timestamp"), ("sensor_logs", "timestamp")):
+    INDEXES[f"{_source}_latest"] = [
+        {"key": [("device_id", ASCENDING), ("sensor_type", ASCENDING)], "unique": True},
+        {"key": [(_time_field, DESCENDING)]},
+    ]
+
+# 由其他模組依設定建立、不列入登記的索引（報告中不會列為「未登記」）
+OPTIONAL_INDEXES = {
+    "ingest_key_1",     # scale_out.ensure_ingest_key_index()（冪等寫入模式）
+    "retention_ttl",    # retention.apply_retention()（TTL 保留方式）
+}
+
+# ============================================================================
+# 查詢形狀登記
+# ============================================================================
+
+# 查詢用的範例值（只影響 explain 的計畫選擇，不需要真的有資料）
+SAMPLE_DEVICE = "pico_001"
+SAMPLE_SENSOR = "temperature"
+SAMPLE_TIME = datetime(2025, 1, 1)
+SAMPLE_ID = ObjectId("000000000000000000000000")
+
+def _after(sort_field: str, extra: Dict = None) -> Dict:
+    """分頁查詢的下一頁條件（游標指向 SAMPLE_TIME、SAMPLE_ID）"""
+    after = keyset_filter(sort_field, DESCENDING, SAMPLE_TIME, SAMPLE_ID)
+    return {"$and": [extra, after]} if extra else after
+
+# 集合名稱 → API 服務送出的查詢
+#   source: 查詢來源；filter: 篩選條件；sort: 排序（選填）
+# aggregate 以 $match（與 $sort）開頭時，索引選擇與相同條件的 find 一樣，以 find 的形狀登記
+QUERY_SHAPES: Dict[str, List[Dict]] = {
+    "sensor_data": [
+        {"source": "02 GET /api/data",
+         "filter": {}, "sort": keyset_sort("timestamp")},
+        {"source": "02 GET /api/data?cursor",
+         "filter": _after("timestamp"), "sort": keyset_sort("timestamp")},
+        {"source": "02 GET /api/data?device_id、/api/data/{device_id}",
+         "filter": {"device_id": SAMPLE_DEVICE}, "sort": keyset_sort("timestamp")},
+        {"source": "02 GET /api/data?device_id&cursor、/api/data/{device_id}?cursor",
+         "filter": _after("timestamp", {"device_id": SAMPLE_DEVICE}),
+         "sort": keyset_sort("timestamp")},
+        {"source": "02 GET /api/data?device_id&sensor_type",
+         "filter": {"device_id": SAMPLE_DEVICE, "sensor_type": SAMPLE_SENSOR},
+         "sort": keyset_sort("timestamp")},
+        {"source": "02 GET /api/data?sensor_type",
+         "filter": {"sensor_type": SAMPLE_SENSOR}, "sort": keyset_sort("timestamp")},
+    ],
+    "sensor_data_rollups": [
+        {"source": "02 get_statistics(device_id)",
+         "filter": {"device_id": SAMPLE_DEVICE, "resolution": "1d"}},
+    ],
+    "sensor_buckets": [
+        {"source": "02 分桶模式查詢（裝置 + 感測器 + 時間）",
+         "filter": {"device_id": SAMPLE_DEVICE, "sensor_type": SAMPLE_SENSOR,
+                    "start": {"$gte": SAMPLE_TIME}},
+         "sort": [("start", DESCENDING)]},
+        {"source": "02 分桶模式查詢（全部）",
+         "filter": {}, "sort": [("start", DESCENDING)]},
+    ],
+    "devices": [
+        {"source": "02/06 取得裝置", "filter": {"device_id": SAMPLE_DEVICE}},
+        {"source": "06 GET /api/dashboard（線上裝置數）", "filter": {"status": "online"}},
+    ],
+    "sensor_readings": [
+        {"source": "05 GET /api/data",
+         "filter": {}, "sort": keyset_sort("stored_at")},
+        {"source": "05 GET /api/data?cursor",
+         "filter": _after("stored_at"), "sort": keyset_sort("stored_at")},
+        {"source": "05 GET /api/data/{device_id}",
+         "filter": {"device_id": SAMPLE_DEVICE}, "sort": keyset_sort("stored_at")},
+        {"source": "05 GET /api/data/{device_id}?cursor",
+         "filter": _after("stored_at", {"device_id": SAMPLE_DEVICE}),
+         "sort": keyset_sort("stored_at")},
+        {"source": "05 GET /api/data/range?device_id、06 裝置統計",
+         "filter": {"device_id": SAMPLE_DEVICE, "stored_at": {"$gte": SAMPLE_TIME}},
+         "sort": keyset_sort("stored_at")},
+        {"source": "05 GET /api/data/range、06 GET /api/dashboard",
+         "filter": {"stored_at": {"$gte": SAMPLE_TIME}}, "sort": keyset_sort("stored_at")},
+    ],
+    "device_alerts": [
+        {"source": "06 GET /api/alerts",
+         "filter": {}, "sort": [("created_at", DESCENDING)]},
+        {"source": "06 GET /api/alerts?device_id",
+         "filter": {"device_id": SAMPLE_DEVICE}, "sort": [("created_at", DESCENDING)]},
+    ],
+    "environmental_data": [
+        {"source": "07/01 GET /api/history",
+         "filter": {"device_id": SAMPLE_DEVICE, "timestamp": {"$gte": SAMPLE_TIME}},
+         "sort": [("timestamp", DESCENDING)]},
+        {"source": "07/01 GET /api/trend、/api/stats（不滿一分鐘的部分）",
+         "filter": {"device_id": SAMPLE_DEVICE, "sensor_type": SAMPLE_SENSOR,
+                    "timestamp": {"$gte": SAMPLE_TIME}},
+         "sort": [("timestamp", ASCENDING)]},
+    ],
+    "sensor_logs": [
+        {"source": "07/04 GET /api/history、/api/chart、/api/compare",
+         "filter": {"device_id": SAMPLE_DEVICE, "timestamp": {"$gte": SAMPLE_TIME}},
+         "sort": [("timestamp", ASCENDING)]},
+    ],
+    "alerts": [
+        {"source": "07/03 alert_history --list",
+         "filter": {"timestamp": {"$gte": SAMPLE_TIME}}, "sort": [("timestamp", DESCENDING)]},
+        {"source": "07/03 alert_history --list --device",
+         "filter": {"device_id": SAMPLE_DEVICE, "timestamp": {"$gte": SAMPLE_TIME}},
+         "sort": [("timestamp", DESCENDING)]},
+    ],
+    "sensor_readings_rollups": [
+        {"source": "05 GET /api/stats/{device_id}",
+         "filter": {"device_id": SAMPLE_DEVICE, "resolution": "1d"}},
+        {"source": "06 GET /api/statistics?device_id、/api/timeseries",
+         "filter": {"device_id": SAMPLE_DEVICE, "$or": [
+             {"resolution": "1m", "start": {"$gte": SAMPLE_TIME}},
+             {"resolution": "1h", "start": {"$gte": SAMPLE_TIME}}]}},
+        {"source": "06 GET /api/statistics",
+         "filter": {"$or": [
+             {"resolution": "1m", "start": {"$gte": SAMPLE_TIME}},
+             {"resolution": "1h", "start": {"$gte": SAMPLE_TIME}}]}},
+    ],
+    "environmental_data_rollups": [
+        {"source": "07/01 GET /api/stats",
+         "filter": {"device_id": SAMPLE_DEVICE, "sensor_type": SAMPLE_SENSOR, "$or": [
+             {"resolution": "1m", "start": {"$gte": SAMPLE_TIME}},
+             {"resolution": "1h", "start": {"$gte": SAMPLE_TIME}}]}},
+    ],
+    "sensor_logs_rollups": [
+        {"source": "07/04 GET /api/stats",
+         "filter": {"device_id": SAMPLE_DEVICE, "$or": [
+             {"resolution": "1m", "start": {"$gte": SAMPLE_TIME}},
+             {"resolution": "1h", "start": {"$gte": SAMPLE_TIME}}]}},
+    ],
+    "sensor_data_latest": [
+        {"source": "02 get_latest_data(device_id)",
+         "filter": {"device_id": SAMPLE_DEVICE}, "sort": [("timestamp", DESCENDING)]},
+    ],
+    "sensor_readings_latest": [
+        {"source": "05 GET /api/devices、06 GET /api/dashboard",
+         "filter": {}, "sort": [("stored_at", DESCENDING)]},
+        {"source": "06 最新讀數（裝置狀態、GET /api/devices/{device_id}）",
+         "filter": {"device_id": SAMPLE_DEVICE}, "sort": [("stored_at", DESCENDING)]},
+    ],
+    "environmental_data_latest": [
+        {"source": "07/01 GET /api/latest",
+         "filter": {"device_id": SAMPLE_DEVICE}, "sort": [("timestamp", DESCENDING)]},
+    ],
+    "sensor_logs_latest": [
+        {"source": "07/04 GET /api/latest",
+         "filter": {"device_id": SAMPLE_DEVICE}, "sort": [("timestamp", DESCENDING)]},
+    ],
+    "control_history": [
+        {"source": "07/05 control_history",
+         "filter": {"timestamp": {"$gte": SAMPLE_TIME}}, "sort": [("timestamp", DESCENDING)]},
+        {"source": "07/05 control_history --device",
+         "filter": {"device_id": SAMPLE_DEVICE, "timestamp": {"$gte": SAMPLE_TIME}},
+         "sort": [("timestamp", DESCENDING)]},
+    ],
+}
+
+# ============================================================================
+# 建立索引
+# ============================================================================
+
+def index_specs(name: str) -> List[Dict]:
+    """取得集合登記的索引（沒有登記時為空列表）"""
+    return [dict(spec) for spec in INDEXES.get(name, [])]
+
+def ensure_indexes(collection, name: Optional[str] = None) -> List[str]:
+    """
+    建立集合登記的所有索引（已存在的索引不受影響）
+
+    參數:
+        collection: MongoDB 集合
+        name: 登記的集合名稱（省略則使用集合名稱；集合名稱可自訂時傳入登記名稱）
+
+    返回:
+        List[str]: 索引名稱（無法建立的索引不包含在內）
+    """
+    names = []
+    for spec in index_specs(name or collection.name):
+        key = spec.pop("key")
+        try:
+            names.append(collection.create_index(key, **spec))
+        except OperationFailure as e:
+            # 同名但設定不同的索引、時間序列集合不支援的索引等
+            print(f"⚠ 無法建立索引 {collection.name} {key}: {e}")
+    return names
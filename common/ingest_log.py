@@ -0,0 +1,287 @@
+"""
+資料收集服務日誌模組
+給高流量服務使用的低負擔日誌工具
+
+功能：
+- setup_logging(): 以 QueueHandler 把日誌交給背景執行緒寫入檔案和終端機，
+  收訊息的執行緒不必等待磁碟或終端機 I/O
+- IngestMonitor: 每則訊息只更新計數，定期輸出一行彙總
+  （訊息/秒、各類錯誤數、寫入延遲 p99），個別訊息只抽樣輸出，
+  同類錯誤在每個週期內只輸出前幾則
+"""
+
+import atexit
+import logging
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Dict, List, Optional
+
+# ============================================================================
+# 預設設定
+# ============================================================================
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_QUEUE_SIZE = 10000      # 日誌佇列上限，滿了就丟棄（不阻塞收訊息的執行緒）
+
+ROLLUP_INTERVAL = 10.0      # 彙總輸出間隔（秒）
+SAMPLE_EVERY = 100          # 每幾則訊息輸出一則明細
+EVENT_LOG_LIMIT = 5         # 每個週期同類錯誤/警告最多輸出幾則
+LATENCY_SAMPLES = 4096      # 每個週期保留的延遲樣本數（計算百分位數用）
+
+class DroppingQueueHandler(QueueHandler):
+    """佇列滿時直接丟棄日誌並計數，不阻塞也不拋出例外"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def setup_logging(name: str, log_file: Optional[str] = None, level: int = logging.INFO,
+                  fmt: str = LOG_FORMAT, datefmt: Optional[str] = None,
+                  console: bool = True, queue_size: int = LOG_QUEUE_SIZE) -> logging.Logger:
+    """
+    設定非阻塞的日誌記錄器
+
+    呼叫端只把記錄放進佇列，格式化與寫入由背景執行緒（QueueListener）處理，
+    程式結束時會自動把佇列中剩餘的日誌寫完
+
+    參數:
+        name: 記錄器名稱
+        log_file: 日誌檔案路徑（省略則不寫檔）
+        level: 記錄等級
+        fmt: 日誌格式
+        datefmt: 時間格式
+        console: 是否輸出到終端機
+        queue_size: 日誌佇列上限
+
+    返回:
+        logging.Logger: 設定好的記錄器
+    """
+    formatter = logging.Formatter(fmt, datefmt)
+    handlers = []
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.handlers = [DroppingQueueHandler(log_queue)]
+    logger.propagate = False
+    return logger
+
+def percentile(values: List[float], pct: float) -> float:
+    """計算已排序列表的百分位數（最近排名法）"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))
+    return values[index]
+
+class IngestMonitor:
+    """
+    資料收集監控
+
+    熱路徑上只做計數：
+        if monitor.record_message():          # 每 SAMPLE_EVERY 則回傳一次 True
+            logger.info(...明細...)
+        monitor.record_latency(elapsed_ms)
+        monitor.record_error('parse', f"JSON 解析錯誤: {e}")
+
+    背景執行緒每 interval 秒輸出一行彙總，例如：
+        [彙總 10s] 訊息 3120 則（312.0 則/秒）| 錯誤 parse=2 | 寫入延遲 p50 1.2 ms, p99 8.4 ms
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = ROLLUP_INTERVAL,
+                 sample_every: int = SAMPLE_EVERY, event_log_limit: int = EVENT_LOG_LIMIT,
+                 extra: Optional[Callable[[], str]] = None):
+        """
+        初始化監控
+
+        參數:
+            logger: 輸出用的記錄器
+            interval: 彙總輸出間隔（秒）
+            sample_every: 每幾則訊息輸出一則明細（0 表示不輸出明細）
+            event_log_limit: 每個週期同類錯誤/警告最多輸出幾則
+            extra: 回傳額外資訊字串的函式（例如佇列深度），附加在彙總後面
+        """
+        self.logger = logger
+        self.interval = interval
+        self.sample_every = sample_every
+        self.event_log_limit = event_log_limit
+        self.extra = extra
+
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # 累計
+        self.total_messages = 0
+        self.total_events: Dict[str, int] = {}
+        self.samples: Dict[str, int] = {}
+
+        self._reset_window()
+
+    def _reset_window(self):
+        """開始新的彙總週期"""
+        self.window_start = time.monotonic()
+        self.window_messages = 0
+        self.window_errors: Dict[str, int] = {}
+        self.window_warnings: Dict[str, int] = {}
+        self.window_suppressed = 0
+        self.latencies: List[float] = []
+        self.latency_count = 0
+        self.latency_max = 0.0
+
+    # ====== 熱路徑 ======
+
+    def record_message(self) -> bool:
+        """
+        記錄一則已處理的訊息
+
+        返回:
+            bool: 這則訊息是否要輸出明細（抽樣）
+        """
+        with self.lock:
+            self.total_messages += 1
+            self.window_messages += 1
+            return self.sample_every > 0 and self.total_messages % self.sample_every == 1 % self.sample_every
+
+    def sample(self, key: str) -> bool:
+        """
+        其他事件的抽樣（每個 key 各自計數）
+
+        返回:
+            bool: 第 1、1+N、1+2N... 次呼叫時為 True
+        """
+        if self.sample_every <= 0:
+            return False
+        with self.lock:
+            count = self.samples.get(key, 0)
+            self.samples[key] = count + 1
+            return count % self.sample_every == 0
+
+    def record_latency(self, latency_ms: float):
+        """記錄一次寫入延遲（毫秒），超過樣本上限時以蓄水池抽樣保留"""
+        with self.lock:
+            self.latency_count += 1
+            if latency_ms > self.latency_max:
+                self.latency_max = latency_ms
+            if len(self.latencies) < LATENCY_SAMPLES:
+                self.latencies.append(latency_ms)
+            else:
+                index = random.randrange(self.latency_count)
+                if index < LATENCY_SAMPLES:
+                    self.latencies[index] = latency_ms
+
+    def record_error(self, kind: str, message: str):
+        """記錄錯誤：依類型計數，每個週期同類錯誤只輸出前幾則"""
+        self._record_event(self.window_errors, kind, message, logging.ERROR)
+
+    def record_warning(self, kind: str, message: str):
+        """記錄警告：與 record_error 相同，但以 WARNING 等級輸出"""
+        self._record_event(self.window_warnings, kind, message, logging.WARNING)
+
+    def _record_event(self, window: Dict[str, int], kind: str, message: str, level: int):
+        with self.lock:
+            count = window.get(kind, 0) + 1
+            window[kind] = count
+            self.total_events[kind] = self.total_events.get(kind, 0) + 1
+            if count > self.event_log_limit:
+                self.window_suppressed += 1
+                return
+        self.logger.log(level, message)
+
+    # ====== 彙總 ======
+
+    def start(self):
+        """啟動彙總執行緒"""
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="ingest_monitor", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 5):
+        """停止彙總執行緒並輸出最後一次彙總"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+        self.log_rollup()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.log_rollup()
+
+    def log_rollup(self):
+        """輸出目前週期的彙總並開始新週期（週期內沒有任何事件時不輸出）"""
+        line = self.rollup()
+        if line:
+            self.logger.info(line)
+
+    def rollup(self) -> Optional[str]:
+        """
+        產生目前週期的彙總字串並開始新週期
+
+        返回:
+            Optional[str]: 彙總字串，週期內沒有任何事件時為 None
+        """
+        with self.lock:
+            elapsed = max(time.monotonic() - self.window_start, 1e-9)
+            messages = self.window_messages
+            errors = self.window_errors
+            warnings = self.window_warnings
+            suppressed = self.window_suppressed
+            latencies = self.latencies
+            latency_max = self.latency_max
+            self._reset_window()
+
+        if not messages and not errors and not warnings:
+            return None
+
+        parts = [f"[彙總 {elapsed:.0f}s] 訊息 {messages} 則（{messages / elapsed:.1f} 則/秒）"]
+
+        if errors:
+            parts.append("錯誤 " + ", ".join(f"{k}={v}" for k, v in sorted(errors.items())))
+        else:
+            parts.append("錯誤 0")
+        if warnings:
+            parts.append("警告 " + ", ".join(f"{k}={v}" for k, v in sorted(warnings.items())))
+
+        if latencies:
+            latencies.sort()
+            parts.append(f"寫入延遲 p50 {percentile(latencies, 50):.1f} ms, "
+                         f"p99 {percentile(latencies, 99):.1f} ms, 最長 {latency_max:.1f} ms")
+
+        if suppressed:
+            parts.append(f"略過 {suppressed} 則重複的錯誤/警告")
+        if self.extra is not None:
+            parts.append(self.extra())
+
+        return " | ".join(parts)
+
+    def get_statistics(self) -> Dict:
+        """
+        取得累計統計
+
+        返回:
+            Dict: 訊息總數與各類錯誤/警告次數
+        """
+        with self.lock:
+            return {
+                'messages': self.total_messages,
+                'events': dict(self.total_events)
+            }
@@ -0,0 +1,273 @@
+"""
+最新讀數（latest）模組
+寫入讀數時同步更新「每個裝置、每種感測器的最新一筆」，查詢目前數值時讀這個小集合而不是排序原始讀數
+
+以前的 /api/latest、裝置列表、儀表板每次請求都在原始讀數上排序或 $group：
+讀數越多越慢，儀表板每次刷新都要掃過整個集合；
+最新讀數集合的大小只和「裝置數 × 感測器種類」有關，與讀數筆數無關
+
+最新讀數文件（集合名稱為「原始集合_latest」，例如 sensor_readings_latest）：
+
+    {
+      device_id, sensor_type,   # 唯一鍵（與原始讀數相同）
+      reading_id,               # 原始讀數的 _id
+      ...                       # 原始讀數的其他欄位（時間、數值、單位等）
+    }
+
+寫入：
+- LatestWriter.apply() 把一批讀數在記憶體中先挑出每個（裝置, 感測器）最新的一筆，
+  以「時間早於這筆」為條件的 replace upsert 一次送出（bulk_write(ordered=False)）
+- 條件取代讓延遲送達、補寫的舊讀數不會蓋掉較新的讀數：
+  已有較新的讀數時條件不成立，upsert 會因唯一鍵衝突失敗，這個錯誤直接略過
+- 多個程序或執行緒同時寫入時也不需要鎖，結果一定是時間最新的讀數
+
+查詢：
+- latest_reading(): 一筆（例如某裝置最新的一筆）
+- latest_readings(): 多筆（例如所有裝置目前的數值），依時間由新到舊
+
+讀回的文件與原始讀數相同：_id 為原始讀數的 _id（沒有記錄時省略）
+
+已有資料的集合第一次啟用時重建（不需要停止資料收集服務）：
+    python latest.py sensor_readings --rebuild
+"""
+
+import argparse
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import MongoClient, ReplaceOne, DESCENDING
+from pymongo.errors import BulkWriteError
+
+from indexes import ensure_indexes
+
+# ============================================================================
+# 預設設定
+# ============================================================================
+
+MONGO_URI = "mongodb://localhost:27017/"
+MONGO_DB = "iot_data"
+
+# 原始集合 → 讀數時間欄位（比較新舊使用這個欄位）
+LATEST_SOURCES: Dict[str, str] = {
+    "sensor_data": "timestamp",             # 02_pi_basics/fastapi_app
+    "sensor_readings": "stored_at",         # 05_integration、06_multi_device
+    "environmental_data": "timestamp",      # 07_example_projects/01_environmental_monitor
+    "sensor_logs": "timestamp",             # 07_example_projects/02_data_logger、04_dashboard
+}
+
+KEY_FIELDS = ("device_id", "sensor_type")   # 唯一鍵
+READING_ID_FIELD = "reading_id"
+
+DUPLICATE_KEY_ERROR = 11000
+
+def latest_collection_name(source: str) -> str:
+    """原始集合對應的最新讀數集合名稱"""
+    return f"{source}_latest"
+
+# ============================================================================
+# 寫入
+# ============================================================================
+
+class LatestWriter:
+    """
+    讀數寫入後更新最新讀數集合
+
+    使用方式：
+        latest = LatestWriter.for_collection(collection)
+        collection.insert_many(docs)
+        latest.apply(docs)
+    """
+
+    def __init__(self, collection, time_field: str):
+        """
+        參數:
+            collection: 最新讀數集合
+            time_field: 讀數的時間欄位（BSON 日期）
+        """
+        self.collection = collection
+        self.time_field = time_field
+
+    @classmethod
+    def for_collection(cls, source, name: Optional[str] = None) -> "LatestWriter":
+        """
+        建立原始集合的最新讀數寫入器（並建立最新讀數集合的索引）
+
+        參數:
+            source: 原始讀數集合
+            name: 登記的集合名稱（省略則使用集合名稱；集合名稱可自訂時傳入登記名稱）
+        """
+        name = name or source.name
+        collection = source.database[latest_collection_name(source.name)]
+        ensure_indexes(collection, latest_collection_name(name))
+        return cls(collection, LATEST_SOURCES[name])
+
+    def operations(self, documents: Iterable[Dict]) -> List[ReplaceOne]:
+        """
+        一批讀數合併成的取代操作（每個裝置、感測器只取最新的一筆）
+
+        沒有時間的讀數不計入
+        """
+        newest = {}
+        for doc in documents:
+            timestamp = doc.get(self.time_field)
+            if not isinstance(timestamp, datetime):
+                continue
+            key = tuple(doc.get(field) for field in KEY_FIELDS)
+            current = newest.get(key)
+            if current is None or timestamp >= current[self.time_field]:
+                newest[key] = doc
+
+        operations = []
+        for key, doc in newest.items():
+            replacement = {field: value for field, value in doc.items() if field != "_id"}
+            replacement.update(zip(KEY_FIELDS, key))
+            if "_id" in doc:
+                replacement[READING_ID_FIELD] = doc["_id"]
+            selector = dict(zip(KEY_FIELDS, key))
+            selector[self.time_field] = {"$lt": doc[self.time_field]}
+            operations.append(ReplaceOne(selector, replacement, upsert=True))
+        return operations
+
+    def apply(self, documents: Iterable[Dict]) -> int:
+        """
+        以一批已寫入的讀數更新最新讀數
+
+        重複鍵錯誤有兩種情況：已有較新（或同時間）的讀數，不需要更新；
+        或兩個程序同時建立同一個文件，這時重試一次，由條件決定是否取代
+
+        返回:
+            int: 送出的操作數
+        """
+        operations = self.operations(documents)
+        if not operations:
+            return 0
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            retry = [operations[err["index"]] for err in errors
+                     if err.get("code") == DUPLICATE_KEY_ERROR]
+            if len(retry) < len(errors):
+                raise
+            try:
+                self.collection.bulk_write(retry, ordered=False)
+            except BulkWriteError as retry_error:
+                # 重試後仍衝突代表已有較新的讀數
+                if any(err.get("code") != DUPLICATE_KEY_ERROR
+                       for err in retry_error.details.get("writeErrors", [])):
+                    raise
+        return len(operations)
+
+    def remove(self, match: Dict) -> int:
+        """
+        刪除符合條件的最新讀數（刪除裝置或清除資料時一併呼叫）
+
+        返回:
+            int: 刪除的文件數
+        """
+        return self.collection.delete_many(match).deleted_count
+
+# ============================================================================
+# 查詢
+# ============================================================================
+
+def as_reading(doc: Dict) -> Dict:
+    """最新讀數文件還原成原始讀數的格式（_id 為原始讀數的 _id）"""
+    doc.pop("_id", None)
+    if READING_ID_FIELD in doc:
+        doc["_id"] = doc.pop(READING_ID_FIELD)
+    return doc
+
+def latest_readings(latest, time_field: str, match: Optional[Dict] = None,
+                    limit: int = 0) -> List[Dict]:
+    """
+    最新讀數（每個裝置、感測器一筆），依時間由新到舊
+
+    參數:
+        latest: 最新讀數集合
+        time_field: 讀數的時間欄位
+        match: 條件（例如 {"device_id": ...}；省略表示全部裝置）
+        limit: 最多回傳筆數（0 表示不限制）
+
+    返回:
+        List[Dict]: 讀數列表
+    """
+    cursor = latest.find(match or {}).sort(time_field, DESCENDING)
+    if limit:
+        cursor = cursor.limit(limit)
+    return [as_reading(doc) for doc in cursor]
+
+def latest_reading(latest, time_field: str, match: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    最新的一筆讀數（例如某裝置任何感測器中最新的一筆）
+
+    返回:
+        Optional[Dict]: 讀數，沒有資料時為 None
+    """
+    doc = latest.find_one(match or {}, sort=[(time_field, DESCENDING)])
+    return as_reading(doc) if doc else None
+
+def latest_by_device(latest, time_field: str, match: Optional[Dict] = None) -> Dict[str, Dict]:
+    """
+    每個裝置最新的一筆讀數
+
+    返回:
+        {裝置 ID: 讀數}
+    """
+    devices = {}
+    for doc in latest_readings(latest, time_field, match):
+        devices.setdefault(doc.get("device_id"), doc)
+    return devices
+
+# ============================================================================
+# 重建最新讀數
+# ============================================================================
+
+def rebuild(source, name: Optional[str] = None) -> int:
+    """
+    由原始讀數重新找出每個裝置、感測器的最新讀數
+
+    使用與寫入相同的條件取代，資料收集服務執行中也可以重建（不會蓋掉較新的讀數）
+
+    參數:
+        source: 原始讀數集合
+        name: 登記的集合名稱（省略則使用集合名稱）
+
+    返回:
+        int: 最新讀數文件數
+    """
+    writer = LatestWriter.for_collection(source, name)
+    time_field = writer.time_field
+    rows = source.aggregate([
+        {"$match": {time_field: {"$type": "date"}}},
+        {"$sort": {time_field: DESCENDING}},
+        {"$group": {
+            "_id": {field: f"${field}" for field in KEY_FIELDS},
+            "doc": {"$first": "$$ROOT"}
+        }}
+    ], allowDiskUse=True)
+    writer.apply(row["doc"] for row in rows)
+    return writer.collection.count_documents({})
+
+def main():
+    parser = argparse.ArgumentParser(description='最新讀數管理')
+    parser.add_argument('collection', choices=sorted(LATEST_SOURCES), help='原始讀數集合')
+    parser.add_argument('--uri', default=MONGO_URI, help='MongoDB 連接字串')
+    parser.add_argument('--db', default=MONGO_DB, help='資料庫名稱')
+    parser.add_argument('--rebuild', action='store_true', help='由原始讀數重建最新讀數')
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    try:
+        source = client[args.db][args.collection]
+        target = source.database[latest_collection_name(args.collection)]
+        if args.rebuild:
+            print(f"重建最新讀數: {args.collection} → {target.name} ...")
+            print(f"✓ 完成，共 {rebuild(source):,} 個文件")
+        else:
+            print(f"{target.name}: {target.count_documents({}):,} 個文件")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
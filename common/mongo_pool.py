@@ -0,0 +1,144 @@
+"""
+共用 MongoDB 連線模組
+同一個程序內以連接字串（與選項）為鍵共用 MongoClient，每個 MongoClient 內建連線池
+
+以前每個模組（API、裝置管理、監控、自動化…）各自建立 MongoClient，
+manual_control 甚至每個命令建立再關閉一次；每個 MongoClient 都有自己的連線池與監控執行緒，
+啟動時間、socket 數量和每次連線的握手都會增加
+
+功能：
+- get_client(): 取得共用的 MongoClient（第一次使用時才連線）
+- get_database(): 取得共用 MongoClient 的資料庫
+- release_client(): 歸還（最後一個使用者歸還時才關閉）
+- close_all(): 關閉所有共用的 MongoClient（程式結束時）
+
+fork 安全：
+- 建立時使用 connect=False，第一次操作才連線並啟動背景執行緒，
+  在 fork 之前建立（例如模組層級）但未使用的 MongoClient 可以安全地帶進子程序
+- fork 後子程序會清空快取，之後的 get_client() 會建立新的 MongoClient；
+  父程序已經使用過的 MongoClient 不可在子程序中使用（PyMongo 的限制）
+
+環境變數（預設值適合 Raspberry Pi 上的小型服務）：
+    MONGO_MAX_POOL_SIZE                 每個 MongoClient 最多連線數（預設 10，PyMongo 預設 100）
+    MONGO_MIN_POOL_SIZE                 保持的最少連線數（預設 0）
+    MONGO_MAX_IDLE_TIME_MS              閒置連線關閉時間（預設 60000）
+    MONGO_SERVER_SELECTION_TIMEOUT_MS   找不到伺服器時的逾時（預設 5000，PyMongo 預設 30000）
+    MONGO_CONNECT_TIMEOUT_MS            建立連線逾時（預設 5000）
+    MONGO_SOCKET_TIMEOUT_MS             單次操作 socket 逾時（預設不限制）
+"""
+
+import os
+import threading
+from typing import Dict, Tuple
+
+from pymongo import MongoClient
+
+# ============================================================================
+# 預設設定
+# ============================================================================
+
+def _env_int(name: str, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+DEFAULT_OPTIONS = {
+    "maxPoolSize": _env_int("MONGO_MAX_POOL_SIZE", 10),
+    "minPoolSize": _env_int("MONGO_MIN_POOL_SIZE", 0),
+    "maxIdleTimeMS": _env_int("MONGO_MAX_IDLE_TIME_MS", 60000),
+    "serverSelectionTimeoutMS": _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000),
+    "connectTimeoutMS": _env_int("MONGO_CONNECT_TIMEOUT_MS", 5000),
+    "socketTimeoutMS": _env_int("MONGO_SOCKET_TIMEOUT_MS", None),
+}
+
+# ============================================================================
+# 共用 MongoClient
+# ============================================================================
+
+_lock = threading.Lock()
+_clients: Dict[Tuple, MongoClient] = {}     # 鍵 → MongoClient
+_refs: Dict[int, list] = {}                 # id(MongoClient) → [鍵, 使用者數]
+_pid = os.getpid()
+
+def _reset_after_fork():
+    """子程序不能使用父程序的 MongoClient，清空快取（不關閉，關閉會影響父程序的連線）"""
+    global _lock, _pid
+    _lock = threading.Lock()
+    _clients.clear()
+    _refs.clear()
+    _pid = os.getpid()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _client_key(uri: str, options: Dict) -> Tuple:
+    return (uri, tuple(sorted((k, v) for k, v in options.items() if v is not None)))
+
+def get_client(uri: str, **options) -> MongoClient:
+    """
+    取得共用的 MongoClient
+
+    相同的連接字串與選項會拿到同一個 MongoClient；
+    第一次操作時才連線，連不到伺服器的錯誤會在第一次操作時拋出
+
+    參數:
+        uri: MongoDB 連接字串
+        **options: MongoClient 選項，覆寫 DEFAULT_OPTIONS（例如 serverSelectionTimeoutMS=2000）
+
+    返回:
+        MongoClient: 共用的客戶端（用完呼叫 release_client，不要直接 close）
+    """
+    if os.getpid() != _pid:
+        # 沒有 register_at_fork 的平台
+        _reset_after_fork()
+
+    merged = dict(DEFAULT_OPTIONS)
+    merged.update(options)
+    key = _client_key(uri, merged)
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = MongoClient(uri, connect=False,
+                                 **{k: v for k, v in merged.items() if v is not None})
+            _clients[key] = client
+            _refs[id(client)] = [key, 0]
+        _refs[id(client)][1] += 1
+        return client
+
+def get_database(uri: str, name: str, **options):
+    """取得共用 MongoClient 的資料庫"""
+    return get_client(uri, **options)[name]
+
+def release_client(client: MongoClient):
+    """
+    歸還共用的 MongoClient，最後一個使用者歸還時才關閉
+
+    不是由 get_client() 取得的 MongoClient 會直接關閉
+    """
+    if client is None:
+        return
+    with _lock:
+        ref = _refs.get(id(client))
+        if ref is None:
+            if client not in _clients.values():
+                client.close()
+            return
+        ref[1] -= 1
+        if ref[1] > 0:
+            return
+        _clients.pop(ref[0], None)
+        del _refs[id(client)]
+    client.close()
+
+def close_all():
+    """關閉所有共用的 MongoClient"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        _refs.clear()
+    for client in clients:
+        client.close()
+
+def active_clients() -> int:
+    """目前共用中的 MongoClient 數量"""
+    return len(_clients)
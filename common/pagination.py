@@ -0,0 +1,171 @@
+"""
+鍵集分頁（keyset / cursor-based pagination）模組
+以上一頁最後一筆的（排序欄位, _id）當作下一頁的起點，取代 skip/limit
+
+skip/limit 的問題：
+- skip(N) 要先掃過 N 筆才開始回傳，第 1000 頁比第 1 頁慢得多
+- 資料持續寫入時，新資料會把舊資料往後推，翻頁時重複或漏掉資料
+
+鍵集分頁：
+- 條件為「排序欄位 < 上一頁最後的值，或相等且 _id < 上一頁最後的 _id」（降冪），
+  配合（篩選欄位, 排序欄位, _id）複合索引，每一頁都直接從索引中的位置開始讀，成本與第一頁相同
+- 加上 _id 排序讓時間相同的資料也有固定順序，不會因時間相同而重複或漏掉
+- 以第一頁之後新寫入的資料不會影響後續頁面
+
+游標是不透明的字串（base64 編碼的 JSON），內容包含排序欄位、最後的值與 _id；
+API 回傳 next_cursor，客戶端原樣帶回即可取得下一頁，沒有下一頁時為 None
+
+功能：
+- encode_cursor() / decode_cursor(): 游標編碼與解碼（格式錯誤時拋出 ValueError）
+- keyset_sort() / keyset_filter(): 排序與「上一頁之後」的查詢條件
+- paginate(): 查詢一頁並產生 next_cursor（每頁筆數至少 1，否則拋出 ValueError）
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DESCENDING
+
+# ============================================================================
+# 游標編碼
+# ============================================================================
+
+def _encode_value(value):
+    """BSON 值 → 可放進 JSON 的形式（datetime 與 ObjectId 加上型別標記）"""
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "$date" in value:
+            return datetime.fromisoformat(value["$date"])
+        if "$oid" in value:
+            return ObjectId(value["$oid"])
+        raise ValueError("游標格式錯誤")
+    return value
+
+def encode_cursor(doc: Dict, sort_field: str, sort_order: int = DESCENDING) -> str:
+    """
+    以一筆文件（頁面的最後一筆）產生下一頁的游標
+
+    參數:
+        doc: 原始文件（尚未轉換 _id 與時間格式）
+        sort_field: 排序欄位
+        sort_order: 排序方向
+
+    返回:
+        str: 游標（URL 安全的 base64 字串）
+    """
+    payload = {
+        "f": sort_field,
+        "o": sort_order,
+        "v": _encode_value(doc.get(sort_field)),
+        "id": _encode_value(doc["_id"])
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, sort_field: str, sort_order: int = DESCENDING) -> Tuple:
+    """
+    解碼游標
+
+    參數:
+        cursor: encode_cursor() 產生的游標
+        sort_field: 本次查詢的排序欄位
+        sort_order: 本次查詢的排序方向
+
+    返回:
+        (最後的排序值, 最後的 _id)
+
+    例外:
+        ValueError: 游標格式錯誤，或與本次查詢的排序不同
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        value = _decode_value(payload["v"])
+        last_id = _decode_value(payload["id"])
+    except (binascii.Error, UnicodeDecodeError, TypeError, KeyError,
+            ValueError, InvalidId):
+        raise ValueError("游標格式錯誤")
+    if payload.get("f") != sort_field or payload.get("o") != sort_order:
+        raise ValueError("游標與查詢的排序方式不同")
+    return value, last_id
+
+# ============================================================================
+# 查詢條件
+# ============================================================================
+
+def check_limit(limit: int):
+    """每頁筆數至少 1（0 筆的頁面無法產生游標，MongoDB 的 limit(0) 則是不限筆數）"""
+    if limit < 1:
+        raise ValueError(f"每頁筆數必須至少為 1: {limit}")
+
+def keyset_sort(sort_field: str, sort_order: int = DESCENDING) -> List[Tuple[str, int]]:
+    """排序條件（排序欄位相同時以 _id 決定順序）"""
+    return [(sort_field, sort_order), ("_id", sort_order)]
+
+def keyset_filter(sort_field: str, sort_order: int, value, last_id) -> Dict:
+    """
+    上一頁最後一筆之後的資料
+
+    外層的 $lte（$gte）讓索引掃描直接從游標位置開始，
+    $or 只需要排除與最後一筆時間相同、已經回傳過的資料
+    """
+    if sort_order == DESCENDING:
+        op, op_or_equal = "$lt", "$lte"
+    else:
+        op, op_or_equal = "$gt", "$gte"
+    return {
+        sort_field: {op_or_equal: value},
+        "$or": [{sort_field: {op: value}}, {"_id": {op: last_id}}]
+    }
+
+def paginate(collection, filter_dict: Optional[Dict] = None, sort_field: str = "timestamp",
+             sort_order: int = DESCENDING, limit: int = 100, cursor: Optional[str] = None,
+             skip: int = 0, projection: Optional[Dict] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    查詢一頁資料
+
+    多讀一筆判斷是否還有下一頁；回傳的文件維持原始格式（_id 與時間未轉換）
+
+    參數:
+        collection: MongoDB 集合
+        filter_dict: 查詢條件
+        sort_field: 排序欄位（需要有以 _id 結尾的複合索引）
+        sort_order: 排序方向
+        limit: 每頁筆數
+        cursor: 上一頁回傳的 next_cursor（第一頁為 None）
+        skip: 跳過筆數（相容舊版的 skip/limit 分頁；與游標一起使用時從游標之後開始跳過）
+        projection: 回傳欄位（必須包含排序欄位）
+
+    返回:
+        (文件列表, next_cursor)；沒有下一頁時 next_cursor 為 None
+
+    例外:
+        ValueError: 游標格式錯誤，或每頁筆數小於 1
+    """
+    check_limit(limit)
+    query = dict(filter_dict or {})
+    if cursor:
+        after = keyset_filter(sort_field, sort_order, *decode_cursor(cursor, sort_field, sort_order))
+        query = {"$and": [query, after]} if query else after
+
+    find = collection.find(query, projection).sort(keyset_sort(sort_field, sort_order))
+    if skip:
+        find = find.skip(skip)
+    docs = list(find.limit(limit + 1))
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1], sort_field, sort_order)
+    return docs, next_cursor
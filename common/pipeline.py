@@ -0,0 +1,475 @@
+"""
+資料收集流程模組
+把「解碼 → 驗證 → 補充欄位 → 偵測 → 儲存」拆成可組合的階段（stage）與輸出（sink）
+
+功能：
+- Stage: 處理單筆（process）或整批（process_batch）資料，回傳 None 表示略過
+- Sink: 把處理好的資料寫到 MongoDB、檔案、終端機或自訂函式
+- Pipeline: 依序執行各階段並寫入所有輸出，內建每個階段的筆數、耗時統計
+
+各服務只需要組合階段與輸出：
+
+    pipeline = Pipeline("mqtt_to_db", [
+        DecodeStage(SensorDecoder(), topic_field="mqtt_topic"),
+        EnrichStage(stored_at=datetime.now),
+    ], [MongoSink(collection)])
+
+    def on_message(client, userdata, msg):
+        pipeline.run(msg)
+
+錯誤處理：
+- 階段拋出 ValueError（包含 PayloadError、JSON 解析錯誤）視為資料不合格（rejected）
+- 其他例外視為錯誤（errors）
+- FunctionSink 的函式回傳 False（自行處理例外的既有儲存函式）視為錯誤，拋出 SinkWriteFailed
+兩者都會交給 on_error 回調，並只略過該筆資料
+"""
+
+import json
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+from timestamps import normalize_fields
+
+# 統計欄位索引（用列表存放，熱路徑上比字典快）
+_CALLS, _IN, _OUT, _REJECTED, _ERRORS, _TOTAL, _MAX = range(7)
+
+# ============================================================================
+# 階段
+# ============================================================================
+
+class Stage:
+    """
+    處理階段基底類別
+
+    子類別實作 process(item)；需要整批處理（例如批次查詢）時可覆寫 process_batch
+    """
+
+    name = "stage"
+
+    def process(self, item):
+        """
+        處理單筆資料
+
+        返回:
+            處理後的資料，None 表示略過這筆
+        """
+        return item
+
+    def process_batch(self, items: List, reject: Callable) -> List:
+        """
+        處理一批資料（預設逐筆呼叫 process）
+
+        參數:
+            items: 資料列表
+            reject: 回報單筆失敗的函式 reject(item, exc)
+
+        返回:
+            List: 處理後（未被略過）的資料
+        """
+        results = []
+        process = self.process
+        for item in items:
+            try:
+                result = process(item)
+            except Exception as e:
+                reject(item, e)
+                continue
+            if result is not None:
+                results.append(result)
+        return results
+
+class FunctionStage(Stage):
+    """把一般函式包成階段"""
+
+    def __init__(self, name: str, func: Callable):
+        """
+        參數:
+            name: 階段名稱（顯示在統計中）
+            func: 處理函式，接收一筆資料並回傳處理後的資料（None 表示略過）
+        """
+        self.name = name
+        self.process = func
+
+class DecodeStage(Stage):
+    """把 MQTT 訊息解碼、驗證成要儲存的字典"""
+
+    name = "decode"
+
+    def __init__(self, decoder, topic_field: Optional[str] = None):
+        """
+        參數:
+            decoder: SensorDecoder 實例
+            topic_field: 要把 MQTT 主題存入的欄位名稱（省略則不存）
+        """
+        self.decode = decoder.decode
+        self.topic_field = topic_field
+
+    def process(self, msg):
+        doc = self.decode(getattr(msg, 'payload', msg)).to_document()
+        if self.topic_field is not None:
+            doc[self.topic_field] = msg.topic
+        return doc
+
+class EnrichStage(Stage):
+    """
+    補充欄位
+
+    參數值是函式時每筆資料呼叫一次（例如 datetime.now），否則直接寫入
+    """
+
+    name = "enrich"
+
+    def __init__(self, **fields):
+        self.fields = [(key, value, callable(value)) for key, value in fields.items()]
+
+    def process(self, doc: Dict):
+        for key, value, dynamic in self.fields:
+            doc[key] = value() if dynamic else value
+        return doc
+
+class TimestampStage(Stage):
+    """
+    把時間欄位轉成 BSON 日期（datetime）
+
+    Pico 送來的 Unix 秒數、ISO 字串都轉成本機時間的 datetime（見 timestamps 模組），
+    無法解析時拋出 ValueError，該筆資料視為不合格
+    """
+
+    name = "timestamps"
+
+    def __init__(self, *fields: str, fill_missing: bool = False):
+        """
+        參數:
+            fields: 時間欄位名稱
+            fill_missing: 欄位不存在時填入目前時間
+        """
+        self.fields = fields
+        self.fill_missing = fill_missing
+
+    def process(self, doc: Dict):
+        return normalize_fields(doc, self.fields, self.fill_missing)
+
+# ============================================================================
+# 輸出
+# ============================================================================
+
+class Sink:
+    """輸出基底類別"""
+
+    name = "sink"
+
+    def write(self, items: List):
+        """寫入一批資料（失敗時拋出例外）"""
+        raise NotImplementedError
+
+    def close(self):
+        """關閉輸出"""
+
+class MongoSink(Sink):
+    """寫入 MongoDB 集合（多筆時用 insert_many(ordered=False)）"""
+
+    name = "mongodb"
+
+    def __init__(self, collection, rollups=None, latest=None):
+        """
+        參數:
+            collection: MongoDB 集合
+            rollups: 寫入成功後累加統計的 RollupWriter（見 rollups.py，可省略）
+            latest: 寫入成功後更新最新讀數的 LatestWriter（見 latest.py，可省略）
+        """
+        self.collection = collection
+        self.writers = [writer for writer in (rollups, latest) if writer is not None]
+
+    def write(self, items: List):
+        if len(items) == 1:
+            self.collection.insert_one(items[0])
+        else:
+            try:
+                self.collection.insert_many(items, ordered=False)
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                failed = {err['index'] for err in errors}
+                written = [item for i, item in enumerate(items) if i not in failed]
+                for writer in self.writers:
+                    writer.apply(written)
+                raise RuntimeError(f"批次寫入部分失敗: {len(errors)}/{len(items)} 筆") from e
+        for writer in self.writers:
+            writer.apply(items)
+
+class FileSink(Sink):
+    """以 JSON Lines 格式附加寫入檔案"""
+
+    name = "file"
+
+    def __init__(self, path: str, formatter: Optional[Callable[[Any], str]] = None):
+        """
+        參數:
+            path: 檔案路徑
+            formatter: 把一筆資料轉成一行文字的函式（預設為 JSON）
+        """
+        self.formatter = formatter or (lambda item: json.dumps(item, ensure_ascii=False, default=str))
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, items: List):
+        self.file.write("".join(self.formatter(item) + "\n" for item in items))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class StdoutSink(Sink):
+    """輸出到終端機"""
+
+    name = "stdout"
+
+    def __init__(self, formatter: Optional[Callable[[Any], str]] = None):
+        self.formatter = formatter or str
+
+    def write(self, items: List):
+        sys.stdout.write("".join(self.formatter(item) + "\n" for item in items))
+
+class SinkWriteFailed(RuntimeError):
+    """FunctionSink 的儲存函式回傳 False（函式已自行記錄錯誤，on_error 可以不再重複記錄）"""
+
+class FunctionSink(Sink):
+    """
+    把既有的儲存函式包成輸出
+
+    儲存函式拋出例外或回傳 False 都視為寫入失敗（回傳 None 等其他值視為成功）
+    """
+
+    def __init__(self, name: str, func: Callable, batch: bool = False):
+        """
+        參數:
+            name: 輸出名稱（顯示在統計中）
+            func: 儲存函式
+            batch: True 時 func 接收整批列表，否則逐筆呼叫
+        """
+        self.name = name
+        self.func = func
+        self.batch = batch
+
+    def write(self, items: List):
+        if self.batch:
+            if self.func(items) is False:
+                raise SinkWriteFailed(f"{self.name} 寫入失敗: {len(items)} 筆")
+            return
+        failed = sum(1 for item in items if self.func(item) is False)
+        if failed:
+            raise SinkWriteFailed(f"{self.name} 寫入失敗: {failed}/{len(items)} 筆")
+
+# ============================================================================
+# 流程
+# ============================================================================
+
+class Pipeline:
+    """
+    資料收集流程
+
+    run() 處理單筆資料；run_batch() 讓每個階段一次處理整批，
+    輸出也整批寫入。每個階段與輸出各自記錄筆數與耗時。
+    """
+
+    def __init__(self, name: str, stages: Iterable[Stage], sinks: Iterable[Sink],
+                 monitor=None, on_error: Optional[Callable] = None):
+        """
+        初始化流程
+
+        參數:
+            name: 流程名稱
+            stages: 依序執行的階段
+            sinks: 輸出（全部都會寫入）
+            monitor: IngestMonitor 實例（可省略），記錄輸出延遲與錯誤
+            on_error: 錯誤回調 on_error(stage_name, item, exc, rejected)，
+                      省略時交給 monitor.record_error 或直接列印
+        """
+        self.name = name
+        self.stages = list(stages)
+        self.sinks = list(sinks)
+        self.monitor = monitor
+        self.on_error = on_error
+
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.stats = {}
+        for step in self.stages + self.sinks:
+            if step.name in self.stats:
+                raise ValueError(f"階段名稱重複: {step.name}")
+            self.stats[step.name] = [0, 0, 0, 0, 0, 0.0, 0.0]
+
+    # ====== 執行 ======
+
+    def run(self, item):
+        """
+        處理單筆資料並寫入所有輸出
+
+        返回:
+            處理完成的資料；被略過或失敗時為 None
+        """
+        timings = []
+        clock = time.perf_counter
+
+        for stage in self.stages:
+            start = clock()
+            try:
+                result = stage.process(item)
+            except Exception as e:
+                timings.append((stage.name, clock() - start, 1, 0, e))
+                self._merge(timings)
+                self._report(stage.name, item, e)
+                return None
+            timings.append((stage.name, clock() - start, 1, 0 if result is None else 1, None))
+            if result is None:
+                self._merge(timings)
+                return None
+            item = result
+
+        batch = [item]
+        write_start = clock()
+        for sink in self.sinks:
+            start = clock()
+            try:
+                sink.write(batch)
+            except Exception as e:
+                timings.append((sink.name, clock() - start, 1, 0, e))
+                self._merge(timings)
+                self._report(sink.name, item, e)
+                return None
+            timings.append((sink.name, clock() - start, 1, 1, None))
+
+        if self.monitor is not None and self.sinks:
+            self.monitor.record_latency((clock() - write_start) * 1000)
+        self._merge(timings)
+        return item
+
+    def run_batch(self, items: List) -> List:
+        """
+        整批處理資料：每個階段一次處理整批，輸出也整批寫入
+
+        返回:
+            List: 處理完成並寫入的資料
+        """
+        timings = []
+        clock = time.perf_counter
+        failures = []
+
+        for stage in self.stages:
+            if not items:
+                break
+            rejected = []
+            start = clock()
+            count_in = len(items)
+            items = stage.process_batch(items, lambda item, e: rejected.append((item, e)))
+            timings.append((stage.name, clock() - start, count_in, len(items), None))
+            for item, e in rejected:
+                failures.append((stage.name, item, e))
+        stage_failures = list(failures)
+
+        written = items
+        if items:
+            write_start = clock()
+            for sink in self.sinks:
+                start = clock()
+                try:
+                    sink.write(items)
+                except Exception as e:
+                    timings.append((sink.name, clock() - start, len(items), 0, e))
+                    failures.append((sink.name, items, e))
+                    written = []
+                    continue
+                timings.append((sink.name, clock() - start, len(items), len(items), None))
+            if self.monitor is not None and self.sinks:
+                self.monitor.record_latency((clock() - write_start) * 1000)
+
+        self._merge(timings, stage_failures)
+        for name, item, e in failures:
+            self._report(name, item, e)
+        return written
+
+    def _merge(self, timings, stage_failures=()):
+        """把這次執行的耗時與筆數合併到統計（每次執行只鎖定一次）"""
+        failed = {}
+        for name, _, e in stage_failures:
+            key = (name, isinstance(e, ValueError))
+            failed[key] = failed.get(key, 0) + 1
+
+        with self.lock:
+            stats = self.stats
+            for name, elapsed, count_in, count_out, error in timings:
+                row = stats[name]
+                row[_CALLS] += 1
+                row[_IN] += count_in
+                row[_OUT] += count_out
+                row[_TOTAL] += elapsed
+                if elapsed > row[_MAX]:
+                    row[_MAX] = elapsed
+                if error is not None:
+                    row[_REJECTED if isinstance(error, ValueError) else _ERRORS] += 1
+            for (name, is_rejected), count in failed.items():
+                stats[name][_REJECTED if is_rejected else _ERRORS] += count
+
+    def _report(self, stage_name, item, e):
+        """回報失敗的資料"""
+        rejected = isinstance(e, ValueError)
+        if self.on_error is not None:
+            self.on_error(stage_name, item, e, rejected)
+        elif self.monitor is not None:
+            self.monitor.record_error(stage_name, f"✗ {stage_name}: {e}")
+        else:
+            print(f"✗ {self.name}/{stage_name}: {e}")
+
+    # ====== 統計 ======
+
+    def get_statistics(self) -> Dict:
+        """
+        取得各階段統計
+
+        返回:
+            Dict: {階段名稱: {calls, items_in, items_out, rejected, errors,
+                              avg_us, max_ms, total_ms, share}}
+        """
+        with self.lock:
+            rows = {name: list(row) for name, row in self.stats.items()}
+
+        total = sum(row[_TOTAL] for row in rows.values()) or 1e-9
+        result = {}
+        for name, row in rows.items():
+            result[name] = {
+                'calls': row[_CALLS],
+                'items_in': row[_IN],
+                'items_out': row[_OUT],
+                'rejected': row[_REJECTED],
+                'errors': row[_ERRORS],
+                'avg_us': round(row[_TOTAL] / row[_IN] * 1e6, 1) if row[_IN] else 0.0,
+                'max_ms': round(row[_MAX] * 1000, 2),
+                'total_ms': round(row[_TOTAL] * 1000, 1),
+                'share': round(row[_TOTAL] / total * 100, 1)
+            }
+        return result
+
+    def format_statistics(self) -> List[str]:
+        """
+        把各階段統計整理成文字（每個階段一行）
+
+        返回:
+            List[str]: 可直接列印或寫入日誌的文字
+        """
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        lines = [f"流程 {self.name} 各階段統計："]
+        for name, row in self.get_statistics().items():
+            lines.append(
+                f"  {name:<12} {row['items_in']:>8} 筆 "
+                f"({row['items_in'] / elapsed:,.1f} 筆/秒)  "
+                f"平均 {row['avg_us']:>8.1f} µs  最長 {row['max_ms']:>7.2f} ms  "
+                f"佔 {row['share']:>5.1f}%  拒絕 {row['rejected']}  錯誤 {row['errors']}"
+            )
+        return lines
+
+    def close(self):
+        """關閉所有輸出"""
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,371 @@
+"""
+API 回應快取模組
+儀表板每幾秒輪詢統計、比較、裝置列表等端點，相同的參數在資料沒有變化時直接回傳上次的結果
+
+以前每次輪詢都重新執行相同的聚合查詢：
+多個儀表板同時開啟時，同一個統計每秒被計算好幾次，結果完全相同
+
+功能：
+- 以路由名稱與正規化的查詢參數為鍵（參數依名稱排序、字串去除空白）
+- 每個路由各自的存活時間（TTL），總筆數有上限，超過時淘汰最久沒有使用的（LRU）
+- 單飛（single-flight）：相同的請求同時進來時只計算一次，其他請求等待同一個結果
+- 依裝置失效：IngestWatcher 輪詢最新讀數集合（見 latest.py），
+  裝置有新資料時刪除該裝置的快取；資料收集服務在其他程序也能失效
+- 不指定裝置的彙總（例如所有裝置的統計、儀表板摘要）只依 TTL 過期：
+  持續有資料寫入時任何裝置的新資料都會讓它失效，快取就沒有作用
+- 命中率統計（整體與每個路由），由 API 的 /api/cache 端點輸出，用於調整 TTL 與上限
+
+使用方式：
+    from response_cache import ResponseCache, IngestWatcher
+
+    cache = ResponseCache()
+
+    @app.get("/api/statistics")
+    @cache.cached("statistics", ttl=10, device_param="device_id")
+    async def get_statistics(device_id: Optional[str] = None, hours: int = 24):
+        ...
+
+    @app.on_event("startup")
+    async def startup():
+        app.state.watcher = IngestWatcher(cache, latest_collection, "stored_at").start()
+
+計算結果（回傳值）由多個請求共用，端點不可以修改回傳後的物件；
+拋出的例外（例如 404 的 HTTPException）不會被快取
+
+環境變數：
+    RESPONSE_CACHE_MAX_ENTRIES      快取筆數上限（預設 256）
+    RESPONSE_CACHE_POLL_INTERVAL    檢查新資料的間隔秒數（預設 1）
+    RESPONSE_CACHE                  設為 0 時停用（每個請求都重新計算，例如效能測試）
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from async_db import run_db
+
+# ============================================================================
+# 預設設定
+# ============================================================================
+
+def _env_number(name: str, default, cast=int):
+    value = os.environ.get(name)
+    return cast(value) if value else default
+
+CACHE_MAX_ENTRIES = _env_number("RESPONSE_CACHE_MAX_ENTRIES", 256)
+CACHE_POLL_INTERVAL = _env_number("RESPONSE_CACHE_POLL_INTERVAL", 1.0, float)
+CACHE_ENABLED = os.environ.get("RESPONSE_CACHE", "1") != "0"
+DEFAULT_TTL = 10.0              # 路由沒有指定時的存活時間（秒）
+
+# 檢查新資料時往回多查的時間：寫入的時間戳記與實際可讀取的時間可能有先後，
+# 重疊的部分依每個（裝置, 感測器）記錄的時間判斷是否真的有新資料
+WATCH_OVERLAP = timedelta(seconds=5)
+
+logger = logging.getLogger("response_cache")
+
+def normalize_params(params: Dict[str, Any]) -> Tuple:
+    """查詢參數正規化為可做為鍵的 tuple（依名稱排序，字串去除前後空白）"""
+    items = []
+    for name in sorted(params):
+        value = params[name]
+        if isinstance(value, str):
+            value = value.strip()
+        elif isinstance(value, (list, tuple, set)):
+            value = tuple(value)
+        items.append((name, value))
+    return tuple(items)
+
+def split_devices(value) -> Optional[Tuple[str, ...]]:
+    """裝置參數（單一 ID 或逗號分隔的列表）→ 裝置 ID tuple；沒有指定時為 None"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        devices = tuple(d.strip() for d in value.split(",") if d.strip())
+    else:
+        devices = tuple(value)
+    return devices or None
+
+# ============================================================================
+# 快取
+# ============================================================================
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "route", "devices")
+
+    def __init__(self, value, expires_at: float, route: str, devices: Optional[Tuple[str, ...]]):
+        self.value = value
+        self.expires_at = expires_at
+        self.route = route
+        self.devices = devices
+
+class ResponseCache:
+    """
+    記憶體中的回應快取（LRU + 每個路由的 TTL + 單飛 + 依裝置失效）
+
+    所有操作都在事件迴圈中執行，不需要鎖；每個 API 程序（uvicorn worker）各自一份
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, clock: Callable[[], float] = time.monotonic):
+        """
+        參數:
+            max_entries: 快取筆數上限
+            clock: 時間來源（秒）
+        """
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+        self._device_keys: Dict[str, set] = {}
+        # 失效版本：計算期間裝置有新資料時，結果不寫入快取
+        self._generation = 0
+        self._device_generation: Dict[str, int] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "expired": 0,
+                      "evictions": 0, "invalidations": 0}
+        self.route_stats: Dict[str, Dict[str, int]] = {}
+
+    # ---------------------------------------------------------------- 查詢
+
+    def _count(self, route: str, field: str):
+        self.stats[field] += 1
+        counts = self.route_stats.setdefault(route, {"hits": 0, "misses": 0, "coalesced": 0})
+        if field in counts:
+            counts[field] += 1
+
+    def _lookup(self, key: Tuple) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        if entry.expires_at <= self.clock():
+            self._remove(key)
+            self.stats["expired"] += 1
+            return False, None
+        self._entries.move_to_end(key)
+        return True, entry.value
+
+    async def get_or_compute(self, route: str, params: Dict[str, Any],
+                             compute: Callable[[], Awaitable[Any]], ttl: float = DEFAULT_TTL,
+                             devices: Optional[Iterable[str]] = None) -> Any:
+        """
+        取得快取的結果，沒有時計算並寫入快取
+
+        參數:
+            route: 路由名稱（統計與鍵的一部分）
+            params: 查詢參數
+            compute: 計算結果的 coroutine 函式（沒有參數）
+            ttl: 存活時間（秒）
+            devices: 結果涉及的裝置（這些裝置有新資料時失效）；None 表示不指定裝置，只依 TTL 過期
+
+        返回:
+            計算結果（多個請求共用同一個物件）
+        """
+        key = (route, normalize_params(params))
+        found, value = self._lookup(key)
+        if found:
+            self._count(route, "hits")
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count(route, "coalesced")
+            # shield：等待中的請求被取消時，不影響其他請求共用的計算
+            return await asyncio.shield(task)
+
+        self._count(route, "misses")
+        devices = tuple(devices) if devices is not None else None
+        generation = self._generations(devices)
+        task = asyncio.ensure_future(compute())
+        self._inflight[key] = task
+        try:
+            value = await asyncio.shield(task)
+        finally:
+            self._inflight.pop(key, None)
+
+        if self._generations(devices) == generation:
+            self._store(key, _Entry(value, self.clock() + ttl, route, devices))
+        return value
+
+    def _generations(self, devices: Optional[Tuple[str, ...]]):
+        if devices is None:
+            return self._generation
+        return tuple(self._device_generation.get(device, 0) for device in devices)
+
+    # ---------------------------------------------------------------- 寫入與刪除
+
+    def _store(self, key: Tuple, entry: _Entry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        for device in entry.devices or ():
+            self._device_keys.setdefault(device, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    def _remove(self, key: Tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for device in entry.devices or ():
+            keys = self._device_keys.get(device)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._device_keys[device]
+
+    def invalidate(self, device_id: Optional[str] = None) -> int:
+        """
+        刪除裝置相關的快取（device_id 為 None 時清空全部）
+
+        返回:
+            int: 刪除的筆數
+        """
+        if device_id is None:
+            count = len(self._entries)
+            self._entries.clear()
+            self._device_keys.clear()
+            self._generation += 1
+            for device in self._device_generation:
+                self._device_generation[device] += 1
+        else:
+            self._device_generation[device_id] = self._device_generation.get(device_id, 0) + 1
+            keys = list(self._device_keys.get(device_id, ()))
+            for key in keys:
+                self._remove(key)
+            count = len(keys)
+        self.stats["invalidations"] += count
+        return count
+
+    # ---------------------------------------------------------------- 裝飾器與統計
+
+    def cached(self, route: str, ttl: float = DEFAULT_TTL, device_param: Optional[str] = None):
+        """
+        快取 FastAPI 端點的回傳值（以端點的全部參數為鍵）
+
+        參數:
+            route: 路由名稱
+            ttl: 存活時間（秒）
+            device_param: 裝置 ID 參數的名稱（可為逗號分隔的列表）；
+                省略或請求沒有指定裝置時只依 TTL 過期
+        """
+        def decorator(endpoint):
+            if not CACHE_ENABLED:
+                return endpoint
+
+            @functools.wraps(endpoint)
+            async def wrapper(**kwargs):
+                devices = split_devices(kwargs.get(device_param)) if device_param else None
+                return await self.get_or_compute(route, kwargs, lambda: endpoint(**kwargs),
+                                                 ttl=ttl, devices=devices)
+            return wrapper
+        return decorator
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """命中率統計（hits / (hits + misses + coalesced)，共用計算的請求不算命中）"""
+        def rate(counts):
+            total = counts["hits"] + counts["misses"] + counts["coalesced"]
+            return round(counts["hits"] / total, 4) if total else None
+
+        return {
+            **self.stats,
+            "hit_rate": rate(self.stats),
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "inflight": len(self._inflight),
+            "routes": {route: {**counts, "hit_rate": rate(counts)}
+                       for route, counts in self.route_stats.items()},
+        }
+
+# ============================================================================
+# 依新資料失效
+# ============================================================================
+
+class IngestWatcher:
+    """
+    定期檢查最新讀數集合（latest.py），裝置有新資料時刪除該裝置的快取
+
+    最新讀數集合每個（裝置, 感測器）只有一筆，依時間欄位有索引，
+    每次只讀取上次檢查之後更新的文件，查詢成本與讀數筆數無關
+    """
+
+    def __init__(self, cache: ResponseCache, latest, time_field: str,
+                 interval: float = CACHE_POLL_INTERVAL):
+        """
+        參數:
+            cache: 回應快取
+            latest: 最新讀數集合
+            time_field: 讀數的時間欄位
+            interval: 檢查間隔（秒）
+        """
+        self.cache = cache
+        self.latest = latest
+        self.time_field = time_field
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+        self._seen: Dict[Tuple, datetime] = {}
+        self._watermark: Optional[datetime] = None
+        self._primed = False
+
+    def _changes(self):
+        """上次檢查之後有新資料的裝置（在執行緒池執行）"""
+        query = {}
+        if self._watermark is not None:
+            query[self.time_field] = {"$gte": self._watermark - WATCH_OVERLAP}
+        fields = {"_id": 0, "device_id": 1, "sensor_type": 1, self.time_field: 1}
+        return list(self.latest.find(query, fields))
+
+    async def check(self) -> int:
+        """
+        檢查一次新資料並失效對應的快取
+
+        返回:
+            int: 有新資料的裝置數
+        """
+        changed = set()
+        for doc in await run_db(self._changes):
+            timestamp = doc.get(self.time_field)
+            if not isinstance(timestamp, datetime):
+                continue
+            key = (doc.get("device_id"), doc.get("sensor_type"))
+            previous = self._seen.get(key)
+            if previous is None or timestamp > previous:
+                self._seen[key] = timestamp
+                changed.add(doc.get("device_id"))
+            if self._watermark is None or timestamp > self._watermark:
+                self._watermark = timestamp
+        if not self._primed:
+            # 第一次檢查只記錄目前的狀態
+            self._primed = True
+            return 0
+        for device_id in changed:
+            self.cache.invalidate(device_id)
+        return len(changed)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                # 資料庫暫時無法使用時快取仍依 TTL 過期，下次再檢查
+                logger.warning(f"檢查新資料失敗: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> "IngestWatcher":
+        """在目前的事件迴圈啟動背景檢查（API 啟動時呼叫）"""
+        self.task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def stop(self):
+        """停止背景檢查"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -0,0 +1,402 @@
+"""
+資料保留模組
+依集合登記保留期限，過期資料由 MongoDB 整批移除，或由背景排程器分批、限速刪除
+
+以前只有 07/01 有 cleanup_old_data()，而且從來沒有被呼叫；它用一次 delete_many 刪除所有過期資料，
+大集合上是一次長時間、大量 I/O 的掃描，會和資料寫入搶資源；其他服務的資料則會無限成長
+
+保留方式（依集合類型自動選擇，也可在政策中指定 method）：
+- timeseries: 時間序列集合設定 expireAfterSeconds，MongoDB 以整個 bucket 為單位移除
+  （bucket 是依裝置與時間分割的內部分區，不需要逐筆刪除）
+- ttl: 一般集合建立 TTL 索引，由 MongoDB 背景刪除（適合資料量小的事件紀錄）
+- delete: 由 RetentionScheduler 分批刪除，每批之間暫停、每次執行有上限，
+  不會一次佔用大量 I/O；依解析度保留不同期限的彙總集合使用這個方式
+
+RetentionScheduler 在背景執行緒中定期：
+1. 套用 timeseries / ttl 設定（已相同時不做任何事）
+2. 分批刪除 delete 方式的過期資料
+3. 輸出報告：刪除筆數、估計釋放的資料量（刪除筆數 × 平均文件大小）、集合大小
+
+注意：
+- WiredTiger 刪除資料後的空間會留在集合中重複使用（報告的「可重用空間」），
+  不會立即還給作業系統；需要縮小檔案時可在維護時段執行 compact
+- 時間以儲存的本地時間比較；timeseries / ttl 由 MongoDB 以 UTC 判斷，
+  過期時間會相差時區的小時數，對以天計的保留期限沒有影響
+
+執行方式：
+    python retention.py                        # 顯示各集合的保留政策與狀態
+    python retention.py --apply                # 套用 timeseries / ttl 設定
+    python retention.py sensor_readings_rollups --run   # 執行一次分批刪除
+"""
+
+import argparse
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import OperationFailure
+
+from rollups import ROLLUP_SOURCES, rollup_collection_name
+from timeseries import collection_type
+from timestamps import now
+
+# ============================================================================
+# 預設設定
+# ============================================================================
+
+MONGO_URI = "mongodb://localhost:27017/"
+MONGO_DB = "iot_data"
+
+METHOD_TIMESERIES = "timeseries"
+METHOD_TTL = "ttl"
+METHOD_DELETE = "delete"
+
+TTL_INDEX_NAME = "retention_ttl"
+
+RETENTION_INTERVAL = 3600       # 排程器執行間隔（秒）
+DELETE_BATCH_SIZE = 1000        # 每批刪除筆數
+DELETE_PAUSE = 0.2              # 每批之間暫停（秒），讓出 I/O 給資料寫入
+MAX_DELETES_PER_RUN = 100000    # 每個集合每次執行最多刪除筆數，其餘留到下一次
+
+# 彙總集合依解析度保留（天數；None 表示永久保留）
+ROLLUP_RETENTION_DAYS = {"1m": 90, "1h": 730, "1d": None}
+
+# 集合名稱 → 保留政策
+#   field: 時間欄位
+#   days: 保留天數；依某個欄位的值保留不同期限時為 {值: 天數}，並以 key 指定欄位
+#   method: 保留方式（省略則時間序列集合為 timeseries，其他為 delete）
+RETENTION_POLICIES: Dict[str, Dict] = {
+    # 原始讀數
+    "sensor_data": {"field": "timestamp", "days": 7},           # 02 文件模式
+    "sensor_buckets": {"field": "start", "days": 7},            # 02 分桶模式
+    "sensor_readings": {"field": "stored_at", "days": 7},       # 05、06
+    "environmental_data": {"field": "timestamp", "days": 30},   # 07/01（config.DATA_RETENTION_DAYS）
+    "sensor_logs": {"field": "timestamp", "days": 30},          # 07/02
+    # 事件紀錄（資料量小，使用 TTL 索引）
+    "device_alerts": {"field": "created_at", "days": 90, "method": METHOD_TTL},      # 06
+    "alerts": {"field": "timestamp", "days": 90, "method": METHOD_TTL},              # 07/03
+    "control_history": {"field": "timestamp", "days": 90, "method": METHOD_TTL},     # 07/05
+}
+for _source in ROLLUP_SOURCES:
+    RETENTION_POLICIES[rollup_collection_name(_source)] = {
+        "field": "start", "key": "resolution", "days": dict(ROLLUP_RETENTION_DAYS)
+    }
+
+def policy_for(name: str, days=None) -> Dict:
+    """
+    取得集合登記的保留政策
+
+    參數:
+        name: 登記的集合名稱
+        days: 覆寫保留天數（例如服務設定檔的 DATA_RETENTION_DAYS）
+    """
+    policy = dict(RETENTION_POLICIES[name])
+    if days is not None:
+        policy["days"] = days
+    return policy
+
+# ============================================================================
+# 套用設定
+# ============================================================================
+
+def resolve_method(db, name: str, policy: Dict) -> str:
+    """決定集合的保留方式（時間序列集合一律使用 expireAfterSeconds）"""
+    if collection_type(db, name) == "timeseries":
+        return METHOD_TIMESERIES
+    return policy.get("method", METHOD_DELETE)
+
+def _seconds(days) -> Optional[int]:
+    return None if days is None else int(days * 86400)
+
+def apply_policy(db, name: str, policy: Dict) -> str:
+    """
+    套用 timeseries / ttl 設定（delete 方式不需要設定）
+
+    依解析度保留不同期限的政策不能使用單一的 expireAfterSeconds，一律使用 delete
+
+    返回:
+        str: 保留方式
+    """
+    method = resolve_method(db, name, policy)
+    days = policy["days"]
+    if isinstance(days, dict):
+        return METHOD_DELETE
+    seconds = _seconds(days)
+
+    if method == METHOD_TIMESERIES:
+        current = None
+        for info in db.list_collections(filter={"name": name}):
+            current = info.get("options", {}).get("expireAfterSeconds")
+        if current != seconds:
+            db.command("collMod", name, expireAfterSeconds=seconds if seconds is not None else "off")
+            print(f"✓ {name}: 時間序列集合保留 {days} 天（MongoDB 整批移除過期 bucket）")
+    elif method == METHOD_TTL and seconds is not None:
+        collection = db[name]
+        try:
+            collection.create_index([(policy["field"], ASCENDING)], name=TTL_INDEX_NAME,
+                                    expireAfterSeconds=seconds)
+        except OperationFailure:
+            # 已存在但保留期限不同：直接修改 TTL 索引
+            db.command("collMod", name, index={"name": TTL_INDEX_NAME, "expireAfterSeconds": seconds})
+            print(f"✓ {name}: TTL 索引改為保留 {days} 天")
+    return method
+
+def apply_retention(collection, name: Optional[str] = None, days=None) -> str:
+    """
+    套用集合登記的保留政策（服務啟動時呼叫，重複執行沒有影響）
+
+    參數:
+        collection: MongoDB 集合
+        name: 登記的集合名稱（省略則使用集合名稱）
+        days: 覆寫保留天數
+
+    返回:
+        str: 保留方式；delete 方式需要另外執行 RetentionScheduler
+    """
+    try:
+        return apply_policy(collection.database, collection.name,
+                            policy_for(name or collection.name, days))
+    except OperationFailure as e:
+        print(f"⚠ 無法套用 {collection.name} 的保留政策: {e}")
+        return METHOD_DELETE
+
+# ============================================================================
+# 分批刪除
+# ============================================================================
+
+def expired_filters(policy: Dict, current: Optional[datetime] = None) -> List[Dict]:
+    """過期資料的查詢條件（依解析度保留時每個解析度一個條件，永久保留的不包含）"""
+    current = current or now()
+    field, days = policy["field"], policy["days"]
+    if not isinstance(days, dict):
+        if days is None:
+            return []
+        return [{field: {"$lt": current - timedelta(days=days)}}]
+    return [{policy["key"]: value, field: {"$lt": current - timedelta(days=value_days)}}
+            for value, value_days in days.items() if value_days is not None]
+
+def collection_stats(db, name: str) -> Dict:
+    """集合大小（collStats；無法取得時為空字典）"""
+    try:
+        stats = db.command("collStats", name)
+    except OperationFailure:
+        return {}
+    return {
+        "count": stats.get("count", 0),
+        "size": stats.get("size", 0),
+        "avg_obj_size": stats.get("avgObjSize", 0),
+        "storage_size": stats.get("storageSize", 0),
+        "free_storage_size": stats.get("freeStorageSize", 0)
+    }
+
+def format_bytes(size: float) -> str:
+    """位元組數轉為易讀的單位"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+class RetentionScheduler:
+    """
+    背景保留排程器
+
+    使用方式：
+        scheduler = RetentionScheduler(db, {"sensor_readings": policy_for("sensor_readings")})
+        scheduler.start()
+        ...
+        scheduler.stop()
+    """
+
+    def __init__(self, db, policies: Dict[str, Dict], interval: float = RETENTION_INTERVAL,
+                 batch_size: int = DELETE_BATCH_SIZE, pause: float = DELETE_PAUSE,
+                 max_deletes: int = MAX_DELETES_PER_RUN, log: Callable[[str], None] = print):
+        """
+        參數:
+            db: MongoDB 資料庫
+            policies: 集合名稱 → 保留政策（policy_for() 取得）
+            interval: 執行間隔（秒）
+            batch_size: 每批刪除筆數
+            pause: 每批之間暫停（秒）
+            max_deletes: 每個集合每次執行最多刪除筆數
+            log: 報告輸出函式（例如 logger.info）
+        """
+        self.db = db
+        self.policies = policies
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.max_deletes = max_deletes
+        self.log = log
+
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {
+            'runs': 0,
+            'deleted': 0,
+            'reclaimed_bytes': 0,
+            'last_error': None
+        }
+
+    def start(self):
+        """啟動背景執行緒（啟動後立即執行第一次）"""
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 10):
+        """停止背景執行緒（刪除中的批次完成後停止）"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.stats['last_error'] = str(e)
+                self.log(f"✗ 資料保留執行失敗: {e}")
+            self.stop_event.wait(self.interval)
+
+    def _delete_expired(self, collection, query: Dict, limit: int) -> int:
+        """分批刪除符合條件的資料（每批以 _id 刪除，批次之間暫停）"""
+        deleted = 0
+        while deleted < limit and not self.stop_event.is_set():
+            batch = min(self.batch_size, limit - deleted)
+            ids = [doc["_id"] for doc in collection.find(query, {"_id": 1}).limit(batch)]
+            if not ids:
+                break
+            deleted += collection.delete_many({"_id": {"$in": ids}}).deleted_count
+            if len(ids) < batch:
+                break
+            self.stop_event.wait(self.pause)
+        return deleted
+
+    def run_once(self) -> List[Dict]:
+        """
+        執行一次：套用設定、分批刪除並輸出報告
+
+        返回:
+            每個集合的報告 [{collection, method, deleted, reclaimed_bytes, pending, size, free_storage_size}]
+        """
+        reports = []
+        for name, policy in self.policies.items():
+            method = apply_policy(self.db, name, policy)
+            collection = self.db[name]
+            before = collection_stats(self.db, name)
+            deleted = 0
+            start = time.perf_counter()
+
+            filters = expired_filters(policy)
+            if method == METHOD_DELETE:
+                for query in filters:
+                    deleted += self._delete_expired(collection, query, self.max_deletes - deleted)
+
+            # 尚未刪除的過期資料（delete 超過每次上限、或等待 MongoDB 背景刪除）
+            pending = sum(collection.count_documents(query) for query in filters)
+            after = collection_stats(self.db, name)
+            report = {
+                "collection": name,
+                "method": method,
+                "deleted": deleted,
+                "reclaimed_bytes": deleted * before.get("avg_obj_size", 0),
+                "pending": pending,
+                "size": after.get("size", 0),
+                "free_storage_size": after.get("free_storage_size", 0),
+                "seconds": time.perf_counter() - start
+            }
+            reports.append(report)
+            self.stats['deleted'] += deleted
+            self.stats['reclaimed_bytes'] += report["reclaimed_bytes"]
+            self.log(format_report(report))
+
+        self.stats['runs'] += 1
+        return reports
+
+    def get_statistics(self) -> Dict:
+        """累計統計（執行次數、刪除筆數、估計釋放的資料量）"""
+        return dict(self.stats)
+
+def format_report(report: Dict) -> str:
+    """一個集合的報告轉為一行文字"""
+    text = f"資料保留 {report['collection']}（{report['method']}）: "
+    if report["method"] == METHOD_DELETE:
+        text += (f"刪除 {report['deleted']:,} 筆，約 {format_bytes(report['reclaimed_bytes'])}，"
+                 f"耗時 {report['seconds']:.1f} 秒")
+    else:
+        text += "由 MongoDB 背景移除"
+    if report["pending"]:
+        text += f"，尚有 {report['pending']:,} 筆過期"
+    return (text + f"；資料 {format_bytes(report['size'])}，"
+            f"可重用空間 {format_bytes(report['free_storage_size'])}")
+
+def start_scheduler(db, policies: Dict[str, Dict], logger: Optional[logging.Logger] = None,
+                    **options) -> Optional[RetentionScheduler]:
+    """
+    建立並啟動排程器；所有集合都由 MongoDB 處理（timeseries / ttl）時只套用設定，不啟動執行緒
+
+    返回:
+        RetentionScheduler，或 None（不需要背景執行緒）
+    """
+    log = logger.info if logger is not None else print
+    methods = {}
+    for name, policy in policies.items():
+        try:
+            methods[name] = apply_policy(db, name, policy)
+        except OperationFailure as e:
+            log(f"⚠ 無法套用 {name} 的保留政策: {e}")
+            methods[name] = METHOD_DELETE
+    if METHOD_DELETE not in methods.values():
+        return None
+    scheduler = RetentionScheduler(db, policies, log=log, **options)
+    scheduler.start()
+    return scheduler
+
+# ============================================================================
+# 命令列
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='資料保留管理')
+    parser.add_argument('collections', nargs='*',
+                        help=f"集合（預設全部: {', '.join(sorted(RETENTION_POLICIES))}）")
+    parser.add_argument('--uri', default=MONGO_URI, help='MongoDB 連接字串')
+    parser.add_argument('--db', default=MONGO_DB, help='資料庫名稱')
+    parser.add_argument('--apply', action='store_true', help='套用 timeseries / ttl 設定')
+    parser.add_argument('--run', action='store_true', help='執行一次分批刪除（delete 方式）')
+    parser.add_argument('--batch-size', type=int, default=DELETE_BATCH_SIZE, help='每批刪除筆數')
+    parser.add_argument('--pause', type=float, default=DELETE_PAUSE, help='每批之間暫停（秒）')
+    args = parser.parse_args()
+    unknown = [name for name in args.collections if name not in RETENTION_POLICIES]
+    if unknown:
+        parser.error(f"沒有登記保留政策的集合: {', '.join(unknown)}")
+
+    client = MongoClient(args.uri)
+    try:
+        db = client[args.db]
+        names = [name for name in (args.collections or sorted(RETENTION_POLICIES))
+                 if name in db.list_collection_names()]
+        policies = {name: policy_for(name) for name in names}
+
+        if args.run:
+            RetentionScheduler(db, policies, batch_size=args.batch_size,
+                               pause=args.pause, max_deletes=float("inf")).run_once()
+            return
+
+        print("=" * 60)
+        print(f"資料保留政策: {args.db}")
+        print("=" * 60)
+        for name, policy in policies.items():
+            method = apply_policy(db, name, policy) if args.apply else resolve_method(db, name, policy)
+            pending = sum(db[name].count_documents(query) for query in expired_filters(policy))
+            stats = collection_stats(db, name)
+            print(f"  {name:<28} {method:<10} 保留 {policy['days']}  "
+                  f"過期 {pending:,} 筆  資料 {format_bytes(stats.get('size', 0))}")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+"""
+多解析度彙總（rollup）模組
+寫入讀數時同步累加每分鐘、每小時、每天的統計，統計 API 改讀彙總文件而不是掃描原始讀數
+
+以前的統計 API 每次請求都對原始讀數做 $group：每 5 秒一筆的裝置 30 天約 52 萬筆，
+請求越多、時間範圍越長越慢；彙總文件依寫入累加，30 天的統計只需要讀約 30 個每日文件
+
+彙總文件（集合名稱為「原始集合_rollups」，例如 sensor_readings_rollups）：
+
+    {
+      device_id, sensor_type,          # 分組欄位（與原始讀數相同）
+      resolution: "1m" | "1h" | "1d",  # 解析度
+      start,                           # 區間起始時間（對齊分鐘、整點、午夜）
+      count, sum, sum_sq,              # 筆數、總和、平方和（平均值與標準差）
+      min, max,                        # 最小、最大值
+      first, last                      # 區間內最早、最晚的讀數時間
+    }
+
+寫入：
+- RollupWriter.apply() 把一批讀數在記憶體中先合併，每個（分組, 解析度, 區間）只產生一個
+  $inc/$min/$max upsert，再以 bulk_write(ordered=False) 一次送出
+- 只累加數值讀數（布林值、字串等不計入），count 為數值讀數的筆數
+- 只彙總實際寫入成功的讀數；重複鍵（冪等寫入略過的重送資料）不會重複累加
+
+查詢：
+- plan_ranges() 把時間範圍拆成「開頭不滿一分鐘的原始讀數 → 分鐘 → 小時 → 天」，
+  結束時間有指定時再反向拆回小時、分鐘與原始讀數；
+  結束時間為現在（None）時最後一個區間就是目前累加中的彙總，不需要再拆
+- summarize(): 統計（筆數、平均、最小、最大、標準差、最早/最晚時間）
+- series(): 固定間隔的時間序列（圖表）
+
+時間對齊方式與其他模組相同：以儲存的（本地）時間對齊，每天從午夜開始
+
+已有資料的集合第一次啟用時，先停止資料收集服務再重建彙總（MongoDB 5.0 以上）：
+    python rollups.py sensor_readings --rebuild
+"""
+
+import argparse
+import math
+from datetime import datetime, timedelta
+from numbers import Number
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from indexes import ensure_indexes
+
+# ============================================================================
+# 預設設定
+# ============================================================================
+
+MONGO_URI = "mongodb://localhost:27017/"
+MONGO_DB = "iot_data"
+
+# 解析度名稱 → 秒數（由細到粗）
+RESOLUTIONS: Dict[str, int] = {
+    "1m": 60,
+    "1h": 3600,
+    "1d": 86400,
+}
+
+# 重建彙總時 $dateTrunc 的單位
+_TRUNC_UNITS = {"1m": "minute", "1h": "hour", "1d": "day"}
+
+# 原始集合 → 讀數時間欄位（寫入與查詢都使用這個欄位對齊區間）
+ROLLUP_SOURCES: Dict[str, str] = {
+    "sensor_data": "timestamp",             # 02_pi_basics/fastapi_app
+    "sensor_readings": "stored_at",         # 05_integration、06_multi_device
+    "environmental_data": "timestamp",      # 07_example_projects/01_environmental_monitor
+    "sensor_logs": "timestamp",             # 07_example_projects/02_data_logger
+}
+
+KEY_FIELDS = ("device_id", "sensor_type")   # 分組欄位
+VALUE_FIELD = "value"
+
+DUPLICATE_KEY_ERROR = 11000
+
+_EPOCH = datetime(1970, 1, 1)
+
+def rollup_collection_name(source: str) -> str:
+    """原始集合對應的彙總集合名稱"""
+    return f"{source}_rollups"
+
+# ============================================================================
+# 時間區間
+# ============================================================================
+
+def floor_time(timestamp: datetime, seconds: int) -> datetime:
+    """時間向下對齊到 seconds 的倍數（從 1970-01-01 起算，每天對齊午夜）"""
+    offset = int((timestamp - _EPOCH).total_seconds()) // seconds * seconds
+    return _EPOCH + timedelta(seconds=offset)
+
+def ceil_time(timestamp: datetime, seconds: int) -> datetime:
+    """時間向上對齊到 seconds 的倍數（已對齊時不變）"""
+    floor = floor_time(timestamp, seconds)
+    return floor if floor == timestamp else floor + timedelta(seconds=seconds)
+
+def plan_ranges(start: Optional[datetime], end: Optional[datetime] = None,
+                coarsest: Optional[str] = "1d") -> List[Tuple[Optional[str], Optional[datetime], Optional[datetime]]]:
+    """
+    把查詢的時間範圍拆成各解析度的區間
+
+    參數:
+        start: 開始時間（包含；None 表示全部資料）
+        end: 結束時間（不包含；None 表示到現在）
+        coarsest: 最粗使用的解析度（None 表示全部使用原始讀數）
+
+    返回:
+        [(解析度, 區間開始, 區間結束), ...]，解析度為 None 的區間查詢原始讀數
+    """
+    if coarsest is None:
+        return [(None, start, end)]
+    levels = [(name, seconds) for name, seconds in RESOLUTIONS.items()
+              if seconds <= RESOLUTIONS[coarsest]]
+    if start is None:
+        return [(coarsest, None, end)]
+
+    segments = []
+    cursor, current = start, None
+
+    # 由細到粗：對齊到下一個分鐘、整點、午夜
+    for name, seconds in levels:
+        boundary = ceil_time(cursor, seconds)
+        if end is not None and boundary > end:
+            break
+        if boundary > cursor:
+            segments.append((current, cursor, boundary))
+        cursor, current = boundary, name
+    else:
+        if end is None:
+            segments.append((current, cursor, None))
+            return segments
+
+    # 由粗到細：剩下的範圍用目前可用的最粗解析度，不滿一個區間的部分再往下拆
+    for name, seconds in reversed(levels):
+        if current is None or RESOLUTIONS[name] > RESOLUTIONS[current]:
+            continue
+        boundary = floor_time(end, seconds)
+        if boundary > cursor:
+            segments.append((name, cursor, boundary))
+            cursor = boundary
+    if cursor < end:
+        segments.append((None, cursor, end))
+    return segments
+
+# ============================================================================
+# 寫入
+# ============================================================================
+
+def _is_number(value) -> bool:
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+class RollupWriter:
+    """
+    讀數寫入後累加到彙總集合
+
+    使用方式：
+        rollups = RollupWriter.for_collection(collection)
+        collection.insert_many(docs)
+        rollups.apply(docs)
+    """
+
+    def __init__(self, collection, time_field: str,
+                 resolutions: Sequence[str] = tuple(RESOLUTIONS)):
+        """
+        參數:
+            collection: 彙總集合
+            time_field: 讀數的時間欄位（BSON 日期）
+            resolutions: 要維護的解析度
+        """
+        self.collection = collection
+        self.time_field = time_field
+        self.resolutions = [(name, RESOLUTIONS[name]) for name in resolutions]
+
+    @classmethod
+    def for_collection(cls, source, name: Optional[str] = None) -> "RollupWriter":
+        """
+        建立原始集合的彙總寫入器（並建立彙總集合的索引）
+
+        參數:
+            source: 原始讀數集合
+            name: 登記的集合名稱（省略則使用集合名稱；集合名稱可自訂時傳入登記名稱）
+        """
+        name = name or source.name
+        collection = source.database[rollup_collection_name(source.name)]
+        ensure_indexes(collection, rollup_collection_name(name))
+        return cls(collection, ROLLUP_SOURCES[name])
+
+    def operations(self, documents: Iterable[Dict]) -> List[UpdateOne]:
+        """
+        一批讀數合併成的更新操作（每個分組、解析度、區間一個 upsert）
+
+        沒有時間或數值不是數字的讀數不計入
+        """
+        groups = {}
+        for doc in documents:
+            value = doc.get(VALUE_FIELD)
+            timestamp = doc.get(self.time_field)
+            if not _is_number(value) or not isinstance(timestamp, datetime):
+                continue
+            key = tuple(doc.get(field) for field in KEY_FIELDS)
+            for name, seconds in self.resolutions:
+                slot = (key, name, floor_time(timestamp, seconds))
+                acc = groups.get(slot)
+                if acc is None:
+                    groups[slot] = [1, value, value * value, value, value, timestamp, timestamp]
+                    continue
+                acc[0] += 1
+                acc[1] += value
+                acc[2] += value * value
+                acc[3] = min(acc[3], value)
+                acc[4] = max(acc[4], value)
+                acc[5] = min(acc[5], timestamp)
+                acc[6] = max(acc[6], timestamp)
+
+        operations = []
+        for (key, name, start), (count, total, total_sq, low, high, first, last) in groups.items():
+            selector = dict(zip(KEY_FIELDS, key))
+            selector["resolution"] = name
+            selector["start"] = start
+            operations.append(UpdateOne(selector, {
+                "$inc": {"count": count, "sum": total, "sum_sq": total_sq},
+                "$min": {"min": low, "first": first},
+                "$max": {"max": high, "last": last}
+            }, upsert=True))
+        return operations
+
+    def apply(self, documents: Iterable[Dict]) -> int:
+        """
+        累加一批已寫入的讀數
+
+        兩個程序同時建立同一個彙總文件時，其中一個會得到重複鍵錯誤，
+        這時文件已經存在，重試一次即可累加上去
+
+        返回:
+            int: 更新的彙總文件數
+        """
+        operations = self.operations(documents)
+        if not operations:
+            return 0
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            retry = [operations[err["index"]] for err in e.details.get("writeErrors", [])
+                     if err.get("code") == DUPLICATE_KEY_ERROR]
+            if len(retry) < len(e.details.get("writeErrors", [])) or not retry:
+                raise
+            self.collection.bulk_write(retry, ordered=False)
+        return len(operations)
+
+def written_documents(documents: List[Dict], error: BulkWriteError) -> List[Dict]:
+    """insert_many(ordered=False) 部分失敗時，實際寫入成功的文件"""
+    failed = {err["index"] for err in error.details.get("writeErrors", [])}
+    return [doc for i, doc in enumerate(documents) if i not in failed]
+
+# ============================================================================
+# 查詢
+# ============================================================================
+
+def _time_condition(start: Optional[datetime], end: Optional[datetime]) -> Dict:
+    condition = {}
+    if start is not None:
+        condition["$gte"] = start
+    if end is not None:
+        condition["$lt"] = end
+    return condition
+
+def _split(segments) -> Tuple[Optional[Dict], List[Dict]]:
+    """區間 → (彙總文件的查詢條件, 原始讀數的時間條件列表)"""
+    rollup_ranges, raw_ranges = [], []
+    for resolution, seg_start, seg_end in segments:
+        condition = _time_condition(seg_start, seg_end)
+        if resolution is None:
+            raw_ranges.append(condition)
+            continue
+        part = {"resolution": resolution}
+        if condition:
+            part["start"] = condition
+        rollup_ranges.append(part)
+    if not rollup_ranges:
+        return None, raw_ranges
+    if len(rollup_ranges) == 1:
+        return rollup_ranges[0], raw_ranges
+    return {"$or": rollup_ranges}, raw_ranges
+
+def _with(match: Dict, extra: Dict) -> Dict:
+    return {"$and": [match, extra]} if match else extra
+
+def _raw_match(match: Dict, time_field: str, ranges: List[Dict]) -> Dict:
+    times = [{time_field: condition} if condition else {} for condition in ranges]
+    extra = times[0] if len(times) == 1 else {"$or": times}
+    extra = dict(extra)
+    extra[VALUE_FIELD] = {"$type": "number"}
+    return _with(match, extra)
+
+def _merge(target: Dict, other: Dict) -> Dict:
+    """合併兩組（count, sum, sum_sq, min, max, first, last）"""
+    if not target:
+        return dict(other)
+    target["count"] += other["count"]
+    target["sum"] += other["sum"]
+    target["sum_sq"] += other["sum_sq"]
+    for field, pick in (("min", min), ("max", max), ("first", min), ("last", max)):
+        values = [v for v in (target.get(field), other.get(field)) if v is not None]
+        target[field] = pick(values) if values else None
+    return target
+
+def _finish(acc: Dict) -> Dict:
+    """加上平均值與母體標準差（與 $avg、$stdDevPop 相同）"""
+    count = acc["count"]
+    mean = acc["sum"] / count if count else None
+    std_dev = None
+    if count:
+        std_dev = math.sqrt(max(acc["sum_sq"] / count - mean * mean, 0.0))
+    return {**acc, "avg": mean, "std_dev": std_dev}
+
+def summarize(rollups, raw, match: Dict, time_field: str,
+              start: Optional[datetime] = None, end: Optional[datetime] = None,
+              group_by: Optional[str] = None):
+    """
+    統計時間範圍內的讀數
+
+    參數:
+        rollups: 彙總集合
+        raw: 原始讀數集合（查詢不滿一分鐘的頭尾）
+        match: 分組欄位的條件（只能使用 device_id、sensor_type）
+        time_field: 原始讀數的時間欄位
+        start: 開始時間（None 表示全部資料）
+        end: 結束時間（None 表示到現在）
+        group_by: 分組欄位（例如 device_id）；None 表示全部合併
+
+    返回:
+        {count, sum, sum_sq, min, max, first, last, avg, std_dev}；
+        group_by 時為 {分組值: 統計}；沒有資料時為 None（group_by 時為空字典）
+    """
+    rollup_match, raw_ranges = _split(plan_ranges(start, end))
+    key = f"${group_by}" if group_by else None
+    results = {}
+
+    if rollup_match is not None:
+        for row in rollups.aggregate([
+            {"$match": _with(match, rollup_match)},
+            {"$group": {
+                "_id": key,
+                "count": {"$sum": "$count"},
+                "sum": {"$sum": "$sum"},
+                "sum_sq": {"$sum": "$sum_sq"},
+                "min": {"$min": "$min"},
+                "max": {"$max": "$max"},
+                "first": {"$min": "$first"},
+                "last": {"$max": "$last"}
+            }}
+        ]):
+            group = row.pop("_id")
+            results[group] = _merge(results.get(group), row)
+
+    if raw_ranges:
+        value = f"${VALUE_FIELD}"
+        for row in raw.aggregate([
+            {"$match": _raw_match(match, time_field, raw_ranges)},
+            {"$group": {
+                "_id": key,
+                "count": {"$sum": 1},
+                "sum": {"$sum": value},
+                "sum_sq": {"$sum": {"$multiply": [value, value]}},
+                "min": {"$min": value},
+                "max": {"$max": value},
+                "first": {"$min": f"${time_field}"},
+                "last": {"$max": f"${time_field}"}
+            }}
+        ]):
+            group = row.pop("_id")
+            results[group] = _merge(results.get(group), row)
+
+    results = {group: _finish(acc) for group, acc in results.items() if acc["count"]}
+    if group_by:
+        return results
+    return results.get(None)
+
+def series_resolution(interval_seconds: int) -> Optional[str]:
+    """能組成指定間隔的最粗解析度（間隔不是整分鐘時為 None，全部使用原始讀數）"""
+    best = None
+    for name, seconds in RESOLUTIONS.items():
+        if interval_seconds % seconds == 0:
+            best = name
+    return best
+
+def series(rollups, raw, match: Dict, time_field: str, start: datetime,
+           interval_seconds: int, end: Optional[datetime] = None) -> List[Dict]:
+    """
+    固定間隔的時間序列
+
+    區間以 1970-01-01 起算對齊（與 $toLong(時間) 取餘數分組相同）
+
+    參數:
+        rollups: 彙總集合
+        raw: 原始讀數集合
+        match: 分組欄位的條件
+        time_field: 原始讀數的時間欄位
+        start: 開始時間
+        interval_seconds: 間隔（秒）
+        end: 結束時間（None 表示到現在）
+
+    返回:
+        依時間排序的 [{start, count, avg, min, max, first, last}]；
+        first 為區間內最早的讀數時間
+    """
+    rollup_match, raw_ranges = _split(plan_ranges(start, end, series_resolution(interval_seconds)))
+    points: Dict[datetime, Dict] = {}
+
+    def add(timestamp, acc):
+        slot = floor_time(timestamp, interval_seconds)
+        points[slot] = _merge(points.get(slot), acc)
+
+    if rollup_match is not None:
+        fields = {"_id": 0, "start": 1, "count": 1, "sum": 1, "sum_sq": 1,
+                  "min": 1, "max": 1, "first": 1, "last": 1}
+        for doc in rollups.find(_with(match, rollup_match), fields):
+            add(doc.pop("start"), doc)
+
+    if raw_ranges:
+        for doc in raw.find(_raw_match(match, time_field, raw_ranges),
+                            {"_id": 0, time_field: 1, VALUE_FIELD: 1}):
+            value, timestamp = doc[VALUE_FIELD], doc[time_field]
+            add(timestamp, {"count": 1, "sum": value, "sum_sq": value * value,
+                            "min": value, "max": value, "first": timestamp, "last": timestamp})
+
+    return [{"start": slot, **_finish(points[slot])} for slot in sorted(points)]
+
+# ============================================================================
+# 重建彙總
+# ============================================================================
+
+def rebuild(source, name: Optional[str] = None) -> int:
+    """
+    由原始讀數重新計算全部彙總（MongoDB 5.0 以上，使用 $dateTrunc 與 $merge）
+
+    會先刪除原有的彙總；重建期間寫入的讀數會被重複或遺漏累加，執行前請先停止資料收集服務
+
+    參數:
+        source: 原始讀數集合
+        name: 登記的集合名稱（省略則使用集合名稱）
+
+    返回:
+        int: 彙總文件數
+    """
+    writer = RollupWriter.for_collection(source, name)
+    time_field = writer.time_field
+    target = writer.collection
+    target.delete_many({})
+
+    value = f"${VALUE_FIELD}"
+    for name, _ in writer.resolutions:
+        source.aggregate([
+            {"$match": {VALUE_FIELD: {"$type": "number"}, time_field: {"$type": "date"},
+                        **{field: {"$exists": True} for field in KEY_FIELDS}}},
+            {"$group": {
+                "_id": {
+                    **{field: f"${field}" for field in KEY_FIELDS},
+                    "start": {"$dateTrunc": {"date": f"${time_field}", "unit": _TRUNC_UNITS[name]}}
+                },
+                "count": {"$sum": 1},
+                "sum": {"$sum": value},
+                "sum_sq": {"$sum": {"$multiply": [value, value]}},
+                "min": {"$min": value},
+                "max": {"$max": value},
+                "first": {"$min": f"${time_field}"},
+                "last": {"$max": f"${time_field}"}
+            }},
+            {"$project": {
+                "_id": 0,
+                **{field: f"$_id.{field}" for field in KEY_FIELDS},
+                "resolution": {"$literal": name},
+                "start": "$_id.start",
+                "count": 1, "sum": 1, "sum_sq": 1, "min": 1, "max": 1, "first": 1, "last": 1
+            }},
+            {"$merge": {"into": target.name, "on": [*KEY_FIELDS, "resolution", "start"],
+                        "whenMatched": "replace", "whenNotMatched": "insert"}}
+        ], allowDiskUse=True)
+    return target.count_documents({})
+
+def main():
+    parser = argparse.ArgumentParser(description='讀數彙總（rollup）管理')
+    parser.add_argument('collection', choices=sorted(ROLLUP_SOURCES), help='原始讀數集合')
+    parser.add_argument('--uri', default=MONGO_URI, help='MongoDB 連接字串')
+    parser.add_argument('--db', default=MONGO_DB, help='資料庫名稱')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='由原始讀數重建全部彙總（請先停止資料收集服務）')
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    try:
+        source = client[args.db][args.collection]
+        target = source.database[rollup_collection_name(args.collection)]
+        if args.rebuild:
+            print(f"重建彙總: {args.collection} → {target.name} ...")
+            print(f"✓ 完成，共 {rebuild(source):,} 個彙總文件")
+        for name in RESOLUTIONS:
+            print(f"  {name}: {target.count_documents({'resolution': name}):,} 個文件")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+水平擴充模組
+讓多個資料收集程序（worker）透過 MQTT 共享訂閱分攤同一個訊息流，並以冪等寫入避免重複資料
+
+功能：
+- shared_topic(): 產生 MQTT v5 共享訂閱主題 $share/<群組>/<主題>，
+  Broker 會把每則訊息只交給群組中的一個 worker
+- create_mqtt_client(): 共享訂閱模式使用 MQTT v5，每個 worker 有自己的 client_id
+- connect_mqtt_client(): 共享訂閱模式以持續的工作階段連線（clean_start=False），
+  worker 重新啟動後接回原本的訂閱與尚未確認的訊息
+- ingest_key(): 每筆讀數的唯一鍵（裝置 + 感測器 + 裝置時間 + 序號），沒有裝置時間的讀數拒絕
+- upsert_new(): 以唯一鍵做無序批次 upsert，QoS 1 重送或 worker 重新啟動都不會產生重複資料，
+  並回傳實際新寫入的文件（給只處理新資料的後續步驟，例如彙總）
+
+環境變數（各服務的預設值）：
+    INGEST_SHARE_GROUP   共享訂閱群組名稱（未設定則為一般訂閱）
+    INGEST_WORKER_ID     worker 編號（預設 0）
+    INGEST_SESSION_EXPIRY  worker 斷線後 Broker 保留工作階段的秒數（預設 3600）
+"""
+
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from sensor_decoder import PayloadValidationError
+
+# ============================================================================
+# 預設設定
+# ============================================================================
+
+SHARE_GROUP = os.environ.get("INGEST_SHARE_GROUP") or None
+WORKER_ID = os.environ.get("INGEST_WORKER_ID", "0")
+SESSION_EXPIRY = int(os.environ.get("INGEST_SESSION_EXPIRY") or 3600)
+
+INGEST_KEY_FIELD = "ingest_key"     # 儲存唯一鍵的欄位
+SEQUENCE_FIELDS = ("seq", "sequence")   # 裝置送來的序號欄位（有的話加入唯一鍵）
+
+DUPLICATE_KEY_ERROR = 11000
+
+# ============================================================================
+# MQTT 共享訂閱
+# ============================================================================
+
+def shared_topic(topic: str, group: Optional[str] = SHARE_GROUP) -> str:
+    """
+    產生共享訂閱主題
+
+    參數:
+        topic: 原本的主題（例如 sensors/#）
+        group: 共享群組名稱，None 表示一般訂閱
+
+    返回:
+        str: $share/<group>/<topic> 或原本的主題
+    """
+    if not group:
+        return topic
+    return f"$share/{group}/{topic}"
+
+def worker_client_id(base: str, group: Optional[str] = SHARE_GROUP,
+                     worker_id: str = WORKER_ID) -> str:
+    """
+    產生 worker 的 client_id
+
+    同一個 client_id 同時只能有一個連線，共享訂閱模式下每個 worker 必須不同；
+    固定的編號讓 worker 重新啟動後能接回自己的工作階段
+
+    參數:
+        base: 原本的 client_id（例如 data_collector）
+        group: 共享群組名稱，None 時直接回傳 base
+        worker_id: worker 編號
+    """
+    if not group:
+        return base
+    return f"{base}_{group}_{worker_id}"
+
+def create_mqtt_client(client_id: str, group: Optional[str] = SHARE_GROUP) -> mqtt.Client:
+    """
+    建立 MQTT 客戶端
+
+    共享訂閱模式使用 MQTT v5；回調函式需相容兩種版本的參數，例如：
+        def on_connect(client, userdata, flags, rc, properties=None)
+        def on_disconnect(client, userdata, rc, properties=None)
+    連線時使用 connect_mqtt_client()，共享訂閱模式才會保留工作階段
+
+    參數:
+        client_id: 客戶端 ID
+        group: 共享群組名稱，None 表示使用 MQTT v3.1.1
+    """
+    if group:
+        return mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+    return mqtt.Client(client_id=client_id)
+
+def connect_mqtt_client(client: mqtt.Client, host: str, port: int, keepalive: int = 60,
+                        group: Optional[str] = SHARE_GROUP,
+                        session_expiry: int = SESSION_EXPIRY):
+    """
+    連接到 MQTT Broker
+
+    共享訂閱模式以持續的工作階段連線（clean_start=False，斷線後保留 session_expiry 秒），
+    worker 重新啟動時以相同的 client_id 接回原本的訂閱，停機期間 QoS 1 的訊息不會遺失；
+    一般訂閱沒有冪等寫入，重送的訊息會重複寫入，維持原本的乾淨工作階段
+
+    參數:
+        client: create_mqtt_client() 建立的客戶端
+        host: Broker 位址
+        port: Broker 連接埠
+        keepalive: 心跳間隔（秒）
+        group: 共享群組名稱，None 表示一般訂閱
+        session_expiry: 工作階段保留秒數
+    """
+    if not group:
+        return client.connect(host, port, keepalive)
+    properties = Properties(PacketTypes.CONNECT)
+    properties.SessionExpiryInterval = session_expiry
+    return client.connect(host, port, keepalive, clean_start=False, properties=properties)
+
+# ============================================================================
+# 冪等寫入
+# ============================================================================
+
+def ingest_key(doc: Dict) -> str:
+    """
+    產生讀數的唯一鍵
+
+    格式為 device_id:sensor_type:timestamp[:seq]
+
+    鍵必須能區分同一個裝置的每一筆讀數：不能用內容計算（同一個裝置、感測器連續兩筆相同的數值
+    會得到相同的鍵，第二筆被當成重送略過），所以裝置必須提供 timestamp
+
+    參數:
+        doc: 解碼後（尚未加入儲存時間等欄位）的讀數
+
+    例外:
+        PayloadValidationError: 缺少 timestamp
+    """
+    timestamp = doc.get("timestamp")
+    if timestamp is None:
+        raise PayloadValidationError("冪等寫入需要裝置提供 timestamp")
+
+    key = f"{doc.get('device_id')}:{doc.get('sensor_type', '')}:{timestamp}"
+    for field in SEQUENCE_FIELDS:
+        if field in doc:
+            key += f":{doc[field]}"
+            break
+    return key
+
+def add_ingest_key(doc: Dict) -> Dict:
+    """在讀數中加入唯一鍵欄位（可直接當作流程的階段）"""
+    doc[INGEST_KEY_FIELD] = ingest_key(doc)
+    return doc
+
+def ensure_ingest_key_index(collection):
+    """建立唯一鍵索引（只有帶唯一鍵的文件才納入，不影響舊資料）"""
+    collection.create_index(
+        INGEST_KEY_FIELD,
+        unique=True,
+        partialFilterExpression={INGEST_KEY_FIELD: {"$exists": True}}
+    )
+
+def upsert_new(collection, documents: Iterable[Dict]) -> Tuple[List[Dict], int, List[Dict]]:
+    """
+    以唯一鍵做無序批次 upsert，並回傳實際新寫入的文件
+
+    已存在的鍵不會被覆寫（$setOnInsert），所以重送的資料只會被略過；
+    兩個 worker 同時寫入同一個鍵造成的重複鍵錯誤也視為已寫入
+
+    參數:
+        collection: MongoDB 集合
+        documents: 已帶有唯一鍵欄位的文件
+
+    返回:
+        (新寫入的文件列表, 重複略過筆數, 失敗的錯誤列表)
+    """
+    documents = list(documents)
+    operations = []
+    for doc in documents:
+        operations.append(UpdateOne(
+            {INGEST_KEY_FIELD: doc[INGEST_KEY_FIELD]},
+            {"$setOnInsert": doc},
+            upsert=True
+        ))
+    if not operations:
+        return [], 0, []
+
+    try:
+        result = collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        details = e.details
+        errors = [err for err in details.get("writeErrors", [])
+                  if err.get("code") != DUPLICATE_KEY_ERROR]
+        inserted = [documents[item["index"]] for item in details.get("upserted", [])]
+        duplicates = len(operations) - len(inserted) - len(errors)
+        return inserted, duplicates, errors
+
+    inserted = [documents[index] for index in sorted(result.upserted_ids)]
+    return inserted, len(operations) - len(inserted), []
@@ -0,0 +1,183 @@
+"""
+感測器訊息解碼模組
+把 MQTT 的原始 payload（bytes）直接解析成 SensorReading 記錄
+
+功能：
+- 必要欄位、數值型別、各感測器合理範圍集中定義一次（範圍檢查由服務自行選擇是否啟用）
+- 有安裝 msgspec 時直接解析 bytes，不產生中間字串
+- 解析出的字典直接當作儲存用的文件，不再複製
+"""
+
+import json
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    import msgspec
+    _json_loads = msgspec.json.Decoder().decode
+    _JSON_ERRORS = (msgspec.DecodeError,)
+except ImportError:
+    # json.loads(bytes) 每次都要偵測編碼，直接 decode 後交給共用的解析器比較快
+    _std_decode = json.JSONDecoder().decode
+
+    def _json_loads(payload):
+        if type(payload) is not str:
+            payload = bytes(payload).decode('utf-8')
+        return _std_decode(payload)
+
+    _JSON_ERRORS = (json.JSONDecodeError, UnicodeDecodeError)
+
+# ============================================================================
+# 訊息格式定義
+# ============================================================================
+
+# 預設必要欄位
+REQUIRED_FIELDS = ('device_id', 'sensor_type', 'value')
+
+# 各感測器的合理範圍（最小值, 最大值）；建立解碼器時傳入 ranges=SENSOR_RANGES 才檢查，
+# 超出即視為無效資料
+SENSOR_RANGES = {
+    'temperature': (-50, 100),   # °C
+    'humidity': (0, 100),        # %
+}
+
+class PayloadError(ValueError):
+    """訊息無法使用"""
+
+class PayloadParseError(PayloadError):
+    """訊息不是合法的 JSON 物件"""
+
+class PayloadValidationError(PayloadError):
+    """訊息格式或數值不符合定義"""
+
+class SensorReading:
+    """
+    感測器讀數記錄
+
+    常用欄位存成具型別的屬性（使用 __slots__，存取快、佔用記憶體少），
+    fields 則是解析出來的原始字典，包含裝置送來的所有欄位
+    """
+
+    __slots__ = ('device_id', 'sensor_type', 'value', 'unit', 'timestamp', 'fields')
+
+    def __init__(self, device_id: str, sensor_type: str, value: float,
+                 unit: Optional[str] = None, timestamp=None, fields: Optional[Dict] = None):
+        self.device_id = device_id
+        self.sensor_type = sensor_type
+        self.value = value
+        self.unit = unit
+        self.timestamp = timestamp
+        self.fields = fields if fields is not None else {}
+
+    def get(self, name: str, default=None):
+        """與 dict.get 相同的用法，方便沿用原本的輸出程式"""
+        if name in self.__slots__ and name != 'fields':
+            value = getattr(self, name)
+            return default if value is None else value
+        return self.fields.get(name, default)
+
+    def to_document(self) -> Dict:
+        """
+        轉換為可寫入 MongoDB 的字典
+
+        直接把屬性寫回原始字典並回傳，不另外複製
+        """
+        doc = self.fields
+        doc['device_id'] = self.device_id
+        doc['sensor_type'] = self.sensor_type
+        doc['value'] = self.value
+        if self.unit is not None:
+            doc['unit'] = self.unit
+        if self.timestamp is not None:
+            doc['timestamp'] = self.timestamp
+        return doc
+
+    def __repr__(self):
+        return (f"SensorReading(device_id={self.device_id!r}, "
+                f"sensor_type={self.sensor_type!r}, value={self.value!r})")
+
+class SensorDecoder:
+    """
+    感測器訊息解碼器
+
+    各服務的必要欄位略有不同（例如記錄服務要求 timestamp），
+    可在建立解碼器時指定；超出範圍時拒絕資料的服務傳入 ranges=SENSOR_RANGES
+    """
+
+    def __init__(self, required: Iterable[str] = REQUIRED_FIELDS,
+                 ranges: Optional[Dict[str, Tuple[float, float]]] = None):
+        """
+        初始化解碼器
+
+        參數:
+            required: 必要欄位
+            ranges: 各感測器合理範圍，超出時拒絕資料（預設不檢查範圍）
+        """
+        self.required = tuple(required)
+        # value 為必要欄位時 null 也不接受；選填時才允許省略或為 null
+        self.value_required = 'value' in self.required
+        self.ranges = ranges or {}
+
+    def decode(self, payload) -> SensorReading:
+        """
+        解析原始 payload
+
+        參數:
+            payload: MQTT 訊息內容（bytes 或 str）
+
+        返回:
+            SensorReading: 解析後的記錄
+
+        例外:
+            PayloadParseError: 不是合法的 JSON 物件
+            PayloadValidationError: 缺少欄位或數值不合理
+        """
+        try:
+            data = _json_loads(payload)
+        except _JSON_ERRORS as e:
+            raise PayloadParseError(f"JSON 解析錯誤: {e}") from None
+
+        if type(data) is not dict:
+            raise PayloadParseError("訊息內容必須是 JSON 物件")
+
+        return self.from_dict(data)
+
+    def from_dict(self, data: Dict) -> SensorReading:
+        """
+        由已解析的字典建立記錄
+
+        data 會直接成為記錄的 fields，不另外複製
+
+        參數:
+            data: 感測器資料字典
+        """
+        for field in self.required:
+            if field not in data:
+                raise PayloadValidationError(f"缺少必要欄位: {field}")
+
+        get = data.get
+        value = get('value')
+        if value is not None or self.value_required:
+            # 用 type() 比對，同時排除 bool（bool 是 int 的子類別）
+            value_type = type(value)
+            if value_type is not float and value_type is not int:
+                raise PayloadValidationError(f"value 必須是數字: {value!r}")
+
+        sensor_type = get('sensor_type')
+        if sensor_type is not None and type(sensor_type) is not str:
+            raise PayloadValidationError(f"sensor_type 必須是字串: {sensor_type!r}")
+        limits = self.ranges.get(sensor_type)
+        if limits is not None and value is not None:
+            low, high = limits
+            if value < low or value > high:
+                raise PayloadValidationError(
+                    f"{sensor_type} 數值超出合理範圍 ({low} ~ {high}): {value}"
+                )
+
+        return SensorReading(
+            get('device_id'),
+            sensor_type,
+            value,
+            get('unit'),
+            get('timestamp'),
+            data
+        )
@@ -0,0 +1,101 @@
+"""
+查詢結果序列化模組
+把 MongoDB 文件直接編碼成 JSON bytes，不逐筆修改文件，也不經過 pydantic 逐項驗證
+
+原本 API 的做法：
+    find() 取回完整文件 → 逐筆 doc['_id'] = str(...)、isoformat() →
+    FastAPI 依 response_model 逐項驗證 → jsonable_encoder 再複製一次 → json.dumps
+
+這裡的做法：
+- 查詢時以 projection 只取需要的欄位（MongoDB 端就不傳送其他欄位）
+- 編碼時才把 ObjectId、datetime 轉成字串（編碼器的 default 函式），文件不需要修改或複製
+- API 直接回傳編碼好的 bytes（fastapi.Response），不再經過 response_model 驗證
+  （response_model 仍保留作為 API 文件）
+- 有安裝 orjson 時使用 orjson（C 實作，datetime 直接編碼），否則使用標準 json
+
+輸出格式與原本相同：_id 為字串，datetime 為 isoformat() 字串
+
+功能：
+- dumps(): 物件 → JSON bytes
+- parse_fields(): API 的 fields 參數（逗號分隔）→ 欄位列表
+- projection(): 欄位列表 → MongoDB projection
+"""
+
+import json
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from bson import ObjectId
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_MEDIA_TYPE = "application/json"
+
+# ============================================================================
+# 編碼
+# ============================================================================
+
+def _default(value):
+    """標準 JSON 無法編碼的 BSON 型別"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"無法編碼為 JSON 的型別: {type(value).__name__}")
+
+if orjson is not None:
+    # orjson 內建的 datetime 格式與 isoformat() 相同，只有 ObjectId 需要 _default
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj) -> bytes:
+        """把查詢結果編碼為 JSON bytes"""
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj) -> bytes:
+        """把查詢結果編碼為 JSON bytes"""
+        return _encoder.encode(obj).encode("utf-8")
+
+# ============================================================================
+# 欄位選擇
+# ============================================================================
+
+def parse_fields(text: Optional[str]) -> Optional[List[str]]:
+    """
+    解析 API 的 fields 參數
+
+    參數:
+        text: 逗號分隔的欄位名稱，例如 "device_id,value,timestamp"
+
+    返回:
+        欄位列表；沒有指定時為 None（回傳所有欄位）
+    """
+    if not text:
+        return None
+    fields = [field.strip() for field in text.split(",") if field.strip()]
+    for field in fields:
+        if field.startswith("$"):
+            raise ValueError(f"無效的欄位名稱: {field}")
+    return fields or None
+
+def projection(fields: Optional[Iterable[str]], required: Iterable[str] = ()) -> Optional[Dict]:
+    """
+    欄位列表轉為 MongoDB projection
+
+    參數:
+        fields: 需要的欄位（None 表示全部）
+        required: 一定要包含的欄位（例如分頁的排序欄位）
+
+    返回:
+        projection；fields 為 None 時為 None
+    """
+    if fields is None:
+        return None
+    result = {field: 1 for field in fields}
+    for field in required:
+        result[field] = 1
+    return result
@@ -0,0 +1,438 @@
+"""
+本機預寫暫存模組（write-ahead spool）
+MongoDB 變慢或無法連線時，先把資料依序寫入本機磁碟，恢復後再批次補寫
+
+功能：
+- 只追加（append-only）的分段檔案，每個分段預先配置固定大小並以 mmap 寫入
+- fsync 策略可選：always（每次寫入）、interval（定時合併寫入）、never（交給作業系統）
+- 背景補寫執行緒（SpoolReplayer）以批次寫入清空暫存
+- 提供暫存筆數、大小與延遲等統計
+
+檔案格式（每筆記錄）：
+    [長度 4 bytes][CRC32 4 bytes][暫存時間 8 bytes][BSON 文件]
+
+SD 卡注意事項：
+- 分段檔案預先配置大小，寫入時不會一直更新檔案大小等中繼資料
+- interval 策略把一段時間內的多次寫入合併成一次 msync，減少寫入放大
+- 補寫進度（checkpoint）每批次才更新一次
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import bson
+
+# ============================================================================
+# 預設設定
+# ============================================================================
+
+SEGMENT_SIZE = 4 * 1024 * 1024      # 每個分段檔案 4 MB
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+SYNC_INTERVAL = 1.0                 # interval 策略的同步間隔（秒）
+
+REPLAY_BATCH_SIZE = 500             # 每次補寫最多筆數
+REPLAY_INTERVAL = 1.0               # 暫存為空時的檢查間隔（秒）
+REPLAY_MAX_BACKOFF = 60.0           # 補寫失敗時最長等待（秒）
+
+_HEADER = struct.Struct('<IId')     # 長度、CRC32、暫存時間
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".spool"
+_CHECKPOINT_FILE = "checkpoint"
+
+class WriteAheadSpool:
+    """
+    本機預寫暫存
+
+    寫入端呼叫 append() / append_many()，補寫端以 read_batch() 讀出
+    尚未寫入資料庫的資料，成功後呼叫 commit() 推進進度並刪除用完的分段
+    """
+
+    def __init__(self, directory: str, segment_size: int = SEGMENT_SIZE,
+                 fsync_policy: str = FSYNC_INTERVAL, sync_interval: float = SYNC_INTERVAL):
+        """
+        開啟（或建立）暫存目錄
+
+        參數:
+            directory: 暫存目錄
+            segment_size: 每個分段檔案大小（bytes）
+            fsync_policy: always / interval / never
+            sync_interval: interval 策略的同步間隔（秒）
+        """
+        if fsync_policy not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError(f"未知的 fsync 策略: {fsync_policy}")
+
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_policy = fsync_policy
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+
+        # 寫入端（目前的分段）
+        self.write_seq = 0
+        self.write_offset = 0
+        self.write_file = None
+        self.write_map = None
+        self.dirty = False
+        self.last_sync = time.monotonic()
+
+        # 補寫進度
+        self.read_seq = 0
+        self.read_offset = 0
+
+        # 統計資訊
+        self.pending_records = 0
+        self.pending_bytes = 0
+        self.stats = {
+            'spooled_total': 0,
+            'replayed_total': 0,
+            'sync_count': 0
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    # ====== 開啟與復原 ======
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{_SEGMENT_PREFIX}{seq:08d}{_SEGMENT_SUFFIX}")
+
+    def _list_segments(self) -> List[int]:
+        """列出目錄中所有分段的序號（由小到大）"""
+        seqs = []
+        for name in os.listdir(self.directory):
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+                seqs.append(int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]))
+        return sorted(seqs)
+
+    def _recover(self):
+        """讀取補寫進度，統計尚未補寫的資料，並開啟新的分段供寫入"""
+        checkpoint = os.path.join(self.directory, _CHECKPOINT_FILE)
+        if os.path.exists(checkpoint):
+            with open(checkpoint, 'r') as f:
+                seq, offset = f.read().split()
+                self.read_seq, self.read_offset = int(seq), int(offset)
+
+        segments = self._list_segments()
+
+        # 已補寫完的分段直接刪除
+        for seq in segments:
+            if seq < self.read_seq:
+                os.remove(self._segment_path(seq))
+        segments = [seq for seq in segments if seq >= self.read_seq]
+
+        if segments and segments[0] > self.read_seq:
+            self.read_seq, self.read_offset = segments[0], 0
+
+        # 重新啟動後一律開新分段，舊分段尾端可能有寫到一半的記錄
+        for seq in segments:
+            offset = self.read_offset if seq == self.read_seq else 0
+            for _, size, _ in self._scan(seq, offset):
+                self.pending_records += 1
+                self.pending_bytes += size
+
+        next_seq = segments[-1] + 1 if segments else self.read_seq
+        if not segments:
+            self.read_seq, self.read_offset = next_seq, 0
+        self._open_segment(next_seq)
+
+    def _scan(self, seq: int, offset: int, end: Optional[int] = None):
+        """
+        依序讀取分段中的記錄
+
+        遇到長度為 0、CRC 不符或超出範圍時視為分段結尾
+
+        產出:
+            (下一筆的位移, 記錄大小, (暫存時間, BSON 內容))
+        """
+        limit = self.segment_size if end is None else end
+        with open(self._segment_path(seq), 'rb') as f:
+            f.seek(offset)
+            while offset + _HEADER.size <= limit:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                length, crc, spooled_at = _HEADER.unpack(header)
+                if length == 0 or offset + _HEADER.size + length > limit:
+                    return
+                body = f.read(length)
+                if len(body) < length or zlib.crc32(body) != crc:
+                    return
+                offset += _HEADER.size + length
+                yield offset, _HEADER.size + length, (spooled_at, body)
+
+    def _open_segment(self, seq: int):
+        """建立並以 mmap 開啟新的分段（預先配置固定大小）"""
+        if self.write_map is not None:
+            self._sync()
+            self.write_map.close()
+            self.write_file.close()
+
+        path = self._segment_path(seq)
+        self.write_file = open(path, 'w+b')
+        self.write_file.truncate(self.segment_size)
+        self.write_map = mmap.mmap(self.write_file.fileno(), self.segment_size)
+        self.write_seq = seq
+        self.write_offset = 0
+
+    # ====== 寫入 ======
+
+    def append(self, document: Dict):
+        """寫入一筆資料"""
+        self.append_many([document])
+
+    def append_many(self, documents: Iterable[Dict]):
+        """
+        寫入多筆資料
+
+        同一批資料在一次鎖定中寫入，依 fsync 策略決定何時同步到磁碟
+
+        參數:
+            documents: 要暫存的文件
+        """
+        now = time.time()
+        records = []
+        for document in documents:
+            body = bson.encode(document)
+            records.append(_HEADER.pack(len(body), zlib.crc32(body), now) + body)
+
+        with self.lock:
+            for record in records:
+                size = len(record)
+                if size > self.segment_size:
+                    raise ValueError(f"單筆資料超過分段大小: {size} bytes")
+                if self.write_offset + size > self.segment_size:
+                    self._open_segment(self.write_seq + 1)
+
+                self.write_map[self.write_offset:self.write_offset + size] = record
+                self.write_offset += size
+                self.pending_records += 1
+                self.pending_bytes += size
+
+            self.stats['spooled_total'] += len(records)
+            self.dirty = True
+
+            if self.fsync_policy == FSYNC_ALWAYS:
+                self._sync()
+            elif self.fsync_policy == FSYNC_INTERVAL:
+                self._sync_if_due()
+
+    def sync_if_due(self):
+        """interval 策略下，到了同步時間就同步（由補寫執行緒定期呼叫）"""
+        if self.fsync_policy != FSYNC_INTERVAL:
+            return
+        with self.lock:
+            self._sync_if_due()
+
+    def _sync_if_due(self):
+        if self.dirty and time.monotonic() - self.last_sync >= self.sync_interval:
+            self._sync()
+
+    def _sync(self):
+        """把目前分段寫到磁碟"""
+        if self.dirty and self.fsync_policy != FSYNC_NEVER:
+            self.write_map.flush()
+            self.stats['sync_count'] += 1
+        self.dirty = False
+        self.last_sync = time.monotonic()
+
+    # ====== 補寫 ======
+
+    def read_batch(self, max_records: int = REPLAY_BATCH_SIZE) -> Tuple[List[Dict], Optional[tuple]]:
+        """
+        從補寫進度開始讀出一批資料（不會移動進度）
+
+        參數:
+            max_records: 最多筆數
+
+        返回:
+            (文件列表, 進度標記)，補寫成功後把進度標記交給 commit()
+        """
+        with self.lock:
+            seq, offset = start = (self.read_seq, self.read_offset)
+            write_seq, write_offset = self.write_seq, self.write_offset
+
+        documents = []
+        size_total = 0
+        while len(documents) < max_records and seq <= write_seq:
+            end = write_offset if seq == write_seq else None
+            for offset, size, (_, body) in self._scan(seq, offset, end):
+                documents.append(bson.decode(body))
+                size_total += size
+                if len(documents) >= max_records:
+                    break
+            else:
+                # 這個分段已讀完，換下一個
+                if seq == write_seq:
+                    break
+                seq, offset = seq + 1, 0
+
+        if not documents and (seq, offset) == start:
+            return [], None
+        return documents, (seq, offset, len(documents), size_total)
+
+    def commit(self, position: tuple):
+        """
+        補寫成功後推進進度，並刪除已補寫完的分段
+
+        參數:
+            position: read_batch() 回傳的進度標記
+        """
+        seq, offset, count, size = position
+
+        with self.lock:
+            old_seq = self.read_seq
+            self.read_seq, self.read_offset = seq, offset
+            self.pending_records -= count
+            self.pending_bytes -= size
+            self.stats['replayed_total'] += count
+
+        # 先寫入新的進度再刪檔，中途斷電最多重複補寫，不會遺失
+        checkpoint = os.path.join(self.directory, _CHECKPOINT_FILE)
+        temp_path = checkpoint + ".tmp"
+        with open(temp_path, 'w') as f:
+            f.write(f"{seq} {offset}")
+            if self.fsync_policy != FSYNC_NEVER:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, checkpoint)
+
+        for old in range(old_seq, seq):
+            try:
+                os.remove(self._segment_path(old))
+            except FileNotFoundError:
+                pass
+
+    # ====== 統計與關閉 ======
+
+    def oldest_age(self) -> float:
+        """最舊一筆未補寫資料的暫存時間距今幾秒（沒有資料時為 0）"""
+        with self.lock:
+            if self.pending_records <= 0:
+                return 0.0
+            seq, offset = self.read_seq, self.read_offset
+            write_seq, write_offset = self.write_seq, self.write_offset
+
+        while seq <= write_seq:
+            end = write_offset if seq == write_seq else None
+            for _, _, (spooled_at, _) in self._scan(seq, offset, end):
+                return max(0.0, time.time() - spooled_at)
+            seq, offset = seq + 1, 0
+        return 0.0
+
+    def get_statistics(self) -> Dict:
+        """
+        取得暫存統計資訊
+
+        返回:
+            Dict: 待補寫筆數、大小、分段數、最舊資料延遲等
+        """
+        lag = self.oldest_age()
+        with self.lock:
+            return {
+                **self.stats,
+                'pending_records': self.pending_records,
+                'pending_bytes': self.pending_bytes,
+                'segments': self.write_seq - self.read_seq + 1,
+                'lag_seconds': round(lag, 1)
+            }
+
+    def close(self):
+        """同步並關閉目前的分段"""
+        with self.lock:
+            if self.write_map is not None:
+                self._sync()
+                self.write_map.close()
+                self.write_file.close()
+                self.write_map = None
+                self.write_file = None
+
+class SpoolReplayer:
+    """
+    背景補寫執行緒
+
+    定期從暫存讀出一批資料交給 sink 寫入資料庫：
+    sink 回傳 True 表示這批已處理完，進度往前推進；
+    回傳 False 或拋出例外表示資料庫仍無法使用，等待後重試（指數退避）
+    """
+
+    def __init__(self, spool: WriteAheadSpool, sink: Callable[[List[Dict]], bool],
+                 batch_size: int = REPLAY_BATCH_SIZE, interval: float = REPLAY_INTERVAL,
+                 max_backoff: float = REPLAY_MAX_BACKOFF):
+        """
+        初始化補寫執行緒
+
+        參數:
+            spool: WriteAheadSpool 實例
+            sink: 批次寫入函式，接收文件列表並回傳是否成功
+            batch_size: 每次補寫最多筆數
+            interval: 暫存為空時的檢查間隔（秒）
+            max_backoff: 補寫失敗時最長等待（秒）
+        """
+        self.spool = spool
+        self.sink = sink
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {
+            'replay_batches': 0,
+            'replay_errors': 0,
+            'last_error': None
+        }
+
+    def start(self):
+        """啟動補寫執行緒"""
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="spool_replayer", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 10):
+        """停止補寫執行緒（未補寫的資料留在磁碟，下次啟動繼續）"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _run(self):
+        """補寫執行緒主迴圈"""
+        backoff = self.interval
+
+        while not self.stop_event.is_set():
+            self.spool.sync_if_due()
+
+            documents, position = self.spool.read_batch(self.batch_size)
+            if position is None:
+                self.stop_event.wait(self.interval)
+                continue
+
+            try:
+                ok = self.sink(documents) if documents else True
+            except Exception as e:
+                self.stats['last_error'] = str(e)
+                ok = False
+
+            if ok:
+                self.spool.commit(position)
+                self.stats['replay_batches'] += 1
+                backoff = self.interval
+            else:
+                self.stats['replay_errors'] += 1
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def get_statistics(self) -> Dict:
+        """
+        取得暫存與補寫統計資訊
+
+        返回:
+            Dict: 合併 spool.get_statistics() 與補寫次數
+        """
+        return {**self.spool.get_statistics(), **self.stats}
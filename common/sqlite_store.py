@@ -0,0 +1,554 @@
+"""
+SQLite 儲存模組
+在不執行 MongoDB 的 Pi 上，以單一 SQLite 檔案儲存感測器讀數
+（mongod 與 MQTT Broker、API 一起常駐時需要數百 MB 記憶體，SQLite 在 API 的程序內執行）
+
+設定：
+- WAL 模式：讀取不會被寫入阻擋；synchronous=NORMAL 時 commit 只寫入 WAL，
+  checkpoint 時才 fsync 資料庫檔案
+- 每個執行緒一個連線（sqlite3 連線不能同時在多個執行緒使用），
+  寫入使用 BEGIN IMMEDIATE 交易，其他寫入者最多等待 BUSY_TIMEOUT 秒
+- 批次寫入在同一個交易中 executemany（逐筆 commit 時每一筆都要寫一次 WAL）
+- SQL 字串固定、參數以 ? 傳入：sqlite3 的 statement cache 重複使用編譯好的 prepared statement
+- 覆蓋索引 (device_id, timestamp, value)：依裝置與時間範圍的查詢、統計只讀索引，不讀資料表
+
+資料表（名稱與 MongoDB 集合相同，預設 sensor_data）：
+    id INTEGER PRIMARY KEY   # 對應 _id
+    device_id, sensor_type   # 常用的篩選欄位
+    timestamp INTEGER        # 本機時間距 1970-01-01 的微秒數（與 MongoDB 的 naive datetime 意義相同）
+    value                    # 讀數值（數字或字串；其他型別存在 data）
+    data TEXT                # 其他欄位的 JSON（device_type、unit、location...）
+
+查詢條件使用與 MongoDB 相同的寫法（欄位相等、$gt/$gte/$lt/$lte/$ne/$in、$and），
+回傳的文件格式與 pymongo 相同（timestamp 為 datetime），API 與分頁模組不需要修改
+
+功能：
+- SQLiteStore: 連線、PRAGMA 與交易
+- ReadingTable: 讀數的寫入、查詢、鍵集分頁、統計（與 rollups.summarize 相同的欄位）
+- SQLiteRetention: 背景分批刪除過期讀數（與 retention.RetentionScheduler 相同的報告）
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from numbers import Number
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import sqlite3
+
+from pymongo import DESCENDING
+
+from timestamps import now, to_datetime, normalize_fields
+from pagination import check_limit, encode_cursor, decode_cursor
+from serialization import dumps, orjson
+from retention import RetentionScheduler, format_report, METHOD_DELETE
+
+# ============================================================================
+# 設定
+# ============================================================================
+
+SQLITE_PATH = "iot_data.db"
+BUSY_TIMEOUT = 5.0              # 等待其他寫入者的秒數
+STATEMENT_CACHE_SIZE = 256      # 每個連線快取的 prepared statement 數量
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",          # 每個連線約 8 MB 頁面快取
+    "PRAGMA mmap_size=67108864",        # 64 MB 記憶體映射讀取
+    "PRAGMA foreign_keys=OFF",
+)
+
+# 文件欄位 → 資料表欄位；其他欄位存在 data（JSON）
+COLUMNS = {
+    "_id": "id",
+    "device_id": "device_id",
+    "sensor_type": "sensor_type",
+    "timestamp": "timestamp",
+    "value": "value",
+}
+
+_OPERATORS = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<=", "$ne": "IS NOT"}
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+# ============================================================================
+# 型別轉換
+# ============================================================================
+
+def to_micros(value) -> int:
+    """時間（datetime、ISO 字串、Unix 秒數）→ 微秒整數"""
+    return (to_datetime(value) - _EPOCH) // _MICROSECOND
+
+def from_micros(value: int) -> datetime:
+    """微秒整數 → datetime"""
+    return _EPOCH + value * _MICROSECOND
+
+def _column_value(value) -> bool:
+    """可以存在 value 欄位的值（數字或字串；bool 存在 data 以免變成 0/1）"""
+    return value is None or isinstance(value, str) or \
+        (isinstance(value, Number) and not isinstance(value, bool))
+
+# ============================================================================
+# 連線
+# ============================================================================
+
+class SQLiteStore:
+    """
+    SQLite 資料庫檔案
+
+    使用方式：
+        store = SQLiteStore("iot_data.db")
+        with store.transaction() as conn:
+            conn.executemany("INSERT ...", rows)
+        store.connection().execute("SELECT ...")
+        store.close()
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """目前執行緒的連線（第一次使用時建立）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                   check_same_thread=False,
+                                   cached_statements=STATEMENT_CACHE_SIZE)
+            # 必須在建立資料表之前設定，刪除後才能以 incremental_vacuum 歸還空間
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        寫入交易（BEGIN IMMEDIATE：開始時就取得寫入鎖，不會在交易中途因鎖定失敗）
+
+        區塊正常結束時 COMMIT，發生例外時 ROLLBACK
+        """
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def pragma(self, name: str) -> int:
+        """讀取一個數值 PRAGMA（page_count、freelist_count...）"""
+        return self.connection().execute(f"PRAGMA {name}").fetchone()[0]
+
+    def file_size(self) -> Tuple[int, int]:
+        """(資料庫大小, 可重用空間)，單位為位元組"""
+        page_size = self.pragma("page_size")
+        return self.pragma("page_count") * page_size, self.pragma("freelist_count") * page_size
+
+    def close(self):
+        """關閉所有執行緒的連線（關閉前更新查詢規劃用的統計）"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.execute("PRAGMA optimize")
+            except sqlite3.Error:
+                pass
+            conn.close()
+        self._local = threading.local()
+
+# ============================================================================
+# 讀數資料表
+# ============================================================================
+
+class ReadingTable:
+    """
+    感測器讀數資料表
+
+    文件格式與 MongoDB 相同（_id 為整數），查詢條件使用 MongoDB 的寫法
+    """
+
+    def __init__(self, store: SQLiteStore, name: str = "sensor_data"):
+        if not name.isidentifier():
+            raise ValueError(f"無效的資料表名稱: {name}")
+        self.store = store
+        self.name = name
+        self._insert_sql = (f"INSERT INTO {name} (device_id, sensor_type, timestamp, value, data) "
+                            f"VALUES (?, ?, ?, ?, ?)")
+        self.ensure_schema()
+
+    def ensure_schema(self):
+        """建立資料表與索引（已存在時不變更）"""
+        self.store.connection().executescript(f"""
+            CREATE TABLE IF NOT EXISTS {self.name} (
+                id INTEGER PRIMARY KEY,
+                device_id TEXT,
+                sensor_type TEXT,
+                timestamp INTEGER NOT NULL,
+                value,
+                data TEXT NOT NULL DEFAULT '{{}}'
+            );
+            -- 依裝置與時間的查詢、統計（value 在索引中，不需要讀資料表）
+            CREATE INDEX IF NOT EXISTS idx_{self.name}_device_time
+                ON {self.name} (device_id, timestamp, value);
+            -- 不指定裝置的時間排序與過期資料刪除（索引隱含 id，鍵集分頁不需要額外排序）
+            CREATE INDEX IF NOT EXISTS idx_{self.name}_time
+                ON {self.name} (timestamp);
+        """)
+
+    # ------------------------------------------------------------------------
+    # 寫入
+    # ------------------------------------------------------------------------
+
+    @staticmethod
+    def _row(doc: Dict) -> Tuple:
+        """文件 → 資料表的一列（timestamp 需要已經是 datetime）"""
+        value = doc.get("value")
+        extra = {key: item for key, item in doc.items()
+                 if key not in COLUMNS or (key == "value" and not _column_value(value))}
+        return (doc.get("device_id"), doc.get("sensor_type"), to_micros(doc["timestamp"]),
+                value if _column_value(value) else None,
+                dumps(extra).decode("utf-8") if extra else "{}")
+
+    def insert_one(self, doc: Dict) -> int:
+        """
+        寫入一筆讀數（沒有時間時填入目前時間）
+
+        返回:
+            int: 讀數 ID（也會寫入 doc['_id']，與 pymongo 的 insert_one 相同）
+        """
+        normalize_fields(doc, ("timestamp",), fill_missing=True)
+        with self.store.transaction() as conn:
+            doc["_id"] = conn.execute(self._insert_sql, self._row(doc)).lastrowid
+        return doc["_id"]
+
+    def insert_many(self, docs: Iterable[Dict]) -> int:
+        """
+        在同一個交易中寫入多筆讀數（全部成功或全部不寫入）
+
+        返回:
+            int: 寫入筆數
+        """
+        rows = [self._row(normalize_fields(doc, ("timestamp",), fill_missing=True))
+                for doc in docs]
+        if not rows:
+            return 0
+        with self.store.transaction() as conn:
+            conn.executemany(self._insert_sql, rows)
+        return len(rows)
+
+    # ------------------------------------------------------------------------
+    # 查詢條件
+    # ------------------------------------------------------------------------
+
+    @staticmethod
+    def _field(field: str) -> Tuple[str, List]:
+        """文件欄位 → SQL 運算式與參數"""
+        if field in COLUMNS:
+            return COLUMNS[field], []
+        if not field or field.startswith("$") or '"' in field:
+            raise ValueError(f"SQLite 不支援的查詢欄位: {field}")
+        return "json_extract(data, ?)", [f'$."{field}"']
+
+    @staticmethod
+    def _operand(field: str, value):
+        """查詢值轉為資料表中的形式（時間 → 微秒、_id → 整數、其他欄位的 datetime → ISO 字串）"""
+        if value is None:
+            return None
+        if field == "timestamp":
+            return to_micros(value)
+        if field == "_id":
+            return int(value)
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return value
+
+    def where(self, filter_dict: Optional[Dict]) -> Tuple[List[str], List]:
+        """
+        MongoDB 查詢條件 → SQL 條件
+
+        返回:
+            (條件列表（以 AND 連接）, 參數)
+
+        例外:
+            ValueError: 不支援的運算子或欄位
+        """
+        clauses, params = [], []
+        for field, condition in (filter_dict or {}).items():
+            if field == "$and":
+                for part in condition:
+                    sub_clauses, sub_params = self.where(part)
+                    clauses.extend(sub_clauses)
+                    params.extend(sub_params)
+                continue
+
+            expression, expression_params = self._field(field)
+            if not isinstance(condition, dict):
+                clauses.append(f"{expression} IS ?")
+                params.extend(expression_params + [self._operand(field, condition)])
+                continue
+
+            for op, operand in condition.items():
+                if op == "$in":
+                    values = [self._operand(field, item) for item in operand]
+                    clauses.append(f"{expression} IN ({', '.join('?' * len(values))})"
+                                   if values else "0")
+                    params.extend(expression_params + values if values else [])
+                elif op in _OPERATORS:
+                    clauses.append(f"{expression} {_OPERATORS[op]} ?")
+                    params.extend(expression_params + [self._operand(field, operand)])
+                else:
+                    raise ValueError(f"SQLite 不支援的查詢條件: {op}")
+        return clauses, params
+
+    @staticmethod
+    def _sql_where(clauses: List[str]) -> str:
+        return f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    # ------------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------------
+
+    @staticmethod
+    def _document(row: Tuple, fields: Optional[List[str]]) -> Dict:
+        """資料表的一列 → 文件（與 pymongo 回傳的格式相同）"""
+        doc_id, device_id, sensor_type, timestamp, value, data = row
+        # NULL 的欄位視為文件中沒有這個欄位（與 MongoDB 相同）
+        doc = {"_id": doc_id}
+        if device_id is not None:
+            doc["device_id"] = device_id
+        if sensor_type is not None:
+            doc["sensor_type"] = sensor_type
+        if data is not None and data != "{}":
+            doc.update(_loads(data))
+        doc["timestamp"] = from_micros(timestamp)
+        if value is not None:
+            doc["value"] = value
+        if fields is not None:
+            keep = {"_id", *fields}
+            doc = {key: item for key, item in doc.items() if key in keep}
+        return doc
+
+    def _select(self, fields: Optional[List[str]]) -> str:
+        """SELECT 欄位（只需要資料表欄位時不讀取 data）"""
+        needs_data = fields is None or any(field not in COLUMNS for field in fields)
+        data = "data" if needs_data else "NULL"
+        return f"SELECT id, device_id, sensor_type, timestamp, value, {data} FROM {self.name}"
+
+    def find(self, filter_dict: Optional[Dict] = None, sort_by: str = "timestamp",
+             sort_order: int = DESCENDING, limit: int = 0, skip: int = 0,
+             fields: Optional[List[str]] = None) -> List[Dict]:
+        """
+        查詢讀數（與 collection.find().sort().skip().limit() 相同）
+
+        參數:
+            filter_dict: MongoDB 寫法的查詢條件
+            sort_by: 排序欄位（相同時依 _id）
+            sort_order: DESCENDING 或 ASCENDING
+            limit: 筆數上限（0 表示不限制）
+            skip: 跳過筆數
+            fields: 只取回這些欄位（None 表示全部，_id 一定包含）
+        """
+        clauses, params = self.where(filter_dict)
+        sort_expression, sort_params = self._field(sort_by)
+        direction = "DESC" if sort_order == DESCENDING else "ASC"
+        sql = (f"{self._select(fields)}{self._sql_where(clauses)} "
+               f"ORDER BY {sort_expression} {direction}, id {direction} LIMIT ? OFFSET ?")
+        rows = self.store.connection().execute(
+            sql, params + sort_params + [limit if limit else -1, skip])
+        return [self._document(row, fields) for row in rows]
+
+    def find_page(self, filter_dict: Optional[Dict] = None, limit: int = 100,
+                  cursor: Optional[str] = None, skip: int = 0, sort_order: int = DESCENDING,
+                  fields: Optional[List[str]] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        鍵集分頁（依時間排序，時間相同時依 _id；游標格式與 pagination.paginate 相同）
+
+        返回:
+            (文件列表, next_cursor)；沒有下一頁時 next_cursor 為 None
+
+        例外:
+            ValueError: 游標格式錯誤，或每頁筆數小於 1
+        """
+        check_limit(limit)
+        clauses, params = self.where(filter_dict)
+        if cursor:
+            timestamp, last_id = decode_cursor(cursor, "timestamp", sort_order)
+            if not isinstance(timestamp, datetime) or not isinstance(last_id, int):
+                raise ValueError("游標格式錯誤")
+            op, op_or_equal = ("<", "<=") if sort_order == DESCENDING else (">", ">=")
+            # 與 pagination.keyset_filter 相同：外層條件讓索引掃描從游標位置開始
+            clauses.append(f"timestamp {op_or_equal} ? AND (timestamp {op} ? OR id {op} ?)")
+            micros = to_micros(timestamp)
+            params.extend([micros, micros, last_id])
+
+        direction = "DESC" if sort_order == DESCENDING else "ASC"
+        sql = (f"{self._select(fields)}{self._sql_where(clauses)} "
+               f"ORDER BY timestamp {direction}, id {direction} LIMIT ? OFFSET ?")
+        rows = self.store.connection().execute(sql, params + [limit + 1, skip]).fetchall()
+
+        docs = [self._document(row, fields) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            # 以資料表的值產生游標（fields 沒有選取 timestamp 時也能翻頁）
+            last_id, timestamp = rows[limit - 1][0], from_micros(rows[limit - 1][3])
+            next_cursor = encode_cursor({"_id": last_id, "timestamp": timestamp},
+                                        "timestamp", sort_order)
+        return docs, next_cursor
+
+    def find_one(self, filter_dict: Optional[Dict] = None) -> Optional[Dict]:
+        """最新的一筆讀數"""
+        docs = self.find(filter_dict, limit=1)
+        return docs[0] if docs else None
+
+    def count(self, filter_dict: Optional[Dict] = None) -> int:
+        """符合條件的讀數筆數"""
+        clauses, params = self.where(filter_dict)
+        sql = f"SELECT COUNT(*) FROM {self.name}{self._sql_where(clauses)}"
+        return self.store.connection().execute(sql, params).fetchone()[0]
+
+    def delete(self, filter_dict: Optional[Dict] = None) -> int:
+        """刪除符合條件的讀數，回傳刪除筆數"""
+        clauses, params = self.where(filter_dict)
+        with self.store.transaction() as conn:
+            return conn.execute(f"DELETE FROM {self.name}{self._sql_where(clauses)}",
+                                params).rowcount
+
+    # ------------------------------------------------------------------------
+    # 統計
+    # ------------------------------------------------------------------------
+
+    def statistics(self, filter_dict: Optional[Dict] = None,
+                   group_by: Optional[str] = None):
+        """
+        數值讀數的統計（SQL 版的 rollups.summarize，欄位相同）
+
+        參數:
+            filter_dict: 查詢條件（device_id、timestamp 範圍由覆蓋索引處理）
+            group_by: 分組欄位（例如 device_id）
+
+        返回:
+            {count, sum, sum_sq, min, max, first, last, avg, std_dev}，沒有資料時為 None；
+            指定 group_by 時為 {分組值: 統計}
+        """
+        clauses, params = self.where(filter_dict)
+        clauses.append("typeof(value) IN ('integer', 'real')")
+        group_expression, group_params = self._field(group_by) if group_by else ("NULL", [])
+        sql = (f"SELECT {group_expression}, COUNT(value), SUM(value), SUM(value * value), "
+               f"MIN(value), MAX(value), MIN(timestamp), MAX(timestamp) "
+               f"FROM {self.name}{self._sql_where(clauses)}")
+        if group_by:
+            sql += f" GROUP BY {group_expression}"
+        rows = self.store.connection().execute(sql, group_params + params + group_params)
+
+        results = {}
+        for key, count, total, total_sq, low, high, first, last in rows:
+            if not count:
+                continue
+            avg = total / count
+            results[key] = {
+                "count": count, "sum": total, "sum_sq": total_sq, "min": low, "max": high,
+                "first": from_micros(first), "last": from_micros(last),
+                "avg": avg, "std_dev": max(total_sq / count - avg * avg, 0) ** 0.5
+            }
+        if group_by:
+            return results
+        return results.get(None)
+
+    def device_summary(self) -> List[Dict]:
+        """每個裝置的最後資料時間與筆數（只讀 (device_id, timestamp) 索引）"""
+        rows = self.store.connection().execute(
+            f"SELECT device_id, MAX(timestamp), COUNT(*) FROM {self.name} GROUP BY device_id")
+        return [{"device_id": device_id, "last_seen": from_micros(last), "data_count": count}
+                for device_id, last, count in rows]
+
+    # ------------------------------------------------------------------------
+    # 資料保留
+    # ------------------------------------------------------------------------
+
+    def delete_before(self, cutoff: datetime, batch_size: int, limit: int,
+                      pause: float = 0, stop_event: Optional[threading.Event] = None) -> int:
+        """
+        分批刪除 cutoff 之前的讀數（每批一個短交易，批次之間暫停讓出寫入鎖）
+
+        返回:
+            int: 刪除筆數
+        """
+        sql = (f"DELETE FROM {self.name} WHERE id IN "
+               f"(SELECT id FROM {self.name} WHERE timestamp < ? LIMIT ?)")
+        micros = to_micros(cutoff)
+        deleted = 0
+        while deleted < limit and not (stop_event and stop_event.is_set()):
+            batch = min(batch_size, limit - deleted)
+            with self.store.transaction() as conn:
+                count = conn.execute(sql, (micros, batch)).rowcount
+            deleted += count
+            if count < batch:
+                break
+            if stop_event:
+                stop_event.wait(pause)
+            else:
+                time.sleep(pause)
+        return deleted
+
+# ============================================================================
+# 資料保留
+# ============================================================================
+
+class SQLiteRetention(RetentionScheduler):
+    """
+    SQLite 的背景保留排程器
+
+    執行緒、批次大小、暫停與報告格式與 RetentionScheduler 相同；
+    刪除後以 incremental_vacuum 把空出的頁面歸還給檔案系統
+
+    使用方式：
+        retention = SQLiteRetention(store, {"sensor_data": policy_for("sensor_data")})
+        retention.start()
+    """
+
+    def run_once(self) -> List[Dict]:
+        """執行一次：分批刪除、歸還空間並輸出報告"""
+        store = self.db
+        reports = []
+        for name, policy in self.policies.items():
+            table = ReadingTable(store, name)
+            start = time.perf_counter()
+            size_before, _ = store.file_size()
+            cutoff = now() - timedelta(days=policy["days"])
+            deleted = table.delete_before(cutoff, self.batch_size, self.max_deletes,
+                                          self.pause, self.stop_event)
+            # executescript 才會把 PRAGMA 執行完畢（execute 只釋放一頁）
+            store.connection().executescript("PRAGMA incremental_vacuum;")
+            size, free = store.file_size()
+
+            report = {
+                "collection": name,
+                "method": METHOD_DELETE,
+                "deleted": deleted,
+                "reclaimed_bytes": max(size_before - size, 0),
+                "pending": table.count({"timestamp": {"$lt": cutoff}}),
+                "size": size,
+                "free_storage_size": free,
+                "seconds": time.perf_counter() - start
+            }
+            reports.append(report)
+            self.stats['deleted'] += deleted
+            self.stats['reclaimed_bytes'] += report["reclaimed_bytes"]
+            self.log(format_report(report))
+
+        self.stats['runs'] += 1
+        return reports
@@ -0,0 +1,95 @@
+"""
+時間序列集合模組
+把感測器讀數存成 MongoDB 原生的時間序列集合（MongoDB 5.0 以上）
+
+時間序列集合會依 metaField（裝置）與時間自動分桶，以欄式壓縮儲存，
+查詢語法與一般集合相同，既有的 find / aggregate / count_documents 不需要修改
+
+功能：
+- TIMESERIES_COLLECTIONS: 各集合的 timeField、metaField、granularity 設定
+- ensure_timeseries_collection(): 集合不存在時建立為時間序列集合，已存在時檢查設定
+
+既有的一般集合可用 migrate_timeseries.py 線上轉換；timeField 必須是 BSON 日期，
+寫入前請用 timestamps.to_datetime() 轉換
+"""
+
+from typing import Dict, Optional
+
+from pymongo.errors import OperationFailure
+
+# ============================================================================
+# 集合設定
+# ============================================================================
+
+GRANULARITY = "seconds"     # Pico 每幾秒送一筆
+
+# 集合名稱 → 時間序列設定
+# metaField 使用 device_id：查詢都以裝置篩選，且 metaField 必須是單一欄位，
+# 維持原本的文件格式才能讓既有查詢不用修改（sensor_type 仍是一般欄位，同樣會壓縮）
+TIMESERIES_COLLECTIONS: Dict[str, Dict[str, str]] = {
+    # 02_pi_basics/fastapi_app
+    "sensor_data": {"timeField": "timestamp", "metaField": "device_id", "granularity": GRANULARITY},
+    # 05_integration/data_collection_system、06_multi_device
+    "sensor_readings": {"timeField": "stored_at", "metaField": "device_id", "granularity": GRANULARITY},
+}
+
+def timeseries_options(name: str) -> Optional[Dict[str, str]]:
+    """取得集合的時間序列設定（沒有登記時為 None）"""
+    options = TIMESERIES_COLLECTIONS.get(name)
+    return dict(options) if options else None
+
+def collection_type(db, name: str) -> Optional[str]:
+    """
+    取得集合類型
+
+    返回:
+        'timeseries'、'collection'、'view'，集合不存在時為 None
+    """
+    for info in db.list_collections(filter={"name": name}):
+        return info.get("type", "collection")
+    return None
+
+def ensure_timeseries_collection(db, name: str, options: Optional[Dict[str, str]] = None) -> bool:
+    """
+    確認集合是時間序列集合
+
+    - 集合不存在：建立為時間序列集合
+    - 已是時間序列集合：檢查 timeField / metaField 是否與設定相同
+    - 已是一般集合：不變更，提示使用 migrate_timeseries.py 轉換
+
+    參數:
+        db: MongoDB 資料庫
+        name: 集合名稱
+        options: 時間序列設定（省略則使用 TIMESERIES_COLLECTIONS）
+
+    返回:
+        bool: 集合是否為時間序列集合
+    """
+    options = options or timeseries_options(name)
+    if options is None:
+        raise ValueError(f"集合 {name} 沒有時間序列設定")
+
+    try:
+        kind = collection_type(db, name)
+        if kind is None:
+            db.create_collection(name, timeseries=options)
+            print(f"✓ 已建立時間序列集合: {name}"
+                  f"（timeField={options['timeField']}, metaField={options.get('metaField')}）")
+            return True
+    except OperationFailure as e:
+        # MongoDB 5.0 以前不支援時間序列集合，維持一般集合
+        print(f"⚠ 無法建立時間序列集合 {name}，改用一般集合: {e}")
+        return False
+
+    if kind != "timeseries":
+        print(f"⚠ {name} 是一般集合，可執行 python common/migrate_timeseries.py {name} 轉換為時間序列集合")
+        return False
+
+    current = {}
+    for info in db.list_collections(filter={"name": name}):
+        current = info.get("options", {}).get("timeseries", {})
+    for field in ("timeField", "metaField"):
+        if current.get(field) != options.get(field):
+            print(f"⚠ 時間序列集合 {name} 的 {field} 為 {current.get(field)}，"
+                  f"與設定 {options.get(field)} 不同")
+    return True
@@ -0,0 +1,123 @@
+"""
+時間欄位正規化模組
+所有服務寫入 MongoDB 的時間欄位都經過這裡轉成 BSON 日期（datetime），
+範圍查詢才能直接用 datetime 比較並使用索引
+
+字串時間的問題：
+- "2025-01-01T09:00:00" 和 "2025-01-01T01:00:00Z" 是同一時間，字串比較卻不相等
+- Pico 送來的 Unix 秒數（數字）和字串截止時間比較永遠不成立
+- 字串佔用的空間比 BSON 日期（8 bytes）大
+
+儲存慣例：
+- 存 naive datetime，代表 Pi 的本機時間；與 05/06 的 stored_at 相同，
+  查詢端以 datetime.now() - timedelta(...) 當截止時間即可
+- 帶時區的時間（...Z、+08:00）先換算成本機時間再去掉時區
+- 數字視為 Unix 秒數（Pico 的 time.time()），大於 1e11 視為毫秒（JavaScript 的 Date.now()）
+
+功能：
+- now(): 寫入用的目前時間
+- to_datetime(): datetime、ISO 8601 字串、Unix 秒數 → datetime
+- normalize_fields(): 把文件中的多個時間欄位轉成 datetime
+- TIMESTAMP_FIELDS: 各集合的時間欄位（舊版以字串或數字儲存，
+  由 normalize_timestamps.py 轉換）
+
+資料收集流程可使用 pipeline.TimestampStage
+"""
+
+from datetime import datetime
+from numbers import Number
+from typing import Dict, Iterable, Tuple
+
+# ============================================================================
+# 設定
+# ============================================================================
+
+MILLISECONDS_THRESHOLD = 1e11   # 超過此值的數字視為毫秒（秒數要到西元 5138 年才會超過）
+
+# 集合名稱 → 時間欄位（這些集合舊版以 ISO 字串或 Unix 秒數儲存）
+TIMESTAMP_FIELDS: Dict[str, Tuple[str, ...]] = {
+    # 07_example_projects/01_environmental_monitor
+    "environmental_data": ("timestamp", "created_at"),
+    # 07_example_projects/02_data_logger、04_dashboard
+    "sensor_logs": ("timestamp", "logged_at"),
+    # 07_example_projects/03_alert_system
+    "alerts": ("timestamp", "data_timestamp"),
+    # 07_example_projects/05_smart_home
+    "control_history": ("timestamp",),
+}
+
+# ============================================================================
+# 轉換
+# ============================================================================
+
+def now() -> datetime:
+    """寫入用的目前時間（本機時間）"""
+    return datetime.now()
+
+def _from_epoch(value: float) -> datetime:
+    if value > MILLISECONDS_THRESHOLD:
+        value /= 1000
+    return datetime.fromtimestamp(value)
+
+def _local(value: datetime) -> datetime:
+    """帶時區的時間換算成本機時間並去掉時區"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+def to_datetime(value) -> datetime:
+    """
+    把時間值轉為 datetime（本機時間，不帶時區）
+
+    參數:
+        value: datetime、ISO 8601 字串、Unix 秒數（或數字字串）
+
+    返回:
+        datetime: 轉換後的時間
+
+    例外:
+        ValueError: 無法解析
+    """
+    if isinstance(value, datetime):
+        return _local(value)
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            # Python 3.11 以前的 fromisoformat 不接受結尾的 Z
+            return _local(datetime.fromisoformat(text.replace("Z", "+00:00")))
+        except ValueError:
+            pass
+        try:
+            return _from_epoch(float(text))
+        except (ValueError, OverflowError, OSError):
+            raise ValueError(f"無法解析的時間: {value!r}")
+    if isinstance(value, Number) and not isinstance(value, bool):
+        try:
+            return _from_epoch(float(value))
+        except (OverflowError, OSError):
+            raise ValueError(f"超出範圍的時間: {value!r}")
+    raise ValueError(f"無法解析的時間: {value!r}")
+
+def normalize_fields(doc: Dict, fields: Iterable[str], fill_missing: bool = False) -> Dict:
+    """
+    把文件中的時間欄位轉成 datetime（直接修改文件）
+
+    參數:
+        doc: 文件
+        fields: 時間欄位名稱
+        fill_missing: 欄位不存在或為 None 時填入目前時間
+
+    返回:
+        Dict: 原本的文件
+
+    例外:
+        ValueError: 欄位無法解析
+    """
+    for field in fields:
+        value = doc.get(field)
+        if value is None:
+            if fill_missing:
+                doc[field] = now()
+            continue
+        doc[field] = to_datetime(value)
+    return doc